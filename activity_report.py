@@ -2,6 +2,7 @@ import io
 import pandas as pd
 
 from helpers import get_financial_year_for_series, log_activity
+from visit_status import TOLERANCE_STATUSES, visit_status_column
 
 
 def _sanitize_visits(visits_df: pd.DataFrame) -> pd.DataFrame:
@@ -14,7 +15,7 @@ def _sanitize_visits(visits_df: pd.DataFrame) -> pd.DataFrame:
         if col not in df.columns:
             df[col] = None
     # Drop tolerance markers
-    df = df[~df['Visit'].isin(['-', '+'])]
+    df = df[~visit_status_column(df).isin(TOLERANCE_STATUSES)]
     # Normalize date
     df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
     df = df.dropna(subset=['Date'])
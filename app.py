@@ -5,19 +5,19 @@ from helpers import (
     load_file, normalize_columns, parse_dates_column, 
     standardize_visit_columns, safe_string_conversion_series, 
     load_file_with_defaults, init_error_system, display_error_log_section,
-    log_activity, display_activity_log_sidebar, trigger_data_refresh
+    log_activity, display_activity_log_sidebar, trigger_data_refresh, refresh_log_level
 )
 from file_validation import validate_file_upload, get_validation_summary, FileValidationError
 import database as db
-from processing_calendar import build_calendar, clear_build_calendar_cache
+from processing_calendar import build_calendar
 from database import clear_database_cache
 from display_components import (
-    show_legend, display_calendar, display_site_statistics,
+    show_legend, display_calendar, display_calendar_window, display_site_statistics,
     display_download_buttons, display_monthly_income_tables,
     display_quarterly_profit_sharing_tables, display_income_realization_analysis,
     display_site_income_by_fy, display_study_income_summary,
     apply_calendar_start_filter, display_site_busy_calendar,
-    render_reporting_year_selector
+    render_reporting_year_selector, display_performance_panel, display_performance_history
 )
 from gantt_view import build_gantt_data, display_gantt_chart
 from recruitment_tracking import build_recruitment_data, display_recruitment_dashboard
@@ -117,7 +117,7 @@ def render_db_admin_page():
             else:
                 if db.safe_upsert_table(config["table"], edited_df, save_function=config["save"]):
                     st.success("Table saved successfully.")
-                    trigger_data_refresh()
+                    trigger_data_refresh(tables=[config["table"]])
                 else:
                     st.error("Failed to save table.")
                     st.error("Check the logs in Database Operations & Debug section below for details.")
@@ -149,10 +149,19 @@ def render_db_admin_page():
             else:
                 st.error(message)
 
+    st.markdown("---")
+    display_performance_history()
+
 def check_and_refresh_data():
     """Check if data refresh is needed and reload from database"""
     if st.session_state.get('data_refresh_needed', False):
         try:
+            # Writes that named their tables already cleared just those caches (and the
+            # artifacts built from them); otherwise clear everything before re-fetching
+            stale_tables = st.session_state.get('stale_tables')
+            if stale_tables is None:
+                clear_database_cache()
+
             # Always refresh from database
             st.session_state.patients_df = db.fetch_all_patients()
             st.session_state.trials_df = db.fetch_all_trial_schedules()
@@ -160,8 +169,7 @@ def check_and_refresh_data():
 
             log_activity("Data refreshed from database", level='success')
 
-            clear_build_calendar_cache()
-            clear_database_cache()
+            st.session_state.stale_tables = set()
             st.session_state.calendar_cache_buster = st.session_state.get('calendar_cache_buster', 0) + 1
             st.session_state.data_refresh_needed = False
         except Exception as e:
@@ -309,6 +317,7 @@ def setup_file_uploaders():
                     key="debug_level_selector"
                 )
                 st.session_state.debug_level = debug_level_options[selected_option]
+                refresh_log_level(st.session_state.debug_level)
                 
                 calendar_debug = st.checkbox(
                     "Calendar debug logging (slower)",
@@ -403,7 +412,7 @@ def setup_file_uploaders():
                                             )
                                             st.session_state.validation_results = validation_results
                                             st.session_state.overwrite_patients_confirmed = False
-                                            trigger_data_refresh()
+                                            trigger_data_refresh(tables=['patients'])
                                             st.session_state.overwrite_in_progress = False
                                         else:
                                             st.error("❌ Failed to overwrite patients table")
@@ -453,7 +462,7 @@ def setup_file_uploaders():
                                             )
                                             st.session_state.validation_results = validation_results
                                             st.session_state.overwrite_trials_confirmed = False
-                                            trigger_data_refresh()
+                                            trigger_data_refresh(tables=['trial_schedules'])
                                             st.session_state.overwrite_in_progress = False
                                         else:
                                             st.error("❌ Failed to overwrite trials table")
@@ -503,7 +512,7 @@ def setup_file_uploaders():
                                             )
                                             st.session_state.validation_results = validation_results
                                             st.session_state.overwrite_visits_confirmed = False
-                                            trigger_data_refresh()
+                                            trigger_data_refresh(tables=['actual_visits'])
                                             st.session_state.overwrite_in_progress = False
                                         else:
                                             st.error("❌ Failed to overwrite visits table")
@@ -548,7 +557,7 @@ def setup_file_uploaders():
                                         if db.safe_overwrite_table('study_site_details', details_df, db.save_study_site_details_to_database):
                                             st.success("✅ Study site details overwritten successfully!")
                                             st.session_state.overwrite_study_details_confirmed = False
-                                            trigger_data_refresh()
+                                            trigger_data_refresh(tables=['study_site_details'])
                                             st.session_state.overwrite_in_progress = False
                                         else:
                                             st.error("❌ Failed to overwrite study site details")
@@ -623,6 +632,7 @@ def main():
     st.markdown(f"# {APP_TITLE} <span style='font-size: 0.6em; color: #666; font-weight: normal;'>{APP_VERSION} | {APP_SUBTITLE}</span>", unsafe_allow_html=True)
 
     initialize_session_state()
+    refresh_log_level()
     
     # Check database availability
     if 'database_available' not in st.session_state:
@@ -826,7 +836,8 @@ def main():
         cache_buster = st.session_state.get('calendar_cache_buster', 0)
         import calendar_builder
         calendar_builder.CALENDAR_DEBUG = st.session_state.get('calendar_debug', False)
-        visits_df, calendar_df, stats, messages, site_column_mapping, unique_visit_sites, patients_df = build_calendar(
+        (visits_df, calendar_df, cell_status, stats, messages, site_column_mapping,
+         unique_visit_sites, patients_df) = build_calendar(
             patients_df=patients_df, 
             trials_df=trials_df, 
             actual_visits_df=actual_visits_df, 
@@ -977,10 +988,8 @@ def main():
                     help="Hide patients who have withdrawn, screen failed, died, or finished all visits",
                     key="hide_inactive_checkbox"
                 )
-                # Check if value changed and clear cache if so
+                # Check if value changed - the cached build is re-used, only the patient columns change
                 if hide_inactive != prev_hide_inactive:
-                    clear_build_calendar_cache()
-                    st.session_state.calendar_cache_buster = st.session_state.get('calendar_cache_buster', 0) + 1
                     st.session_state.hide_inactive_patients = hide_inactive
                     st.rerun()
                 else:
@@ -1019,6 +1028,18 @@ def main():
                     st.rerun()
             with col_options[4]:
                 calendar_start_date = None
+                prev_windowed = st.session_state.get('calendar_windowed', True)
+                windowed = st.checkbox(
+                    "Windowed view",
+                    value=prev_windowed,
+                    help="Render one date window at a time (Earlier/Later to move) instead of the whole history",
+                    key="calendar_windowed_checkbox"
+                )
+                if windowed != prev_windowed:
+                    st.session_state.calendar_windowed = windowed
+                    st.rerun()
+                else:
+                    st.session_state.calendar_windowed = windowed
             with col_options[5]:
                 # Build filter summary for expander header
                 active_sites_count = len(st.session_state.active_site_filter) if st.session_state.active_site_filter else 0
@@ -1140,10 +1161,8 @@ def main():
                     help="Hide patients who have withdrawn, screen failed, died, or finished all visits",
                     key="hide_inactive_checkbox_site"
                 )
-                # Check if value changed and clear cache if so
+                # Check if value changed - the cached build is re-used, only the patient columns change
                 if hide_inactive != prev_hide_inactive:
-                    clear_build_calendar_cache()
-                    st.session_state.calendar_cache_buster = st.session_state.get('calendar_cache_buster', 0) + 1
                     st.session_state.hide_inactive_patients = hide_inactive
                     st.rerun()
                 else:
@@ -1269,7 +1288,12 @@ def main():
                     log_activity(f"Error building Gantt chart: {e}", level='error')
                     st.exception(e)
             elif current_page == 'Calendar':
-                display_calendar(calendar_df_filtered, filtered_site_column_mapping, filtered_unique_visit_sites, compact_mode=compact_mode)
+                if st.session_state.get('calendar_windowed', True):
+                    display_calendar_window(calendar_df_filtered, filtered_site_column_mapping, filtered_unique_visit_sites, compact_mode=compact_mode,
+                                            cell_status=cell_status)
+                else:
+                    display_calendar(calendar_df_filtered, filtered_site_column_mapping, filtered_unique_visit_sites, compact_mode=compact_mode,
+                                     cell_status=cell_status)
         
         if current_page in ['Calendar', 'Site Busy']:
             # Show view-specific legend
@@ -1421,7 +1445,7 @@ def main():
                                     if success:
                                         st.success(f"✅ Successfully confirmed {len(records)} visit(s)/event(s)")
                                         log_activity(f"Confirmed {len(records)} proposed visits via bulk import", level='success')
-                                        trigger_data_refresh()
+                                        trigger_data_refresh(tables=['actual_visits'])
                                         st.rerun()
                                     else:
                                         st.error(f"❌ Error confirming visits: {message}")
@@ -1491,6 +1515,10 @@ def main():
 
         display_error_log_section()
 
+        # Flame breakdown of the last calendar build (VERBOSE level or higher)
+        if should_show_debug_ui():
+            display_performance_panel()
+
     except Exception as e:
         st.error(f"Error building calendar: {e}")
         st.exception(e)
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Headless benchmarks for the calendar pipeline stages
+
+Runs each stage against synthetic datasets (synthetic_data.py) of increasing size without
+a Streamlit server, records wall time and peak memory per stage, and fits a power-law
+scaling curve (seconds ~ patients^exponent) per stage to show which stages grow
+super-linearly. Run from the repo root:
+
+    python benchmark_suite.py --sizes 100 1000 10000 --output benchmarks.csv
+
+--debug-levels instead times the full calendar build at DEBUG_OFF vs DEBUG_STANDARD.
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from config import DEBUG_OFF, DEBUG_STANDARD
+from runtime_context import HeadlessContext, use_context
+from synthetic_data import DEFAULT_SEED, REFERENCE_DATE, generate_dataset
+
+STAGES = ('build_calendar', 'build_calendar_dataframe', 'fill_calendar_with_visits',
+          'calculate_financial_totals', 'build_site_busy_calendar', 'build_gantt_data',
+          'render_calendar_table', 'render_calendar_window', 'create_enhanced_excel_export')
+# Stages only run when named in --stages: the original Styler + regex calendar renderer, to compare
+# against render_calendar_table
+REFERENCE_STAGES = ('render_calendar_styler',)
+DEFAULT_SIZES = (100, 1000, 10000)
+# Exponent above which a stage is reported as super-linear
+SUPER_LINEAR_EXPONENT = 1.2
+
+
+def _stage_calls(dataset):
+    """(stage name, function taking no arguments) for every stage, with inputs from one full build
+
+    Each call works on copies so repeated runs start from the same inputs.
+    """
+    from processing_calendar import _build_calendar_impl, _prepare_calendar_inputs, calculate_financial_totals
+    from calendar_builder import build_calendar_dataframe, fill_calendar_with_visits, build_site_busy_calendar
+    from gantt_view import build_gantt_data
+    from display_components import (_calendar_display_frames, default_calendar_window_start,
+                                    render_calendar_table, slice_calendar_window)
+    from table_builders import create_enhanced_excel_export
+    from parity_checks import reference_calendar_html
+
+    patients_df = dataset['patients']
+    trials_df = dataset['trial_schedules']
+    actual_visits_df = dataset['actual_visits']
+
+    visits_df, calendar_df, cell_status, _, _, site_column_mapping, unique_visit_sites, prepared_patients = _build_calendar_impl(
+        patients_df.copy(), trials_df.copy(), actual_visits_df.copy()
+    )
+    _, prepared_trials, prepared_actual, *_ = _prepare_calendar_inputs(
+        patients_df.copy(), trials_df.copy(), actual_visits_df.copy()
+    )
+    empty_calendar = build_calendar_dataframe(visits_df, prepared_patients, False, prepared_actual)[0]
+    filled_calendar = fill_calendar_with_visits(empty_calendar.copy(), visits_df, prepared_trials)[0]
+    display_df, header_rows = _calendar_display_frames(calendar_df, site_column_mapping, unique_visit_sites)
+
+    def render_window():
+        window_start = default_calendar_window_start(calendar_df, REFERENCE_DATE)
+        window_df, window_mapping, window_sites, _ = slice_calendar_window(
+            calendar_df, site_column_mapping, unique_visit_sites, window_start)
+        window_display_df, window_header_rows = _calendar_display_frames(window_df, window_mapping, window_sites)
+        return render_calendar_table(window_display_df, window_header_rows, window_mapping, pd.Timestamp(REFERENCE_DATE),
+                                     cell_status=cell_status)
+
+    return {
+        'build_calendar': lambda: _build_calendar_impl(
+            patients_df.copy(), trials_df.copy(), actual_visits_df.copy()),
+        'build_calendar_dataframe': lambda: build_calendar_dataframe(
+            visits_df.copy(), prepared_patients.copy(), False, prepared_actual.copy()),
+        'fill_calendar_with_visits': lambda: fill_calendar_with_visits(
+            empty_calendar.copy(), visits_df.copy(), prepared_trials.copy()),
+        'calculate_financial_totals': lambda: calculate_financial_totals(filled_calendar.copy()),
+        'build_site_busy_calendar': lambda: build_site_busy_calendar(
+            visits_df.copy(), trials_df=prepared_trials.copy(), actual_visits_df=prepared_actual.copy()),
+        'build_gantt_data': lambda: build_gantt_data(
+            prepared_patients.copy(), prepared_trials.copy(), visits_df.copy(), prepared_actual.copy()),
+        'render_calendar_table': lambda: render_calendar_table(
+            display_df, header_rows, site_column_mapping, pd.Timestamp(REFERENCE_DATE), cell_status=cell_status),
+        'render_calendar_window': render_window,
+        'render_calendar_styler': lambda: reference_calendar_html(
+            calendar_df, site_column_mapping, unique_visit_sites, pd.Timestamp(REFERENCE_DATE)),
+        'create_enhanced_excel_export': lambda: create_enhanced_excel_export(
+            calendar_df.copy(), prepared_patients.copy(), visits_df.copy(), site_column_mapping,
+            unique_visit_sites, include_financial=True),
+    }
+
+
+def measure(func, repeats=1, memory=True):
+    """Best-of-`repeats` wall time and (one extra traced run) peak allocated memory in MB
+
+    Memory is measured in a separate run because tracemalloc slows the code it traces.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    peak_mb = None
+    if memory:
+        already_tracing = tracemalloc.is_tracing()
+        if not already_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        try:
+            func()
+            peak_mb = (tracemalloc.get_traced_memory()[1] - baseline) / (1024 * 1024)
+        finally:
+            if not already_tracing:
+                tracemalloc.stop()
+    return min(timings), peak_mb
+
+
+def benchmark_pipeline(sizes=DEFAULT_SIZES, stages=STAGES, seed=DEFAULT_SEED, repeats=1, memory=True):
+    """Time every stage on a generated dataset per size
+
+    Returns a DataFrame (Patients, ActualVisits, Stage, Seconds, PeakMemoryMB). A stage that
+    fails is recorded with its error instead of stopping the run. Stages run in a headless
+    context with logging off and today fixed at the datasets' REFERENCE_DATE.
+    """
+    with use_context(HeadlessContext(settings={'debug_level': DEBUG_OFF}, today=REFERENCE_DATE)):
+        return _benchmark_sizes(sizes, stages, seed, repeats, memory)
+
+
+def _benchmark_sizes(sizes, stages, seed, repeats, memory):
+    rows = []
+    for size in sizes:
+        dataset = generate_dataset(size, seed=seed)
+        calls = _stage_calls(dataset)
+        for stage in stages:
+            row = {'Patients': size, 'ActualVisits': len(dataset['actual_visits']), 'Stage': stage}
+            try:
+                seconds, peak_mb = measure(calls[stage], repeats=repeats, memory=memory)
+                row.update(Seconds=round(seconds, 4),
+                           PeakMemoryMB=round(peak_mb, 1) if peak_mb is not None else None)
+            except Exception as e:
+                row.update(Seconds=None, PeakMemoryMB=None, Error=str(e))
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def benchmark_debug_levels(sizes=DEFAULT_SIZES, levels=(DEBUG_OFF, DEBUG_STANDARD), seed=DEFAULT_SEED, repeats=3):
+    """Time the full calendar build at each debug level per size
+
+    Returns a DataFrame (Patients, DebugLevel, Seconds, Overhead) with the best of `repeats` builds;
+    Overhead is relative to the first level of the same size. The levels take turns within each
+    repeat so machine noise hits them alike.
+    """
+    from helpers import refresh_log_level
+    from processing_calendar import _build_calendar_impl
+
+    rows = []
+    for size in sizes:
+        dataset = generate_dataset(size, seed=seed)
+        contexts = {level: HeadlessContext(settings={'debug_level': level}, today=REFERENCE_DATE) for level in levels}
+        timings = {level: [] for level in levels}
+        for _ in range(repeats):
+            for level in levels:
+                with use_context(contexts[level]):
+                    refresh_log_level(level)
+                    try:
+                        start = time.perf_counter()
+                        _build_calendar_impl(dataset['patients'].copy(), dataset['trial_schedules'].copy(),
+                                             dataset['actual_visits'].copy())
+                        timings[level].append(time.perf_counter() - start)
+                    finally:
+                        refresh_log_level(DEBUG_OFF)
+        rows.extend({'Patients': size, 'DebugLevel': level, 'Seconds': round(min(timings[level]), 3)}
+                    for level in levels)
+
+    results = pd.DataFrame(rows, columns=['Patients', 'DebugLevel', 'Seconds'])
+    results['Overhead'] = (results['Seconds'] / results.groupby('Patients')['Seconds'].transform('first')).round(2)
+    return results
+
+
+def fit_scaling(results, x_column='Patients'):
+    """Least-squares fit of log(seconds) = exponent * log(size) + c per stage
+
+    Returns a DataFrame (Stage, Exponent, R2, MemoryExponent, Scaling). Exponent ~1 is
+    linear; above SUPER_LINEAR_EXPONENT the stage is flagged 'super-linear'.
+    """
+    rows = []
+    for stage, stage_results in results.dropna(subset=['Seconds']).groupby('Stage', sort=False):
+        stage_results = stage_results[stage_results['Seconds'] > 0]
+        if stage_results[x_column].nunique() < 2:
+            continue
+        x = np.log(stage_results[x_column].astype(float))
+        y = np.log(stage_results['Seconds'].astype(float))
+        exponent, intercept = np.polyfit(x, y, 1)
+        residual = ((y - (exponent * x + intercept)) ** 2).sum()
+        total = ((y - y.mean()) ** 2).sum()
+        memory = stage_results.dropna(subset=['PeakMemoryMB'])
+        memory = memory[memory['PeakMemoryMB'] > 0]
+        memory_exponent = (np.polyfit(np.log(memory[x_column].astype(float)), np.log(memory['PeakMemoryMB']), 1)[0]
+                           if memory[x_column].nunique() >= 2 else None)
+        rows.append({
+            'Stage': stage,
+            'Exponent': round(exponent, 2),
+            'R2': round(1 - residual / total, 3) if total else None,
+            'MemoryExponent': round(memory_exponent, 2) if memory_exponent is not None else None,
+            'Scaling': 'super-linear' if exponent > SUPER_LINEAR_EXPONENT else 'linear or better',
+        })
+    return pd.DataFrame(rows, columns=['Stage', 'Exponent', 'R2', 'MemoryExponent', 'Scaling'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the calendar pipeline stages on synthetic data")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="patient counts")
+    parser.add_argument('--stages', nargs='+', choices=STAGES + REFERENCE_STAGES, default=list(STAGES))
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--repeats', type=int, default=1, help="timed runs per stage (best is kept)")
+    parser.add_argument('--no-memory', action='store_true', help="skip the peak memory run")
+    parser.add_argument('--output', help="write the per-stage results to this CSV file")
+    parser.add_argument('--debug-levels', action='store_true',
+                        help="time the full calendar build at DEBUG_OFF vs DEBUG_STANDARD instead of the stages")
+    args = parser.parse_args(argv)
+
+    if args.debug_levels:
+        results = benchmark_debug_levels(args.sizes, seed=args.seed, repeats=max(args.repeats, 3))
+        print(results.to_string(index=False))
+        if args.output:
+            results.to_csv(args.output, index=False)
+        return results
+
+
+    results = benchmark_pipeline(args.sizes, args.stages, seed=args.seed, repeats=args.repeats,
+                                 memory=not args.no_memory)
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(results.to_string(index=False))
+        print()
+        print(fit_scaling(results).to_string(index=False))
+    if args.output:
+        results.to_csv(args.output, index=False)
+    return results
+
+
+if __name__ == '__main__':
+    main()
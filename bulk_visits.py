@@ -5,6 +5,7 @@ from typing import Tuple, Dict, Any, List
 import pandas as pd
 
 from helpers import log_activity
+from visit_status import TOLERANCE_STATUSES, visit_status_column
 
 
 def _normalize_visit_name(value: Any) -> str:
@@ -81,7 +82,7 @@ def build_overdue_predicted_export(
 
     # Exclude placeholder visits ("-" and "+")
     if "Visit" in df.columns:
-        df = df[~df["Visit"].isin(["-", "+"])]
+        df = df[~visit_status_column(df).isin(TOLERANCE_STATUSES)]
 
     # CRITICAL: Exclude visits for inactive patients (withdrawn, screen failed, deceased, completed)
     # These patients shouldn't have "overdue" visits since they're no longer in the study
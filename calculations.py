@@ -1,9 +1,13 @@
 import pandas as pd
-import streamlit as st
-from datetime import date
-from helpers import get_financial_year, get_financial_year_for_series, get_current_financial_year_boundaries, create_trial_payment_lookup, get_trial_payment_for_visit, log_activity
+from runtime_context import cache_data, get_context, register_cache_dependency, CACHE_TABLES
+from helpers import get_financial_year, get_financial_year_for_series, get_current_financial_year_boundaries, log_activity
+from visit_status import TOLERANCE_STATUSES, visit_status_column
+from financial_cube import FROM_TODAY, UP_TO_TODAY, VISIT_KINDS, cube_periods, cube_slice, get_financial_cube
 
-@st.cache_data(ttl=60, show_spinner=False)
+# Practices sharing the profits (work at third-party sites doesn't count)
+PROFIT_SHARING_SITES = ['Ashfields', 'Kiltearn']
+
+@cache_data(ttl=60, show_spinner=False)
 def _prepare_financial_data_impl(visits_df):
     """Internal cached implementation of financial data preparation"""
     if visits_df.empty:
@@ -28,8 +32,8 @@ def _prepare_financial_data_impl(visits_df):
         financial_df['Payment'] = pd.to_numeric(financial_df['Payment'], errors='coerce').fillna(0.0)
     
     # Filter for relevant visits (exclude only tolerance periods '-' and '+')
-    # Include: actual visits (with ✅, 🔴, ⚠  ), scheduled visits (plain visit names), but exclude tolerance periods
-    mask = ~financial_df['Visit'].isin(['-', '+'])
+    # Include: actual and scheduled visits of every status, but exclude tolerance periods
+    mask = ~visit_status_column(financial_df).isin(TOLERANCE_STATUSES)
     
     # OPTIMIZED: No need for .copy() here since we're just filtering, not modifying the filtered result
     financial_df = financial_df[mask]
@@ -80,9 +84,16 @@ def _prepare_financial_data_impl(visits_df):
     
     return financial_df
 
+register_cache_dependency('financial_data', _prepare_financial_data_impl.clear, CACHE_TABLES)
+
 def prepare_financial_data(visits_df):
-    """Prepare visits data with financial period columns (with caching)"""
-    return _prepare_financial_data_impl(visits_df)
+    """Prepare visits data with financial period columns (with caching)
+
+    The result is fingerprinted from the visits, so the financial cube doesn't hash it again.
+    """
+    from processing_calendar import attach_derived_fingerprint, get_table_fingerprint
+    financial_df = _prepare_financial_data_impl(visits_df)
+    return attach_derived_fingerprint(financial_df, 'financial_data', get_table_fingerprint(visits_df))
 
 def calculate_work_ratios(data_df, period_column, period_value):
     """Calculate work done ratios for a specific period"""
@@ -256,7 +267,7 @@ def calculate_recruitment_ratios(patients_df, period_column, period_value):
             'kiltearn_recruitment_count': kiltearn_count
         }
     except Exception as e:
-        st.error(f"Error calculating recruitment ratios for {period_value}: {e}")
+        get_context().notify(f"Error calculating recruitment ratios for {period_value}: {e}")
         return {
             'ashfields_recruitment_ratio': 0,
             'kiltearn_recruitment_ratio': 0,
@@ -324,30 +335,81 @@ def calculate_period_ratios(data_df, patients_df, period_column, period_value, w
         'combined': combined_ratios
     }
 
-def build_profit_sharing_analysis(financial_df, patients_df, weights):
-    """Build complete profit sharing analysis data"""
+def calculate_period_ratios_from_cube(cube, period_column, weights):
+    """calculate_period_ratios for every period of one period type at once, from the financial cube
+
+    Returns:
+        dict: period -> ratios (as calculate_period_ratios, plus the period's total 'income')
+    """
+    cells = cube_slice(cube, period_column)
+    visit_cells = cells[cells['Kind'] != 'recruited']
+    recruit_cells = cells[cells['Kind'] == 'recruited']
+    periods = cube_periods(cube, period_column)
+
+    # Only work at Ashfields and Kiltearn counts; third-party sites are excluded
+    site_work = (visit_cells[visit_cells['Site'].isin(PROFIT_SHARING_SITES)]
+                 .pivot_table(index='Period', columns='Site', values='Visits', aggfunc='sum', fill_value=0)
+                 .reindex(index=periods, columns=PROFIT_SHARING_SITES, fill_value=0))
+    site_recruits = (recruit_cells.pivot_table(index='Period', columns='Site', values='Recruits', aggfunc='sum', fill_value=0)
+                     .reindex(index=periods, fill_value=0))
+    recruit_totals = site_recruits.sum(axis=1)
+    site_recruits = site_recruits.reindex(columns=PROFIT_SHARING_SITES, fill_value=0)
+    income = visit_cells.groupby('Period')['Income'].sum()
+
+    list_ratios = get_list_ratios()
+    period_ratios = {}
+    for period in periods:
+        ashfields_work, kiltearn_work = site_work.loc[period, 'Ashfields'], site_work.loc[period, 'Kiltearn']
+        total_work = ashfields_work + kiltearn_work
+        work_ratios = {
+            'ashfields_work_ratio': ashfields_work / total_work if total_work > 0 else 0,
+            'kiltearn_work_ratio': kiltearn_work / total_work if total_work > 0 else 0,
+            'total_work': total_work,
+            'ashfields_work_count': ashfields_work,
+            'kiltearn_work_count': kiltearn_work
+        }
+        ashfields_recruits, kiltearn_recruits = site_recruits.loc[period, 'Ashfields'], site_recruits.loc[period, 'Kiltearn']
+        total_recruitment = recruit_totals.loc[period]
+        recruitment_ratios = {
+            'ashfields_recruitment_ratio': ashfields_recruits / total_recruitment if total_recruitment > 0 else 0,
+            'kiltearn_recruitment_ratio': kiltearn_recruits / total_recruitment if total_recruitment > 0 else 0,
+            'total_recruitment': total_recruitment,
+            'ashfields_recruitment_count': ashfields_recruits,
+            'kiltearn_recruitment_count': kiltearn_recruits
+        }
+        period_ratios[period] = {
+            'list': list_ratios,
+            'work': work_ratios,
+            'recruitment': recruitment_ratios,
+            'combined': calculate_combined_ratios(list_ratios, work_ratios, recruitment_ratios, weights),
+            'income': income.get(period, 0.0)
+        }
+    return period_ratios
+
+def build_profit_sharing_analysis(financial_df, patients_df, weights, cube=None):
+    """Build complete profit sharing analysis data
+
+    OPTIMIZED: Every quarter and financial year is a slice of the financial cube
+    (financial_cube.py, built once per visits/patients) instead of re-filtering the visits and
+    patients per period. Pass `cube` to share one cube between views.
+    """
     if financial_df.empty:
         return []
+    if cube is None:
+        cube = get_financial_cube(financial_df, patients_df)
     
-    quarters = sorted([q for q in financial_df['QuarterYear'].unique() if pd.notna(q)]) if 'QuarterYear' in financial_df.columns else []
-    financial_years = sorted([fy for fy in financial_df['FinancialYear'].unique() if pd.notna(fy)]) if 'FinancialYear' in financial_df.columns else []
+    quarter_ratios = calculate_period_ratios_from_cube(cube, 'QuarterYear', weights) if 'QuarterYear' in financial_df.columns else {}
+    fy_ratios = calculate_period_ratios_from_cube(cube, 'FinancialYear', weights) if 'FinancialYear' in financial_df.columns else {}
     
     quarterly_ratios = []
     
     # Process quarters
-    for quarter in quarters:
-        quarter_data = financial_df[financial_df['QuarterYear'] == quarter]
-        if len(quarter_data) == 0:
-            continue
-            
-        ratios = calculate_period_ratios(financial_df, patients_df, 'QuarterYear', quarter, weights)
-        
-        # Calculate quarter income - handle NaN values safely
-        quarter_total_income = quarter_data['Payment'].fillna(0).sum()
+    for quarter, ratios in quarter_ratios.items():
+        quarter_total_income = ratios['income']
         ashfields_income = quarter_total_income * ratios['combined']['ashfields_final_ratio']
         kiltearn_income = quarter_total_income * ratios['combined']['kiltearn_final_ratio']
         
-        # Extract financial year for sorting - improved parsing
+        # Extract financial year for sorting
         try:
             year_part = int(quarter.split('-Q')[0])
             quarter_num = int(quarter.split('-Q')[1])
@@ -357,32 +419,12 @@ def build_profit_sharing_analysis(financial_df, patients_df, weights):
             log_activity(f"FY parsing failed for period '{quarter}': {e}", level='warning')
             fy_year = None
         
-        quarterly_ratios.append({
-            'Period': quarter,
-            'Financial Year': fy_year,
-            'Type': 'Quarter',
-            'Total Visits': ratios['work']['total_work'],
-            'Ashfields Visits': ratios['work']['ashfields_work_count'],
-            'Kiltearn Visits': ratios['work']['kiltearn_work_count'],
-            'Ashfields Patients': ratios['recruitment']['ashfields_recruitment_count'],
-            'Kiltearn Patients': ratios['recruitment']['kiltearn_recruitment_count'],
-            'Ashfields Share': f"{ratios['combined']['ashfields_final_ratio']:.1%}",
-            'Kiltearn Share': f"{ratios['combined']['kiltearn_final_ratio']:.1%}",
-            'Total Income': f"£{quarter_total_income:,.2f}",
-            'Ashfields Income': f"£{ashfields_income:,.2f}",
-            'Kiltearn Income': f"£{kiltearn_income:,.2f}"
-        })
+        quarterly_ratios.append(_profit_sharing_row(quarter, fy_year, 'Quarter', ratios,
+                                                    quarter_total_income, ashfields_income, kiltearn_income))
     
     # Process financial years
-    for fy in financial_years:
-        fy_data = financial_df[financial_df['FinancialYear'] == fy]
-        if len(fy_data) == 0:
-            continue
-            
-        ratios = calculate_period_ratios(financial_df, patients_df, 'FinancialYear', fy, weights)
-        
-        # Calculate financial year income - handle NaN values safely
-        fy_total_income = fy_data['Payment'].fillna(0).sum()
+    for fy, ratios in fy_ratios.items():
+        fy_total_income = ratios['income']
         ashfields_income = fy_total_income * ratios['combined']['ashfields_final_ratio']
         kiltearn_income = fy_total_income * ratios['combined']['kiltearn_final_ratio']
         
@@ -392,54 +434,51 @@ def build_profit_sharing_analysis(financial_df, patients_df, weights):
             log_activity(f"FY parsing failed for period '{fy}': {e}", level='warning')
             fy_year = None
         
-        quarterly_ratios.append({
-            'Period': f"FY {fy}",
-            'Financial Year': fy_year,
-            'Type': 'Financial Year',
-            'Total Visits': ratios['work']['total_work'],
-            'Ashfields Visits': ratios['work']['ashfields_work_count'],
-            'Kiltearn Visits': ratios['work']['kiltearn_work_count'],
-            'Ashfields Patients': ratios['recruitment']['ashfields_recruitment_count'],
-            'Kiltearn Patients': ratios['recruitment']['kiltearn_recruitment_count'],
-            'Ashfields Share': f"{ratios['combined']['ashfields_final_ratio']:.1%}",
-            'Kiltearn Share': f"{ratios['combined']['kiltearn_final_ratio']:.1%}",
-            'Total Income': f"£{fy_total_income:,.2f}",
-            'Ashfields Income': f"£{ashfields_income:,.2f}",
-            'Kiltearn Income': f"£{kiltearn_income:,.2f}"
-        })
+        quarterly_ratios.append(_profit_sharing_row(f"FY {fy}", fy_year, 'Financial Year', ratios,
+                                                    fy_total_income, ashfields_income, kiltearn_income))
     
     # Sort results
     quarterly_ratios.sort(key=lambda x: (x['Financial Year'], x['Type'] == 'Financial Year', x['Period']))
     
     return quarterly_ratios
 
-def build_ratio_breakdown_data(financial_df, patients_df, period_config, weights):
-    """Build ratio breakdown data for any time period"""
+def _profit_sharing_row(period, fy_year, period_type, ratios, total_income, ashfields_income, kiltearn_income):
+    """One row of the profit sharing table"""
+    return {
+        'Period': period,
+        'Financial Year': fy_year,
+        'Type': period_type,
+        'Total Visits': ratios['work']['total_work'],
+        'Ashfields Visits': ratios['work']['ashfields_work_count'],
+        'Kiltearn Visits': ratios['work']['kiltearn_work_count'],
+        'Ashfields Patients': ratios['recruitment']['ashfields_recruitment_count'],
+        'Kiltearn Patients': ratios['recruitment']['kiltearn_recruitment_count'],
+        'Ashfields Share': f"{ratios['combined']['ashfields_final_ratio']:.1%}",
+        'Kiltearn Share': f"{ratios['combined']['kiltearn_final_ratio']:.1%}",
+        'Total Income': f"£{total_income:,.2f}",
+        'Ashfields Income': f"£{ashfields_income:,.2f}",
+        'Kiltearn Income': f"£{kiltearn_income:,.2f}"
+    }
+
+def build_ratio_breakdown_data(financial_df, patients_df, period_config, weights, cube=None):
+    """Build ratio breakdown data for any time period
+
+    OPTIMIZED: Periods are slices of the financial cube (see build_profit_sharing_analysis).
+    """
     period_column = period_config['column']
     period_name = period_config['name']
     
     # Handle empty financial_df case
     if financial_df.empty or period_column not in financial_df.columns:
         return []
-    
-    if period_column == 'MonthYear':
-        periods = sorted([p for p in financial_df['MonthYear'].unique() if pd.notna(p)]) if not financial_df.empty else []
-    elif period_column == 'QuarterYear':
-        periods = sorted([p for p in financial_df['QuarterYear'].unique() if pd.notna(p)]) if 'QuarterYear' in financial_df.columns else []
-    elif period_column == 'FinancialYear':
-        periods = sorted([p for p in financial_df['FinancialYear'].unique() if pd.notna(p)]) if 'FinancialYear' in financial_df.columns else []
-    else:
+    if period_column not in ('MonthYear', 'QuarterYear', 'FinancialYear'):
         return []
+    if cube is None:
+        cube = get_financial_cube(financial_df, patients_df)
     
-    list_ratios = get_list_ratios()
     ratio_data = []
-    
-    for period in periods:
-        ratios = calculate_period_ratios(financial_df, patients_df, period_column, period, weights)
-        
-        period_display = str(period) if period_column == 'MonthYear' else period
-        if period_column == 'FinancialYear':
-            period_display = f"FY {period}"
+    for period, ratios in calculate_period_ratios_from_cube(cube, period_column, weights).items():
+        period_display = f"FY {period}" if period_column == 'FinancialYear' else period
         
         ratio_data.append({
             f'{period_name}': period_display,
@@ -457,113 +496,63 @@ def build_ratio_breakdown_data(financial_df, patients_df, period_config, weights
     
     return ratio_data
 
-def calculate_income_realization_metrics(visits_df, trials_df, patients_df):
-    """Calculate income realization and pipeline metrics"""
-    from datetime import date
-    # Get current financial year boundaries using centralized function
-    fy_start, fy_end = get_current_financial_year_boundaries()
+def _current_fy_cells(cube):
+    """Scheduled-visit cells (no tolerance markers or recruits) of the current financial year"""
+    fy_start, _ = get_current_financial_year_boundaries()
+    return cube_slice(cube, 'FinancialYear', get_financial_year(fy_start), kinds=VISIT_KINDS)
 
-    # OPTIMIZED: Filter visits for current financial year only (no copy needed for filtering)
-    fy_visits = visits_df[(visits_df['Date'] >= fy_start) & (visits_df['Date'] <= fy_end)]
-    
-    # Get today's date for filtering proposed visits
-    today = pd.to_datetime(date.today()).normalize()
-    
-    # Separate completed vs scheduled work (no copy needed - just filtering/reading)
-    # CRITICAL: Exclude proposed visits from completed income (only count past actual visits)
-    is_actual = fy_visits.get('IsActual', False) == True
-    is_proposed = fy_visits.get('IsProposed', False) == True if 'IsProposed' in fy_visits.columns else pd.Series([False] * len(fy_visits))
-    date_past = fy_visits['Date'] <= today
-    completed_visits = fy_visits[is_actual & ~is_proposed & date_past]
-    all_visits = fy_visits  # Both completed and scheduled - no copy needed since we're just reading
-    
-    # Use existing Payment column directly - already has correct values
-    # (No need to recalculate from trial schedule as this causes double-counting)
-    
-    # Remove tolerance periods (-, +) from calculations
-    completed_visits = completed_visits[~completed_visits['Visit'].isin(['-', '+'])]
-    all_visits = all_visits[~all_visits['Visit'].isin(['-', '+'])]
-    
-    # Calculate totals - handle NaN values safely
-    completed_income = completed_visits['Payment'].fillna(0).sum()
-    total_scheduled_income = all_visits['Payment'].fillna(0).sum()
-    
-    # Pipeline = remaining scheduled income
-    remaining_visits = all_visits[all_visits.get('IsActual', False) == False]
-    pipeline_income = remaining_visits['Payment'].fillna(0).sum()
-    
-    # Realization rate - prevent division by zero
+def _completed_cells(cells):
+    """Actual (not proposed) visits up to today"""
+    return cells[(cells['Kind'] == 'actual') & cells['When'].isin(UP_TO_TODAY)]
+
+def calculate_income_realization_metrics(visits_df, trials_df, patients_df, cube=None):
+    """Calculate income realization and pipeline metrics
+
+    OPTIMIZED: Slices of the financial cube (pass `cube` to share one between views).
+    """
+    if cube is None:
+        cube = get_financial_cube(visits_df)
+    fy_cells = _current_fy_cells(cube)
+    completed = _completed_cells(fy_cells)
+    remaining = fy_cells[fy_cells['Kind'] == 'predicted']
+
+    completed_income = completed['Income'].sum()
+    total_scheduled_income = fy_cells['Income'].sum()
     realization_rate = (completed_income / total_scheduled_income * 100) if total_scheduled_income > 0 else 0
     
     return {
         'completed_income': completed_income,
         'total_scheduled_income': total_scheduled_income,
-        'pipeline_income': pipeline_income,
+        'pipeline_income': remaining['Income'].sum(),
         'realization_rate': realization_rate,
-        'completed_visits_count': len(completed_visits),
-        'total_scheduled_visits_count': len(all_visits),
-        'pipeline_visits_count': len(remaining_visits)
+        'completed_visits_count': int(completed['Visits'].sum()),
+        'total_scheduled_visits_count': int(fy_cells['Visits'].sum()),
+        'pipeline_visits_count': int(remaining['Visits'].sum())
     }
 
-def calculate_actual_and_predicted_income_by_site(visits_df, trials_df):
-    """Calculate actual and predicted income by site for current financial year"""
-    from datetime import date
-    from helpers import get_current_financial_year_boundaries, create_trial_payment_lookup, get_trial_payment_for_visit
-    
+def calculate_actual_and_predicted_income_by_site(visits_df, trials_df, cube=None):
+    """Calculate actual and predicted income by site for current financial year
+
+    OPTIMIZED: Slices of the financial cube instead of filtering the visits.
+    """
     try:
-        # Get current date and financial year boundaries
-        today = pd.to_datetime(date.today())
         fy_start, fy_end = get_current_financial_year_boundaries()
-        
-        # OPTIMIZED: Filter visits for current financial year (no copy needed for filtering)
-        fy_visits = visits_df[
-            (visits_df['Date'] >= fy_start) & 
-            (visits_df['Date'] <= fy_end)
-        ]
-        
-        if fy_visits.empty:
-            return pd.DataFrame()
-        
-        # Exclude tolerance markers (no copy needed - just filtering)
-        fy_visits = fy_visits[~fy_visits['Visit'].isin(['-', '+'])]
-        
-        if fy_visits.empty:
+        if cube is None:
+            cube = get_financial_cube(visits_df)
+        fy_cells = _current_fy_cells(cube)
+        if fy_cells.empty:
             return pd.DataFrame()
         
-        # Use all visits as-is without filtering or modifying site assignments
-        # This ensures consistency with Quarterly Profit Sharing calculations
-        
-        # Use existing Payment column directly - already has correct values
-        # (No need to recalculate from trial schedule as this causes double-counting)
-        
-        # OPTIMIZED: Separate actual and predicted visits (no copy needed - just filtering)
-        # CRITICAL: Exclude proposed visits from actual income (only count past actual visits)
-        is_actual = fy_visits.get('IsActual', False) == True
-        is_proposed = fy_visits.get('IsProposed', False) == True if 'IsProposed' in fy_visits.columns else pd.Series([False] * len(fy_visits))
-        date_past = fy_visits['Date'] <= today
-        actual_visits = fy_visits[is_actual & ~is_proposed & date_past]
-        predicted_visits = fy_visits[fy_visits.get('IsActual', False) == False]
-        
-        # Prefer ContractSite for financial attribution if present
-        site_income_col = 'ContractSite' if 'ContractSite' in fy_visits.columns else 'SiteofVisit'
-        
-        # Calculate actual income by site - handle NaN values safely
-        actual_income = actual_visits.groupby(site_income_col).agg({
-            'Payment': lambda x: x.fillna(0).sum(),
-            'VisitName': 'count'
-        }).rename(columns={
-            'Payment': 'Actual Income',
-            'VisitName': 'Actual Visits'
-        }).reset_index()
+        # Prefer ContractSite for financial attribution if present (the cube's ContractSite
+        # already falls back to SiteofVisit)
+        site_income_col = 'ContractSite' if 'ContractSite' in visits_df.columns else 'SiteofVisit'
         
-        # Calculate predicted income by site - handle NaN values safely
-        predicted_income = predicted_visits.groupby(site_income_col).agg({
-            'Payment': lambda x: x.fillna(0).sum(),
-            'VisitName': 'count'
-        }).rename(columns={
-            'Payment': 'Predicted Income',
-            'VisitName': 'Predicted Visits'
-        }).reset_index()
+        actual_income = _completed_cells(fy_cells).groupby('ContractSite').agg(
+            **{'Actual Income': ('Income', 'sum'), 'Actual Visits': ('Visits', 'sum')}
+        ).rename_axis(site_income_col).reset_index()
+        predicted_income = fy_cells[fy_cells['Kind'] == 'predicted'].groupby('ContractSite').agg(
+            **{'Predicted Income': ('Income', 'sum'), 'Predicted Visits': ('Visits', 'sum')}
+        ).rename_axis(site_income_col).reset_index()
         
         # Merge actual and predicted data
         site_income = pd.merge(
@@ -590,243 +579,174 @@ def calculate_actual_and_predicted_income_by_site(visits_df, trials_df):
         return site_income
         
     except Exception as e:
-        st.error(f"Error calculating actual and predicted income: {e}")
+        get_context().notify(f"Error calculating actual and predicted income: {e}")
         return pd.DataFrame()
 
-def calculate_monthly_realization_breakdown(visits_df, trials_df):
-    """Calculate month-by-month realization metrics"""
+def calculate_monthly_realization_breakdown(visits_df, trials_df, cube=None):
+    """Calculate month-by-month realization metrics
+
+    OPTIMIZED: Month cells of the financial cube instead of re-filtering the visits per month.
+    """
     try:
-        # Get current financial year boundaries using centralized function
         fy_start, fy_end = get_current_financial_year_boundaries()
+        if cube is None:
+            cube = get_financial_cube(visits_df)
+        fy_months = pd.period_range(fy_start, fy_end, freq='M').astype(str)
+        month_cells = cube_slice(cube, 'MonthYear', kinds=VISIT_KINDS)
+        month_cells = month_cells[month_cells['Period'].isin(fy_months)]
         
-        # OPTIMIZED: Filter for current financial year (use view first, copy only when modifying)
-        fy_visits_view = visits_df[(visits_df['Date'] >= fy_start) & (visits_df['Date'] <= fy_end)]
-        
-        if fy_visits_view.empty:
-            return []
-        
-        # OPTIMIZED: Only copy when we need to modify (add MonthYear column)
-        fy_visits = fy_visits_view.copy()
-        fy_visits['MonthYear'] = fy_visits['Date'].dt.to_period('M')
-        
-        # Use existing Payment column directly - already has correct values
-        # (No need to recalculate from trial schedule as this causes double-counting)
+        scheduled = month_cells.groupby('Period')[['Income', 'Visits']].sum()
+        completed = _completed_cells(month_cells).groupby('Period')[['Income', 'Visits']].sum()
+        completed = completed.reindex(scheduled.index, fill_value=0)
         
-        # Remove tolerance periods (no copy needed - just filtering)
-        fy_visits = fy_visits[~fy_visits['Visit'].isin(['-', '+'])]
-        
-        # Calculate monthly breakdown
         monthly_data = []
-        from datetime import date
-        today = pd.to_datetime(date.today()).normalize()
-        month_values = fy_visits['MonthYear'].dropna().unique()
-        for month in sorted(month_values):
-            month_visits = fy_visits[fy_visits['MonthYear'] == month]
-            
-            # CRITICAL: Exclude proposed visits from completed income (only count past actual visits)
-            is_actual = month_visits.get('IsActual', False) == True
-            is_proposed = month_visits.get('IsProposed', False) == True if 'IsProposed' in month_visits.columns else pd.Series([False] * len(month_visits))
-            date_past = month_visits['Date'] <= today
-            completed = month_visits[is_actual & ~is_proposed & date_past]
-            completed_income = pd.to_numeric(completed['Payment'], errors='coerce').fillna(0).sum()
-            
-            total_scheduled_income = pd.to_numeric(month_visits['Payment'], errors='coerce').fillna(0).sum()
-            
+        for month in scheduled.index:
+            completed_income = completed.at[month, 'Income']
+            total_scheduled_income = scheduled.at[month, 'Income']
             realization_rate = (completed_income / total_scheduled_income * 100) if total_scheduled_income > 0 else 0
             
             monthly_data.append({
-                'Month': str(month),
+                'Month': month,
                 'Completed_Income': completed_income,
                 'Scheduled_Income': total_scheduled_income,
                 'Realization_Rate': realization_rate,
-                'Completed_Visits': len(completed),
-                'Scheduled_Visits': len(month_visits)
+                'Completed_Visits': int(completed.at[month, 'Visits']),
+                'Scheduled_Visits': int(scheduled.at[month, 'Visits'])
             })
         
         return monthly_data
     except Exception as e:
-        st.error(f"Error calculating monthly realization breakdown: {e}")
+        get_context().notify(f"Error calculating monthly realization breakdown: {e}")
         return []
 
-def calculate_study_pipeline_breakdown(visits_df, trials_df):
-    """Calculate pipeline value by study"""
-    from datetime import date
-    
+def calculate_study_pipeline_breakdown(visits_df, trials_df, cube=None):
+    """Calculate pipeline value by study
+
+    OPTIMIZED: All-time predicted cells from today on, from the financial cube.
+    """
     try:
-        today = pd.to_datetime(date.today())
-        
-        # OPTIMIZED: Get remaining visits (use view first, copy only if needed)
-        remaining_visits_view = visits_df[
-            (visits_df['Date'] >= today) & 
-            (visits_df.get('IsActual', False) == False)
-        ]
+        if cube is None:
+            cube = get_financial_cube(visits_df)
+        remaining = cube_slice(cube, 'All', kinds=['predicted'], when=FROM_TODAY)
         
-        # Remove tolerance periods (filtering doesn't require copy)
-        remaining_visits = remaining_visits_view[~remaining_visits_view['Visit'].isin(['-', '+'])]
-        
-        if remaining_visits.empty:
+        if remaining.empty:
             return pd.DataFrame(columns=['Study', 'Pipeline_Value', 'Remaining_Visits'])
         
-        # Use existing Payment column directly - already has correct values
-        # (No need to recalculate from trial schedule as this causes double-counting)
-        
         # Group by study
-        study_pipeline = remaining_visits.groupby('Study').agg({
-            'Payment': 'sum',
-            'Visit': 'count'
-        }).rename(columns={'Payment': 'Pipeline_Value', 'Visit': 'Remaining_Visits'})
+        study_pipeline = remaining.groupby('Study').agg(
+            Pipeline_Value=('Income', 'sum'),
+            Remaining_Visits=('Visits', 'sum')
+        )
         
         # Sort by pipeline value descending
         study_pipeline = study_pipeline.sort_values('Pipeline_Value', ascending=False)
         
         return study_pipeline.reset_index()
     except Exception as e:
-        st.error(f"Error calculating study pipeline breakdown: {e}")
+        get_context().notify(f"Error calculating study pipeline breakdown: {e}")
         return pd.DataFrame(columns=['Study', 'Pipeline_Value', 'Remaining_Visits'])
 
-def calculate_site_realization_breakdown(visits_df, trials_df):
-    """Calculate realization rates by site"""
+def calculate_site_realization_breakdown(visits_df, trials_df, cube=None):
+    """Calculate realization rates by site
+
+    OPTIMIZED: Slices of the financial cube, sites in order of their first visit, instead of
+    re-filtering the visits per site.
+    """
     try:
-        # Use existing Payment column directly - already has correct values
-        # (No need to recalculate from trial schedule as this causes double-counting)
-        
-        # Get current financial year boundaries using centralized function
-        fy_start, fy_end = get_current_financial_year_boundaries()
-        
-        # OPTIMIZED: Filter visits (no copy needed - just filtering/reading)
-        fy_visits = visits_df[(visits_df['Date'] >= fy_start) & (visits_df['Date'] <= fy_end)]
-        fy_visits = fy_visits[~fy_visits['Visit'].isin(['-', '+'])]  # Remove tolerance periods
+        if cube is None:
+            cube = get_financial_cube(visits_df)
+        fy_cells = _current_fy_cells(cube)
         
-        if fy_visits.empty:
+        if fy_cells.empty:
             return []
         
-        # Calculate by site
-        site_data = []
-        from datetime import date
-        today = pd.to_datetime(date.today()).normalize()
-        
-        site_income_col = 'ContractSite' if 'ContractSite' in fy_visits.columns else 'SiteofVisit'
+        by_site = fy_cells.groupby('ContractSite', dropna=False)
+        totals = by_site[['Income', 'Visits']].sum()
+        completed = _completed_cells(fy_cells).groupby('ContractSite', dropna=False)[['Income', 'Visits']].sum()
+        remaining = fy_cells[(fy_cells['Kind'] == 'predicted') & fy_cells['When'].isin(FROM_TODAY)]
+        remaining = remaining.groupby('ContractSite', dropna=False)[['Income', 'Visits']].sum()
+        completed = completed.reindex(totals.index, fill_value=0)
+        remaining = remaining.reindex(totals.index, fill_value=0)
         
-        for site in fy_visits[site_income_col].unique():
-            site_visits = fy_visits[fy_visits[site_income_col] == site]
-            
-            # CRITICAL: Exclude proposed visits from completed income (only count past actual visits)
-            is_actual = site_visits.get('IsActual', False) == True
-            is_proposed = site_visits.get('IsProposed', False) == True if 'IsProposed' in site_visits.columns else pd.Series([False] * len(site_visits))
-            date_past = site_visits['Date'] <= today
-            completed = site_visits[is_actual & ~is_proposed & date_past]
-            completed_income = completed['Payment'].fillna(0).sum()
-            
-            total_scheduled_income = site_visits['Payment'].fillna(0).sum()
-            
-            # Remaining pipeline for this site
-            remaining = site_visits[(site_visits['Date'] >= today) & (site_visits.get('IsActual', False) == False)]
-            pipeline_income = remaining['Payment'].fillna(0).sum()
-            
+        site_data = []
+        for site in by_site['FirstSeen'].min().sort_values(kind='mergesort').index:
+            completed_income = completed.at[site, 'Income']
+            total_scheduled_income = totals.at[site, 'Income']
             realization_rate = (completed_income / total_scheduled_income * 100) if total_scheduled_income > 0 else 0
             
             site_data.append({
                 'Site': site,
                 'Completed_Income': completed_income,
                 'Total_Scheduled_Income': total_scheduled_income,
-                'Pipeline_Income': pipeline_income,
+                'Pipeline_Income': remaining.at[site, 'Income'],
                 'Realization_Rate': realization_rate,
-                'Completed_Visits': len(completed),
-                'Total_Visits': len(site_visits),
-                'Remaining_Visits': len(remaining)
+                'Completed_Visits': int(completed.at[site, 'Visits']),
+                'Total_Visits': int(totals.at[site, 'Visits']),
+                'Remaining_Visits': int(remaining.at[site, 'Visits'])
             })
         
         return site_data
     except Exception as e:
-        st.error(f"Error calculating site realization breakdown: {e}")
+        get_context().notify(f"Error calculating site realization breakdown: {e}")
         return []
 
-def calculate_study_realization_by_study(visits_df, period: str = 'current_fy'):
+def calculate_study_realization_by_study(visits_df, period: str = 'current_fy', cube=None):
     """Build per-study realization (completed vs scheduled vs pipeline) for a period.
 
+    OPTIMIZED: Slices of the financial cube instead of filtering the visits.
+
     Args:
         visits_df: Visits with columns including Date, Study, Payment, Visit, IsActual
         period: 'current_fy' or 'all_time'
+        cube: Optional financial cube of visits_df (built if not given)
 
     Returns:
         pd.DataFrame with columns:
             Study, Completed Income, Completed Visits, Scheduled Income,
             Scheduled Visits, Pipeline Income, Remaining Visits, Realization Rate
     """
+    empty = pd.DataFrame(columns=[
+        'Study', 'Completed Income', 'Completed Visits',
+        'Scheduled Income', 'Scheduled Visits',
+        'Pipeline Income', 'Remaining Visits', 'Realization Rate'
+    ])
     try:
         if visits_df is None or visits_df.empty:
-            return pd.DataFrame(columns=[
-                'Study', 'Completed Income', 'Completed Visits',
-                'Scheduled Income', 'Scheduled Visits',
-                'Pipeline Income', 'Remaining Visits', 'Realization Rate'
-            ])
-
-        # OPTIMIZED: Only copy if we need to modify, otherwise use views
-        df = visits_df.copy()  # Keep copy here since we modify Payment column below
+            return empty
+        if cube is None:
+            cube = get_financial_cube(visits_df)
 
-        # Filter by period (no copy needed - just filtering)
         if period == 'current_fy':
-            from helpers import get_current_financial_year_boundaries
-            fy_start, fy_end = get_current_financial_year_boundaries()
-            df = df[(df['Date'] >= fy_start) & (df['Date'] <= fy_end)]
-
-        if df.empty:
-            return pd.DataFrame(columns=[
-                'Study', 'Completed Income', 'Completed Visits',
-                'Scheduled Income', 'Scheduled Visits',
-                'Pipeline Income', 'Remaining Visits', 'Realization Rate'
-            ])
-
-        # Exclude tolerance markers (no copy needed - just filtering)
-        df = df[~df['Visit'].isin(['-', '+'])]
-
-        if df.empty:
-            return pd.DataFrame(columns=[
-                'Study', 'Completed Income', 'Completed Visits',
-                'Scheduled Income', 'Scheduled Visits',
-                'Pipeline Income', 'Remaining Visits', 'Realization Rate'
-            ])
-
-        # Ensure numeric payments
-        df['Payment'] = pd.to_numeric(df.get('Payment', 0), errors='coerce').fillna(0.0)
-
-        # Completed vs scheduled flags
-        # CRITICAL: Exclude proposed visits from completed income (only count past actual visits)
-        from datetime import date
-        today = pd.to_datetime(date.today()).normalize()
-        is_actual = df.get('IsActual', False) == True
-        is_proposed = df.get('IsProposed', False) == True if 'IsProposed' in df.columns else pd.Series([False] * len(df))
-        date_past = df['Date'] <= today
-        is_completed = is_actual & ~is_proposed & date_past
-        is_pipeline = df.get('IsActual', False) == False
+            cells = _current_fy_cells(cube)
+        else:
+            cells = cube_slice(cube, 'All', kinds=VISIT_KINDS)
+        if cells.empty:
+            return empty
 
         # Group aggregations
-        completed = df[is_completed].groupby('Study').agg(
-            Completed_Income=('Payment', 'sum'),
-            Completed_Visits=('Visit', 'count')
+        completed = _completed_cells(cells).groupby('Study').agg(
+            Completed_Income=('Income', 'sum'),
+            Completed_Visits=('Visits', 'sum')
         )
-        scheduled = df.groupby('Study').agg(
-            Scheduled_Income=('Payment', 'sum'),
-            Scheduled_Visits=('Visit', 'count')
+        scheduled = cells.groupby('Study').agg(
+            Scheduled_Income=('Income', 'sum'),
+            Scheduled_Visits=('Visits', 'sum')
         )
-        pipeline = df[is_pipeline].groupby('Study').agg(
-            Pipeline_Income=('Payment', 'sum'),
-            Remaining_Visits=('Visit', 'count')
+        pipeline = cells[cells['Kind'] == 'predicted'].groupby('Study').agg(
+            Pipeline_Income=('Income', 'sum'),
+            Remaining_Visits=('Visits', 'sum')
         )
 
         # Merge
         result = scheduled.join(completed, how='left').join(pipeline, how='left').fillna(0)
 
         # Realization rate
-        result['Realization Rate'] = result.apply(
-            lambda r: (r['Completed_Income'] / r['Scheduled_Income'] * 100) if r['Scheduled_Income'] > 0 else 0,
-            axis=1
-        )
+        result['Realization Rate'] = (result['Completed_Income'] / result['Scheduled_Income'] * 100).where(
+            result['Scheduled_Income'] > 0, 0)
 
         # Reorder and rename columns for display
         result = result.reset_index()
         result = result.rename(columns={
-            'Study': 'Study',
             'Completed_Income': 'Completed Income',
             'Completed_Visits': 'Completed Visits',
             'Scheduled_Income': 'Scheduled Income',
@@ -840,9 +760,5 @@ def calculate_study_realization_by_study(visits_df, period: str = 'current_fy'):
 
         return result
     except Exception as e:
-        st.error(f"Error calculating by-study realization: {e}")
-        return pd.DataFrame(columns=[
-            'Study', 'Completed Income', 'Completed Visits',
-            'Scheduled Income', 'Scheduled Visits',
-            'Pipeline Income', 'Remaining Visits', 'Realization Rate'
-        ])
+        get_context().notify(f"Error calculating by-study realization: {e}")
+        return empty
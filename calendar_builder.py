@@ -1,7 +1,12 @@
+import numpy as np
 import pandas as pd
 from datetime import timedelta
-from helpers import safe_string_conversion, format_site_events, log_activity
+from helpers import safe_string_conversion_series, format_site_events, log_activity
 from profiling import timeit
+from visit_processor import expand_tolerance_markers
+from runtime_context import current_date
+from visit_status import (ACTUAL_MASK, ACTUAL_STATUSES, STATUS_ACTUAL, STATUS_BITS, STATUS_PLANNED, STATUS_PREDICTED,
+                          STATUS_PROPOSED, TOLERANCE_STATUSES, status_bit, visit_status_column)
 
 CALENDAR_DEBUG = False
 
@@ -47,12 +52,12 @@ def is_patient_inactive(patient_id, study, visits_df, actual_visits_df=None):
             # Check if there are any predicted visits (not actual, not tolerance markers)
             predicted = patient_visits[
                 (patient_visits.get('IsActual', False) == False) &
-                (~patient_visits['Visit'].isin(['-', '+']))
+                (~visit_status_column(patient_visits).isin(TOLERANCE_STATUSES))
             ]
             
             # Check if there are any proposed visits (IsProposed=True)
             is_proposed = patient_visits.get('IsProposed', False) == True if 'IsProposed' in patient_visits.columns else pd.Series([False] * len(patient_visits))
-            proposed = patient_visits[is_proposed & (~patient_visits['Visit'].isin(['-', '+']))]
+            proposed = patient_visits[is_proposed & (~visit_status_column(patient_visits).isin(TOLERANCE_STATUSES))]
             
             # Patient is only "finished" if no predicted visits AND no proposed visits remain
             if predicted.empty and proposed.empty:
@@ -60,21 +65,82 @@ def is_patient_inactive(patient_id, study, visits_df, actual_visits_df=None):
     
     return False, 'active'
 
-@timeit
-def build_calendar_dataframe(visits_df, patients_df, hide_inactive=False, actual_visits_df=None):
-    """Build the basic calendar dataframe structure"""
-    log_activity(f"Building calendar - visits_df empty: {visits_df.empty}, len: {len(visits_df)}", level='info')
-    
-    # DEBUG: Check visits_df state when calendar is built
-    if not visits_df.empty:
-        log_activity(f"Visits_df has data - date range: {visits_df['Date'].min()} to {visits_df['Date'].max()}", level='info')
-    else:
-        log_activity(f"Visits_df is empty when building calendar!", level='warning')
-    
+def build_inactivity_index(visits_df, actual_visits_df=None):
+    """(PatientID, Study) -> (is_inactive, reason) for every patient, in one grouped pass
+
+    Same rules as is_patient_inactive: Withdrawn/ScreenFail/Died in the actual visit Notes, otherwise
+    'finished' once no predicted or proposed visits remain. Patients not in the index are active.
+    """
+    inactivity_index = {}
+    if visits_df is not None and not visits_df.empty:
+        is_marker = visit_status_column(visits_df).isin(TOLERANCE_STATUSES)
+        predicted = (visits_df['IsActual'] == False) if 'IsActual' in visits_df.columns else pd.Series(True, index=visits_df.index)
+        proposed = (visits_df['IsProposed'] == True) if 'IsProposed' in visits_df.columns else pd.Series(False, index=visits_df.index)
+        remaining = ((predicted | proposed) & ~is_marker).groupby(
+            [visits_df['PatientID'].astype(str), visits_df['Study'].astype(str)], sort=False
+        ).any()
+        inactivity_index.update(
+            (key, (False, 'active') if has_remaining else (True, 'finished')) for key, has_remaining in remaining.items()
+        )
+
+    if actual_visits_df is not None and not actual_visits_df.empty and 'Notes' in actual_visits_df.columns:
+        notes = actual_visits_df['Notes'].fillna('').astype(str)
+        flags = pd.DataFrame({
+            reason: notes.str.contains(marker, regex=False)
+            for marker, reason in (('Withdrawn', 'withdrawn'), ('ScreenFail', 'screen_failed'), ('Died', 'died'))
+        }).groupby([actual_visits_df['PatientID'].astype(str), actual_visits_df['Study'].astype(str)], sort=False).any()
+        # First matching flag wins (withdrawn, then screen_failed, then died)
+        reasons = flags.idxmax(axis=1)[flags.any(axis=1)]
+        inactivity_index.update((key, (True, reason)) for key, reason in reasons.items())
+
+    return inactivity_index
+
+def hide_inactive_columns(calendar_df, site_column_mapping, inactivity_index):
+    """Drop inactive patients' columns from a full calendar build (no rebuild needed)
+
+    Returns:
+        tuple: (calendar_df, site_column_mapping) without the inactive patient columns
+    """
+    hidden_columns = set()
+    visible_mapping = {}
+    for visit_site, site_info in site_column_mapping.items():
+        patient_info = []
+        for info in site_info['patient_info']:
+            is_inactive, reason = inactivity_index.get((str(info['patient_id']), str(info['study'])), (False, 'active'))
+            if is_inactive:
+                hidden_columns.add(info['col_id'])
+            else:
+                patient_info.append(info)
+        visible_mapping[visit_site] = {
+            **site_info,
+            'columns': [col for col in site_info['columns'] if col not in hidden_columns],
+            'patient_info': patient_info
+        }
+    if hidden_columns:
+        log_activity(f"Filtering {len(hidden_columns)} inactive patient column(s) from the calendar", level='info')
+    return calendar_df.drop(columns=[col for col in calendar_df.columns if col in hidden_columns]), visible_mapping
+
+def get_visits_date_span(visits_df):
+    """Earliest and latest visit date, including tolerance windows stored on predicted visits"""
+    min_date = visits_df["Date"].min()
+    max_date = visits_df["Date"].max()
+    if 'ToleranceStart' in visits_df.columns:
+        window_start = visits_df["ToleranceStart"].min()
+        window_end = visits_df["ToleranceEnd"].max()
+        if pd.notna(window_start):
+            min_date = min(min_date, window_start)
+        if pd.notna(window_end):
+            max_date = max(max_date, window_end)
+    return min_date, max_date
+
+def get_calendar_date_range(visits_df, patients_df):
+    """Calendar start/end dates: visit span (incl. tolerance windows) padded by a day,
+    extended to cover every actual visit, or a patient/today-based fallback without visits"""
     # Create date range based on visits if available, otherwise use patient dates
     if not visits_df.empty and 'Date' in visits_df.columns and len(visits_df) > 0:
-        min_date = visits_df["Date"].min() - timedelta(days=1)
-        max_date = visits_df["Date"].max() + timedelta(days=1)
+        visits_min, visits_max = get_visits_date_span(visits_df)
+        min_date = visits_min - timedelta(days=1)
+        max_date = visits_max + timedelta(days=1)
         log_activity(f"Using visits date range: {min_date} to {max_date}", level='info')
     else:
         # Fallback: use patient screening dates to create a reasonable date range
@@ -87,8 +153,7 @@ def build_calendar_dataframe(visits_df, patients_df, hide_inactive=False, actual
             log_activity(f"Using patient date range: {min_date} to {max_date}", level='info')
         else:
             # Ultimate fallback: use current date range
-            from datetime import date
-            today = date.today()
+            today = current_date()
             min_date = today - timedelta(days=30)
             max_date = today + timedelta(days=365)
             log_activity(f"Using fallback date range: {min_date} to {max_date}", level='info')
@@ -110,7 +175,20 @@ def build_calendar_dataframe(visits_df, patients_df, hide_inactive=False, actual
                 log_activity(f"Extended max_date to include actual visits: {max_date}", level='info')
             
             log_activity(f"Final calendar date range: {min_date} to {max_date}", level='info')
+    return min_date, max_date
+
+@timeit
+def build_calendar_dataframe(visits_df, patients_df, hide_inactive=False, actual_visits_df=None):
+    """Build the basic calendar dataframe structure"""
+    log_activity(f"Building calendar - visits_df empty: {visits_df.empty}, len: {len(visits_df)}", level='info')
     
+    # DEBUG: Check visits_df state when calendar is built
+    if not visits_df.empty:
+        log_activity(f"Visits_df has data - date range: {visits_df['Date'].min()} to {visits_df['Date'].max()}", level='info')
+    else:
+        log_activity(f"Visits_df is empty when building calendar!", level='warning')
+    
+    min_date, max_date = get_calendar_date_range(visits_df, patients_df)
     calendar_dates = pd.date_range(start=min_date, end=max_date)
     calendar_df = pd.DataFrame({"Date": calendar_dates})
     calendar_df["Day"] = calendar_df["Date"].dt.day_name()
@@ -142,6 +220,9 @@ def build_calendar_dataframe(visits_df, patients_df, hide_inactive=False, actual
             if origin_site:
                 origin_lookup[(patient_id, study)] = origin_site
     
+    # OPTIMIZED: One grouped pass for every patient's inactive status instead of a scan per patient
+    inactivity_index = build_inactivity_index(visits_df, actual_visits_df) if hide_inactive else None
+    
     # Get unique visit sites from actual visit data only
     # This ensures only sites that perform work get calendar sections
     
@@ -177,7 +258,7 @@ def build_calendar_dataframe(visits_df, patients_df, hide_inactive=False, actual
                 
                 # Filter inactive patients if hide_inactive is enabled
                 if hide_inactive:
-                    is_inactive, reason = is_patient_inactive(patient_id, study, visits_df, actual_visits_df)
+                    is_inactive, reason = inactivity_index.get((str(patient_id), str(study)), (False, 'active'))
                     if is_inactive:
                         log_activity(f"Filtering inactive patient {patient_id} ({study}) - reason: {reason}", level='info')
                         continue
@@ -255,235 +336,121 @@ def build_calendar_dataframe(visits_df, patients_df, hide_inactive=False, actual
 
     return calendar_df, site_column_mapping, unique_visit_sites
 
-@timeit
-def fill_calendar_with_visits(calendar_df, visits_df, trials_df):
-    """Fill the calendar with visit information"""
-    
-    
-    # Check for actual visits
-    if 'IsActual' in visits_df.columns and CALENDAR_DEBUG:
-        actual_count = len(visits_df[visits_df['IsActual'] == True])
-        if actual_count > 0:
-            log_activity(f"📅 Processing {actual_count} actual visits", level='info')
-    
-    # Create income tracking columns
-    for study in trials_df["Study"].unique():
-        income_col = f"{study} Income"
-        calendar_df[income_col] = 0.0
-    
-    calendar_df["Daily Total"] = 0.0
+# Labels landing in the same calendar cell are merged in visit order (see _merge_cell_labels)
+TOLERANCE_MARKERS = ("-", "+")
 
-    # OPTIMIZED: Pre-filter visits to calendar date range and group by date for fast lookup
-    if visits_df.empty:
-        log_activity("No visits to process", level='info')
-        return calendar_df
-    
-    # Normalize dates to date-only for consistent comparison
-    calendar_min_date = calendar_df["Date"].min()
-    calendar_max_date = calendar_df["Date"].max()
-    
-    # Filter visits to only those in calendar range (much faster than filtering in loop)
-    visits_in_range = visits_df[
-        (visits_df["Date"] >= calendar_min_date) & 
-        (visits_df["Date"] <= calendar_max_date)
-    ].copy()
-    
-    # Normalize visit dates to date-only Timestamps for matching
-    visits_in_range["Date"] = pd.to_datetime(visits_in_range["Date"]).dt.normalize()
-    
-    # Group visits by date for O(1) lookup instead of O(n) filtering in loop
-    visits_by_date = {}
-    for date, group in visits_in_range.groupby("Date"):
-        visits_by_date[date] = group
-    
-    # OPTIMIZED: Pre-compute column ID mappings to avoid repeated column searches
-    # Create mapping from base_col_id to actual column IDs (handles site suffixes)
-    col_id_mapping = {}
-    for col in calendar_df.columns:
-        if col not in ["Date", "Day"] and not col.endswith("_Events") and not col.endswith(" Income") and col != "Daily Total":
-            # Extract base_col_id (Study_PatientID) from column name
-            if "_" in col:
-                parts = col.split("_")
-                if len(parts) >= 2:
-                    # Try to find base pattern (Study_PatientID)
-                    for i in range(1, len(parts)):
-                        base_col_id = "_".join(parts[:i+1])
-                        if base_col_id not in col_id_mapping:
-                            col_id_mapping[base_col_id] = []
-                        col_id_mapping[base_col_id].append(col)
-    
-    # PHASE 3 OPTIMIZATION: Create date-to-index mapping for O(1) lookup
-    # This eliminates the need to iterate through calendar_df
-    calendar_dates = pd.to_datetime(calendar_df['Date']).dt.normalize()
-    date_to_idx = {date: idx for idx, date in enumerate(calendar_dates)}
-    
-    # Initialize Daily Total for all dates (dates without visits will remain 0.0)
-    # Income columns are already initialized above
-    
-    # OPTIMIZED: Process visits by date (only iterate through dates that have visits)
-    # This reduces iterations from 365 (all dates) to ~100-200 (dates with visits)
-    for visit_date, visits_group in visits_by_date.items():
-        if visit_date not in date_to_idx:
+def _merge_cell_labels(labels, statuses):
+    """Merge the labels that land in one calendar cell, in visit order
+
+    Actual visits replace predicted/planned/proposed ones (several actual visits are all kept),
+    proposed visits replace predicted/planned ones, planned and predicted visits stack unless
+    something higher is already there, and tolerance markers only fill cells without a scheduled visit.
+
+    Returns:
+        tuple: (cell value, status mask of the labels kept in it)
+    """
+    value = ""
+    mask = 0
+    for label, status in zip(labels, statuses):
+        bit = status_bit(status)
+        if value == "":
+            value, mask = label, bit
             continue
-            
-        i = date_to_idx[visit_date]
-        visits_today = visits_group
-        
-        
-        daily_total = 0.0
-
-        # Group events by site for the events columns
-        site_events = {}
-
-        # OPTIMIZED: Use itertuples for visit iteration (faster than iterrows)
-        if not visits_today.empty:
-            for visit_tuple in visits_today.itertuples(index=True):
-                # Convert tuple to dict-like for compatibility with existing code
-                visit = visits_today.loc[visit_tuple.Index]
-                study = str(visit["Study"])
-                pid = str(visit["PatientID"])
-                visit_info = visit["Visit"]
-                payment = float(visit["Payment"]) if pd.notna(visit["Payment"]) else 0.0
-                is_actual = visit.get("IsActual", False)
-                visit_site = visit["SiteofVisit"]
-                
+        has_actual = bool(mask & ACTUAL_MASK)
+        has_planned = bool(mask & (status_bit(STATUS_PLANNED) | status_bit(STATUS_PROPOSED)))
+        has_predicted = bool(mask & status_bit(STATUS_PREDICTED))
+        empty_or_marker = value in ("-", "+", "")
+        if status in TOLERANCE_STATUSES:
+            if not (has_actual or has_planned or has_predicted):
+                value, mask = (label, bit) if empty_or_marker else (f"{value}, {label}", mask | bit)
+        elif status == STATUS_PLANNED:
+            if not has_actual:
+                value, mask = (label, bit) if empty_or_marker else (f"{value}\n{label}", mask | bit)
+        elif status == STATUS_PREDICTED:
+            if empty_or_marker:
+                value, mask = label, bit
+            elif not (has_actual or has_planned):
+                value, mask = f"{value}\n{label}", mask | bit
+        else:
+            # Actual visit (completed, stoppage, data error and proposed-date visits)
+            value, mask = (label, bit) if empty_or_marker or not has_actual else (f"{value}\n{label}", mask | bit)
+    return value, mask
 
-                # Handle study events - FIXED: Properly handle NaN values
-                is_study_event = visit.get("IsStudyEvent", False)
-                # Convert NaN to False (pandas NaN evaluates to True in if statements)
-                if pd.isna(is_study_event):
-                    is_study_event = False
-                
-                if is_study_event:
-                    if visit_site not in site_events:
-                        site_events[visit_site] = []
-                    
-                    # Validate event data before formatting
-                    event_type = safe_string_conversion(visit.get("EventType", "")).upper()
-                    study_name = safe_string_conversion(visit.get("Study", ""))
-                    
-                    # Skip if essential data is missing or invalid
-                    if not event_type or event_type in ['NAN', 'NONE', '']:
-                        continue
-                    if not study_name or study_name in ['NAN', 'NONE', ''] or study_name.upper() == 'NAN':
-                        continue
-                    
-                    # Format event for display
-                    event_display = f"✅ {event_type}_{study_name}"
-                    
-                    site_events[visit_site].append(event_display)
-                    
-                    # Add to study income
-                    income_col = f"{study_name} Income"
-                    if income_col in calendar_df.columns and payment > 0:
-                        calendar_df.at[i, income_col] += payment
-                        daily_total += payment
-
-                else:
-                    # Handle regular patient visits
-                    base_col_id = f"{study}_{pid}"
-                    
-                    # OPTIMIZED: Use pre-computed mapping for O(1) lookup instead of O(n) search
-                    col_id = None
-                    if base_col_id in calendar_df.columns:
-                        col_id = base_col_id
-                    elif base_col_id in col_id_mapping:
-                        # Use first matching column from mapping
-                        col_id = col_id_mapping[base_col_id][0]
-                    
-                    if col_id and col_id in calendar_df.columns:
-                        current_value = calendar_df.at[i, col_id]
-                        
-                        if current_value == "":
-                            calendar_df.at[i, col_id] = visit_info
-                        else:
-                            # Handle multiple visits on same day - IMPROVED LOGIC
-                            current_str = str(current_value)
-                            has_actual = any(symbol in current_str for symbol in ["✅", "🔴", "⚠️"])
-                            has_planned = "📅" in current_str
-                            has_predicted = "📋" in current_str
-                            has_proposed = "❓" in current_str
-                            
-                            # If this is a tolerance marker
-                            if visit_info in ["-", "+"]:
-                                # Only add if there's no actual or scheduled visit already there
-                                if not (has_actual or has_planned or has_predicted):
-                                    if current_value in ["-", "+", ""]:
-                                        calendar_df.at[i, col_id] = visit_info
-                                    else:
-                                        calendar_df.at[i, col_id] = f"{current_value}, {visit_info}"
-                            # If this is a planned visit (📅)
-                            elif "📅" in visit_info and "(Planned)" in visit_info:
-                                # Only add if there's no actual visit on this date
-                                if not has_actual:
-                                    if current_value in ["-", "+", ""]:
-                                        calendar_df.at[i, col_id] = visit_info
-                                    else:
-                                        calendar_df.at[i, col_id] = f"{current_value}\n{visit_info}"
-                            # If this is a proposed visit (❓)
-                            elif "❓" in visit_info and "(Proposed)" in visit_info:
-                                # Proposed visits can replace predicted/planned, but not actual
-                                if current_value in ["-", "+", ""]:
-                                    calendar_df.at[i, col_id] = visit_info
-                                elif not has_actual:
-                                    # Replace predicted/planned with proposed, but keep existing actual
-                                    calendar_df.at[i, col_id] = visit_info
-                                else:
-                                    # Actual visit exists - don't replace, but can append if multiple actual visits
-                                    if has_actual:
-                                        calendar_df.at[i, col_id] = f"{current_value}\n{visit_info}"
-                            # If this is a predicted visit (📋) 
-                            elif "📋" in visit_info and "(Predicted)" in visit_info:
-                                # Only add if cell is empty or has tolerance markers
-                                if current_value in ["-", "+", ""]:
-                                    calendar_df.at[i, col_id] = visit_info
-                                elif not (has_actual or has_planned or has_proposed):
-                                    calendar_df.at[i, col_id] = f"{current_value}\n{visit_info}"
-                            # If this is an actual visit (✅, 🔴, ⚠️)
-                            else:
-                                # Actual visits take priority - always add them (replace proposed/predicted)
-                                if current_value in ["-", "+", ""]:
-                                    calendar_df.at[i, col_id] = visit_info
-                                    if is_actual:
-                                        if CALENDAR_DEBUG:
-                                            log_activity(f"    -> Placed in cell with tolerance markers", level='info')
-                                else:
-                                    # Check if there's already an actual visit
-                                    if has_actual:
-                                        # Multiple actual visits on same day
-                                        calendar_df.at[i, col_id] = f"{current_value}\n{visit_info}"
-                                        if is_actual:
-                                            if CALENDAR_DEBUG:
-                                                log_activity(f"    -> Added to existing actual visit", level='info')
-                                    else:
-                                        # Replace predicted/proposed/planned with actual
-                                        calendar_df.at[i, col_id] = visit_info
-                                        if is_actual:
-                                            if CALENDAR_DEBUG:
-                                                log_activity(f"    -> Replaced predicted/proposed/planned with actual", level='info')
-                    else:
-                        # NEW: Log when column not found
-                        if is_actual:
-                            available_cols = [c for c in calendar_df.columns if study in c or pid in c]
-                            log_activity(f"  ERROR: Could not find column for actual visit {base_col_id}. Available similar columns: {available_cols}", level='error')
-
-                    # Count payments for actual visits and scheduled main visits
-                    # CRITICAL: Exclude proposed visits from income (they're future dates, not earned yet)
-                    is_proposed = visit.get('IsProposed', False)
-                    if (is_actual and not is_proposed) or (not is_actual and visit_info not in ("-", "+")):
-                        income_col = f"{study} Income"
-                        if income_col in calendar_df.columns:
-                            calendar_df.at[i, income_col] += payment
-                            daily_total += payment
-
-        # Fill site events columns
-        for site, events in site_events.items():
-            events_col = f"{site}_Events"
-            if events_col in calendar_df.columns:
-                calendar_df.at[i, events_col] = format_site_events(events)
-
-        calendar_df.at[i, "Daily Total"] = daily_total
-    
+def _reduce_calendar_cells(cells):
+    """Reduce a long (row, column, label, status) table, in visit order, to one value per calendar cell
+
+    Cells holding only the statuses the visit engines produce - actual (completed, stoppage, data
+    error), proposed-date, predicted and tolerance markers - are reduced column-wise: actual visits
+    from the first completed/stoppage one onwards (or the last proposed-date visit) win, otherwise
+    the predicted visits are stacked, and marker-only cells take the last marker. Any other mix
+    (planned visits, labels without a status) goes through _merge_cell_labels.
+
+    Returns:
+        DataFrame: row, column, value and mask (status mask of the labels kept in the cell)
+    """
+    if cells.empty:
+        return pd.DataFrame(columns=['row', 'column', 'value', 'mask'])
+    label = cells['label']
+    status = cells['status']
+
+    is_marker = status.isin(TOLERANCE_STATUSES)
+    is_predicted = status == STATUS_PREDICTED
+    is_actual = ~(is_marker | is_predicted | (status == STATUS_PLANNED))
+    anchors_actual = status.isin(ACTUAL_STATUSES)
+    standard = (
+        is_marker | anchors_actual | (status == STATUS_PROPOSED) | is_predicted
+    ) & label.map(lambda value: isinstance(value, str))
+
+    cell = cells.groupby(['row', 'column'], sort=False).ngroup()
+    order = pd.Series(np.arange(len(cells)), index=cells.index)
+    fallback = cell.isin(cell[~standard].unique())
+    real = ~is_marker & ~fallback
+
+    # Real visits: keep actual visits from the anchor on, or every predicted visit if there is none
+    first_anchor = order.where(anchors_actual & real).groupby(cell).transform('min')
+    last_actual = order.where(is_actual & real).groupby(cell).transform('max')
+    anchor = first_anchor.fillna(last_actual)
+    kept = cells[real & (anchor.isna() | (is_actual & (order >= anchor)))]
+    kept = kept.assign(mask=STATUS_BITS[kept['status'].to_numpy()])
+    kept_cell = cell[kept.index]
+    stacked = kept_cell.duplicated(keep=False)
+    stacked_kept = kept[stacked]
+    joined = stacked_kept.groupby(kept_cell[stacked], sort=False).agg(
+        row=('row', 'first'), column=('column', 'first'), value=('label', '\n'.join)
+    )
+    # OR of the stacked labels' bits = sum of their distinct bits
+    stacked_bits = pd.DataFrame({'cell': kept_cell[stacked], 'mask': stacked_kept['mask']}).drop_duplicates()
+    joined['mask'] = stacked_bits.groupby('cell')['mask'].sum().reindex(joined.index).to_numpy()
+    values = [kept.loc[~stacked, ['row', 'column', 'label', 'mask']].rename(columns={'label': 'value'}), joined]
+
+    # Tolerance markers only reach cells without a visit - the last one wins
+    markers = cells[is_marker & ~fallback & ~cell.isin(cell[real].unique())]
+    markers = markers.drop_duplicates(subset=['row', 'column'], keep='last')
+    values.append(pd.DataFrame({
+        'row': markers['row'], 'column': markers['column'], 'value': markers['label'],
+        'mask': STATUS_BITS[markers['status'].to_numpy()],
+    }))
+
+    if fallback.any():
+        merged = [
+            (group['row'].iloc[0], group['column'].iloc[0], *_merge_cell_labels(group['label'], group['status']))
+            for _, group in cells[fallback].groupby(cell[fallback], sort=False)
+        ]
+        values.append(pd.DataFrame(merged, columns=['row', 'column', 'value', 'mask']))
+    return pd.concat(values, ignore_index=True)
+
+def _flag_column(df, column, nan_is_true=True):
+    """Row-wise truth value of an optional flag column, as `if row[column]:` sees it"""
+    if column not in df.columns:
+        return pd.Series(False, index=df.index)
+    values = df[column]
+    if pd.api.types.is_bool_dtype(values):
+        return values.astype(bool)
+    flags = values.map(bool).astype(bool)
+    return flags if nan_is_true else flags & values.notna()
+
+def _finalize_filled_calendar(calendar_df, visits_df, cell_status):
+    """Column clean-up and debug counts after the calendar has been filled"""
     # Check for duplicate indices before returning
     if not calendar_df.index.is_unique:
         log_activity(f"Reset duplicate indices in calendar DataFrame", level='info')
@@ -508,49 +475,217 @@ def fill_calendar_with_visits(calendar_df, visits_df, trials_df):
         log_activity(f"Calendar filled: {total_actual} actual visits, {total_predicted} predicted visits", level='info')
         
         # Debug: Check how many actual visits ended up in the calendar
-        actual_visits_in_calendar = 0
-        for col in calendar_df.columns:
-            if col not in ["Date", "Day"] and not col.endswith("_Events") and not col.endswith(" Income") and not col in ["Daily Total", "MonthPeriod", "Monthly Total", "FYStart", "FY Total"]:
-                for val in calendar_df[col]:
-                    if "✅" in str(val):
-                        actual_visits_in_calendar += 1
+        patient_columns = [col for col in cell_status.columns if not col.endswith("_Events")]
+        actual_visits_in_calendar = int((cell_status[patient_columns].to_numpy() & status_bit(STATUS_ACTUAL) != 0).sum())
         
         log_activity(f"DEBUG: {actual_visits_in_calendar} actual visit markers placed in calendar", level='info')
     
-    return calendar_df
+    return calendar_df, cell_status
+
+def _empty_cell_status(calendar_dates, status_columns):
+    """Status frame with no status set: int16 masks indexed by Date, one column per cell column"""
+    return pd.DataFrame(
+        np.zeros((len(calendar_dates), len(status_columns)), dtype=np.int16),
+        index=pd.DatetimeIndex(calendar_dates, name='Date'), columns=status_columns
+    )
+
+def _build_col_id_mapping(columns):
+    """Map base column IDs (Study_PatientID) to the patient columns carrying them (handles site suffixes)"""
+    col_id_mapping = {}
+    for col in columns:
+        if col not in ["Date", "Day"] and not col.endswith("_Events") and not col.endswith(" Income") and col != "Daily Total":
+            # Extract base_col_id (Study_PatientID) from column name
+            if "_" in col:
+                parts = col.split("_")
+                if len(parts) >= 2:
+                    # Try to find base pattern (Study_PatientID)
+                    for i in range(1, len(parts)):
+                        base_col_id = "_".join(parts[:i+1])
+                        if base_col_id not in col_id_mapping:
+                            col_id_mapping[base_col_id] = []
+                        col_id_mapping[base_col_id].append(col)
+    return col_id_mapping
 
 @timeit
-def build_site_busy_calendar(visits_df, trials_df=None, actual_visits_df=None, date_range=None):
-    """Build a site-busy calendar view showing all visits/events per site per day
+def fill_calendar_with_visits(calendar_df, visits_df, trials_df):
+    """Fill the calendar with visit information
+
+    OPTIMIZED: Column-wise - visits and tolerance markers become one long (row, column, label)
+    table that is reduced per cell (_reduce_calendar_cells) and pivoted into the grid once, and
+    study income plus Daily Total come from one pivot_table. `python parity_checks.py --checks
+    calendar_fill` diffs the grid against the original cell-by-cell fill.
+
+    Returns:
+        tuple: (calendar_df, cell_status) - cell_status holds the status mask (visit_status) of
+        every patient/events cell: int16, indexed by Date, one column per cell column
+    """
+    # Check for actual visits
+    if 'IsActual' in visits_df.columns and CALENDAR_DEBUG:
+        actual_count = len(visits_df[visits_df['IsActual'] == True])
+        if actual_count > 0:
+            log_activity(f"📅 Processing {actual_count} actual visits", level='info')
     
-    Args:
-        visits_df: DataFrame with all visits (actual, predicted, proposed)
-        trials_df: Optional DataFrame with trial schedules (for tolerance lookup)
-        actual_visits_df: Optional DataFrame with actual visits (for Notes/DNA detection)
-        date_range: Optional tuple (min_date, max_date) to limit date range
+    calendar_dates = pd.to_datetime(calendar_df['Date']).dt.normalize()
+    status_columns = list(dict.fromkeys(col for col in calendar_df.columns if col not in ('Date', 'Day')))
+    cell_status = _empty_cell_status(calendar_dates, status_columns)
+
+    # Create income tracking columns
+    for study in trials_df["Study"].unique():
+        income_col = f"{study} Income"
+        calendar_df[income_col] = 0.0
     
+    calendar_df["Daily Total"] = 0.0
+
+    if visits_df.empty:
+        log_activity("No visits to process", level='info')
+        return calendar_df, cell_status
+    
+    # Tolerance windows are stored as ToleranceStart/ToleranceEnd on predicted visits -
+    # expand the '-'/'+' markers here, after the real visits so those always take the cell
+    tolerance_markers = expand_tolerance_markers(visits_df)
+    if not tolerance_markers.empty:
+        visits_df = pd.concat([visits_df, tolerance_markers], ignore_index=True, sort=False)
+    
+    # Calendar row of every visit in the calendar date range
+    date_rows = pd.Series(np.arange(len(calendar_dates)), index=pd.DatetimeIndex(calendar_dates))
+    date_rows = date_rows[~date_rows.index.duplicated(keep='last')]
+    visits = visits_df[
+        (visits_df["Date"] >= calendar_df["Date"].min()) & 
+        (visits_df["Date"] <= calendar_df["Date"].max())
+    ]
+    rows = pd.to_datetime(visits["Date"]).dt.normalize().map(date_rows)
+    visits = visits[rows.notna()].reset_index(drop=True)
+    rows = rows[rows.notna()].astype(int).reset_index(drop=True)
+    payments = pd.to_numeric(visits["Payment"], errors='coerce').fillna(0.0)
+    calendar_columns = set(calendar_df.columns)
+    is_event = _flag_column(visits, "IsStudyEvent", nan_is_true=False)
+
+    # Study events: one events cell per site and date, income for valid events with a payment
+    events = visits[is_event]
+    event_type = safe_string_conversion_series(
+        events["EventType"] if "EventType" in events.columns else pd.Series("", index=events.index)
+    ).str.upper()
+    event_study = safe_string_conversion_series(events["Study"])
+    valid_event = (
+        ~event_type.isin(['NAN', 'NONE', '']) & ~event_study.isin(['NAN', 'NONE', '']) & (event_study.str.upper() != 'NAN')
+    )
+    event_cells = pd.DataFrame(columns=['row', 'column', 'value', 'mask'])
+    if not events.empty:
+        event_labels = ("✅ " + event_type + "_" + event_study).where(valid_event)
+        site_events = event_labels.groupby([rows[is_event].to_numpy(), events["SiteofVisit"].to_numpy()], sort=False, dropna=False).agg(
+            lambda labels: format_site_events(labels.dropna().tolist())
+        )
+        event_cells = pd.DataFrame({
+            'row': site_events.index.get_level_values(0),
+            'column': [f"{site}_Events" for site in site_events.index.get_level_values(1)],
+            'value': site_events.to_numpy(),
+        })
+        # The events cell lists its valid events, each rendered as completed
+        has_events = valid_event.groupby([rows[is_event].to_numpy(), events["SiteofVisit"].to_numpy()], sort=False, dropna=False).any()
+        event_cells['mask'] = np.where(has_events.reindex(site_events.index).to_numpy(), status_bit(STATUS_ACTUAL), 0)
+        event_cells = event_cells[event_cells['column'].isin(calendar_columns)]
+    event_income = pd.DataFrame({
+        'row': rows[is_event], 'column': event_study + " Income", 'payment': payments[is_event]
+    })[valid_event & (payments[is_event] > 0)]
+
+    # Patient visits: resolve each Study_PatientID to its calendar column
+    regular = visits[~is_event]
+    studies = regular["Study"].astype(str)
+    patient_ids = regular["PatientID"].astype(str)
+    base_col_ids = studies + "_" + patient_ids
+    col_id_mapping = _build_col_id_mapping(calendar_df.columns)
+    resolved = {
+        base_col_id: base_col_id if base_col_id in calendar_columns else col_id_mapping.get(base_col_id, [None])[0]
+        for base_col_id in base_col_ids.unique()
+    }
+    target_columns = base_col_ids.map(resolved)
+    is_actual = _flag_column(regular, "IsActual")
+
+    missing_actual = target_columns.isna() & is_actual
+    if missing_actual.any():
+        missing = pd.DataFrame({'base_col_id': base_col_ids, 'study': studies, 'pid': patient_ids})[missing_actual]
+        for visit in missing.drop_duplicates('base_col_id').itertuples(index=False):
+            available_cols = [c for c in calendar_df.columns if visit.study in c or visit.pid in c]
+            log_activity(f"  ERROR: Could not find column for actual visit {visit.base_col_id}. Available similar columns: {available_cols}", level='error')
+
+    placed = target_columns.notna()
+    statuses = visit_status_column(regular)
+    cells = pd.DataFrame({
+        'row': rows[~is_event][placed].to_numpy(),
+        'column': target_columns[placed].to_numpy(),
+        'label': regular["Visit"][placed].to_numpy(),
+        'status': statuses[placed].to_numpy(),
+    })
+
+    # Count payments for actual visits and scheduled main visits
+    # CRITICAL: Exclude proposed visits from income (they're future dates, not earned yet)
+    is_proposed = _flag_column(regular, "IsProposed")
+    counted = (is_actual & ~is_proposed) | (~is_actual & ~statuses.isin(TOLERANCE_STATUSES))
+    visit_income = pd.DataFrame({
+        'row': rows[~is_event], 'column': studies + " Income", 'payment': payments[~is_event]
+    })[counted]
+
+    # Write the grid: one pivot of all cell values (events cells win, as they are written last)
+    grid_cells = pd.concat([_reduce_calendar_cells(cells), event_cells], ignore_index=True)
+    grid_cells = grid_cells.drop_duplicates(subset=['row', 'column'], keep='last')
+    if not grid_cells.empty:
+        grid = grid_cells.pivot(index='row', columns='column', values='value').reindex(np.arange(len(calendar_df)))
+        grid_columns = list(grid.columns)
+        grid_values = grid.to_numpy(dtype=object)
+        existing = calendar_df[grid_columns].to_numpy(dtype=object)
+        calendar_df[grid_columns] = np.where(pd.isna(grid_values), existing, grid_values)
+        # Status mask per cell, for styles, icons and tooltips at display time
+        positions = pd.Index(status_columns).get_indexer(grid_cells['column'])
+        placed_cells = positions >= 0
+        masks = cell_status.to_numpy(copy=True)
+        cell_rows = grid_cells['row'].to_numpy(dtype=int)[placed_cells]
+        masks[cell_rows, positions[placed_cells]] = grid_cells['mask'].to_numpy(dtype=np.int16)[placed_cells]
+        cell_status = pd.DataFrame(masks, index=cell_status.index, columns=status_columns)
+
+    # Per-study income and Daily Total from one pivot_table (visit order kept for the sums)
+    income = pd.concat([event_income, visit_income]).sort_index(kind='mergesort')
+    income = income[income['column'].isin(calendar_columns)]
+    if not income.empty:
+        totals = income.pivot_table(
+            index='row', columns='column', values='payment', aggfunc='sum',
+            fill_value=0.0, margins=True, margins_name='Daily Total'
+        ).drop(index='Daily Total')
+        totals = totals.reindex(np.arange(len(calendar_df)))
+        for income_col in totals.columns:
+            column_totals = totals[income_col].to_numpy(dtype=float)
+            current = calendar_df[income_col].to_numpy(dtype=float, copy=True)
+            filled = ~np.isnan(column_totals)
+            current[filled] = column_totals[filled]
+            calendar_df[income_col] = current
+
+    return _finalize_filled_calendar(calendar_df, visits_df, cell_status)
+
+@timeit
+def _site_busy_frame(visits_df, date_range=None):
+    """Empty site-busy grid (Date, Day and one "" column per valid SiteofVisit) and its sites
+
     Returns:
-        site_busy_df: DataFrame with Date, Day, and one column per site
+        tuple: (site_busy_df, unique_sites) - unique_sites is empty when there is nothing to fill
     """
-    from datetime import date
     from helpers import log_activity
     
     if visits_df.empty:
         log_activity("No visits to build site busy calendar", level='warning')
-        return pd.DataFrame(columns=['Date', 'Day'])
+        return pd.DataFrame(columns=['Date', 'Day']), []
     
     # Determine date range
+    visits_min, visits_max = get_visits_date_span(visits_df)
     if date_range:
         min_date, max_date = date_range
         # If max_date is None, use visits_df max date
         if max_date is None:
-            max_date = visits_df["Date"].max() + timedelta(days=1)
+            max_date = visits_max + timedelta(days=1)
         # Ensure min_date is not None (shouldn't happen, but be safe)
         if min_date is None:
-            min_date = visits_df["Date"].min() - timedelta(days=1)
+            min_date = visits_min - timedelta(days=1)
     else:
-        min_date = visits_df["Date"].min() - timedelta(days=1)
-        max_date = visits_df["Date"].max() + timedelta(days=1)
+        min_date = visits_min - timedelta(days=1)
+        max_date = visits_max + timedelta(days=1)
     
     # Create calendar date range
     calendar_dates = pd.date_range(start=min_date, end=max_date)
@@ -565,158 +700,150 @@ def build_site_busy_calendar(visits_df, trials_df=None, actual_visits_df=None, d
     
     if not unique_sites:
         log_activity("No valid sites found for site busy calendar", level='warning')
-        return site_busy_df
+        return site_busy_df, []
     
     # Initialize site columns
     for site in unique_sites:
         site_busy_df[site] = ""
     
-    # Normalize dates for matching
-    visits_df = visits_df.copy()
-    visits_df["Date"] = pd.to_datetime(visits_df["Date"]).dt.normalize()
     site_busy_df["Date"] = pd.to_datetime(site_busy_df["Date"]).dt.normalize()
-    
-    # Create date-to-index mapping
-    date_to_idx = {date: idx for idx, date in enumerate(site_busy_df['Date'])}
-    
-    # Create tolerance lookup from trials_df if available - OPTIMIZED: use itertuples
-    tolerance_lookup = {}
-    if trials_df is not None and not trials_df.empty:
-        for trial in trials_df.itertuples(index=False):
-            key = (str(getattr(trial, 'Study', '')), str(getattr(trial, 'VisitName', '')))
-            tolerance_before = int(getattr(trial, 'ToleranceBefore', 0) or 0)
-            tolerance_after = int(getattr(trial, 'ToleranceAfter', 0) or 0)
-            tolerance_lookup[key] = (tolerance_before, tolerance_after)
-    
-    # Create Notes lookup from actual_visits_df if available (for DNA detection) - OPTIMIZED
-    notes_lookup = {}
-    if actual_visits_df is not None and not actual_visits_df.empty:
-        for visit in actual_visits_df.itertuples(index=False):
-            actual_date = getattr(visit, 'ActualDate', None)
-            normalized_date = pd.to_datetime(actual_date).normalize() if pd.notna(actual_date) else None
-            key = (
-                str(getattr(visit, 'PatientID', '')),
-                str(getattr(visit, 'Study', '')),
-                str(getattr(visit, 'VisitName', '')),
-                normalized_date
-            )
-            notes = str(getattr(visit, 'Notes', '') or '')
-            if key[3] is not None:
-                notes_lookup[key] = notes
-    
-    today = pd.Timestamp(date.today()).normalize()
-    
-    # Group visits by date and site
-    for visit_date, date_group in visits_df.groupby('Date'):
-        if visit_date not in date_to_idx:
-            continue
-        
-        idx = date_to_idx[visit_date]
-        
-        # Group by site
-        for site, site_group in date_group.groupby('SiteofVisit'):
-            if site not in unique_sites:
-                continue
-            
-            # Separate events from patient visits
-            events = []
-            patient_visits = []
-            
-            for _, visit in site_group.iterrows():
-                is_study_event = visit.get('IsStudyEvent', False)
-                if pd.isna(is_study_event):
-                    is_study_event = False
-                
-                if is_study_event:
-                    events.append(visit)
-                else:
-                    # Skip tolerance markers
-                    visit_display = str(visit.get('Visit', ''))
-                    if visit_display not in ['-', '+']:
-                        patient_visits.append(visit)
-            
-            # Format and combine visits
-            formatted_items = []
-            
-            # Format events first (at top of cell)
-            for event in events:
-                event_type = str(event.get('EventType', '')).upper()
-                study = str(event.get('Study', ''))
-                is_proposed = event.get('IsProposed', False)
-                
-                if is_proposed:
-                    formatted_items.append(f"📅 {event_type}_{study} (Proposed)")
-                else:
-                    formatted_items.append(f"✅ {event_type}_{study}")
-            
-            # Format patient visits
-            for visit in patient_visits:
-                label = format_visit_label_for_site_busy(
-                    visit, today, tolerance_lookup, notes_lookup
-                )
-                if label:
-                    formatted_items.append(label)
-            
-            # Combine all items with newlines
-            if formatted_items:
-                site_busy_df.at[idx, site] = "\n".join(formatted_items)
-    
-    return site_busy_df
+    return site_busy_df, unique_sites
+
+def _site_busy_tolerances(trials_df):
+    """(Study, VisitName, ToleranceBefore, ToleranceAfter) per schedule visit, last row winning"""
+    if trials_df is None or trials_df.empty:
+        return None
+    tolerances = pd.DataFrame({
+        'Study': _text_column(trials_df, 'Study'),
+        'VisitName': _text_column(trials_df, 'VisitName'),
+        'ToleranceBefore': _whole_days(trials_df, 'ToleranceBefore'),
+        'ToleranceAfter': _whole_days(trials_df, 'ToleranceAfter'),
+    })
+    return tolerances.drop_duplicates(subset=['Study', 'VisitName'], keep='last')
+
+def _site_busy_notes(actual_visits_df):
+    """(PatientID, Study, VisitName, Date, Notes) per dated actual visit, last row winning"""
+    if actual_visits_df is None or actual_visits_df.empty:
+        return None
+    dates = (pd.to_datetime(actual_visits_df['ActualDate'], errors='coerce').dt.normalize()
+             if 'ActualDate' in actual_visits_df.columns else pd.Series(pd.NaT, index=actual_visits_df.index))
+    notes = actual_visits_df['Notes'] if 'Notes' in actual_visits_df.columns else pd.Series('', index=actual_visits_df.index)
+    notes = pd.DataFrame({
+        'PatientID': _text_column(actual_visits_df, 'PatientID'),
+        'Study': _text_column(actual_visits_df, 'Study'),
+        'VisitName': _text_column(actual_visits_df, 'VisitName'),
+        'Date': dates,
+        'Notes': notes.where(notes.map(bool), '').astype(str),
+    })[dates.notna()]
+    return notes.drop_duplicates(subset=['PatientID', 'Study', 'VisitName', 'Date'], keep='last')
+
+def _text_column(df, column):
+    """str() of every value of an optional column ('' when the column is missing)"""
+    if column not in df.columns:
+        return pd.Series('', index=df.index)
+    return df[column].map(str)
+
+def _whole_days(df, column):
+    """int(value or 0) per value of an optional tolerance column"""
+    if column not in df.columns:
+        return pd.Series(0, index=df.index)
+    return np.trunc(pd.to_numeric(df[column], errors='coerce').fillna(0)).astype(int)
+
+def format_site_busy_labels(visits, today, tolerances=None, notes=None):
+    """Site-busy labels for patient visits with normalized Dates, built column-wise
+
+    Proposed: "📅 ... (Proposed)"; past actual: "✅ ..." or "❌ ... DNA" when its Notes mention
+    DNA; past predicted: "📋 ... ?"; future predicted: "📋 ..." plus " +after -before" tolerance.
+
+    tolerances and notes are the _site_busy_tolerances/_site_busy_notes tables (or None).
+    Visits without a VisitName, Study or PatientID get None.
+    """
+    visit_names = _text_column(visits, 'VisitName')
+    studies = _text_column(visits, 'Study')
+    patient_ids = _text_column(visits, 'PatientID')
+    dates = visits['Date']
+    is_actual = _flag_column(visits, 'IsActual')
+    is_proposed = _flag_column(visits, 'IsProposed')
+    past = (dates < today).to_numpy()
+    base = visit_names + " " + studies + " " + patient_ids
+
+    is_dna = np.zeros(len(visits), dtype=bool)
+    if notes is not None and not notes.empty:
+        keys = pd.DataFrame({'PatientID': patient_ids, 'Study': studies, 'VisitName': visit_names, 'Date': dates})
+        matched = keys.merge(notes, on=['PatientID', 'Study', 'VisitName', 'Date'], how='left', sort=False)['Notes']
+        is_dna = past & is_actual.to_numpy() & matched.fillna('').str.upper().str.contains('DNA', regex=False).to_numpy()
 
-def format_visit_label_for_site_busy(visit_row, today, tolerance_lookup=None, notes_lookup=None):
-    """Format a visit label for site busy view
+    tolerance_text = pd.Series('', index=visits.index)
+    if tolerances is not None and not tolerances.empty:
+        keys = pd.DataFrame({'Study': studies, 'VisitName': visit_names})
+        matched = keys.merge(tolerances, on=['Study', 'VisitName'], how='left', sort=False)
+        before = matched['ToleranceBefore'].fillna(0).astype(int)
+        after = matched['ToleranceAfter'].fillna(0).astype(int)
+        has_tolerance = ((before > 0) | (after > 0)).to_numpy()
+        tolerance_text[has_tolerance] = (" +" + after.astype(str) + " -" + before.astype(str)).to_numpy()[has_tolerance]
+
+    is_actual = is_actual.to_numpy()
+    is_proposed = is_proposed.to_numpy()
+    labels = pd.Series(np.select(
+        [is_proposed, is_actual & is_dna, ~is_actual & past, ~is_actual],
+        ["📅 " + base + " (Proposed)", "❌ " + base + " DNA", "📋 " + base + " ?", "📋 " + base + tolerance_text],
+        default="✅ " + base,
+    ), index=visits.index, dtype=object)
+    missing = (visit_names == '') | (studies == '') | (patient_ids == '') | dates.isna()
+    return labels.where(~missing, None)
+
+def build_site_busy_calendar(visits_df, trials_df=None, actual_visits_df=None, date_range=None):
+    """Build a site-busy calendar view showing all visits/events per site per day
+    
+    OPTIMIZED: Single pass - visits in the date range are sorted once by (date, site, events
+    first, visit order), labelled column-wise (format_site_busy_labels; tolerance and DNA notes
+    come from merges), joined per (date, site) with one groupby-agg and pivoted into the grid.
     
     Args:
-        visit_row: Series with visit data
-        today: Timestamp for today's date
-        tolerance_lookup: Dict mapping (Study, VisitName) -> (tolerance_before, tolerance_after)
-        notes_lookup: Dict mapping (PatientID, Study, VisitName, Date) -> Notes
+        visits_df: DataFrame with all visits (actual, predicted, proposed)
+        trials_df: Optional DataFrame with trial schedules (for tolerance lookup)
+        actual_visits_df: Optional DataFrame with actual visits (for Notes/DNA detection)
+        date_range: Optional tuple (min_date, max_date) to limit date range
     
     Returns:
-        Formatted label string
+        site_busy_df: DataFrame with Date, Day, and one column per site
     """
-    visit_name = str(visit_row.get('VisitName', ''))
-    study = str(visit_row.get('Study', ''))
-    patient_id = str(visit_row.get('PatientID', ''))
-    
-    if not visit_name or not study or not patient_id:
-        return None
-    
-    visit_date = pd.to_datetime(visit_row.get('Date')).normalize() if pd.notna(visit_row.get('Date')) else None
-    if visit_date is None:
-        return None
-    
-    is_actual = visit_row.get('IsActual', False)
-    is_proposed = visit_row.get('IsProposed', False)
-    
-    # Check for DNA in Notes
-    is_dna = False
-    if notes_lookup and visit_date < today and is_actual:
-        lookup_key = (patient_id, study, visit_name, visit_date)
-        notes = notes_lookup.get(lookup_key, '')
-        if 'DNA' in str(notes).upper():
-            is_dna = True
-    
-    # Format based on state
-    if is_proposed:
-        return f"📅 {visit_name} {study} {patient_id} (Proposed)"
-    elif is_actual and visit_date < today:
-        if is_dna:
-            return f"❌ {visit_name} {study} {patient_id} DNA"
-        else:
-            return f"✅ {visit_name} {study} {patient_id}"
-    elif not is_actual and visit_date < today:
-        return f"📋 {visit_name} {study} {patient_id} ?"
-    elif not is_actual and visit_date >= today:
-        # Future predicted - include tolerance if available
-        tolerance_str = ""
-        if tolerance_lookup:
-            key = (study, visit_name)
-            tolerance = tolerance_lookup.get(key)
-            if tolerance:
-                tolerance_before, tolerance_after = tolerance
-                if tolerance_before > 0 or tolerance_after > 0:
-                    tolerance_str = f" +{tolerance_after} -{tolerance_before}"
-        return f"📋 {visit_name} {study} {patient_id}{tolerance_str}"
-    else:
-        return f"✅ {visit_name} {study} {patient_id}"
+    site_busy_df, unique_sites = _site_busy_frame(visits_df, date_range)
+    if not unique_sites:
+        return site_busy_df
+
+    # Visits on a calendar date at a listed site, with their calendar row
+    date_rows = pd.Series(np.arange(len(site_busy_df)), index=pd.DatetimeIndex(site_busy_df['Date']))
+    visits = visits_df.assign(Date=pd.to_datetime(visits_df['Date']).dt.normalize())
+    rows = visits['Date'].map(date_rows)
+    visits = visits[rows.notna() & visits['SiteofVisit'].isin(unique_sites)]
+    rows = rows[visits.index].astype(int)
+
+    # Events (at the top of the cell) and patient visits without tolerance markers
+    is_event = _flag_column(visits, 'IsStudyEvent', nan_is_true=False)
+    keep = is_event | ~visit_status_column(visits).isin(TOLERANCE_STATUSES)
+    visits, rows, is_event = visits[keep], rows[keep], is_event[keep]
+
+    labels = pd.Series(None, index=np.arange(len(visits)), dtype=object)
+    events = visits[is_event]
+    if not events.empty:
+        event_names = _text_column(events, 'EventType').str.upper() + "_" + _text_column(events, 'Study')
+        labels[is_event.to_numpy()] = ("✅ " + event_names).where(
+            ~_flag_column(events, 'IsProposed'), "📅 " + event_names + " (Proposed)").to_numpy()
+    patient_visits = visits[~is_event]
+    if not patient_visits.empty:
+        today = pd.Timestamp(current_date()).normalize()
+        labels[~is_event.to_numpy()] = format_site_busy_labels(
+            patient_visits, today, _site_busy_tolerances(trials_df), _site_busy_notes(actual_visits_df)).to_numpy()
+
+    items = pd.DataFrame({
+        'row': rows.to_numpy(), 'site': visits['SiteofVisit'].to_numpy(), 'event_first': ~is_event.to_numpy(),
+        'order': np.arange(len(visits)), 'label': labels.to_numpy(),
+    }).dropna(subset=['label'])
+    if items.empty:
+        return site_busy_df
+    items = items.sort_values(['row', 'site', 'event_first', 'order'], kind='mergesort')
+    cells = items.groupby(['row', 'site'], sort=False)['label'].agg('\n'.join)
+    grid = cells.unstack('site').reindex(index=np.arange(len(site_busy_df)), columns=unique_sites)
+    site_busy_df[unique_sites] = grid.fillna("").to_numpy(dtype=object)
+    return site_busy_df
@@ -1,4 +1,3 @@
-import streamlit as st
 import pandas as pd
 
 # =============================================================================
@@ -14,6 +13,7 @@ DEBUG_DEBUG = 4
 
 def initialize_session_state():
     """Initialize all session state variables"""
+    import streamlit as st
     from helpers import init_activity_log, init_error_system
     
     # Authentication state - public by default
@@ -52,6 +52,12 @@ def initialize_session_state():
         st.session_state.show_weights_form = False
     if 'show_scrollbars' not in st.session_state:
         st.session_state.show_scrollbars = True  # Default to showing scrollbars for new users
+    if 'calendar_windowed' not in st.session_state:
+        st.session_state.calendar_windowed = True  # Render one date window of the calendar at a time
+    if 'calendar_window_start' not in st.session_state:
+        st.session_state.calendar_window_start = None  # None = window around today
+    if 'calendar_column_page' not in st.session_state:
+        st.session_state.calendar_column_page = 0
     
     # Filter state variables - initialized as empty lists, will be populated when data is loaded
     if 'pending_site_filter' not in st.session_state:
@@ -93,6 +99,33 @@ APP_TITLE = "Clinical Trial Calendar Generator"
 APP_VERSION = "v1.2"
 APP_SUBTITLE = "For Ashfields and Kiltearn GP Surgeries use only - no unauthorised use..."
 
+# Visit generation engine for calendar builds:
+# 'vectorized' = visit_engine.generate_patient_visits (column-wise cross-join)
+# 'reference'  = processing_calendar.process_all_patients (row-by-row per patient)
+VISIT_ENGINE = 'vectorized'
+
+# Multi-process backend for process_all_patients (only used when VISIT_ENGINE = 'reference'):
+# patients are chunked by study across worker processes from this patient count.
+# None = off; set it from benchmark_patient_backends on the deployment host
+PARALLEL_PATIENT_THRESHOLD = None
+PARALLEL_MAX_WORKERS = None  # None = os.cpu_count()
+
+# Track peak memory per span (tracemalloc) in calendar build traces; slows builds noticeably.
+# The Performance panel can switch it on per session (st.session_state.trace_memory).
+TRACE_MEMORY = False
+
+# Persistent performance history (performance_history.py): span timings of every traced
+# calendar build are appended to this SQLite file, shown on the DB Admin page (None disables)
+PERFORMANCE_HISTORY_PATH = '~/.clinical-trial-calendar-performance.sqlite'
+# A stage is flagged when its recent median build time exceeds the earlier median by this fraction
+PERFORMANCE_REGRESSION_THRESHOLD = 0.25
+
+# Windowed calendar view: days sent to the browser per window, how far Earlier/Later move
+# the window, and patient columns per page (columns with nothing in the window are left out)
+CALENDAR_WINDOW_DAYS = 120
+CALENDAR_WINDOW_STEP_DAYS = 90
+CALENDAR_WINDOW_MAX_COLUMNS = 120
+
 # Default profit sharing weights
 DEFAULT_LIST_WEIGHT = 35
 DEFAULT_WORK_WEIGHT = 35  
@@ -103,12 +136,9 @@ ASHFIELDS_LIST_SIZE = 28500
 KILTEARN_LIST_SIZE = 12500
 
 def get_debug_level():
-    """Get current debug level from session state, defaulting to STANDARD"""
-    try:
-        return st.session_state.get('debug_level', DEBUG_STANDARD)
-    except (AttributeError, RuntimeError):
-        # Fallback if streamlit not available (e.g., in tests)
-        return DEBUG_STANDARD
+    """Get current debug level from the runtime context (session state in the app), defaulting to STANDARD"""
+    from runtime_context import get_context
+    return get_context().state.get('debug_level', DEBUG_STANDARD)
 
 def should_log_debug():
     """Check if detailed debug logging should occur (level >= DEBUG)"""
@@ -1,7 +1,9 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-from helpers import get_financial_year, get_financial_year_for_series, log_activity
+from helpers import get_financial_year, get_financial_year_for_series, get_patient_origin_site_for_series, log_activity
+from runtime_context import CACHE_TABLES, cache_data, register_cache_dependency
+from visit_status import STATUS_ACTUAL, STATUS_SCREEN_FAIL, TOLERANCE_STATUSES, visit_status_column
 
 def extract_screen_failures(actual_visits_df):
     """Extract screen failure information from actual visits"""
@@ -111,10 +113,35 @@ def display_site_wise_statistics(visits_df, patients_df, unique_visit_sites, scr
     """Display detailed statistics for each visit site with quarterly and financial year analysis"""
     if visits_df.empty or patients_df.empty:
         return
-    
+
     st.subheader("📊 Visit Site Analysis")
-    
-    # Add time period columns to visits_df if not already present
+
+    # OPTIMIZED: Every site's tables are built in one grouped pass and cached, so switching
+    # tabs or widgets re-renders them without recomputing
+    try:
+        site_stats = get_site_statistics(visits_df, patients_df, unique_visit_sites, screen_failures, withdrawals)
+    except Exception as e:
+        st.error(f"Error displaying site statistics: {e}")
+        st.exception(e)
+        return
+
+    # Always create tabs for all visit sites, even if they have no visits
+    # This ensures sites like Kiltearn are visible even when they only have patient recruitment income
+    if len(unique_visit_sites) > 1:
+        tabs = st.tabs(unique_visit_sites)
+
+        for i, visit_site in enumerate(unique_visit_sites):
+            with tabs[i]:
+                _display_enhanced_single_site_stats(site_stats.get(visit_site), visit_site)
+    else:
+        # If only one site, display directly
+        _display_enhanced_single_site_stats(site_stats.get(unique_visit_sites[0]), unique_visit_sites[0])
+
+# Site column of the related-patients table (patients can carry their own site columns)
+SITE_KEY = '_Site'
+
+def _with_period_columns(visits_df):
+    """Copy of visits_df with QuarterYear and FinancialYear columns (rows without a Date dropped)"""
     visits_df_enhanced = visits_df.copy()
     if 'QuarterYear' not in visits_df_enhanced.columns:
         # Check for NaN values in Date column
@@ -122,369 +149,355 @@ def display_site_wise_statistics(visits_df, patients_df, unique_visit_sites, scr
         if nan_dates > 0:
             log_activity(f"Filtered {nan_dates} invalid dates", level='info')
             visits_df_enhanced = visits_df_enhanced.dropna(subset=['Date'])
-        
+
         visits_df_enhanced['Quarter'] = visits_df_enhanced['Date'].dt.quarter
         visits_df_enhanced['Year'] = visits_df_enhanced['Date'].dt.year
         # Handle NaN values before converting to int
         visits_df_enhanced['QuarterYear'] = (
-            visits_df_enhanced['Year'].fillna(0).astype(int).astype(str) + '-Q' + 
+            visits_df_enhanced['Year'].fillna(0).astype(int).astype(str) + '-Q' +
             visits_df_enhanced['Quarter'].fillna(0).astype(int).astype(str)
         )
-    
+
     # FIXED: Use centralized FY calculation from helpers
     if 'FinancialYear' not in visits_df_enhanced.columns:
         visits_df_enhanced['FinancialYear'] = get_financial_year_for_series(visits_df_enhanced['Date'])
-    
-    # Always create tabs for all visit sites, even if they have no visits
-    # This ensures sites like Kiltearn are visible even when they only have patient recruitment income
-    if len(unique_visit_sites) > 1:
-        tabs = st.tabs(unique_visit_sites)
-        
-        for i, visit_site in enumerate(unique_visit_sites):
-            with tabs[i]:
-                _display_enhanced_single_site_stats(visits_df_enhanced, patients_df, visit_site, screen_failures, withdrawals)
+    return visits_df_enhanced
+
+def _recruitment_date_column(patients_df):
+    """REFACTOR: RandomizationDate for recruited patients, with fallbacks (None if there is no date column)"""
+    for column in ('RandomizationDate', 'ScreeningDate', 'StartDate'):
+        if column in patients_df.columns:
+            return column
+    return None
+
+def _recruitment_periods(patients, date_column):
+    """Patients with a recruitment date, with the QuarterYear and FinancialYear of that date"""
+    dates = pd.to_datetime(patients[date_column], errors='coerce')
+    # Check for NaN values in date column
+    nan_dates = dates.isna().sum()
+    if nan_dates > 0:
+        log_activity(f"Filtered {nan_dates} invalid dates from {date_column}", level='info')
+    recruits = patients[dates.notna()].copy()
+    dates = dates[dates.notna()]
+    recruits['QuarterYear'] = dates.dt.year.astype(int).astype(str) + '-Q' + dates.dt.quarter.astype(int).astype(str)
+    recruits['FinancialYear'] = get_financial_year_for_series(dates)
+    return recruits
+
+def _is_actual(visits):
+    """IsActual as a boolean Series (all False without the column)"""
+    if 'IsActual' not in visits.columns:
+        return pd.Series(False, index=visits.index)
+    return visits['IsActual'] == True
+
+def _split_by_site(grouped):
+    """{site: rows without the site level} of a table grouped by (site, ...), plus an empty part"""
+    parts = {site: part.droplevel(0) for site, part in grouped.groupby(level=0, sort=False)}
+    return parts, grouped.iloc[0:0].droplevel(0)
+
+def _period_summary(stats, recruitment, label):
+    """Patients recruited, visits completed and income per period of a site"""
+    all_periods = set(stats.index.dropna()) if not stats.empty else set()
+    all_periods.update(recruitment.index.dropna())
+
+    # Filter out any remaining None values and sort safely
+    all_periods = [period for period in all_periods if period is not None and pd.notna(period)]
+    try:
+        sorted_periods = sorted(all_periods)
+    except TypeError:
+        # If sorting fails due to mixed types, convert all to strings
+        sorted_periods = sorted([str(period) for period in all_periods])
+
+    summary_data = []
+    for period in sorted_periods:
+        period_visits = stats.loc[period, 'Visit Count'] if period in stats.index else 0
+        period_income = stats.loc[period, 'Income'] if period in stats.index else 0
+        period_patients = recruitment.loc[period] if period in recruitment.index else 0
+
+        summary_data.append({
+            label: period,
+            'Patients Recruited': period_patients,
+            'Visits Completed': period_visits,
+            'Income': f"£{period_income:,.2f}"
+        })
+    return pd.DataFrame(summary_data)
+
+def _stoppage_rows(site_patients, events, date_label):
+    """Patient/Study/date rows of a site's patients found in `events` (PatientID_Study -> date)"""
+    if not events or site_patients.empty:
+        return pd.DataFrame()
+    keys = site_patients['PatientID'].astype(str) + '_' + site_patients['Study'].astype(str)
+    found = keys.isin(list(events))
+    return pd.DataFrame({
+        'Patient': site_patients.loc[found, 'PatientID'].to_numpy(),
+        'Study': site_patients.loc[found, 'Study'].to_numpy(),
+        date_label: [events[key].strftime('%Y-%m-%d') for key in keys[found]],
+    })
+
+def _site_tables(site_patients, has_visits, from_origin, totals, visit_breakdown, quarterly_stats, fy_stats,
+                 origin_breakdown, quarterly_recruitment, fy_recruitment, screen_failures, withdrawals):
+    """One site's statistics dict from its parts of the grouped tables"""
+    study_breakdown = site_patients.groupby('Study').agg({
+        'PatientID': 'count'
+    }).rename(columns={'PatientID': 'Patient Count'})
+    if has_visits:
+        # Add visit counts and income for work done at this site
+        combined_breakdown = study_breakdown.join(visit_breakdown, how='left').fillna(0)
+        combined_breakdown['Total Income'] = combined_breakdown['Total Income'].apply(lambda x: f"£{x:,.2f}")
     else:
-        # If only one site, display directly
-        _display_enhanced_single_site_stats(visits_df_enhanced, patients_df, unique_visit_sites[0], screen_failures, withdrawals)
+        # Just show patient recruitment data
+        combined_breakdown = study_breakdown.copy()
+        combined_breakdown['Visit Count'] = 0
+        combined_breakdown['Total Income'] = "£0.00"
+
+    recruitment_known = quarterly_recruitment is not None
+    return {
+        'has_visits': has_visits,
+        'from_origin': from_origin,
+        'patient_count': len(site_patients),
+        'total_visits': int(totals['Visits']) if has_visits else 0,
+        'completed_visits': int(totals['Completed']) if has_visits else 0,
+        'total_income': float(totals['Income']) if has_visits else 0.0,
+        'study_breakdown': combined_breakdown,
+        'origin_breakdown': origin_breakdown,
+        'quarterly_stats': quarterly_stats,
+        'fy_stats': fy_stats,
+        # None when the patients have no recruitment date column
+        'quarterly_recruitment': quarterly_recruitment,
+        'fy_recruitment': fy_recruitment,
+        'quarterly_summary': _period_summary(quarterly_stats, quarterly_recruitment, 'Quarter') if recruitment_known else None,
+        'fy_summary': _period_summary(fy_stats, fy_recruitment, 'Financial Year') if recruitment_known else None,
+        'screen_failures': _stoppage_rows(site_patients, screen_failures, 'Screen Fail Date'),
+        'withdrawals': _stoppage_rows(site_patients, withdrawals, 'Withdrawal Date'),
+    }
+
+def build_site_statistics(visits_df, patients_df, sites, screen_failures, withdrawals=None):
+    """Statistics tables of every visit site for the site-wise analysis
+
+    OPTIMIZED: Each breakdown is one groupby over all sites (site as the first key) that is then
+    split per site, and origin sites are resolved column-wise - instead of re-filtering the
+    visits per site and resolving origin sites row by row. patients_df is not modified.
+
+    Returns:
+        dict: site -> statistics dict (see _site_tables), None for sites without related patients
+    """
+    visits = _with_period_columns(visits_df)
+    is_actual = _is_actual(visits)
+    not_marker = (visits['Visit'] != '-') & (visits['Visit'] != '+')
+    statuses = visit_status_column(visits)
+    # Relevant financial visits (exclude tolerance periods)
+    is_financial = statuses.isin([STATUS_ACTUAL, STATUS_SCREEN_FAIL]) | (~statuses.isin(TOLERANCE_STATUSES) & ~is_actual)
+
+    totals = pd.DataFrame({
+        'Visits': not_marker, 'Completed': is_actual, 'Income': visits['Payment'],
+    }).groupby(visits['SiteofVisit']).sum()
+    visit_breakdowns, no_visit_breakdown = _split_by_site(visits[not_marker].groupby(['SiteofVisit', 'Study']).agg({
+        'Visit': 'count',
+        'Payment': 'sum'
+    }).rename(columns={'Visit': 'Visit Count', 'Payment': 'Total Income'}))
+    financial_visits = visits[is_financial]
+    period_stats = {
+        period_column: _split_by_site(financial_visits.groupby(['SiteofVisit', period_column]).agg({
+            'Visit': 'count',
+            'Payment': 'sum'
+        }).rename(columns={'Visit': 'Visit Count', 'Payment': 'Income'}))
+        for period_column in ('QuarterYear', 'FinancialYear')
+    }
+
+    # Patients who have visits at a site (regardless of their origin) ...
+    visit_pairs = visits[['SiteofVisit', 'PatientID']].drop_duplicates().rename(columns={'SiteofVisit': SITE_KEY})
+    related = patients_df.merge(visit_pairs, on='PatientID', how='inner')
+    # ... else the patients recruited by the site (centralized origin site detection)
+    origin_sites = [site for site in sites if site not in set(related[SITE_KEY])]
+    if origin_sites:
+        origins = get_patient_origin_site_for_series(patients_df, default="Unknown Site")
+        recruited_here = origins.isin(origin_sites)
+        related = pd.concat([related, patients_df[recruited_here].assign(**{SITE_KEY: origins[recruited_here]})],
+                            ignore_index=True)
+    site_patients = dict(tuple(related.groupby(SITE_KEY, sort=False)))
+
+    # Patient origin breakdown (who recruited the patients), from PatientPractice
+    origin_breakdowns = {}
+    if 'PatientPractice' in related.columns:
+        for site, origin_breakdown in related.groupby([SITE_KEY, 'PatientPractice'])['PatientID'].count().groupby(level=0):
+            origin_breakdown = origin_breakdown.droplevel(0).reset_index()
+            origin_breakdown.columns = ['Origin Site', 'Patients Recruited']
+            origin_breakdowns[site] = origin_breakdown
+
+    date_column = _recruitment_date_column(patients_df)
+    recruitment = {}
+    if date_column is None:
+        log_activity("No date column found for patient recruitment analysis", level='warning')
+    else:
+        recruits = _recruitment_periods(related, date_column)
+        recruitment = {
+            period_column: _split_by_site(recruits.groupby([SITE_KEY, period_column])['PatientID'].count())
+            for period_column in ('QuarterYear', 'FinancialYear')
+        }
+
+    def site_part(tables, period_column, site):
+        if period_column not in tables:
+            return None
+        parts, empty = tables[period_column]
+        return parts.get(site, empty)
+
+    stats = {}
+    for site in sites:
+        patients = site_patients.get(site)
+        if patients is None:
+            stats[site] = None
+            continue
+        from_origin = site in origin_sites
+        if from_origin:
+            log_activity(f"Found {len(patients)} patients recruited by {site} via standardized site detection", level='info')
+        has_visits = site in totals.index
+        stats[site] = _site_tables(
+            patients.drop(columns=[SITE_KEY]), has_visits, from_origin,
+            totals.loc[site] if has_visits else None,
+            visit_breakdowns.get(site, no_visit_breakdown),
+            site_part(period_stats, 'QuarterYear', site) if has_visits else pd.DataFrame(),
+            site_part(period_stats, 'FinancialYear', site) if has_visits else pd.DataFrame(),
+            origin_breakdowns.get(site, pd.DataFrame(columns=['Origin Site', 'Patients Recruited']))
+            if 'PatientPractice' in related.columns else None,
+            site_part(recruitment, 'QuarterYear', site),
+            site_part(recruitment, 'FinancialYear', site),
+            screen_failures, withdrawals,
+        )
+    return stats
 
-def _display_enhanced_single_site_stats(visits_df, patients_df, site, screen_failures, withdrawals=None):
-    """Display enhanced statistics for a single visit site including quarterly and financial year analysis"""
+@cache_data(show_spinner=False)
+def _site_statistics_cached(_visits_df, _patients_df, fingerprints, sites, screen_failures, withdrawals):
+    """Cached site statistics, keyed on the visits/patients fingerprints (underscore args aren't hashed)"""
+    return build_site_statistics(_visits_df, _patients_df, list(sites), screen_failures, withdrawals)
+
+register_cache_dependency('site_statistics', _site_statistics_cached.clear, CACHE_TABLES)
+
+def get_site_statistics(visits_df, patients_df, sites, screen_failures, withdrawals=None):
+    """build_site_statistics, cached until the visits, patients or stoppage dates change
+
+    The calendar build's visits and patients (and their filtered copies) carry derived fingerprints,
+    so the lookup doesn't hash them on every rerun.
+    """
+    from processing_calendar import get_table_fingerprint
+    fingerprints = tuple(get_table_fingerprint(df) for df in (visits_df, patients_df))
+    return _site_statistics_cached(visits_df, patients_df, fingerprints, tuple(sites), screen_failures, withdrawals)
+
+def _display_enhanced_single_site_stats(stats, site):
+    """Display enhanced statistics for a single visit site including quarterly and financial year analysis
+
+    Renders one site's entry of build_site_statistics.
+    """
     try:
-        # Filter data for this visit site (where work is actually done)
-        site_visits = visits_df[visits_df['SiteofVisit'] == site]
-        
-        # Find patients who have visits at this site (regardless of their origin)
-        patients_with_visits_here = site_visits['PatientID'].unique()
-        site_related_patients = patients_df[patients_df['PatientID'].isin(patients_with_visits_here)]
-        
-        # If no patients with visits at this site, check if there are patients recruited by this site
-        if site_related_patients.empty:
-            # Use centralized helper function for consistent site detection
-            from helpers import get_patient_origin_site
-            
-            # Create a standardized origin site column and filter
-            patients_df['_OriginSite'] = patients_df.apply(
-                lambda row: get_patient_origin_site(row, default="Unknown Site"), axis=1
-            )
-            site_related_patients = patients_df[patients_df['_OriginSite'] == site]
-            
-            if not site_related_patients.empty:
-                log_activity(f"Found {len(site_related_patients)} patients recruited by {site} via standardized site detection", level='info')
-            
-            if site_related_patients.empty:
-                st.warning(f"No patients found for site: {site}")
-                return
-            else:
-                st.info(f"ℹ️ No visits performed at {site}, but showing patient recruitment data")
-        
+        if stats is None:
+            st.warning(f"No patients found for site: {site}")
+            return
+        if stats['from_origin']:
+            st.info(f"ℹ️ No visits performed at {site}, but showing patient recruitment data")
+        has_visits = stats['has_visits']
+
         st.subheader(f"🏥 {site} - Visit Site Analysis")
-        
+
         # Overall statistics
         st.write("**Overall Statistics**")
         col1, col2, col3, col4 = st.columns(4)
-        
+
         with col1:
-            total_patients = len(site_related_patients)
-            if len(site_visits) > 0:
-                st.metric("Patients with visits here", total_patients)
+            if has_visits:
+                st.metric("Patients with visits here", stats['patient_count'])
             else:
-                st.metric("Patients recruited by this site", total_patients)
-        
+                st.metric("Patients recruited by this site", stats['patient_count'])
+
         with col2:
-            # Filter out tolerance window markers (-, +) to get actual visit count
-            total_visits = len(site_visits[
-                (site_visits['Visit'] != '-') & 
-                (site_visits['Visit'] != '+')
-            ])
-            st.metric("Total Visits", total_visits)
-        
+            # Tolerance window markers (-, +) are not counted
+            st.metric("Total Visits", stats['total_visits'])
+
         with col3:
-            if len(site_visits) > 0:
-                actual_visits = len(site_visits[site_visits.get('IsActual', False)])
-                st.metric("Completed Visits", actual_visits)
+            if has_visits:
+                st.metric("Completed Visits", stats['completed_visits'])
             else:
                 st.metric("Recruitment Income", "See below")
-        
+
         with col4:
-            if len(site_visits) > 0:
-                total_income = site_visits['Payment'].sum()
-                st.metric("Total Income", f"£{total_income:,.2f}")
+            if has_visits:
+                st.metric("Total Income", f"£{stats['total_income']:,.2f}")
             else:
                 st.metric("Visit Income", "£0.00")
-        
+
         # Study breakdown at this visit site
-        if len(site_visits) > 0:
+        if has_visits:
             st.write("**Studies performed at this site:**")
         else:
             st.write("**Studies recruited by this site:**")
-        
-        study_breakdown = site_related_patients.groupby('Study').agg({
-            'PatientID': 'count'
-        }).rename(columns={'PatientID': 'Patient Count'})
-        
-        if len(site_visits) > 0:
-            # Filter out tolerance window markers (-, +) to get actual visit count
-            filtered_site_visits = site_visits[
-                (site_visits['Visit'] != '-') & 
-                (site_visits['Visit'] != '+')
-            ]
-            # Add visit counts and income for work done at this site
-            visit_breakdown = filtered_site_visits.groupby('Study').agg({
-                'Visit': 'count',
-                'Payment': 'sum'
-            }).rename(columns={'Visit': 'Visit Count', 'Payment': 'Total Income'})
-            
-            combined_breakdown = study_breakdown.join(visit_breakdown, how='left').fillna(0)
-            combined_breakdown['Total Income'] = combined_breakdown['Total Income'].apply(lambda x: f"£{x:,.2f}")
-        else:
-            # Just show patient recruitment data
-            combined_breakdown = study_breakdown.copy()
-            combined_breakdown['Visit Count'] = 0
-            combined_breakdown['Total Income'] = "£0.00"
-        
-        st.dataframe(combined_breakdown, width='stretch')
-        
+        st.dataframe(stats['study_breakdown'], width='stretch')
+
         # Patient origin breakdown (who recruited the patients)
         st.write("**Patient Origins (Who Recruited):**")
-        # Use PatientPractice as the source of site information
-        if 'PatientPractice' in site_related_patients.columns:
-            origin_breakdown = site_related_patients.groupby('PatientPractice')['PatientID'].count().reset_index()
-            origin_breakdown.columns = ['Origin Site', 'Patients Recruited']
-            st.dataframe(origin_breakdown, width='stretch')
+        if stats['origin_breakdown'] is not None:
+            st.dataframe(stats['origin_breakdown'], width='stretch')
         else:
             st.info("No patient practice information available")
-        
-        # Quarterly Analysis
-        if len(site_visits) > 0:
-            st.write("**Quarterly Analysis**")
-            
-            # Filter for relevant visits (exclude tolerance periods)
-            financial_site_visits = site_visits[
-                (site_visits['Visit'].str.startswith("✅", na=False)) |
-                (site_visits['Visit'].str.startswith("⚠️ Screen Fail", na=False)) |
-                (site_visits['Visit'].str.startswith("🔴", na=False)) |
-                (~site_visits['Visit'].isin(['-', '+']) & (~site_visits.get('IsActual', False)))
-            ].copy()
-        else:
-            st.write("**Quarterly Analysis**")
-            st.info("No visits performed at this site - showing patient recruitment analysis only")
-            financial_site_visits = pd.DataFrame()  # Empty dataframe
-        
-        # Initialize empty dataframes to avoid UnboundLocalError
-        quarterly_stats = pd.DataFrame()
-        fy_stats = pd.DataFrame()
-        
-        if not financial_site_visits.empty:
-            # Quarterly visit and income analysis
-            quarterly_stats = financial_site_visits.groupby('QuarterYear').agg({
-                'Visit': 'count',
-                'Payment': 'sum'
-            }).rename(columns={'Visit': 'Visit Count', 'Payment': 'Income'})
-            
-            if not quarterly_stats.empty:
-                quarterly_display = quarterly_stats.copy()
-                quarterly_display['Income'] = quarterly_display['Income'].apply(lambda x: f"£{x:,.2f}")
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.write("*Visit Counts by Quarter*")
-                    st.dataframe(quarterly_stats[['Visit Count']], width='stretch')
-                
-                with col2:
-                    st.write("*Income by Quarter*")
-                    st.dataframe(quarterly_display[['Income']], width='stretch')
-        
-        # Financial Year Analysis
-        if len(site_visits) > 0:
-            st.write("**Financial Year Analysis**")
-        else:
-            st.write("**Financial Year Analysis**")
-            st.info("No visits performed at this site - showing patient recruitment analysis only")
-        
-        if not financial_site_visits.empty:
-            # Financial year visit and income analysis
-            fy_stats = financial_site_visits.groupby('FinancialYear').agg({
-                'Visit': 'count',
-                'Payment': 'sum'
-            }).rename(columns={'Visit': 'Visit Count', 'Payment': 'Income'})
-            
-            if not fy_stats.empty:
-                fy_display = fy_stats.copy()
-                fy_display['Income'] = fy_display['Income'].apply(lambda x: f"£{x:,.2f}")
-                
+
+        # Quarterly and Financial Year Analysis
+        for heading, period, period_stats in (("Quarterly Analysis", "Quarter", stats['quarterly_stats']),
+                                              ("Financial Year Analysis", "Financial Year", stats['fy_stats'])):
+            st.write(f"**{heading}**")
+            if not has_visits:
+                st.info("No visits performed at this site - showing patient recruitment analysis only")
+            if not period_stats.empty:
+                period_display = period_stats.copy()
+                period_display['Income'] = period_display['Income'].apply(lambda x: f"£{x:,.2f}")
+
                 col1, col2 = st.columns(2)
                 with col1:
-                    st.write("*Visit Counts by Financial Year*")
-                    st.dataframe(fy_stats[['Visit Count']], width='stretch')
-                
+                    st.write(f"*Visit Counts by {period}*")
+                    st.dataframe(period_stats[['Visit Count']], width='stretch')
+
                 with col2:
-                    st.write("*Income by Financial Year*")
-                    st.dataframe(fy_display[['Income']], width='stretch')
-        
+                    st.write(f"*Income by {period}*")
+                    st.dataframe(period_display[['Income']], width='stretch')
+
         # Patient recruitment by time period (for patients who have visits at this site)
         st.write("**Patient Recruitment Analysis**")
-        
-        # REFACTOR: Use RandomizationDate for recruited patients, with fallbacks
-        site_patients_enhanced = site_related_patients.copy()
-
-        # Determine date column to use
-        date_column = None
-        if 'RandomizationDate' in site_patients_enhanced.columns:
-            date_column = 'RandomizationDate'
-        elif 'ScreeningDate' in site_patients_enhanced.columns:
-            date_column = 'ScreeningDate'
-        elif 'StartDate' in site_patients_enhanced.columns:
-            date_column = 'StartDate'
-
-        if date_column is None:
-            log_activity("No date column found for patient recruitment analysis", level='warning')
+        quarterly_recruitment = stats['quarterly_recruitment']
+        fy_recruitment = stats['fy_recruitment']
+        if quarterly_recruitment is None:
+            # No recruitment date column (logged when the statistics were built)
             return
 
-        # Check for NaN values in date column
-        nan_dates = site_patients_enhanced[date_column].isna().sum()
-        if nan_dates > 0:
-            log_activity(f"Filtered {nan_dates} invalid dates from {date_column}", level='info')
-            site_patients_enhanced = site_patients_enhanced.dropna(subset=[date_column])
-
-        site_patients_enhanced['Quarter'] = site_patients_enhanced[date_column].dt.quarter
-        site_patients_enhanced['Year'] = site_patients_enhanced[date_column].dt.year
-        # Handle NaN values before converting to int
-        site_patients_enhanced['QuarterYear'] = (
-            site_patients_enhanced['Year'].fillna(0).astype(int).astype(str) + '-Q' +
-            site_patients_enhanced['Quarter'].fillna(0).astype(int).astype(str)
-        )
-        # FIXED: Use centralized FY calculation from helpers
-        site_patients_enhanced['FinancialYear'] = get_financial_year_for_series(site_patients_enhanced[date_column])
-        
-        # Quarterly patient recruitment
-        quarterly_recruitment = site_patients_enhanced.groupby('QuarterYear')['PatientID'].count()
-        
-        # Financial year patient recruitment
-        fy_recruitment = site_patients_enhanced.groupby('FinancialYear')['PatientID'].count()
-        
         if not quarterly_recruitment.empty or not fy_recruitment.empty:
             col1, col2 = st.columns(2)
-            
+
             with col1:
                 if not quarterly_recruitment.empty:
                     st.write("*Patients Recruited by Quarter*")
                     quarterly_recruitment_df = quarterly_recruitment.to_frame()
                     quarterly_recruitment_df.columns = ['Patients Recruited']
                     st.dataframe(quarterly_recruitment_df, width='stretch')
-            
+
             with col2:
                 if not fy_recruitment.empty:
                     st.write("*Patients Recruited by Financial Year*")
                     fy_recruitment_df = fy_recruitment.to_frame()
                     fy_recruitment_df.columns = ['Patients Recruited']
                     st.dataframe(fy_recruitment_df, width='stretch')
-        
-        # Combined quarterly summary
+
+        # Combined quarterly and financial year summaries
         st.write("**Quarterly Summary Table**")
-        
-        # Create comprehensive quarterly summary
-        quarterly_summary_data = []
-        
-        all_quarters = set()
-        if not financial_site_visits.empty:
-            # Filter out None values from QuarterYear
-            quarter_values = financial_site_visits['QuarterYear'].dropna().unique()
-            all_quarters.update(quarter_values)
-        if not quarterly_recruitment.empty:
-            # Filter out None values from index
-            quarter_index_values = quarterly_recruitment.index.dropna()
-            all_quarters.update(quarter_index_values)
-        
-        # Filter out any remaining None values and sort safely
-        all_quarters = [quarter for quarter in all_quarters if quarter is not None and pd.notna(quarter)]
-        try:
-            sorted_quarters = sorted(all_quarters)
-        except TypeError:
-            # If sorting fails due to mixed types, convert all to strings
-            sorted_quarters = sorted([str(quarter) for quarter in all_quarters])
-        
-        for quarter in sorted_quarters:
-            quarter_visits = quarterly_stats.loc[quarter, 'Visit Count'] if quarter in quarterly_stats.index else 0
-            quarter_income = quarterly_stats.loc[quarter, 'Income'] if quarter in quarterly_stats.index else 0
-            quarter_patients = quarterly_recruitment.loc[quarter] if quarter in quarterly_recruitment.index else 0
-            
-            quarterly_summary_data.append({
-                'Quarter': quarter,
-                'Patients Recruited': quarter_patients,
-                'Visits Completed': quarter_visits,
-                'Income': f"£{quarter_income:,.2f}"
-            })
-        
-        if quarterly_summary_data:
-            quarterly_summary_df = pd.DataFrame(quarterly_summary_data)
-            st.dataframe(quarterly_summary_df, width='stretch')
-        
-        # Combined financial year summary
+        if not stats['quarterly_summary'].empty:
+            st.dataframe(stats['quarterly_summary'], width='stretch')
+
         st.write("**Financial Year Summary Table**")
-        
-        # Create comprehensive financial year summary
-        fy_summary_data = []
-        
-        all_fys = set()
-        if not financial_site_visits.empty:
-            # Filter out None values from FinancialYear
-            fy_values = financial_site_visits['FinancialYear'].dropna().unique()
-            all_fys.update(fy_values)
-        if not fy_recruitment.empty:
-            # Filter out None values from index
-            fy_index_values = fy_recruitment.index.dropna()
-            all_fys.update(fy_index_values)
-        
-        # Filter out any remaining None values and sort safely
-        all_fys = [fy for fy in all_fys if fy is not None and pd.notna(fy)]
-        try:
-            sorted_fys = sorted(all_fys)
-        except TypeError:
-            # If sorting fails due to mixed types, convert all to strings
-            sorted_fys = sorted([str(fy) for fy in all_fys])
-        
-        for fy in sorted_fys:
-            fy_visits = fy_stats.loc[fy, 'Visit Count'] if fy in fy_stats.index else 0
-            fy_income = fy_stats.loc[fy, 'Income'] if fy in fy_stats.index else 0
-            fy_patients = fy_recruitment.loc[fy] if fy in fy_recruitment.index else 0
-            
-            fy_summary_data.append({
-                'Financial Year': fy,
-                'Patients Recruited': fy_patients,
-                'Visits Completed': fy_visits,
-                'Income': f"£{fy_income:,.2f}"
-            })
-        
-        if fy_summary_data:
-            fy_summary_df = pd.DataFrame(fy_summary_data)
-            st.dataframe(fy_summary_df, width='stretch')
-        
+        if not stats['fy_summary'].empty:
+            st.dataframe(stats['fy_summary'], width='stretch')
+
         # Screen failures and withdrawals for patients who have visits at this site
-        site_screen_failures = []
-        site_withdrawals = []
-        for patient in site_related_patients.itertuples():
-            patient_study_key = f"{patient.PatientID}_{patient.Study}"
-            if patient_study_key in screen_failures:
-                site_screen_failures.append({
-                    'Patient': patient.PatientID,
-                    'Study': patient.Study,
-                    'Screen Fail Date': screen_failures[patient_study_key].strftime('%Y-%m-%d')
-                })
-            if withdrawals and patient_study_key in withdrawals:
-                site_withdrawals.append({
-                    'Patient': patient.PatientID,
-                    'Study': patient.Study,
-                    'Withdrawal Date': withdrawals[patient_study_key].strftime('%Y-%m-%d')
-                })
-        
-        if site_screen_failures:
+        if not stats['screen_failures'].empty:
             st.write("**Screen Failures**")
-            st.dataframe(pd.DataFrame(site_screen_failures), width='stretch')
-        
-        if site_withdrawals:
+            st.dataframe(stats['screen_failures'], width='stretch')
+
+        if not stats['withdrawals'].empty:
             st.write("**Withdrawals**")
-            st.dataframe(pd.DataFrame(site_withdrawals), width='stretch')
-        
+            st.dataframe(stats['withdrawals'], width='stretch')
+
     except Exception as e:
         st.error(f"Error displaying site statistics: {e}")
         st.exception(e)
@@ -9,11 +9,41 @@ from datetime import datetime
 import zipfile
 from helpers import log_activity
 from payment_handler import normalize_payment_column, validate_payment_data
+from runtime_context import CACHE_TABLES, register_cache_dependency, invalidate_tables, compute_table_fingerprint
 
 # Backup directory for automatic pre-write backups
 BACKUP_DIR = os.path.expanduser('~/.clinical-trial-calendar-backups')
 MAX_BACKUPS = 10
 
+# Hardcoded fallback for when tables are empty (must match actual Supabase schema)
+KNOWN_COLUMNS = {
+    'trial_schedules': ['id', 'Study', 'Day', 'VisitName', 'SiteforVisit', 'Payment',
+                        'ToleranceBefore', 'ToleranceAfter', 'IntervalUnit', 'IntervalValue',
+                        'VisitType', 'Pathway', 'created_at', 'updated_at'],
+    'patients': ['id', 'PatientID', 'Study', 'ScreeningDate', 'PatientPractice',
+                 'SiteSeenAt', 'Pathway', 'RandomizationDate', 'Status', 'notes',
+                 'created_at', 'updated_at'],
+    'actual_visits': ['id', 'PatientID', 'Study', 'VisitName', 'ActualDate', 'Notes',
+                      'VisitType', 'created_at', 'updated_at'],
+    'study_site_details': ['id', 'Study', 'ContractSite', 'StudyStatus', 'RecruitmentTarget',
+                           'FPFV', 'LPFV', 'LPLV',
+                           'SetupFee', 'PerPatientFee', 'AnnualFee', 'FinancialNotes',
+                           'AnchorVisitName'],
+}
+
+# Rows requested per range() call; Supabase caps a single response at 1000 rows by default
+FETCH_PAGE_SIZE = 1000
+
+# Columns the app loads for each table (everything it reads; created_at is never used).
+# Legacy study-level columns on trial_schedules are kept when the schema still has them.
+# Backups and restores fetch all columns instead.
+FETCH_COLUMNS = {
+    'patients': [c for c in KNOWN_COLUMNS['patients'] if c != 'created_at'],
+    'trial_schedules': [c for c in KNOWN_COLUMNS['trial_schedules'] if c != 'created_at'] +
+                       ['FPFV', 'LPFV', 'LPLV', 'StudyStatus', 'RecruitmentTarget'],
+    'actual_visits': [c for c in KNOWN_COLUMNS['actual_visits'] if c != 'created_at'],
+}
+
 def safe_float(value, default=0.0):
     """Safely convert to float, defaulting on invalid values."""
     try:
@@ -39,21 +69,6 @@ def get_table_columns(table_name: str) -> Optional[list]:
     Queries one row to inspect the schema. Falls back to hardcoded
     known-columns if the table is empty.
     """
-    # Hardcoded fallback for when tables are empty (must match actual Supabase schema)
-    KNOWN_COLUMNS = {
-        'trial_schedules': ['id', 'Study', 'Day', 'VisitName', 'SiteforVisit', 'Payment',
-                            'ToleranceBefore', 'ToleranceAfter', 'IntervalUnit', 'IntervalValue',
-                            'VisitType', 'Pathway', 'created_at', 'updated_at'],
-        'patients': ['id', 'PatientID', 'Study', 'ScreeningDate', 'PatientPractice',
-                     'SiteSeenAt', 'Pathway', 'RandomizationDate', 'Status', 'notes',
-                     'created_at', 'updated_at'],
-        'actual_visits': ['id', 'PatientID', 'Study', 'VisitName', 'ActualDate', 'Notes',
-                          'VisitType', 'created_at', 'updated_at'],
-        'study_site_details': ['id', 'Study', 'ContractSite', 'StudyStatus', 'RecruitmentTarget',
-                               'FPFV', 'LPFV', 'LPLV',
-                               'SetupFee', 'PerPatientFee', 'AnnualFee', 'FinancialNotes',
-                               'AnchorVisitName'],
-    }
     try:
         client = get_supabase_client()
         if client is None:
@@ -101,6 +116,64 @@ def _filter_records_to_schema(records: list, table_name: str, keep_id: bool = Fa
     return filtered
 
 
+def get_fetch_columns(table_name: str) -> Optional[list]:
+    """Columns to select for a table load, limited to those present in the live schema.
+
+    Returns None (select everything) for tables without a projection.
+    """
+    wanted = FETCH_COLUMNS.get(table_name)
+    if wanted is None:
+        return None
+    available = get_table_columns(table_name)
+    if not available:
+        return [c for c in wanted if c in KNOWN_COLUMNS.get(table_name, wanted)]
+    return [c for c in wanted if c in available]
+
+def fetch_table(client, table_name: str, columns: Optional[List[str]] = None,
+                date_columns=(), order_by: Optional[str] = 'id',
+                page_size: Optional[int] = None) -> pd.DataFrame:
+    """Fetch every row of a table using range requests of page_size rows.
+
+    A single select() is silently truncated at the server row limit, so rows are
+    requested page by page (ordered by order_by for stable paging) until the exact
+    row count reported with the first page has been read. Rows are gathered into
+    per-column lists and each column in date_columns is parsed once at the end.
+    """
+    page_size = page_size or FETCH_PAGE_SIZE
+    selection = ",".join(columns) if columns else "*"
+
+    data: Dict[str, list] = {col: [] for col in (columns or [])}
+    fetched = 0
+    total = None
+    while total is None or fetched < total:
+        query = client.table(table_name).select(selection, count='exact' if total is None else None)
+        if order_by:
+            query = query.order(order_by)
+        response = query.range(fetched, fetched + page_size - 1).execute()
+        rows = response.data or []
+
+        if total is None:
+            # Without a count, a short page marks the end of the table
+            total = response.count if response.count is not None else float('inf')
+        if not rows:
+            break
+
+        for col in rows[0].keys():
+            if col not in data:
+                data[col] = [None] * fetched
+        for col, values in data.items():
+            values.extend(row.get(col) for row in rows)
+        fetched += len(rows)
+
+        if total == float('inf') and len(rows) < page_size:
+            break
+
+    df = pd.DataFrame(data)
+    for col in date_columns:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    return df
+
 def auto_backup_to_local() -> Optional[str]:
     """Back up all 4 tables to local CSV files before any write operation.
 
@@ -115,9 +188,9 @@ def auto_backup_to_local() -> Optional[str]:
         os.makedirs(backup_path, exist_ok=True)
 
         tables = {
-            'patients': fetch_all_patients,
-            'trial_schedules': fetch_all_trial_schedules,
-            'actual_visits': fetch_all_actual_visits,
+            'patients': lambda: fetch_all_patients(all_columns=True),
+            'trial_schedules': lambda: fetch_all_trial_schedules(all_columns=True),
+            'actual_visits': lambda: fetch_all_actual_visits(all_columns=True),
             'study_site_details': fetch_all_study_site_details,
         }
 
@@ -171,12 +244,9 @@ def _cleanup_old_backups():
         log_activity(f"Auto-backup cleanup error: {e}", level='warning')
 
 
-def clear_database_cache():
-    """Clear all database query caches"""
-    _fetch_all_patients_cached.clear()
-    _fetch_all_trial_schedules_cached.clear()
-    _fetch_all_actual_visits_cached.clear()
-    _fetch_all_study_site_details_cached.clear()
+def clear_database_cache(tables=None):
+    """Clear database query caches (and dependent caches) for `tables`, or for all tables"""
+    invalidate_tables(*(CACHE_TABLES if tables is None else tables))
 
 def test_database_connection() -> bool:
     """Test if database is accessible and tables exist"""
@@ -196,61 +266,54 @@ def test_database_connection() -> bool:
         return False
 
 @st.cache_data(ttl=300, show_spinner=False)
-def _fetch_all_patients_cached() -> Optional[pd.DataFrame]:
+def _fetch_all_patients_cached(all_columns: bool = False) -> Optional[pd.DataFrame]:
     """Internal cached function to fetch all patients from database"""
     try:
         client = get_supabase_client()
         if client is None:
             return None
 
-        # OPTIMIZED: Select all columns (we need most columns for processing)
-        # Future optimization: Could select specific columns if only certain views need them
-        response = client.table('patients').select("*").execute()
-
-        if response.data:
-            df = pd.DataFrame(response.data)
+        # OPTIMIZED: Paged fetch of the columns the app reads (all columns for backups)
+        columns = None if all_columns else get_fetch_columns('patients')
+        df = fetch_table(client, 'patients', columns,
+                         date_columns=['ScreeningDate', 'RandomizationDate'])
 
+        if not df.empty:
             # Database columns are now PascalCase, no renaming needed
-            if 'ScreeningDate' in df.columns:
-                df['ScreeningDate'] = pd.to_datetime(df['ScreeningDate'], errors='coerce')
-
-            if 'RandomizationDate' in df.columns:
-                df['RandomizationDate'] = pd.to_datetime(df['RandomizationDate'], errors='coerce')
-
+            df.attrs['fingerprint'] = compute_table_fingerprint(df)
             return df
-        return pd.DataFrame(columns=['PatientID', 'Study', 'ScreeningDate', 'RandomizationDate', 'Status', 'PatientPractice', 'SiteSeenAt', 'Pathway'])
+        df = pd.DataFrame(columns=['PatientID', 'Study', 'ScreeningDate', 'RandomizationDate', 'Status', 'PatientPractice', 'SiteSeenAt', 'Pathway'])
+        df.attrs['fingerprint'] = compute_table_fingerprint(df)
+        return df
     except Exception as e:
         return None
 
-def fetch_all_patients() -> Optional[pd.DataFrame]:
+register_cache_dependency('patients', _fetch_all_patients_cached.clear, ['patients'])
+
+def fetch_all_patients(all_columns: bool = False) -> Optional[pd.DataFrame]:
     """Fetch all patients from database (with caching)"""
-    df = _fetch_all_patients_cached()
+    df = _fetch_all_patients_cached(all_columns)
     # Reduced logging - only log errors, not successful fetches (handled by app.py)
     if df is None:
         log_activity("No patients found in database", level='warning')
     return df
 
 @st.cache_data(ttl=300, show_spinner=False)
-def _fetch_all_trial_schedules_cached() -> Optional[pd.DataFrame]:
+def _fetch_all_trial_schedules_cached(all_columns: bool = False) -> Optional[pd.DataFrame]:
     """Internal cached function to fetch all trial schedules from database"""
     try:
         client = get_supabase_client()
         if client is None:
             return None
         
-        # OPTIMIZED: Select all columns (we need most columns for processing)
-        # Future optimization: Could select specific columns if only certain views need them
-        response = client.table('trial_schedules').select("*").execute()
+        # OPTIMIZED: Paged fetch of the columns the app reads (all columns for backups)
+        columns = None if all_columns else get_fetch_columns('trial_schedules')
+        df = fetch_table(client, 'trial_schedules', columns,
+                         date_columns=['FPFV', 'LPFV', 'LPLV'])
         
-        if response.data:
-            df = pd.DataFrame(response.data)
+        if not df.empty:
             # Database columns are now PascalCase, no renaming needed
             
-            # Parse date fields if they exist
-            for date_col in ['FPFV', 'LPFV', 'LPLV']:
-                if date_col in df.columns:
-                    df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
-            
             # Ensure StudyStatus defaults to 'active' if missing
             if 'StudyStatus' not in df.columns:
                 df['StudyStatus'] = 'active'
@@ -261,14 +324,19 @@ def _fetch_all_trial_schedules_cached() -> Optional[pd.DataFrame]:
             if 'RecruitmentTarget' in df.columns:
                 df['RecruitmentTarget'] = pd.to_numeric(df['RecruitmentTarget'], errors='coerce')
             
+            df.attrs['fingerprint'] = compute_table_fingerprint(df)
             return df
-        return pd.DataFrame(columns=['Study', 'Day', 'VisitName', 'SiteforVisit', 'Payment', 'ToleranceBefore', 'ToleranceAfter', 'IntervalUnit', 'IntervalValue', 'VisitType', 'FPFV', 'LPFV', 'LPLV', 'StudyStatus', 'RecruitmentTarget'])
+        df = pd.DataFrame(columns=['Study', 'Day', 'VisitName', 'SiteforVisit', 'Payment', 'ToleranceBefore', 'ToleranceAfter', 'IntervalUnit', 'IntervalValue', 'VisitType', 'FPFV', 'LPFV', 'LPLV', 'StudyStatus', 'RecruitmentTarget'])
+        df.attrs['fingerprint'] = compute_table_fingerprint(df)
+        return df
     except Exception as e:
         return None
 
-def fetch_all_trial_schedules() -> Optional[pd.DataFrame]:
+register_cache_dependency('trial_schedules', _fetch_all_trial_schedules_cached.clear, ['trial_schedules'])
+
+def fetch_all_trial_schedules(all_columns: bool = False) -> Optional[pd.DataFrame]:
     """Fetch all trial schedules from database (with caching)"""
-    return _fetch_all_trial_schedules_cached()
+    return _fetch_all_trial_schedules_cached(all_columns)
 
 def update_patient_status(patient_id: str, study: str, status: str, randomization_date=None) -> bool:
     """Update patient status and optionally set randomization date
@@ -296,7 +364,7 @@ def update_patient_status(patient_id: str, study: str, status: str, randomizatio
 
         client.table('patients').update(update_data).eq('PatientID', patient_id).eq('Study', study).execute()
 
-        clear_database_cache()
+        invalidate_tables('patients')
 
         log_activity(f"Updated patient {patient_id} status to '{status}'", level='info')
         return True
@@ -305,22 +373,19 @@ def update_patient_status(patient_id: str, study: str, status: str, randomizatio
         return False
 
 @st.cache_data(ttl=300, show_spinner=False)
-def _fetch_all_actual_visits_cached() -> Optional[pd.DataFrame]:
+def _fetch_all_actual_visits_cached(all_columns: bool = False) -> Optional[pd.DataFrame]:
     """Internal cached function to fetch all actual visits from database"""
     try:
         client = get_supabase_client()
         if client is None:
             return None
         
-        response = client.table('actual_visits').select("*").execute()
+        columns = None if all_columns else get_fetch_columns('actual_visits')
+        df = fetch_table(client, 'actual_visits', columns, date_columns=['ActualDate'])
         
-        if response.data:
-            df = pd.DataFrame(response.data)
+        if not df.empty:
             # Database columns are now PascalCase, no renaming needed
             
-            if 'ActualDate' in df.columns:
-                df['ActualDate'] = pd.to_datetime(df['ActualDate'], errors='coerce')
-            
             # FIXED: Auto-detect study events IMMEDIATELY after loading from database
             # This fixes SIV/Monitor visits that were saved with wrong VisitType
             # Store correction counts for logging
@@ -347,15 +412,20 @@ def _fetch_all_actual_visits_cached() -> Optional[pd.DataFrame]:
             # Store correction counts in DataFrame metadata for logging
             df.attrs['siv_corrected'] = siv_corrected_count
             df.attrs['monitor_corrected'] = monitor_corrected_count
+            df.attrs['fingerprint'] = compute_table_fingerprint(df)
 
             return df
-        return pd.DataFrame(columns=['PatientID', 'Study', 'VisitName', 'ActualDate', 'Notes', 'VisitType'])
+        df = pd.DataFrame(columns=['PatientID', 'Study', 'VisitName', 'ActualDate', 'Notes', 'VisitType'])
+        df.attrs['fingerprint'] = compute_table_fingerprint(df)
+        return df
     except Exception as e:
         return None
 
-def fetch_all_actual_visits() -> Optional[pd.DataFrame]:
+register_cache_dependency('actual_visits', _fetch_all_actual_visits_cached.clear, ['actual_visits'])
+
+def fetch_all_actual_visits(all_columns: bool = False) -> Optional[pd.DataFrame]:
     """Fetch all actual visits from database (with caching)"""
-    df = _fetch_all_actual_visits_cached()
+    df = _fetch_all_actual_visits_cached(all_columns)
     if df is not None:
         nat_count = df['ActualDate'].isna().sum() if 'ActualDate' in df.columns else 0
         if nat_count > 0:
@@ -442,6 +512,7 @@ def save_patients_to_database(patients_df: pd.DataFrame) -> bool:
         
         records = _filter_records_to_schema(records, 'patients')
         response = client.table('patients').insert(records).execute()
+        invalidate_tables('patients')
         log_activity(f"Inserted {len(records)} patient records to database", level='info')
         return True
 
@@ -581,6 +652,7 @@ def save_trial_schedules_to_database(trials_df: pd.DataFrame) -> bool:
         records = _filter_records_to_schema(records, 'trial_schedules')
 
         client.table('trial_schedules').insert(records).execute()
+        invalidate_tables('trial_schedules')
         
         log_activity(f"Successfully saved {len(records)} trial schedules to database", level='info')
         return True
@@ -640,6 +712,7 @@ def save_actual_visits_to_database(actual_visits_df: pd.DataFrame) -> bool:
 
         records = _filter_records_to_schema(records, 'actual_visits')
         client.table('actual_visits').upsert(records).execute()
+        invalidate_tables('actual_visits')
         return True
 
     except Exception as e:
@@ -710,6 +783,7 @@ def append_patient_to_database(patient_df: pd.DataFrame) -> bool:
 
         records = _filter_records_to_schema(records, 'patients')
         response = client.table('patients').insert(records).execute()
+        invalidate_tables('patients')
         log_activity(f"Appended {len(records)} patient(s) to database", level='success')
         return True
 
@@ -795,6 +869,7 @@ def append_visit_to_database(visit_df: pd.DataFrame) -> tuple[bool, str, str]:
 
         records = _filter_records_to_schema(records, 'actual_visits')
         response = client.table('actual_visits').insert(records).execute()
+        invalidate_tables('actual_visits')
         log_activity(f"Appended {len(records)} visit(s) to database", level='success')
         return True, f"Successfully added {len(records)} visit(s)", 'SUCCESS'
         
@@ -819,8 +894,7 @@ def check_visit_duplicates(visit_df: pd.DataFrame, client) -> dict:
     """
     try:
         # Get all existing visits from database
-        response = client.table('actual_visits').select("*").execute()
-        existing_visits = pd.DataFrame(response.data) if response.data else pd.DataFrame()
+        existing_visits = fetch_table(client, 'actual_visits', get_fetch_columns('actual_visits'))
         
         if existing_visits.empty:
             return {'has_duplicates': False, 'is_exact_duplicate': False, 'duplicates': None}
@@ -992,6 +1066,7 @@ def append_trial_schedule_to_database(schedule_df: pd.DataFrame) -> bool:
             records.append(record)
 
         response = client.table('trial_schedules').insert(records).execute()
+        invalidate_tables('trial_schedules')
         
         log_activity(f"Appended {len(records)} trial schedule(s) to database", level='success')
         return True
@@ -1196,10 +1271,9 @@ def _fetch_all_study_site_details_cached() -> Optional[pd.DataFrame]:
         if client is None:
             return None
         
-        response = client.table('study_site_details').select("*").execute()
+        df = fetch_table(client, 'study_site_details')
         
-        if response.data:
-            df = pd.DataFrame(response.data)
+        if not df.empty:
 
             # Log actual columns for debugging
             log_activity(f"study_site_details columns from database: {list(df.columns)}", level='info')
@@ -1240,13 +1314,18 @@ def _fetch_all_study_site_details_cached() -> Optional[pd.DataFrame]:
             if 'RecruitmentTarget' in df.columns:
                 df['RecruitmentTarget'] = pd.to_numeric(df['RecruitmentTarget'], errors='coerce')
 
+            df.attrs['fingerprint'] = compute_table_fingerprint(df)
             return df
         # Return empty DataFrame with ContractSite (normalized column name used internally)
-        return pd.DataFrame(columns=['Study', 'ContractSite', 'FPFV', 'LPFV', 'LPLV', 'StudyStatus', 'RecruitmentTarget'])
+        df = pd.DataFrame(columns=['Study', 'ContractSite', 'FPFV', 'LPFV', 'LPLV', 'StudyStatus', 'RecruitmentTarget'])
+        df.attrs['fingerprint'] = compute_table_fingerprint(df)
+        return df
     except Exception as e:
         log_activity(f"Error fetching study site details: {e}", level='error')
         return None
 
+register_cache_dependency('study_site_details', _fetch_all_study_site_details_cached.clear, ['study_site_details'])
+
 def fetch_all_study_site_details() -> Optional[pd.DataFrame]:
     """Fetch all study site details from database (with caching)"""
     df = _fetch_all_study_site_details_cached()
@@ -1300,7 +1379,7 @@ def create_study_site_details(study: str, site: str, details: Dict) -> bool:
         if response.data:
             log_activity(f"Created study site details: {study}/{site}", level='success')
             # Clear cache
-            _fetch_all_study_site_details_cached.clear()
+            invalidate_tables('study_site_details')
             return True
         return False
     except Exception as e:
@@ -1354,7 +1433,7 @@ def save_study_site_details(study: str, site: str, details: Dict) -> bool:
         
         if response.data:
             # Clear cache
-            _fetch_all_study_site_details_cached.clear()
+            invalidate_tables('study_site_details')
             return True
         return False
     except Exception as e:
@@ -1390,7 +1469,7 @@ def update_study_site_details(study: str, site: str, **kwargs) -> bool:
         if response.data:
             log_activity(f"Updated study site details: {study}/{site}", level='success')
             # Clear cache
-            _fetch_all_study_site_details_cached.clear()
+            invalidate_tables('study_site_details')
             return True
         return False
     except Exception as e:
@@ -1474,7 +1553,7 @@ def save_study_site_details_to_database(details_df: pd.DataFrame) -> bool:
 
         records = _filter_records_to_schema(records, 'study_site_details')
         client.table('study_site_details').insert(records).execute()
-        _fetch_all_study_site_details_cached.clear()
+        invalidate_tables('study_site_details')
         log_activity(f"Saved {len(records)} study site detail records", level='success')
         return True
         
@@ -1634,6 +1713,7 @@ def clear_patients_table() -> bool:
 
         # Delete all rows - use neq filter to match all rows (Supabase requires WHERE clause)
         client.table('patients').delete().neq('id', 0).execute()
+        invalidate_tables('patients')
         log_activity("Cleared all patients from database", level='info')
         return True
 
@@ -1651,6 +1731,7 @@ def clear_trial_schedules_table() -> bool:
 
         # Delete all rows - use neq filter to match all rows (Supabase requires WHERE clause)
         client.table('trial_schedules').delete().neq('id', 0).execute()
+        invalidate_tables('trial_schedules')
         log_activity("Cleared all trial schedules from database", level='info')
         return True
 
@@ -1668,6 +1749,7 @@ def clear_actual_visits_table() -> bool:
 
         # Delete all rows - use neq filter to match all rows (Supabase requires WHERE clause)
         client.table('actual_visits').delete().neq('id', 0).execute()
+        invalidate_tables('actual_visits')
         log_activity("Cleared all actual visits from database", level='info')
         return True
 
@@ -1687,7 +1769,7 @@ def clear_study_site_details_table() -> bool:
         # This matches all rows since Study is never empty (Supabase requires WHERE clause)
         client.table('study_site_details').delete().neq('Study', '').execute()
         log_activity("Cleared all study site details from database", level='info')
-        _fetch_all_study_site_details_cached.clear()
+        invalidate_tables('study_site_details')
         return True
 
     except Exception as e:
@@ -1757,11 +1839,11 @@ def safe_overwrite_table(table_name: str, df: pd.DataFrame, save_function) -> bo
         # 2. In-memory backup of current table data
         backup_df = None
         if table_name == 'patients':
-            backup_df = fetch_all_patients()
+            backup_df = fetch_all_patients(all_columns=True)
         elif table_name == 'trial_schedules':
-            backup_df = fetch_all_trial_schedules()
+            backup_df = fetch_all_trial_schedules(all_columns=True)
         elif table_name == 'actual_visits':
-            backup_df = fetch_all_actual_visits()
+            backup_df = fetch_all_actual_visits(all_columns=True)
         elif table_name == 'study_site_details':
             backup_df = fetch_all_study_site_details()
 
@@ -1942,6 +2024,7 @@ def safe_upsert_table(table_name: str, edited_df: pd.DataFrame, save_function=No
                 client.table(table_name).insert(batch).execute()
             log_activity(f"Inserted {len(records_to_insert)} new rows in {table_name}", level='info')
 
+        invalidate_tables(table_name)
         log_activity(f"Successfully saved {table_name} via upsert ({len(records_to_upsert)} updated, {len(records_to_insert)} new, {len(ids_to_delete)} deleted)", level='success')
         return True
 
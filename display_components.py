@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 import io
 from datetime import date
+from html import escape
 import re
 import streamlit.components.v1 as components
 from helpers import (
@@ -11,6 +12,9 @@ from helpers import (
     get_current_financial_year_boundaries
 )
 from calendar_builder import is_patient_inactive
+from visit_status import (STATUS_ACTUAL, STATUS_DATA_ERROR, STATUS_DIED, STATUS_PLANNED, STATUS_PREDICTED,
+                          STATUS_PROPOSED, STATUS_SCREEN_FAIL, STATUS_WITHDRAWN, cell_status_masks, status_bit,
+                          visit_status_mask)
 
 def render_calendar_start_selector(years_back: int = 4, show_label: bool = True):
     """
@@ -244,8 +248,10 @@ from calculations import (
     calculate_study_pipeline_breakdown, calculate_site_realization_breakdown,
     calculate_study_realization_by_study
 )
+from financial_cube import get_financial_cube
 from formatters import (
-    format_currency, create_site_header_row, style_calendar_row,
+    format_currency, create_site_header_row,
+    calendar_style_codes, DATE_STYLES, VISIT_STYLES,
     apply_currency_formatting, apply_currency_or_empty_formatting,
     create_fy_highlighting_function
 )
@@ -361,8 +367,11 @@ def display_complete_realization_analysis(visits_df, trials_df, patients_df):
     try:
         st.subheader("Income Realization Analysis")
         
+        # One financial cube for every breakdown below
+        cube = get_financial_cube(visits_df)
+
         # Calculate metrics
-        metrics = calculate_income_realization_metrics(visits_df, trials_df, patients_df)
+        metrics = calculate_income_realization_metrics(visits_df, trials_df, patients_df, cube=cube)
         
         # Display summary metrics
         col1, col2, col3, col4 = st.columns(4)
@@ -376,7 +385,7 @@ def display_complete_realization_analysis(visits_df, trials_df, patients_df):
             st.metric("Realization Rate", f"{metrics['realization_rate']:.1f}%")
         
         # Monthly breakdown
-        monthly_data = calculate_monthly_realization_breakdown(visits_df, trials_df)
+        monthly_data = calculate_monthly_realization_breakdown(visits_df, trials_df, cube=cube)
         if monthly_data:
             st.write("**Monthly Realization Breakdown**")
             monthly_df = pd.DataFrame(monthly_data)
@@ -386,7 +395,7 @@ def display_complete_realization_analysis(visits_df, trials_df, patients_df):
             st.dataframe(monthly_df, width="stretch", hide_index=True)
         
         # Study pipeline breakdown
-        study_pipeline = calculate_study_pipeline_breakdown(visits_df, trials_df)
+        study_pipeline = calculate_study_pipeline_breakdown(visits_df, trials_df, cube=cube)
         if not study_pipeline.empty:
             st.write("**Pipeline by Study**")
             study_display = study_pipeline.copy()
@@ -394,7 +403,7 @@ def display_complete_realization_analysis(visits_df, trials_df, patients_df):
             st.dataframe(study_display, width="stretch", hide_index=True)
         
         # Site realization breakdown
-        site_data = calculate_site_realization_breakdown(visits_df, trials_df)
+        site_data = calculate_site_realization_breakdown(visits_df, trials_df, cube=cube)
         if site_data:
             st.write("**Site Realization Summary**")
             site_df = pd.DataFrame(site_data)
@@ -601,96 +610,69 @@ def show_legend(actual_visits_df, view='Standard'):
     
     st.info(legend_text)
 
-def display_calendar(calendar_df, site_column_mapping, unique_visit_sites, excluded_visits=None, compact_mode=False):
-    """Display the main visit calendar with three-level styling"""
-    st.subheader("Generated Visit Calendar")
+def _calendar_display_frames(calendar_df, site_column_mapping, unique_visit_sites):
+    """Calendar columns in display order (Date, Day, then patients by visit site) and the
+    three header rows (create_site_header_row) with their Date column labels
+
+    Returns:
+        tuple: (display_df, header_rows)
+    """
+    # Prepare display columns (avoid duplicates)
+    final_ordered_columns = ["Date", "Day"]
+    seen_columns = {"Date", "Day"}
+    
+    for visit_site in unique_visit_sites:
+        site_data = site_column_mapping.get(visit_site, {})
+        site_columns = site_data.get('columns', [])
+        # Reduced logging - only log if there are issues
+        for col in site_columns:
+            if col in calendar_df.columns and col not in seen_columns:
+                final_ordered_columns.append(col)
+                seen_columns.add(col)
+            elif col not in calendar_df.columns:
+                log_activity(f"Warning: Column {col} not found in calendar DataFrame", level='warning')
+            elif col in seen_columns:
+                log_activity(f"Warning: Duplicate column {col} skipped", level='warning')
+
+    display_df = calendar_df[final_ordered_columns].reset_index(drop=True)
+
+    # Create three-level header rows
+    header_rows = create_site_header_row(display_df.columns, site_column_mapping)
+    
+    # Add labels to Date column in header rows (positioned to the left of the date text)
+    header_rows['level1_site']['Date'] = "Visit Site"
+    header_rows['level2_study_patient']['Date'] = "Study_Patient"
+    header_rows['level3_origin']['Date'] = "Origin Site"
+    return display_df, header_rows
+
+def _calendar_with_header_rows(display_df, header_rows):
+    """Header rows stacked on top of the calendar (Date in UK format) as one DataFrame"""
+    display_df_for_view = display_df.copy()
+    display_df_for_view["Date"] = display_df_for_view["Date"].dt.strftime("%d/%m/%Y")  # UK format
+    return pd.concat([
+        pd.DataFrame([header_rows['level1_site']]),           # Level 1: Visit sites (ASHFIELDS, KILTEARN)
+        pd.DataFrame([header_rows['level2_study_patient']]),  # Level 2: Study_PatientID (Alpha_P001, Beta_P003)
+        pd.DataFrame([header_rows['level3_origin']]),         # Level 3: Origin sites ((Kiltearn), (Ashfields))
+        display_df_for_view                                   # Actual visit data
+    ], ignore_index=True)
+
+def display_calendar(calendar_df, site_column_mapping, unique_visit_sites, excluded_visits=None, compact_mode=False, show_title=True,
+                     cell_status=None):
+    """Display the main visit calendar with three-level styling
+
+    cell_status is the status frame of the calendar build (fill_calendar_with_visits); without
+    it cell statuses are classified from the cell text.
+    """
+    if show_title:
+        st.subheader("Generated Visit Calendar")
 
     try:
-        # Prepare display columns (avoid duplicates)
-        final_ordered_columns = ["Date", "Day"]
-        seen_columns = {"Date", "Day"}
-        
-        for visit_site in unique_visit_sites:
-            site_data = site_column_mapping.get(visit_site, {})
-            site_columns = site_data.get('columns', [])
-            # Reduced logging - only log if there are issues
-            for col in site_columns:
-                if col in calendar_df.columns and col not in seen_columns:
-                    final_ordered_columns.append(col)
-                    seen_columns.add(col)
-                elif col not in calendar_df.columns:
-                    log_activity(f"Warning: Column {col} not found in calendar DataFrame", level='warning')
-                elif col in seen_columns:
-                    log_activity(f"Warning: Duplicate column {col} skipped", level='warning')
-
-        display_df = calendar_df[final_ordered_columns].copy()
-        display_df_for_view = display_df.copy()
-        display_df_for_view["Date"] = display_df_for_view["Date"].dt.strftime("%d/%m/%Y")  # UK format
-
-        # Create three-level header rows
-        header_rows = create_site_header_row(display_df_for_view.columns, site_column_mapping)
-        
-        # Add labels to Date column in header rows (positioned to the left of the date text)
-        header_rows['level1_site']['Date'] = "Visit Site"
-        header_rows['level2_study_patient']['Date'] = "Study_Patient"
-        header_rows['level3_origin']['Date'] = "Origin Site"
-        
-        # Create header dataframes
-        level1_df = pd.DataFrame([header_rows['level1_site']])  # Visit sites
-        level2_df = pd.DataFrame([header_rows['level2_study_patient']])  # Study_Patient
-        level3_df = pd.DataFrame([header_rows['level3_origin']])  # Origin sites
-        
-        # Check for duplicate indices before concatenation
-        if not display_df_for_view.index.is_unique:
-            st.warning(f"Found duplicate indices in calendar data. Resetting index...")
-            display_df_for_view = display_df_for_view.reset_index(drop=True)
-        
-        # Combine all headers with data
-        try:
-            # Check for column alignment (only log if mismatch)
-            all_columns = set(level1_df.columns) | set(level2_df.columns) | set(level3_df.columns) | set(display_df_for_view.columns)
-            if len(all_columns) != len(display_df_for_view.columns):
-                log_activity(f"Warning: Column mismatch in concatenation. Expected {len(display_df_for_view.columns)}, found {len(all_columns)}", level='warning')
-            
-            display_with_headers = pd.concat([
-                level1_df,      # Level 1: Visit sites (ASHFIELDS, KILTEARN)
-                level2_df,      # Level 2: Study_PatientID (Alpha_P001, Beta_P003)
-                level3_df,      # Level 3: Origin sites ((Kiltearn), (Ashfields))
-                display_df_for_view  # Actual visit data
-            ], ignore_index=True)
-            
-            log_activity(f"Concatenation successful - Final shape: {display_with_headers.shape}", level='info')
-            
-        except Exception as concat_error:
-            st.error(f"Error concatenating calendar data: {concat_error}")
-            log_activity(f"Concatenation error details: {str(concat_error)}", level='error')
-            # Fallback: just show the calendar data without headers
-            display_with_headers = display_df_for_view
+        display_df, header_rows = _calendar_display_frames(calendar_df, site_column_mapping, unique_visit_sites)
 
-        # Apply styling for three header rows
         try:
-            log_activity(f"Applying styling to DataFrame with shape: {display_with_headers.shape}", level='info')
+            log_activity(f"Rendering calendar with {len(display_df)} rows x {len(display_df.columns)} columns", level='info')
             today = pd.to_datetime(date.today())
             
-            # CRITICAL: Don't apply Pandas styling to header rows (first 3 rows)
-            # because Pandas inline styles override sticky positioning
-            
-            # Separate headers from data
-            header_rows = display_with_headers.iloc[:3].copy()
-            data_rows = display_with_headers.iloc[3:].copy() if len(display_with_headers) > 3 else pd.DataFrame()
-            
-            log_activity(f"Split into {len(header_rows)} header rows and {len(data_rows)} data rows", level='info')
-            
-            # Style ONLY the data rows (not headers)
-            if not data_rows.empty:
-                styled_data = data_rows.style.apply(
-                    lambda row: style_calendar_row(row, today), axis=1
-                )
-                styled_data = styled_data.hide(axis='index')
-                log_activity(f"Styling applied to data rows", level='info')
-            else:
-                styled_data = None
-            
             # Check if scroll to today was requested
             scroll_to_today = st.session_state.get('scroll_to_today', False)
             if scroll_to_today:
@@ -700,12 +682,14 @@ def display_calendar(calendar_df, site_column_mapping, unique_visit_sites, exclu
             show_scrollbars = st.session_state.get('show_scrollbars', True)
             
             # Generate HTML with frozen headers
-            html_table = _generate_calendar_html_with_frozen_headers(
-                styled_data, site_column_mapping, compact_mode, 
-                list(display_with_headers.columns),
-                header_rows_df=header_rows,  # Pass unstyled headers separately
+            table_html, cell_css = render_calendar_table(
+                display_df, header_rows, site_column_mapping, today, compact_mode, cell_status=cell_status
+            )
+            html_table = _calendar_html_document(
+                table_html, compact_mode,
                 scroll_to_today=scroll_to_today,  # Pass scroll flag
-                show_scrollbars=show_scrollbars  # Pass scrollbar visibility preference
+                show_scrollbars=show_scrollbars,  # Pass scrollbar visibility preference
+                cell_css=cell_css
             )
             log_activity(f"HTML generation successful, length: {len(html_table)}", level='info')
             
@@ -714,7 +698,7 @@ def display_calendar(calendar_df, site_column_mapping, unique_visit_sites, exclu
         except Exception as e:
             st.warning(f"Calendar styling unavailable: {e}")
             log_activity(f"Styling error details: {str(e)}", level='error')
-            st.dataframe(display_with_headers, width="stretch", height=400)
+            st.dataframe(_calendar_with_header_rows(display_df, header_rows), width="stretch", height=400)
 
         if excluded_visits and len(excluded_visits) > 0:
             st.warning("Some visits were excluded due to screen failure:")
@@ -739,24 +723,178 @@ def display_calendar(calendar_df, site_column_mapping, unique_visit_sites, exclu
             st.write(f"First few rows:")
             st.dataframe(calendar_df.head(), width="stretch")
 
-def _get_visit_tooltip(cell_content, col_name, site_column_mapping, date_str=None):
-    """Generate tooltip text for a visit cell"""
-    if not cell_content or str(cell_content).strip() in ['', '-', '+']:
-        return None
-    
-    # Find patient info for this column
-    patient_info = None
+def default_calendar_window_start(calendar_df, today=None, window_days=None):
+    """Start of the window that shows `today` a quarter of the way down, kept inside the calendar"""
+    from config import CALENDAR_WINDOW_DAYS
+    window_days = window_days or CALENDAR_WINDOW_DAYS
+    today = pd.Timestamp(today if today is not None else date.today()).normalize()
+    start = today - pd.Timedelta(days=window_days // 4)
+    return _clamp_window_start(calendar_df, start, window_days)
+
+def _clamp_window_start(calendar_df, start, window_days):
+    first_date, last_date = calendar_df['Date'].min(), calendar_df['Date'].max()
+    latest_start = max(first_date, last_date - pd.Timedelta(days=window_days - 1))
+    return min(max(pd.Timestamp(start).normalize(), first_date), latest_start)
+
+def slice_calendar_window(calendar_df, site_column_mapping, unique_visit_sites, window_start,
+                          window_days=None, column_page=0, max_columns=None):
+    """One date window of the calendar with only the patient columns that have something in it
+
+    Rows come from a positional slice of the (date-sorted) calendar, so the cost and the size of
+    what gets rendered depend on the window and its active patients, not on the full history.
+    Active columns are paged `max_columns` at a time in site order.
+
+    Returns:
+        tuple: (window_df, window_mapping, window_sites, info) where info holds start, end,
+        days, total_days, columns, active_columns, total_columns, column_page, column_pages
+    """
+    from config import CALENDAR_WINDOW_DAYS, CALENDAR_WINDOW_MAX_COLUMNS
+    window_days = window_days or CALENDAR_WINDOW_DAYS
+    max_columns = max_columns or CALENDAR_WINDOW_MAX_COLUMNS
+
+    start = _clamp_window_start(calendar_df, window_start, window_days)
+    end = start + pd.Timedelta(days=window_days - 1)
+    dates = calendar_df['Date']
+    if dates.is_monotonic_increasing:
+        values = dates.to_numpy()
+        first = values.searchsorted(start.to_datetime64(), side='left')
+        last = values.searchsorted(end.to_datetime64(), side='right')
+        rows = calendar_df.iloc[first:last]
+    else:
+        rows = calendar_df[(dates >= start) & (dates <= end)].sort_values('Date')
+
+    # Patient/event columns in display order, kept when any cell in the window is filled
+    ordered_columns = []
+    for visit_site in unique_visit_sites:
+        for col in site_column_mapping.get(visit_site, {}).get('columns', []):
+            if col in rows.columns and col not in ordered_columns:
+                ordered_columns.append(col)
+    window_values = rows[ordered_columns]
+    filled = (window_values.notna() & window_values.ne('')).any()
+    active_columns = [col for col in ordered_columns if filled[col]]
+
+    column_pages = max(1, -(-len(active_columns) // max_columns))
+    column_page = min(max(int(column_page), 0), column_pages - 1)
+    page_columns = active_columns[column_page * max_columns:(column_page + 1) * max_columns]
+    page_set = set(page_columns)
+
+    window_mapping = {}
     for site, site_data in site_column_mapping.items():
-        for p_info in site_data.get('patient_info', []):
-            if p_info['col_id'] == col_name:
-                patient_info = p_info
-                break
-        if patient_info:
-            break
-    
-    if not patient_info:
-        return None
-    
+        site_columns = [col for col in site_data.get('columns', []) if col in page_set]
+        if site_columns:
+            window_mapping[site] = {
+                **site_data,
+                'columns': site_columns,
+                'patient_info': [info for info in site_data.get('patient_info', []) if info.get('col_id') in page_set],
+            }
+    window_sites = [site for site in unique_visit_sites if site in window_mapping]
+    window_df = rows[['Date', 'Day'] + page_columns].reset_index(drop=True)
+
+    info = {
+        'start': start, 'end': end,
+        'days': len(window_df), 'total_days': len(calendar_df),
+        'columns': len(page_columns), 'active_columns': len(active_columns), 'total_columns': len(ordered_columns),
+        'column_page': column_page, 'column_pages': column_pages,
+    }
+    return window_df, window_mapping, window_sites, info
+
+def display_calendar_window(calendar_df, site_column_mapping, unique_visit_sites, excluded_visits=None, compact_mode=False,
+                            cell_status=None):
+    """Display the calendar one date window at a time (Earlier/Later/jump controls), rendering
+    only that window's rows and active patient columns under the frozen headers"""
+    from config import CALENDAR_WINDOW_DAYS, CALENDAR_WINDOW_STEP_DAYS, CALENDAR_WINDOW_MAX_COLUMNS
+
+    if calendar_df.empty or 'Date' not in calendar_df.columns:
+        display_calendar(calendar_df, site_column_mapping, unique_visit_sites, excluded_visits, compact_mode,
+                         cell_status=cell_status)
+        return
+
+    st.subheader("Generated Visit Calendar")
+
+    # Scroll to Today re-centres the window; the flag is left for the page's auto-scroll
+    if st.session_state.get('calendar_window_start') is None or st.session_state.get('scroll_to_today', False):
+        st.session_state.calendar_window_start = default_calendar_window_start(calendar_df)
+    start = _clamp_window_start(calendar_df, st.session_state.calendar_window_start, CALENDAR_WINDOW_DAYS)
+    first_date = calendar_df['Date'].min()
+    latest_start = _clamp_window_start(calendar_df, calendar_df['Date'].max(), CALENDAR_WINDOW_DAYS)
+    step = pd.Timedelta(days=CALENDAR_WINDOW_STEP_DAYS)
+
+    nav = st.columns([1, 1, 1, 2, 2])
+    with nav[0]:
+        if st.button("◀ Earlier", key="calendar_window_earlier", disabled=start <= first_date):
+            st.session_state.calendar_window_start = start - step
+            st.rerun()
+    with nav[1]:
+        if st.button("Today", key="calendar_window_today", help="Move the window back to today's date."):
+            st.session_state.calendar_window_start = default_calendar_window_start(calendar_df)
+            st.rerun()
+    with nav[2]:
+        if st.button("Later ▶", key="calendar_window_later", disabled=start >= latest_start):
+            st.session_state.calendar_window_start = start + step
+            st.rerun()
+    with nav[3]:
+        jump_to = st.date_input(
+            "Window start", value=start.date(), min_value=first_date.date(),
+            max_value=calendar_df['Date'].max().date(), format="DD/MM/YYYY"
+        )
+        if pd.Timestamp(jump_to) != start:
+            st.session_state.calendar_window_start = pd.Timestamp(jump_to)
+            st.rerun()
+
+    window_df, window_mapping, window_sites, info = slice_calendar_window(
+        calendar_df, site_column_mapping, unique_visit_sites, start,
+        column_page=st.session_state.get('calendar_column_page', 0)
+    )
+    with nav[4]:
+        if info['column_pages'] > 1:
+            page_labels = [
+                f"Patients {page * CALENDAR_WINDOW_MAX_COLUMNS + 1}–{min((page + 1) * CALENDAR_WINDOW_MAX_COLUMNS, info['active_columns'])}"
+                for page in range(info['column_pages'])
+            ]
+            page = st.selectbox("Columns", range(info['column_pages']), index=info['column_page'],
+                                format_func=lambda page: page_labels[page])
+            if page != info['column_page']:
+                st.session_state.calendar_column_page = page
+                st.rerun()
+
+    st.caption(
+        f"Showing {info['start']:%d/%m/%Y} – {info['end']:%d/%m/%Y} ({info['days']} of {info['total_days']} days), "
+        f"{info['columns']} of {info['total_columns']} columns - columns with nothing in this window are hidden."
+    )
+    display_calendar(window_df, window_mapping, window_sites, excluded_visits, compact_mode, show_title=False,
+                     cell_status=cell_status)
+
+# Tooltip status per visit status, highest priority first ("Predicted" when none is set)
+_TOOLTIP_STATUS_PRIORITY = (
+    (STATUS_ACTUAL, "Completed"),
+    (STATUS_SCREEN_FAIL, "Screen Failed"),
+    (STATUS_WITHDRAWN, "Withdrawn"),
+    (STATUS_DIED, "Died"),
+    (STATUS_DATA_ERROR, "Data Error"),
+    (STATUS_PROPOSED, "Proposed"),
+    (STATUS_PLANNED, "Planned"),
+)
+
+# Compact-mode icon per visit status, highest priority first (the full text when none is set)
+_COMPACT_ICON_PRIORITY = (
+    (STATUS_SCREEN_FAIL, '⚠️'),
+    (STATUS_WITHDRAWN, '⚠️'),
+    (STATUS_ACTUAL, '✅'),
+    (STATUS_DIED, '⚠️'),
+    (STATUS_DATA_ERROR, '⚠️'),
+    (STATUS_PREDICTED, '📋'),
+    (STATUS_PROPOSED, '📅'),
+    (STATUS_PLANNED, '📅'),
+)
+
+# Whitespace runs inside a rendered calendar cell (collapsed to one space)
+_WHITESPACE_RUN = re.compile(r'\s+')
+
+def _visit_tooltip_status(cell_content, mask=None):
+    """(visit name without emojis/status markers, status) for a visit cell's tooltip
+
+    mask is the cell's status mask (classified from the text when not given).
+    """
     # Extract visit name from cell content
     visit_name = str(cell_content)
     # Remove emojis and status markers for cleaner tooltip
@@ -764,913 +902,769 @@ def _get_visit_tooltip(cell_content, col_name, site_column_mapping, date_str=Non
         visit_name = visit_name.replace(marker, '').strip()
     
     # Determine status
-    status = "Predicted"
-    if '✅' in str(cell_content):
-        status = "Completed"
-    elif '⚠️ Screen Fail' in str(cell_content):
-        status = "Screen Failed"
-    elif '⚠️ Withdrawn' in str(cell_content):
-        status = "Withdrawn"
-    elif '🔴' in str(cell_content):
-        status = "Out of Protocol"
-    
-    tooltip_parts = [
-        f"Patient: {patient_info['patient_id']}",
-        f"Study: {patient_info['study']}",
-        f"Visit: {visit_name}" if visit_name else "Visit",
-        f"Status: {status}"
-    ]
-    
-    if date_str:
-        tooltip_parts.insert(2, f"Date: {date_str}")
-    
-    tooltip_parts.append(f"Origin: {patient_info.get('origin_site', 'Unknown')}")
-    
-    return " | ".join(tooltip_parts)
+    if mask is None:
+        mask = visit_status_mask(str(cell_content))
+    status = next((text for code, text in _TOOLTIP_STATUS_PRIORITY if mask & status_bit(code)), "Predicted")
+    return visit_name, status
 
-def _get_header_tooltip(col_name, site_column_mapping):
-    """Generate tooltip text for header cells"""
-    # Find patient info for this column
-    patient_info = None
-    for site, site_data in site_column_mapping.items():
-        for p_info in site_data.get('patient_info', []):
-            if p_info['col_id'] == col_name:
-                patient_info = p_info
-                break
-        if patient_info:
-            break
-    
-    if patient_info:
-        return f"Patient: {patient_info['patient_id']} | Study: {patient_info['study']} | Origin: {patient_info.get('origin_site', 'Unknown')}"
-    return None
+def _convert_to_compact_icon(cell_content, mask=None):
+    """Convert visit text to icon for compact mode
 
-def _convert_to_compact_icon(cell_content):
-    """Convert visit text to icon for compact mode"""
+    mask is the cell's status mask (classified from the text when not given).
+    """
     if not cell_content or str(cell_content).strip() in ['', '-', '+']:
         return str(cell_content) if cell_content else ''
     
     content_str = str(cell_content)
+    if mask is None:
+        mask = visit_status_mask(content_str)
     
     # Map to icons
-    if '✅' in content_str and 'Screen Fail' not in content_str and 'Withdrawn' not in content_str:
-        return '✅'
-    elif '⚠️ Screen Fail' in content_str:
-        return '⚠️'
-    elif '⚠️ Withdrawn' in content_str:
-        return '⚠️'
-    elif '🔴' in content_str:
-        return '🔴'
-    elif '📋' in content_str:
-        return '📋'
-    elif '📅' in content_str:
-        return '📅'
+    for code, icon in _COMPACT_ICON_PRIORITY:
+        if mask & status_bit(code):
+            return icon
     
     return content_str
 
-def _generate_calendar_html_with_frozen_headers(styled_df, site_column_mapping, compact_mode=False, column_names=None, header_rows_df=None, scroll_to_today=False, show_scrollbars=True):
-    """Generate HTML calendar with frozen headers, month separators, auto-scroll, tooltips, and compact mode"""
-    try:
-        # Generate HTML for data rows (if they exist)
-        if styled_df is not None:
-            html_table_base = styled_df.to_html(escape=False, index=False)
-        else:
-            # Only headers, no data
-            html_table_base = '<table><tbody></tbody></table>'
-        
-        # If we have separate header rows, prepend them to the HTML
-        if header_rows_df is not None:
-            # Convert header rows to HTML WITHOUT Pandas styling
-            header_html = header_rows_df.to_html(escape=False, index=False, header=False)
-            
-            # Extract just the <tr> rows from header HTML
-            # Find all <tr>...</tr> blocks in the header HTML
-            header_tr_matches = re.findall(r'<tr[^>]*>.*?</tr>', header_html, re.DOTALL)
-            if header_tr_matches:
-                header_rows_html = '\n'.join(header_tr_matches)
-                # Insert header rows at the start of tbody
-                if '<tbody>' in html_table_base:
-                    html_table_base = html_table_base.replace('<tbody>', f'<tbody>\n{header_rows_html}', 1)
-        
-        # CRITICAL FIX: Join multi-line <tr> tags onto single lines
-        # This ensures our header detection logic (which checks for '<td>' in same line as '<tr>') works
-        # Join entire <tr>...</tr> blocks onto single lines by removing newlines and extra whitespace within rows
-        # Use a more careful approach that doesn't break HTML structure
-        def normalize_row(match):
-            """Normalize a single table row to be on one line"""
-            row_content = match.group(0)
-            # Remove newlines and extra whitespace, but preserve single spaces
-            normalized = re.sub(r'\s+', ' ', row_content)
-            # Remove spaces between tags
-            normalized = re.sub(r'>\s+<', '><', normalized)
-            return normalized
-        
-        # Match each <tr>...</tr> block individually to avoid cross-row matching
-        html_table_base = re.sub(
-            r'<tr[^>]*>.*?</tr>',
-            normalize_row,
-            html_table_base,
-            flags=re.DOTALL
+def _calendar_patient_lookup(site_column_mapping):
+    """col_id -> patient info from site_column_mapping (first entry wins, like the tooltip helpers)"""
+    lookup = {}
+    for site_data in site_column_mapping.values():
+        for p_info in site_data.get('patient_info', []):
+            lookup.setdefault(p_info['col_id'], p_info)
+    return lookup
+
+def render_calendar_table(display_df, header_rows, site_column_mapping, today, compact_mode=False, cell_status=None):
+    """Render the calendar <table> in one pass over the column arrays (no Styler, no regex rewriting)
+
+    display_df holds Date (datetime), Day and the patient columns in display order and
+    header_rows the three header levels (see _calendar_display_frames). Styles come from the
+    calendar_style_codes matrix - date style for the whole row, else visit style per cell -
+    declared once as CSS classes; tooltips are built from per-column patient details and the
+    cell's status, with the date of the row. Statuses come from cell_status, the build's status
+    frame looked up by Date and column (cell_status_masks), else from the cell text.
+
+    Returns:
+        tuple: (table_html, cell_css) - pass cell_css to _calendar_html_document
+    """
+    columns = list(display_df.columns)
+    patient_columns = [col for col in columns if col not in ('Date', 'Day')]
+    patients = _calendar_patient_lookup(site_column_mapping)
+    style_classes = {}
+
+    def class_attr(style):
+        if not style:
+            return ''
+        if style not in style_classes:
+            style_classes[style] = f'cs{len(style_classes)}'
+        return f' class="{style_classes[style]}"'
+
+    rows = []
+
+    # Header rows: tooltip per patient column, sticky style from the row class
+    header_titles = {}
+    for col in columns:
+        info = patients.get(col)
+        if info:
+            tooltip = f"Patient: {info['patient_id']} | Study: {info['study']} | Origin: {info.get('origin_site', 'Unknown')}"
+            header_titles[col] = f' title="{escape(tooltip)}"'
+    for level, key in enumerate(('level1_site', 'level2_study_patient', 'level3_origin'), start=1):
+        labels = header_rows[key]
+        cells = ''.join(f'<td{header_titles.get(col, "")}>{labels.get(col, "")}</td>' for col in columns)
+        rows.append(f'<tr class="header-row-{level}">{cells}</tr>')
+
+    # Style matrix: date code per row (today, 31 March, month end, weekend), visit code per cell
+    # from the status masks the calendar fill recorded per cell
+    values = display_df[patient_columns].fillna('')
+    masks = cell_status_masks(values.to_numpy(dtype=object), display_df['Date'], patient_columns, cell_status)
+    row_codes, cell_codes = calendar_style_codes(values.assign(Date=display_df['Date']), patient_columns, today,
+                                                 masks=masks)
+    date_classes = [class_attr(style) for style in DATE_STYLES]
+    visit_classes = [class_attr(style) for style in VISIT_STYLES]
+
+    # Row-level values: UK date label and date style class
+    date_labels = pd.to_datetime(display_df['Date']).dt.strftime('%d/%m/%Y').fillna('').tolist()
+    row_classes = [date_classes[code] for code in row_codes]
+    day_names = display_df['Day'].fillna('').astype(str).tolist()
+
+    # Column-level values: tooltip prefix/suffix per patient column
+    column_tooltips = []
+    for col in patient_columns:
+        info = patients.get(col)
+        column_tooltips.append(
+            (escape(f"Patient: {info['patient_id']} | Study: {info['study']}"),
+             escape(f"Origin: {info.get('origin_site', 'Unknown')}")) if info else None
         )
-        
-        html_lines = html_table_base.split('\n')
-        modified_html_lines = []
-
-        prev_month = None
-        header_rows_assigned = 0
-        data_row_counter = 0
-        in_thead = False
-        thead_processed = False
-        
-        # Get column names from parameter or try to extract from styled_df
-        if column_names is None:
-            if hasattr(styled_df.data, 'columns'):
-                column_names = list(styled_df.data.columns)
-            elif hasattr(styled_df, 'columns'):
-                column_names = list(styled_df.columns)
-            else:
-                column_names = []
-        
-        for line in html_lines:
-            # Track if we're in thead section
-            if '<thead>' in line:
-                in_thead = True
-                modified_html_lines.append(line)
-                continue
-            if '</thead>' in line:
-                in_thead = False
-                thead_processed = True
-                modified_html_lines.append(line)
-                continue
-            if '<tbody>' in line:
-                modified_html_lines.append(line)
-                continue
-            if '</tbody>' in line:
-                modified_html_lines.append(line)
+
+    # (value, status mask)-level lookups: displayed text and tooltip visit/status part
+    cell_lookup = {}
+
+    def describe(value, mask):
+        # Each row is rendered on one line: runs of whitespace (the newline between the labels
+        # of a multi-visit cell) show as a single space, in the cell and in its tooltip
+        text = _WHITESPACE_RUN.sub(' ', str(value))
+        if text.isspace():
+            text = ''
+        shown = _convert_to_compact_icon(text, mask) if compact_mode else text
+        visit_status = None
+        if text.strip() not in ('', '-', '+'):
+            # Tooltip from the full visit text, so compact icons still name the visit
+            visit_name, status = _visit_tooltip_status(text, mask)
+            visit_status = escape(f"Visit: {visit_name}" if visit_name else "Visit") + escape(f" | Status: {status}")
+        return shown, visit_status
+
+    column_values = [values[col].tolist() for col in patient_columns]
+    mask_rows = masks.tolist()
+    for i, row_values in enumerate(zip(*column_values)):
+        row_class = row_classes[i]
+        row_cell_codes = cell_codes[i]
+        row_masks = mask_rows[i]
+        date_label = date_labels[i]
+        date_part = f' | Date: {date_label}' if date_label else ''
+        empty_cell = f'<td{row_class}></td>'
+        cells = [f'<tr><td{row_class}>{date_label}</td><td{row_class}>{day_names[i]}</td>']
+        for j, value in enumerate(row_values):
+            if value == '':
+                cells.append(empty_cell)
                 continue
+            key = (value, row_masks[j])
+            described = cell_lookup.get(key)
+            if described is None:
+                described = cell_lookup[key] = describe(value, row_masks[j])
+            shown, visit_status = described
+            title = ''
+            if visit_status is not None and column_tooltips[j] is not None:
+                prefix, suffix = column_tooltips[j]
+                title = f' title="{prefix}{date_part} | {visit_status} | {suffix}"'
+            cells.append(f'<td{row_class or visit_classes[row_cell_codes[j]]}{title}>{shown}</td>')
+        cells.append('</tr>')
+        rows.append(''.join(cells))
+
+    table_html = '<table>\n<tbody>\n' + '\n'.join(rows) + '\n</tbody>\n</table>'
+
+    # ID selectors so cell styles win over the container's column rules, like Styler's per-cell ids
+    cell_css = [f'#calendar-scroll-container tr.header-row-{level} td {{ {_calendar_header_style(level, compact_mode)} }}'
+                for level in (1, 2, 3)]
+    cell_css += [f'#calendar-scroll-container td.{name} {{ {style} }}' for style, name in style_classes.items()]
+    return table_html, '\n'.join(cell_css)
+
+def _calendar_header_style(level, compact_mode=False):
+    """Sticky style for the cells of header row `level` (1 visit site, 2 Study_Patient, 3 origin site)"""
+    top_value = (level - 1) * 32
+    if compact_mode and level == 2:
+        top_value = 0  # In compact mode, row 2 is at top
+    z_index = 100 if level == 1 else (99 if level == 2 else 98)
+
+    # Set header row colors based on level
+    if level == 1:
+        # Level 1: Visit sites - Dark blue background, white text
+        bg_color, text_color, font_weight, font_size = "#1e40af", "#ffffff", "bold", "14px"
+    elif level == 2:
+        # Level 2: Study_Patient - Medium blue background, white text
+        bg_color, text_color, font_weight, font_size = "#3b82f6", "#ffffff", "bold", "12px"
+    else:
+        # Level 3: Origin sites - Light blue background, dark blue text
+        bg_color, text_color, font_weight, font_size = "#93c5fd", "#1e40af", "normal", "10px"
+
+    # use !important to override any existing styles
+    return f'position: -webkit-sticky !important; position: sticky !important; top: {top_value}px !important; z-index: {z_index} !important; background: {bg_color} !important; color: {text_color} !important; font-weight: {font_weight} !important; font-size: {font_size} !important; text-align: center !important; border: 1px solid #ccc !important; box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1) !important;'
+
+def _calendar_html_document(table_html, compact_mode=False, scroll_to_today=False, show_scrollbars=True, cell_css=""):
+    """Wrap a calendar <table> in the scrolling container page (sticky header/column CSS, auto-scroll JS)"""
+    from textwrap import dedent
+    compact_css = ""
+    if compact_mode:
+        compact_css = """
+                .calendar-container table {
+                    table-layout: fixed;
+                }
+                /* Hide level 1 and level 3 headers in compact mode, show only patient IDs */
+                .calendar-container table tbody tr.header-row-1,
+                .calendar-container table tbody tr.header-row-3 {
+                    display: none !important;
+                }
+                /* Make all columns narrow in compact mode */
+                .calendar-container table tbody tr.header-row-2 td,
+                .calendar-container table tbody td {
+                    width: 40px !important;
+                    min-width: 40px !important;
+                    max-width: 40px !important;
+                    padding: 2px !important;
+                    font-size: 10px !important;
+                    text-align: center !important;
+                    overflow: hidden !important;
+                    text-overflow: ellipsis !important;
+                }
+                /* Date column slightly wider but still compact */
+                .calendar-container table tbody tr.header-row-2 td:first-child,
+                .calendar-container table tbody td:first-child {
+                    width: 80px !important;
+                    min-width: 80px !important;
+                    max-width: 80px !important;
+                }
+                /* Day column slightly wider but still compact */
+                .calendar-container table tbody tr.header-row-2 td:nth-child(2),
+                .calendar-container table tbody td:nth-child(2) {
+                    width: 50px !important;
+                    min-width: 50px !important;
+                    max-width: 50px !important;
+                }
+        """
+    
+    sticky_css = """
+                .calendar-container table {
+                    border-collapse: separate !important;
+                    border-spacing: 0 !important;
+                    width: 100%;
+                }
+                .calendar-container table thead {
+                    display: none !important;
+                }
+                .calendar-container table th,
+                .calendar-container table td {
+                    border: 1px solid #dee2e6;
+                    padding: 6px;
+                    background: #ffffff;
+                }
+                /* Date column (first column) - sticky for all rows */
+                .calendar-container table td:first-child,
+                .calendar-container table th:first-child {
+                    position: -webkit-sticky;
+                    position: sticky;
+                    left: 0;
+                    z-index: 5;
+                    background: #f0f4f8;
+                    min-width: 140px;
+                    width: 140px;
+                    -webkit-transform: translateZ(0);
+                    transform: translateZ(0);
+                }
+                /* Day column (second column) - sticky for all rows */
+                .calendar-container table td:nth-child(2),
+                .calendar-container table th:nth-child(2) {
+                    position: -webkit-sticky;
+                    position: sticky;
+                    left: 140px;
+                    z-index: 5;
+                    background: #f6f8fb;
+                    min-width: 120px;
+                    width: 120px;
+                    -webkit-transform: translateZ(0);
+                    transform: translateZ(0);
+                }
+                /* Sticky headers - must combine top and left for Date/Day columns */
+                .calendar-container table tbody tr.header-row-1 td {
+                    position: -webkit-sticky !important;
+                    position: sticky !important;
+                    top: 0 !important;
+                    z-index: 100 !important;
+                    background: #1e40af !important;
+                    color: #ffffff !important;
+                    font-weight: bold !important;
+                    font-size: 14px !important;
+                    text-align: center !important;
+                    box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1) !important;
+                    -webkit-transform: translateZ(0) !important;
+                    transform: translateZ(0) !important;
+                }
+                /* Date column in header row 1 - needs both top and left */
+                .calendar-container table tbody tr.header-row-1 td:first-child {
+                    position: -webkit-sticky !important;
+                    position: sticky !important;
+                    top: 0 !important;
+                    left: 0 !important;
+                    z-index: 15 !important;
+                    background: #1e40af !important;
+                    color: #ffffff !important;
+                    -webkit-transform: translateZ(0) !important;
+                    transform: translateZ(0) !important;
+                }
+                /* Day column in header row 1 - needs both top and left */
+                .calendar-container table tbody tr.header-row-1 td:nth-child(2) {
+                    position: -webkit-sticky !important;
+                    position: sticky !important;
+                    top: 0 !important;
+                    left: 140px !important;
+                    z-index: 14 !important;
+                    background: #1e40af !important;
+                    color: #ffffff !important;
+                    -webkit-transform: translateZ(0) !important;
+                    transform: translateZ(0) !important;
+                }
+                .calendar-container table tbody tr.header-row-2 td {
+                    position: -webkit-sticky !important;
+                    position: sticky !important;
+                    top: 32px !important;
+                    z-index: 99 !important;
+                    background: #3b82f6 !important;
+                    color: #ffffff !important;
+                    font-weight: bold !important;
+                    font-size: 12px !important;
+                    text-align: center !important;
+                    box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1) !important;
+                    -webkit-transform: translateZ(0) !important;
+                    transform: translateZ(0) !important;
+                }
+                /* Date column in header row 2 - needs both top and left */
+                .calendar-container table tbody tr.header-row-2 td:first-child {
+                    position: -webkit-sticky !important;
+                    position: sticky !important;
+                    top: 32px !important;
+                    left: 0 !important;
+                    z-index: 13 !important;
+                    background: #3b82f6 !important;
+                    color: #ffffff !important;
+                    -webkit-transform: translateZ(0) !important;
+                    transform: translateZ(0) !important;
+                }
+                /* Day column in header row 2 - needs both top and left */
+                .calendar-container table tbody tr.header-row-2 td:nth-child(2) {
+                    position: -webkit-sticky !important;
+                    position: sticky !important;
+                    top: 32px !important;
+                    left: 140px !important;
+                    z-index: 12 !important;
+                    background: #3b82f6 !important;
+                    color: #ffffff !important;
+                    -webkit-transform: translateZ(0) !important;
+                    transform: translateZ(0) !important;
+                }
+                .calendar-container table tbody tr.header-row-3 td {
+                    position: -webkit-sticky !important;
+                    position: sticky !important;
+                    top: 64px !important;
+                    z-index: 98 !important;
+                    background: #93c5fd !important;
+                    color: #1e40af !important;
+                    font-weight: normal !important;
+                    font-size: 10px !important;
+                    text-align: center !important;
+                    box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1) !important;
+                    -webkit-transform: translateZ(0) !important;
+                    transform: translateZ(0) !important;
+                }
+                /* Date column in header row 3 - needs both top and left */
+                .calendar-container table tbody tr.header-row-3 td:first-child {
+                    position: -webkit-sticky !important;
+                    position: sticky !important;
+                    top: 64px !important;
+                    left: 0 !important;
+                    z-index: 11 !important;
+                    background: #93c5fd !important;
+                    color: #1e40af !important;
+                    -webkit-transform: translateZ(0) !important;
+                    transform: translateZ(0) !important;
+                }
+                /* Day column in header row 3 - needs both top and left */
+                .calendar-container table tbody tr.header-row-3 td:nth-child(2) {
+                    position: -webkit-sticky !important;
+                    position: sticky !important;
+                    top: 64px !important;
+                    left: 140px !important;
+                    z-index: 10 !important;
+                    background: #93c5fd !important;
+                    color: #1e40af !important;
+                    -webkit-transform: translateZ(0) !important;
+                    transform: translateZ(0) !important;
+                }
+                /* In compact mode, adjust top position since we hide row 1 and 3 */
+                .calendar-container.compact-mode table tbody tr.header-row-2 td {
+                    top: 0 !important;
+                    z-index: 100 !important;
+                }
+                .calendar-container.compact-mode table tbody tr.header-row-2 td:first-child {
+                    top: 0 !important;
+                    left: 0 !important;
+                    z-index: 15 !important;
+                }
+                .calendar-container.compact-mode table tbody tr.header-row-2 td:nth-child(2) {
+                    top: 0 !important;
+                    left: 80px !important;
+                    z-index: 14 !important;
+                }
+                .calendar-container table th {
+                    font-weight: 600;
+                }
+                .calendar-container table td,
+                .calendar-container table th {
+                    white-space: nowrap;
+                }
+    """
+    
+    html_doc = f"""
+    <!DOCTYPE html>
+    <html>
+        <head>
+            <meta charset="utf-8">
+            <style>
+                /* Prevent iframe body/html from scrolling - only .calendar-container should scroll */
+                html, body {{
+                    margin: 0;
+                    padding: 0;
+                    overflow: hidden !important;
+                    height: 100%;
+                    width: 100%;
+                }}
+                
+                .calendar-container {{
+                    height: 800px;
+                    max-height: 800px;
+                    overflow-y: auto;
+                    overflow-x: auto;
+                    -webkit-overflow-scrolling: touch;
+                    border: 1px solid #ddd;
+                    position: relative;
+                    /* Ensure this is the scrolling container for sticky positioning */
+                    display: block;
+                    /* Safari: Create stacking context for proper sticky positioning */
+                    isolation: isolate;
+                    /* Reserve space for scrollbars when shown */
+                    scrollbar-gutter: stable both-edges;
+                }}
+                
+                /* Show scrollbars always when class is applied */
+                .calendar-container.show-scrollbars {{
+                    overflow-y: scroll !important;
+                    overflow-x: scroll !important;
+                }}
+                
+                /* Make scrollbars more visible - especially on Mac */
+                .calendar-container.show-scrollbars::-webkit-scrollbar {{
+                    width: 12px !important;
+                    height: 12px !important;
+                }}
+                
+                .calendar-container.show-scrollbars::-webkit-scrollbar-track {{
+                    background: #f1f1f1 !important;
+                    border-radius: 4px !important;
+                }}
                 
-            if '<tr' in line:
-                is_data_row = '<td>' in line
-                is_header_row = '<th>' in line and not is_data_row
+                .calendar-container.show-scrollbars::-webkit-scrollbar-thumb {{
+                    background: #888 !important;
+                    border-radius: 4px !important;
+                }}
                 
-                if is_header_row and in_thead:
-                    # Remove index column from pandas-generated header row
-                    # Look for empty first <th> or <th></th> and remove it
-                    line = re.sub(r'<th[^>]*></th>\s*', '', line, count=1)
-                    modified_html_lines.append(line)
-                    continue
+                .calendar-container.show-scrollbars::-webkit-scrollbar-thumb:hover {{
+                    background: #555 !important;
+                }}
                 
-                if is_data_row and header_rows_assigned < 3:
-                    data_row_counter += 1
-                    header_rows_assigned += 1
-                    # Add tooltips to header cells
-                    if column_names:
-                        td_matches = list(re.finditer(r'<td[^>]*>(.*?)</td>', line))
-                        th_matches = list(re.finditer(r'<th[^>]*>(.*?)</th>', line))
-                        matches = th_matches if th_matches else td_matches
+                /* For Firefox - ensure scrollbars are always visible */
+                .calendar-container.show-scrollbars {{
+                    scrollbar-width: auto !important;
+                    scrollbar-color: #888 #f1f1f1 !important;
+                }}
+                
+                /* Ensure sticky works - parent must have defined height */
+                .calendar-container table {{
+                    position: relative;
+                }}
+                {sticky_css}
+                {compact_css}
+                {cell_css}
+            </style>
+        </head>
+        <body style="margin: 0; padding: 0; overflow: hidden;">
+            <div class="calendar-container{' compact-mode' if compact_mode else ''}{' show-scrollbars' if show_scrollbars else ''}" id="calendar-scroll-container">
+                {table_html}
+            </div>
+            <script>
+                // Force sticky headers to work - apply styles directly via JavaScript
+                function applyStickyStyles() {{
+                    try {{
+                        const container = document.getElementById('calendar-scroll-container');
+                        if (!container) {{
+                            console.warn('Calendar container not found');
+                            return;
+                        }}
                         
-                        if matches:
-                            new_line = line
-                            for idx, match in enumerate(matches):
-                                if idx < len(column_names):
-                                    col_name = column_names[idx]
-                                    tooltip = _get_header_tooltip(col_name, site_column_mapping)
-                                    if tooltip:
-                                        # Add title attribute
-                                        tag_content = match.group(0)
-                                        if 'title=' not in tag_content:
-                                            new_line = new_line.replace(
-                                                tag_content,
-                                                tag_content.replace('>', f' title="{tooltip}">', 1),
-                                                1
-                                            )
-                            line = new_line
-                    
-                    # Add class to row
-                    line = line.replace('<tr', f'<tr class="header-row-{header_rows_assigned}"', 1)
-                    
-                    # Add inline sticky style to each td/th in this header row
-                    top_value = (header_rows_assigned - 1) * 32
-                    if compact_mode and header_rows_assigned == 2:
-                        top_value = 0  # In compact mode, row 2 is at top
-                    z_index = 100 if header_rows_assigned == 1 else (99 if header_rows_assigned == 2 else 98)
-                    
-                    # Set header row colors based on level
-                    if header_rows_assigned == 1:
-                        # Level 1: Visit sites - Dark blue background, white text
-                        bg_color = "#1e40af"
-                        text_color = "#ffffff"
-                        font_weight = "bold"
-                        font_size = "14px"
-                    elif header_rows_assigned == 2:
-                        # Level 2: Study_Patient - Medium blue background, white text
-                        bg_color = "#3b82f6"
-                        text_color = "#ffffff"
-                        font_weight = "bold"
-                        font_size = "12px"
-                    else:
-                        # Level 3: Origin sites - Light blue background, dark blue text
-                        bg_color = "#93c5fd"
-                        text_color = "#1e40af"
-                        font_weight = "normal"
-                        font_size = "10px"
-                    
-                    # Add sticky styles to each td/th - handle both tags
-                    def add_sticky_style(match):
-                        tag_name = match.group(1)  # 'td' or 'th'
-                        tag_attrs = match.group(2)
+                        // Verify container is scrollable
+                        const containerStyle = window.getComputedStyle(container);
+                        console.log('Container overflow-y:', containerStyle.overflowY);
+                        console.log('Container height:', containerStyle.height);
+                        console.log('Container scrollHeight:', container.scrollHeight);
                         
-                        # Build sticky style string - use !important to override any existing styles
-                        sticky_style = f'position: -webkit-sticky !important; position: sticky !important; top: {top_value}px !important; z-index: {z_index} !important; background: {bg_color} !important; color: {text_color} !important; font-weight: {font_weight} !important; font-size: {font_size} !important; text-align: center !important; border: 1px solid #ccc !important; box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1) !important;'
+                        // Ensure table has border-collapse: separate for sticky to work
+                        const table = container.querySelector('table');
+                        if (table) {{
+                            table.style.setProperty('border-collapse', 'separate', 'important');
+                            table.style.setProperty('border-spacing', '0', 'important');
+                        }}
                         
-                        # Always inject style attribute - replace if exists, add if not
-                        if 'style=' in tag_attrs:
-                            # Replace existing style attribute completely with our sticky style
-                            tag_attrs = re.sub(
-                                r'style="[^"]*"',
-                                f'style="{sticky_style}"',
-                                tag_attrs
-                            )
-                        else:
-                            # Add new style attribute
-                            tag_attrs = f'{tag_attrs} style="{sticky_style}"'
+                        const isCompact = container.classList.contains('compact-mode');
                         
-                        return f'<{tag_name}{tag_attrs}>'
-                    
-                    # Match both <td> and <th> tags
-                    line = re.sub(r'<(td|th)([^>]*)>', add_sticky_style, line)
-                    
-                    modified_html_lines.append(line)
-                    continue
-                
-                # Process data rows - add tooltips and compact mode
-                if is_data_row:
-                    data_row_counter += 1
-                
-                if column_names:
-                    # Extract date from first cell (UK format: DD/MM/YYYY)
-                    date_match = re.search(r'<td[^>]*>(\d{2}/\d{2}/\d{4})</td>', line)
-                    date_str = date_match.group(1) if date_match else None
-                    
-                    # Process each cell - work backwards to avoid index shifting
-                    td_matches = list(re.finditer(r'<td[^>]*>(.*?)</td>', line))
-                    if td_matches and len(column_names) > 0:
-                        new_line = line
-                        # Process in reverse to avoid index issues when replacing
-                        for idx in range(len(td_matches) - 1, -1, -1):
-                            if idx < len(column_names):
-                                col_name = column_names[idx]
-                                match = td_matches[idx]
-                                cell_content = match.group(1)
-                                
-                                # Skip Date and Day columns
-                                if col_name in ['Date', 'Day']:
-                                    continue
+                        // Process all header rows
+                        const row1 = container.querySelector('tr.header-row-1');
+                        const row2 = container.querySelector('tr.header-row-2');
+                        const row3 = container.querySelector('tr.header-row-3');
+                        
+                        console.log('Found header rows - row1:', !!row1, 'row2:', !!row2, 'row3:', !!row3);
+                        
+                        // Row 1: top 0, z-index 100, dark blue background, white text
+                        if (row1 && !isCompact) {{
+                            const cells = row1.querySelectorAll('td, th');
+                            console.log('Applying sticky to row1, cells:', cells.length);
+                            cells.forEach((cell, idx) => {{
+                                // Safari needs -webkit-sticky set via JavaScript too
+                                cell.style.setProperty('position', '-webkit-sticky', 'important');
+                                cell.style.setProperty('position', 'sticky', 'important');
+                                cell.style.setProperty('top', '0px', 'important');
+                                cell.style.setProperty('z-index', '100', 'important');
+                                cell.style.setProperty('background', '#1e40af', 'important');
+                                cell.style.setProperty('color', '#ffffff', 'important');
+                                cell.style.setProperty('font-weight', 'bold', 'important');
+                                // Safari optimization - force GPU acceleration
+                                cell.style.setProperty('-webkit-transform', 'translateZ(0)', 'important');
+                                cell.style.setProperty('transform', 'translateZ(0)', 'important');
+                                // Verify it was set
+                                if (idx === 0) {{
+                                    const computed = window.getComputedStyle(cell);
+                                    console.log('Row1 cell0 position:', computed.position, 'top:', computed.top);
+                                }}
+                            }});
+                        }}
+                        
+                        // Row 2: top 0 (compact) or 32px (normal), z-index 99/100, medium blue background, white text
+                        if (row2) {{
+                            const cells = row2.querySelectorAll('td, th');
+                            const topValue = isCompact ? '0px' : '32px';
+                            const zIndex = isCompact ? '100' : '99';
+                            console.log('Applying sticky to row2, cells:', cells.length, 'top:', topValue);
+                            cells.forEach((cell, idx) => {{
+                                // Safari needs -webkit-sticky
+                                cell.style.setProperty('position', '-webkit-sticky', 'important');
+                                cell.style.setProperty('position', 'sticky', 'important');
+                                cell.style.setProperty('top', topValue, 'important');
+                                cell.style.setProperty('z-index', zIndex, 'important');
+                                cell.style.setProperty('background', '#3b82f6', 'important');
+                                cell.style.setProperty('color', '#ffffff', 'important');
+                                cell.style.setProperty('font-weight', 'bold', 'important');
+                                // Safari optimization
+                                cell.style.setProperty('-webkit-transform', 'translateZ(0)', 'important');
+                                cell.style.setProperty('transform', 'translateZ(0)', 'important');
+                                // Verify it was set
+                                if (idx === 0) {{
+                                    const computed = window.getComputedStyle(cell);
+                                    console.log('Row2 cell0 position:', computed.position, 'top:', computed.top);
+                                }}
+                            }});
+                        }}
+                        
+                        // Row 3: top 64px, z-index 98, light blue background, dark blue text (only in normal mode)
+                        if (row3 && !isCompact) {{
+                            const cells = row3.querySelectorAll('td, th');
+                            console.log('Applying sticky to row3, cells:', cells.length);
+                            cells.forEach((cell, idx) => {{
+                                // Safari needs -webkit-sticky
+                                cell.style.setProperty('position', '-webkit-sticky', 'important');
+                                cell.style.setProperty('position', 'sticky', 'important');
+                                cell.style.setProperty('top', '64px', 'important');
+                                cell.style.setProperty('z-index', '98', 'important');
+                                cell.style.setProperty('background', '#93c5fd', 'important');
+                                cell.style.setProperty('color', '#1e40af', 'important');
+                                cell.style.setProperty('font-weight', 'normal', 'important');
+                                // Safari optimization
+                                cell.style.setProperty('-webkit-transform', 'translateZ(0)', 'important');
+                                cell.style.setProperty('transform', 'translateZ(0)', 'important');
+                                // Verify it was set
+                                if (idx === 0) {{
+                                    const computed = window.getComputedStyle(cell);
+                                    console.log('Row3 cell0 position:', computed.position, 'top:', computed.top);
+                                }}
+                            }});
+                        }}
+                        
+                        // Also ensure Date and Day columns are sticky on the left
+                        const allRows = container.querySelectorAll('tr');
+                        allRows.forEach(row => {{
+                            const cells = row.querySelectorAll('td, th');
+                            if (cells.length >= 2) {{
+                                // First column (Date) - sticky left at 0
+                                cells[0].style.setProperty('position', '-webkit-sticky', 'important');
+                                cells[0].style.setProperty('position', 'sticky', 'important');
+                                cells[0].style.setProperty('left', '0px', 'important');
+                                cells[0].style.setProperty('z-index', '10', 'important');
+                                cells[0].style.setProperty('-webkit-transform', 'translateZ(0)', 'important');
+                                cells[0].style.setProperty('transform', 'translateZ(0)', 'important');
                                 
-                                # Compact mode: convert to icon
-                                if compact_mode:
-                                    icon_content = _convert_to_compact_icon(cell_content)
-                                    if icon_content != cell_content:
-                                        # Replace the cell content
-                                        old_tag = match.group(0)
-                                        new_tag = old_tag.replace(cell_content, icon_content, 1)
-                                        new_line = new_line.replace(old_tag, new_tag, 1)
-                                        cell_content = icon_content
+                                // Second column (Day) - sticky left at 140px
+                                const dayLeft = isCompact ? '80px' : '140px';
+                                cells[1].style.setProperty('position', '-webkit-sticky', 'important');
+                                cells[1].style.setProperty('position', 'sticky', 'important');
+                                cells[1].style.setProperty('left', dayLeft, 'important');
+                                cells[1].style.setProperty('z-index', '10', 'important');
+                                cells[1].style.setProperty('-webkit-transform', 'translateZ(0)', 'important');
+                                cells[1].style.setProperty('transform', 'translateZ(0)', 'important');
                                 
-                                # Add tooltip
-                                tooltip = _get_visit_tooltip(cell_content, col_name, site_column_mapping, date_str)
-                                if tooltip:
-                                    tag_content = match.group(0)
-                                    if 'title=' not in tag_content:
-                                        # Escape quotes in tooltip
-                                        tooltip_escaped = tooltip.replace('"', '&quot;')
-                                        # Find position to insert title attribute
-                                        if 'style=' in tag_content:
-                                            # Insert before style attribute
-                                            new_tag = tag_content.replace('style=', f'title="{tooltip_escaped}" style=', 1)
-                                        else:
-                                            # Insert before closing >
-                                            new_tag = tag_content.replace('>', f' title="{tooltip_escaped}">', 1)
-                                        new_line = new_line.replace(tag_content, new_tag, 1)
-                        line = new_line
-                    
-                # Add month separators (skip for header rows)
-                if data_row_counter > 3:
-                    date_pattern = r'<td>(\d{4}-\d{2}-\d{2})</td>'
-                    match = re.search(date_pattern, line)
-                    if match:
-                        try:
-                            date_obj = pd.to_datetime(match.group(1))
-                            current_month = date_obj.to_period('M')
-
-                            if prev_month is not None and current_month != prev_month:
-                                col_count = line.count('<td>')
-                                separator_line = f'<tr style="border-top: 3px solid #3b82f6; background-color: #eff6ff;"><td colspan="{col_count}" style="text-align: center; font-weight: bold; color: #1e40af; padding: 2px;">{current_month}</td></tr>'
-                                modified_html_lines.append(separator_line)
-
-                            prev_month = current_month
-                        except:
-                            pass
-
-            modified_html_lines.append(line)
-
-        html_table_with_features = '\n'.join(modified_html_lines)
-        
-        from textwrap import dedent
-        compact_css = ""
-        if compact_mode:
-            compact_css = """
-                    .calendar-container table {
-                        table-layout: fixed;
-                    }
-                    /* Hide level 1 and level 3 headers in compact mode, show only patient IDs */
-                    .calendar-container table tbody tr.header-row-1,
-                    .calendar-container table tbody tr.header-row-3 {
-                        display: none !important;
-                    }
-                    /* Make all columns narrow in compact mode */
-                    .calendar-container table tbody tr.header-row-2 td,
-                    .calendar-container table tbody td {
-                        width: 40px !important;
-                        min-width: 40px !important;
-                        max-width: 40px !important;
-                        padding: 2px !important;
-                        font-size: 10px !important;
-                        text-align: center !important;
-                        overflow: hidden !important;
-                        text-overflow: ellipsis !important;
-                    }
-                    /* Date column slightly wider but still compact */
-                    .calendar-container table tbody tr.header-row-2 td:first-child,
-                    .calendar-container table tbody td:first-child {
-                        width: 80px !important;
-                        min-width: 80px !important;
-                        max-width: 80px !important;
-                    }
-                    /* Day column slightly wider but still compact */
-                    .calendar-container table tbody tr.header-row-2 td:nth-child(2),
-                    .calendar-container table tbody td:nth-child(2) {
-                        width: 50px !important;
-                        min-width: 50px !important;
-                        max-width: 50px !important;
-                    }
-            """
-        
-        sticky_css = """
-                    .calendar-container table {
-                        border-collapse: separate !important;
-                        border-spacing: 0 !important;
-                        width: 100%;
-                    }
-                    .calendar-container table thead {
-                        display: none !important;
-                    }
-                    .calendar-container table th,
-                    .calendar-container table td {
-                        border: 1px solid #dee2e6;
-                        padding: 6px;
-                        background: #ffffff;
-                    }
-                    /* Date column (first column) - sticky for all rows */
-                    .calendar-container table td:first-child,
-                    .calendar-container table th:first-child {
-                        position: -webkit-sticky;
-                        position: sticky;
-                        left: 0;
-                        z-index: 5;
-                        background: #f0f4f8;
-                        min-width: 140px;
-                        width: 140px;
-                        -webkit-transform: translateZ(0);
-                        transform: translateZ(0);
-                    }
-                    /* Day column (second column) - sticky for all rows */
-                    .calendar-container table td:nth-child(2),
-                    .calendar-container table th:nth-child(2) {
-                        position: -webkit-sticky;
-                        position: sticky;
-                        left: 140px;
-                        z-index: 5;
-                        background: #f6f8fb;
-                        min-width: 120px;
-                        width: 120px;
-                        -webkit-transform: translateZ(0);
-                        transform: translateZ(0);
-                    }
-                    /* Sticky headers - must combine top and left for Date/Day columns */
-                    .calendar-container table tbody tr.header-row-1 td {
-                        position: -webkit-sticky !important;
-                        position: sticky !important;
-                        top: 0 !important;
-                        z-index: 100 !important;
-                        background: #1e40af !important;
-                        color: #ffffff !important;
-                        font-weight: bold !important;
-                        font-size: 14px !important;
-                        text-align: center !important;
-                        box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1) !important;
-                        -webkit-transform: translateZ(0) !important;
-                        transform: translateZ(0) !important;
-                    }
-                    /* Date column in header row 1 - needs both top and left */
-                    .calendar-container table tbody tr.header-row-1 td:first-child {
-                        position: -webkit-sticky !important;
-                        position: sticky !important;
-                        top: 0 !important;
-                        left: 0 !important;
-                        z-index: 15 !important;
-                        background: #1e40af !important;
-                        color: #ffffff !important;
-                        -webkit-transform: translateZ(0) !important;
-                        transform: translateZ(0) !important;
-                    }
-                    /* Day column in header row 1 - needs both top and left */
-                    .calendar-container table tbody tr.header-row-1 td:nth-child(2) {
-                        position: -webkit-sticky !important;
-                        position: sticky !important;
-                        top: 0 !important;
-                        left: 140px !important;
-                        z-index: 14 !important;
-                        background: #1e40af !important;
-                        color: #ffffff !important;
-                        -webkit-transform: translateZ(0) !important;
-                        transform: translateZ(0) !important;
-                    }
-                    .calendar-container table tbody tr.header-row-2 td {
-                        position: -webkit-sticky !important;
-                        position: sticky !important;
-                        top: 32px !important;
-                        z-index: 99 !important;
-                        background: #3b82f6 !important;
-                        color: #ffffff !important;
-                        font-weight: bold !important;
-                        font-size: 12px !important;
-                        text-align: center !important;
-                        box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1) !important;
-                        -webkit-transform: translateZ(0) !important;
-                        transform: translateZ(0) !important;
-                    }
-                    /* Date column in header row 2 - needs both top and left */
-                    .calendar-container table tbody tr.header-row-2 td:first-child {
-                        position: -webkit-sticky !important;
-                        position: sticky !important;
-                        top: 32px !important;
-                        left: 0 !important;
-                        z-index: 13 !important;
-                        background: #3b82f6 !important;
-                        color: #ffffff !important;
-                        -webkit-transform: translateZ(0) !important;
-                        transform: translateZ(0) !important;
-                    }
-                    /* Day column in header row 2 - needs both top and left */
-                    .calendar-container table tbody tr.header-row-2 td:nth-child(2) {
-                        position: -webkit-sticky !important;
-                        position: sticky !important;
-                        top: 32px !important;
-                        left: 140px !important;
-                        z-index: 12 !important;
-                        background: #3b82f6 !important;
-                        color: #ffffff !important;
-                        -webkit-transform: translateZ(0) !important;
-                        transform: translateZ(0) !important;
-                    }
-                    .calendar-container table tbody tr.header-row-3 td {
-                        position: -webkit-sticky !important;
-                        position: sticky !important;
-                        top: 64px !important;
-                        z-index: 98 !important;
-                        background: #93c5fd !important;
-                        color: #1e40af !important;
-                        font-weight: normal !important;
-                        font-size: 10px !important;
-                        text-align: center !important;
-                        box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1) !important;
-                        -webkit-transform: translateZ(0) !important;
-                        transform: translateZ(0) !important;
-                    }
-                    /* Date column in header row 3 - needs both top and left */
-                    .calendar-container table tbody tr.header-row-3 td:first-child {
-                        position: -webkit-sticky !important;
-                        position: sticky !important;
-                        top: 64px !important;
-                        left: 0 !important;
-                        z-index: 11 !important;
-                        background: #93c5fd !important;
-                        color: #1e40af !important;
-                        -webkit-transform: translateZ(0) !important;
-                        transform: translateZ(0) !important;
-                    }
-                    /* Day column in header row 3 - needs both top and left */
-                    .calendar-container table tbody tr.header-row-3 td:nth-child(2) {
-                        position: -webkit-sticky !important;
-                        position: sticky !important;
-                        top: 64px !important;
-                        left: 140px !important;
-                        z-index: 10 !important;
-                        background: #93c5fd !important;
-                        color: #1e40af !important;
-                        -webkit-transform: translateZ(0) !important;
-                        transform: translateZ(0) !important;
-                    }
-                    /* In compact mode, adjust top position since we hide row 1 and 3 */
-                    .calendar-container.compact-mode table tbody tr.header-row-2 td {
-                        top: 0 !important;
-                        z-index: 100 !important;
-                    }
-                    .calendar-container.compact-mode table tbody tr.header-row-2 td:first-child {
-                        top: 0 !important;
-                        left: 0 !important;
-                        z-index: 15 !important;
-                    }
-                    .calendar-container.compact-mode table tbody tr.header-row-2 td:nth-child(2) {
-                        top: 0 !important;
-                        left: 80px !important;
-                        z-index: 14 !important;
-                    }
-                    .calendar-container table th {
-                        font-weight: 600;
-                    }
-                    .calendar-container table td,
-                    .calendar-container table th {
-                        white-space: nowrap;
-                    }
-        """
-        
-        html_doc = f"""
-        <!DOCTYPE html>
-        <html>
-            <head>
-                <meta charset="utf-8">
-                <style>
-                    /* Prevent iframe body/html from scrolling - only .calendar-container should scroll */
-                    html, body {{
-                        margin: 0;
-                        padding: 0;
-                        overflow: hidden !important;
-                        height: 100%;
-                        width: 100%;
-                    }}
-                    
-                    .calendar-container {{
-                        height: 800px;
-                        max-height: 800px;
-                        overflow-y: auto;
-                        overflow-x: auto;
-                        -webkit-overflow-scrolling: touch;
-                        border: 1px solid #ddd;
-                        position: relative;
-                        /* Ensure this is the scrolling container for sticky positioning */
-                        display: block;
-                        /* Safari: Create stacking context for proper sticky positioning */
-                        isolation: isolate;
-                        /* Reserve space for scrollbars when shown */
-                        scrollbar-gutter: stable both-edges;
-                    }}
-                    
-                    /* Show scrollbars always when class is applied */
-                    .calendar-container.show-scrollbars {{
-                        overflow-y: scroll !important;
-                        overflow-x: scroll !important;
-                    }}
-                    
-                    /* Make scrollbars more visible - especially on Mac */
-                    .calendar-container.show-scrollbars::-webkit-scrollbar {{
-                        width: 12px !important;
-                        height: 12px !important;
-                    }}
-                    
-                    .calendar-container.show-scrollbars::-webkit-scrollbar-track {{
-                        background: #f1f1f1 !important;
-                        border-radius: 4px !important;
-                    }}
-                    
-                    .calendar-container.show-scrollbars::-webkit-scrollbar-thumb {{
-                        background: #888 !important;
-                        border-radius: 4px !important;
-                    }}
-                    
-                    .calendar-container.show-scrollbars::-webkit-scrollbar-thumb:hover {{
-                        background: #555 !important;
-                    }}
-                    
-                    /* For Firefox - ensure scrollbars are always visible */
-                    .calendar-container.show-scrollbars {{
-                        scrollbar-width: auto !important;
-                        scrollbar-color: #888 #f1f1f1 !important;
-                    }}
-                    
-                    /* Ensure sticky works - parent must have defined height */
-                    .calendar-container table {{
-                        position: relative;
-                    }}
-                    {sticky_css}
-                    {compact_css}
-                </style>
-            </head>
-            <body style="margin: 0; padding: 0; overflow: hidden;">
-                <div class="calendar-container{' compact-mode' if compact_mode else ''}{' show-scrollbars' if show_scrollbars else ''}" id="calendar-scroll-container">
-                    {html_table_with_features}
-                </div>
-                <script>
-                    // Force sticky headers to work - apply styles directly via JavaScript
-                    function applyStickyStyles() {{
-                        try {{
-                            const container = document.getElementById('calendar-scroll-container');
-                            if (!container) {{
-                                console.warn('Calendar container not found');
-                                return;
-                            }}
-                            
-                            // Verify container is scrollable
-                            const containerStyle = window.getComputedStyle(container);
-                            console.log('Container overflow-y:', containerStyle.overflowY);
-                            console.log('Container height:', containerStyle.height);
-                            console.log('Container scrollHeight:', container.scrollHeight);
-                            
-                            // Ensure table has border-collapse: separate for sticky to work
-                            const table = container.querySelector('table');
-                            if (table) {{
-                                table.style.setProperty('border-collapse', 'separate', 'important');
-                                table.style.setProperty('border-spacing', '0', 'important');
-                            }}
-                            
-                            const isCompact = container.classList.contains('compact-mode');
-                            
-                            // Process all header rows
-                            const row1 = container.querySelector('tr.header-row-1');
-                            const row2 = container.querySelector('tr.header-row-2');
-                            const row3 = container.querySelector('tr.header-row-3');
-                            
-                            console.log('Found header rows - row1:', !!row1, 'row2:', !!row2, 'row3:', !!row3);
-                            
-                            // Row 1: top 0, z-index 100, dark blue background, white text
-                            if (row1 && !isCompact) {{
-                                const cells = row1.querySelectorAll('td, th');
-                                console.log('Applying sticky to row1, cells:', cells.length);
-                                cells.forEach((cell, idx) => {{
-                                    // Safari needs -webkit-sticky set via JavaScript too
-                                    cell.style.setProperty('position', '-webkit-sticky', 'important');
-                                    cell.style.setProperty('position', 'sticky', 'important');
-                                    cell.style.setProperty('top', '0px', 'important');
-                                    cell.style.setProperty('z-index', '100', 'important');
-                                    cell.style.setProperty('background', '#1e40af', 'important');
-                                    cell.style.setProperty('color', '#ffffff', 'important');
-                                    cell.style.setProperty('font-weight', 'bold', 'important');
-                                    // Safari optimization - force GPU acceleration
-                                    cell.style.setProperty('-webkit-transform', 'translateZ(0)', 'important');
-                                    cell.style.setProperty('transform', 'translateZ(0)', 'important');
-                                    // Verify it was set
-                                    if (idx === 0) {{
-                                        const computed = window.getComputedStyle(cell);
-                                        console.log('Row1 cell0 position:', computed.position, 'top:', computed.top);
-                                    }}
-                                }});
-                            }}
-                            
-                            // Row 2: top 0 (compact) or 32px (normal), z-index 99/100, medium blue background, white text
-                            if (row2) {{
-                                const cells = row2.querySelectorAll('td, th');
-                                const topValue = isCompact ? '0px' : '32px';
-                                const zIndex = isCompact ? '100' : '99';
-                                console.log('Applying sticky to row2, cells:', cells.length, 'top:', topValue);
-                                cells.forEach((cell, idx) => {{
-                                    // Safari needs -webkit-sticky
-                                    cell.style.setProperty('position', '-webkit-sticky', 'important');
-                                    cell.style.setProperty('position', 'sticky', 'important');
-                                    cell.style.setProperty('top', topValue, 'important');
-                                    cell.style.setProperty('z-index', zIndex, 'important');
-                                    cell.style.setProperty('background', '#3b82f6', 'important');
-                                    cell.style.setProperty('color', '#ffffff', 'important');
-                                    cell.style.setProperty('font-weight', 'bold', 'important');
-                                    // Safari optimization
-                                    cell.style.setProperty('-webkit-transform', 'translateZ(0)', 'important');
-                                    cell.style.setProperty('transform', 'translateZ(0)', 'important');
-                                    // Verify it was set
-                                    if (idx === 0) {{
-                                        const computed = window.getComputedStyle(cell);
-                                        console.log('Row2 cell0 position:', computed.position, 'top:', computed.top);
-                                    }}
-                                }});
-                            }}
-                            
-                            // Row 3: top 64px, z-index 98, light blue background, dark blue text (only in normal mode)
-                            if (row3 && !isCompact) {{
-                                const cells = row3.querySelectorAll('td, th');
-                                console.log('Applying sticky to row3, cells:', cells.length);
-                                cells.forEach((cell, idx) => {{
-                                    // Safari needs -webkit-sticky
-                                    cell.style.setProperty('position', '-webkit-sticky', 'important');
-                                    cell.style.setProperty('position', 'sticky', 'important');
-                                    cell.style.setProperty('top', '64px', 'important');
-                                    cell.style.setProperty('z-index', '98', 'important');
-                                    cell.style.setProperty('background', '#93c5fd', 'important');
-                                    cell.style.setProperty('color', '#1e40af', 'important');
-                                    cell.style.setProperty('font-weight', 'normal', 'important');
-                                    // Safari optimization
-                                    cell.style.setProperty('-webkit-transform', 'translateZ(0)', 'important');
-                                    cell.style.setProperty('transform', 'translateZ(0)', 'important');
-                                    // Verify it was set
-                                    if (idx === 0) {{
-                                        const computed = window.getComputedStyle(cell);
-                                        console.log('Row3 cell0 position:', computed.position, 'top:', computed.top);
-                                    }}
-                                }});
-                            }}
-                            
-                            // Also ensure Date and Day columns are sticky on the left
-                            const allRows = container.querySelectorAll('tr');
-                            allRows.forEach(row => {{
-                                const cells = row.querySelectorAll('td, th');
-                                if (cells.length >= 2) {{
-                                    // First column (Date) - sticky left at 0
-                                    cells[0].style.setProperty('position', '-webkit-sticky', 'important');
-                                    cells[0].style.setProperty('position', 'sticky', 'important');
-                                    cells[0].style.setProperty('left', '0px', 'important');
-                                    cells[0].style.setProperty('z-index', '10', 'important');
-                                    cells[0].style.setProperty('-webkit-transform', 'translateZ(0)', 'important');
-                                    cells[0].style.setProperty('transform', 'translateZ(0)', 'important');
-                                    
-                                    // Second column (Day) - sticky left at 140px
-                                    const dayLeft = isCompact ? '80px' : '140px';
-                                    cells[1].style.setProperty('position', '-webkit-sticky', 'important');
-                                    cells[1].style.setProperty('position', 'sticky', 'important');
-                                    cells[1].style.setProperty('left', dayLeft, 'important');
+                                // For header rows, increase z-index for intersection and apply header colors
+                                if (row.classList.contains('header-row-1')) {{
+                                    cells[0].style.setProperty('z-index', '15', 'important');
+                                    cells[0].style.setProperty('background', '#1e40af', 'important');
+                                    cells[0].style.setProperty('color', '#ffffff', 'important');
+                                    cells[1].style.setProperty('z-index', '14', 'important');
+                                    cells[1].style.setProperty('background', '#1e40af', 'important');
+                                    cells[1].style.setProperty('color', '#ffffff', 'important');
+                                }} else if (row.classList.contains('header-row-2')) {{
+                                    cells[0].style.setProperty('z-index', '13', 'important');
+                                    cells[0].style.setProperty('background', '#3b82f6', 'important');
+                                    cells[0].style.setProperty('color', '#ffffff', 'important');
+                                    cells[1].style.setProperty('z-index', '12', 'important');
+                                    cells[1].style.setProperty('background', '#3b82f6', 'important');
+                                    cells[1].style.setProperty('color', '#ffffff', 'important');
+                                }} else if (row.classList.contains('header-row-3')) {{
+                                    cells[0].style.setProperty('z-index', '11', 'important');
+                                    cells[0].style.setProperty('background', '#93c5fd', 'important');
+                                    cells[0].style.setProperty('color', '#1e40af', 'important');
                                     cells[1].style.setProperty('z-index', '10', 'important');
-                                    cells[1].style.setProperty('-webkit-transform', 'translateZ(0)', 'important');
-                                    cells[1].style.setProperty('transform', 'translateZ(0)', 'important');
-                                    
-                                    // For header rows, increase z-index for intersection and apply header colors
-                                    if (row.classList.contains('header-row-1')) {{
-                                        cells[0].style.setProperty('z-index', '15', 'important');
-                                        cells[0].style.setProperty('background', '#1e40af', 'important');
-                                        cells[0].style.setProperty('color', '#ffffff', 'important');
-                                        cells[1].style.setProperty('z-index', '14', 'important');
-                                        cells[1].style.setProperty('background', '#1e40af', 'important');
-                                        cells[1].style.setProperty('color', '#ffffff', 'important');
-                                    }} else if (row.classList.contains('header-row-2')) {{
-                                        cells[0].style.setProperty('z-index', '13', 'important');
-                                        cells[0].style.setProperty('background', '#3b82f6', 'important');
-                                        cells[0].style.setProperty('color', '#ffffff', 'important');
-                                        cells[1].style.setProperty('z-index', '12', 'important');
-                                        cells[1].style.setProperty('background', '#3b82f6', 'important');
-                                        cells[1].style.setProperty('color', '#ffffff', 'important');
-                                    }} else if (row.classList.contains('header-row-3')) {{
-                                        cells[0].style.setProperty('z-index', '11', 'important');
-                                        cells[0].style.setProperty('background', '#93c5fd', 'important');
-                                        cells[0].style.setProperty('color', '#1e40af', 'important');
-                                        cells[1].style.setProperty('z-index', '10', 'important');
-                                        cells[1].style.setProperty('background', '#93c5fd', 'important');
-                                        cells[1].style.setProperty('color', '#1e40af', 'important');
-                                    }}
+                                    cells[1].style.setProperty('background', '#93c5fd', 'important');
+                                    cells[1].style.setProperty('color', '#1e40af', 'important');
                                 }}
-                            }});
-                            
-                            console.log('Applied sticky styles to header rows and fixed columns');
-                        }} catch (error) {{
-                            console.error('Error applying sticky styles:', error);
-                        }}
-                    }}
-                    
-                    // Auto-scroll function - now uses UK date format and checks Date column (cells[0])
-                    function autoScrollToToday() {{
-                        try {{
-                            const scrollContainer = document.getElementById('calendar-scroll-container');
-                            if (!scrollContainer) {{
-                                console.log('Scroll container not found');
-                                return;
                             }}
+                        }});
+                        
+                        console.log('Applied sticky styles to header rows and fixed columns');
+                    }} catch (error) {{
+                        console.error('Error applying sticky styles:', error);
+                    }}
+                }}
+                
+                // Auto-scroll function - now uses UK date format and checks Date column (cells[0])
+                function autoScrollToToday() {{
+                    try {{
+                        const scrollContainer = document.getElementById('calendar-scroll-container');
+                        if (!scrollContainer) {{
+                            console.log('Scroll container not found');
+                            return;
+                        }}
+                        
+                        // Get today's date in UK format (DD/MM/YYYY)
+                        const today = new Date();
+                        const day = String(today.getDate()).padStart(2, '0');
+                        const month = String(today.getMonth() + 1).padStart(2, '0');
+                        const year = today.getFullYear();
+                        const todayUK = `${{day}}/${{month}}/${{year}}`;
+                        
+                        console.log('Looking for date:', todayUK);
+                        
+                        const rows = scrollContainer.getElementsByTagName('tr');
+                        console.log('Total rows:', rows.length);
+                        
+                        for (let i = 0; i < rows.length; i++) {{
+                            const cells = rows[i].getElementsByTagName('td');
                             
-                            // Get today's date in UK format (DD/MM/YYYY)
-                            const today = new Date();
-                            const day = String(today.getDate()).padStart(2, '0');
-                            const month = String(today.getMonth() + 1).padStart(2, '0');
-                            const year = today.getFullYear();
-                            const todayUK = `${{day}}/${{month}}/${{year}}`;
-                            
-                            console.log('Looking for date:', todayUK);
-                            
-                            const rows = scrollContainer.getElementsByTagName('tr');
-                            console.log('Total rows:', rows.length);
-                            
-                            for (let i = 0; i < rows.length; i++) {{
-                                const cells = rows[i].getElementsByTagName('td');
+                            // Date column is now cells[0] (first column)
+                            if (cells.length > 0) {{
+                                const cellText = cells[0].textContent || cells[0].innerText;
                                 
-                                // Date column is now cells[0] (first column)
-                                if (cells.length > 0) {{
-                                    const cellText = cells[0].textContent || cells[0].innerText;
+                                if (cellText.trim() === todayUK) {{
+                                    console.log('Found today at row:', i);
+                                    const rowTop = rows[i].offsetTop;
+                                    const containerHeight = scrollContainer.clientHeight;
+                                    const scrollPosition = rowTop - (containerHeight / 3);
+                                    scrollContainer.scrollTop = Math.max(0, scrollPosition);
+                                    console.log('Scrolled to position:', scrollPosition);
                                     
-                                    if (cellText.trim() === todayUK) {{
-                                        console.log('Found today at row:', i);
-                                        const rowTop = rows[i].offsetTop;
-                                        const containerHeight = scrollContainer.clientHeight;
-                                        const scrollPosition = rowTop - (containerHeight / 3);
-                                        scrollContainer.scrollTop = Math.max(0, scrollPosition);
-                                        console.log('Scrolled to position:', scrollPosition);
-                                        
-                                        // Save the scroll position to localStorage
-                                        setTimeout(function() {{
-                                            localStorage.setItem('calendar_scroll_position', scrollContainer.scrollTop.toString());
-                                        }}, 100);
-                                        break;
-                                    }}
+                                    // Save the scroll position to localStorage
+                                    setTimeout(function() {{
+                                        localStorage.setItem('calendar_scroll_position', scrollContainer.scrollTop.toString());
+                                    }}, 100);
+                                    break;
                                 }}
                             }}
-                        }} catch (error) {{
-                            console.error('Error in auto-scroll:', error);
                         }}
+                    }} catch (error) {{
+                        console.error('Error in auto-scroll:', error);
                     }}
-                    
-                    // Make function globally accessible for button click
-                    window.autoScrollToToday = autoScrollToToday;
-                    
-                    // Apply immediately and after delays to catch timing issues
+                }}
+                
+                // Make function globally accessible for button click
+                window.autoScrollToToday = autoScrollToToday;
+                
+                // Apply immediately and after delays to catch timing issues
+                applyStickyStyles();
+                setTimeout(applyStickyStyles, 50);
+                setTimeout(applyStickyStyles, 200);
+                setTimeout(function() {{
                     applyStickyStyles();
-                    setTimeout(applyStickyStyles, 50);
-                    setTimeout(applyStickyStyles, 200);
-                    setTimeout(function() {{
-                        applyStickyStyles();
-                    }}, 100);
-                    
-                    // Handle scrollbar visibility preference with localStorage
-                    function applyScrollbarPreference() {{
-                        try {{
-                            const container = document.getElementById('calendar-scroll-container');
-                            if (!container) {{
-                                return;
-                            }}
-                            
-                            // Server-side preference (from Streamlit session state) takes precedence
-                            // This value comes from the checkbox in the UI
-                            const serverPreference = {str(show_scrollbars).lower()};
-                            
-                            // Read preference from localStorage (for persistence across sessions)
-                            const storedPreference = localStorage.getItem('calendar_show_scrollbars');
-                            
-                            // Determine the preference: server value always takes precedence
-                            let shouldShowScrollbars = true;
-                            if (serverPreference === 'true') {{
-                                shouldShowScrollbars = true;
-                            }} else if (serverPreference === 'false') {{
-                                shouldShowScrollbars = false;
-                            }} else if (storedPreference !== null) {{
-                                // Fallback to localStorage if server preference is not set (shouldn't happen, but safe fallback)
-                                shouldShowScrollbars = storedPreference === 'true';
-                            }}
-                            
-                            // Apply the preference by adding/removing the class
-                            if (shouldShowScrollbars) {{
-                                container.classList.add('show-scrollbars');
-                                // Force scrollbars to be visible by setting overflow directly
-                                container.style.setProperty('overflow-y', 'scroll', 'important');
-                                container.style.setProperty('overflow-x', 'scroll', 'important');
-                            }} else {{
-                                container.classList.remove('show-scrollbars');
-                                container.style.setProperty('overflow-y', 'auto', 'important');
-                                container.style.setProperty('overflow-x', 'auto', 'important');
-                            }}
-                            
-                            // Save server preference to localStorage to persist across sessions
-                            localStorage.setItem('calendar_show_scrollbars', shouldShowScrollbars.toString());
-                            
-                            // Debug logging (can be removed later)
-                            console.log('Scrollbar preference applied:', shouldShowScrollbars, 'Server:', serverPreference, 'Stored:', storedPreference);
-                        }} catch (error) {{
-                            console.error('Error applying scrollbar preference:', error);
+                }}, 100);
+                
+                // Handle scrollbar visibility preference with localStorage
+                function applyScrollbarPreference() {{
+                    try {{
+                        const container = document.getElementById('calendar-scroll-container');
+                        if (!container) {{
+                            return;
                         }}
+                        
+                        // Server-side preference (from Streamlit session state) takes precedence
+                        // This value comes from the checkbox in the UI
+                        const serverPreference = {str(show_scrollbars).lower()};
+                        
+                        // Read preference from localStorage (for persistence across sessions)
+                        const storedPreference = localStorage.getItem('calendar_show_scrollbars');
+                        
+                        // Determine the preference: server value always takes precedence
+                        let shouldShowScrollbars = true;
+                        if (serverPreference === 'true') {{
+                            shouldShowScrollbars = true;
+                        }} else if (serverPreference === 'false') {{
+                            shouldShowScrollbars = false;
+                        }} else if (storedPreference !== null) {{
+                            // Fallback to localStorage if server preference is not set (shouldn't happen, but safe fallback)
+                            shouldShowScrollbars = storedPreference === 'true';
+                        }}
+                        
+                        // Apply the preference by adding/removing the class
+                        if (shouldShowScrollbars) {{
+                            container.classList.add('show-scrollbars');
+                            // Force scrollbars to be visible by setting overflow directly
+                            container.style.setProperty('overflow-y', 'scroll', 'important');
+                            container.style.setProperty('overflow-x', 'scroll', 'important');
+                        }} else {{
+                            container.classList.remove('show-scrollbars');
+                            container.style.setProperty('overflow-y', 'auto', 'important');
+                            container.style.setProperty('overflow-x', 'auto', 'important');
+                        }}
+                        
+                        // Save server preference to localStorage to persist across sessions
+                        localStorage.setItem('calendar_show_scrollbars', shouldShowScrollbars.toString());
+                        
+                        // Debug logging (can be removed later)
+                        console.log('Scrollbar preference applied:', shouldShowScrollbars, 'Server:', serverPreference, 'Stored:', storedPreference);
+                    }} catch (error) {{
+                        console.error('Error applying scrollbar preference:', error);
                     }}
-                    
-                    // Apply scrollbar preference on page load - run immediately and with delays
-                    applyScrollbarPreference();
-                    setTimeout(applyScrollbarPreference, 50);
-                    setTimeout(applyScrollbarPreference, 100);
-                    setTimeout(applyScrollbarPreference, 300);
-                    
-                    // Also apply when DOM is fully loaded
-                    if (document.readyState === 'loading') {{
-                        document.addEventListener('DOMContentLoaded', applyScrollbarPreference);
-                    }}
-                    
-                    // Always scroll to today on initial load (simpler and more reliable)
-                    // When view options change (compact/hide inactive), the calendar structure changes
-                    // so saved positions become invalid - better to always default to today
-                    {f"""
-                    // Button click: scroll to today
-                    setTimeout(function() {{
-                        autoScrollToToday();
-                    }}, 500);
-                    """ if scroll_to_today else """
-                    // Initial load: always scroll to today (default behavior)
-                    setTimeout(function() {
-                        autoScrollToToday();
-                    }, 600);
-                    """}
-                </script>
-            </body>
-        </html>
-        """
-        return dedent(html_doc).strip()
-    except Exception as e:
-        st.warning(f"Calendar HTML generation failed: {e}")
-        return styled_df.to_html(escape=False)
+                }}
+                
+                // Apply scrollbar preference on page load - run immediately and with delays
+                applyScrollbarPreference();
+                setTimeout(applyScrollbarPreference, 50);
+                setTimeout(applyScrollbarPreference, 100);
+                setTimeout(applyScrollbarPreference, 300);
+                
+                // Also apply when DOM is fully loaded
+                if (document.readyState === 'loading') {{
+                    document.addEventListener('DOMContentLoaded', applyScrollbarPreference);
+                }}
+                
+                // Always scroll to today on initial load (simpler and more reliable)
+                // When view options change (compact/hide inactive), the calendar structure changes
+                // so saved positions become invalid - better to always default to today
+                {f"""
+                // Button click: scroll to today
+                setTimeout(function() {{
+                    autoScrollToToday();
+                }}, 500);
+                """ if scroll_to_today else """
+                // Initial load: always scroll to today (default behavior)
+                setTimeout(function() {
+                    autoScrollToToday();
+                }, 600);
+                """}
+            </script>
+        </body>
+    </html>
+    """
+    return dedent(html_doc).strip()
 
 def display_site_statistics(site_summary_df):
     """Display basic site summary statistics"""
@@ -1805,11 +1799,12 @@ def display_profit_sharing_ratio_breakdowns(financial_df, patients_df):
         st.info(f"**Formula:** List Sizes {list_weight}% + Work Done {work_weight}% + Patient Recruitment {recruitment_weight}%")
         st.info(f"**Fixed List Ratios:** Ashfields {list_ratios['ashfields']:.1%} ({list_ratios['ashfields_size']:,}) | Kiltearn {list_ratios['kiltearn']:.1%} ({list_ratios['kiltearn_size']:,})")
         
-        # Display ratio breakdowns for each time period
+        # Display ratio breakdowns for each time period (slices of one financial cube)
         time_periods = create_time_period_config()
+        cube = get_financial_cube(financial_df, patients_df) if not financial_df.empty else None
         
         for period_key, period_config in time_periods.items():
-            ratio_data = build_ratio_breakdown_data(financial_df, patients_df, period_config, weights)
+            ratio_data = build_ratio_breakdown_data(financial_df, patients_df, period_config, weights, cube=cube)
             if ratio_data:  # Only display if there's data
                 display_ratio_breakdown_table(ratio_data, period_config['title'])
         
@@ -2191,7 +2186,7 @@ def display_download_buttons(calendar_df, site_column_mapping, unique_visit_site
                                 success, message, code = db.append_visit_to_database(records_df)
                                 if success:
                                     st.success(message)
-                                    trigger_data_refresh()
+                                    trigger_data_refresh(tables=['actual_visits'])
                                     rerun_app()
                                 else:
                                     st.error(message)
@@ -2470,4 +2465,137 @@ def style_site_busy_row(row, today_date, site_columns):
         
         styles.append(style)
     
-    return styles
\ No newline at end of file
+    return styles
+
+def display_performance_panel():
+    """Performance panel: flame breakdown of the last calendar build trace with Chrome trace export"""
+    from datetime import datetime
+    import plotly.graph_objects as go
+    from config import TRACE_MEMORY
+    from tracing import get_trace, trace_breakdown, export_chrome_trace
+
+    with st.expander("⏱️ Performance", expanded=False):
+        st.checkbox(
+            "Track peak memory per span (slower builds)",
+            value=st.session_state.get('trace_memory', TRACE_MEMORY),
+            key='trace_memory',
+            help="Uses tracemalloc during the next calendar build"
+        )
+
+        build_trace = get_trace('calendar_build')
+        if build_trace is None:
+            st.info("No calendar build traced yet this session (cached builds are not re-traced).")
+            return
+
+        breakdown = trace_breakdown(build_trace)
+        total = breakdown['Seconds'].iloc[0]
+        started = datetime.fromtimestamp(build_trace['started_at']).strftime('%H:%M:%S')
+        st.caption(f"Last calendar build at {started}: {total:.2f}s across {len(breakdown) - 1} spans")
+
+        # Flame chart: one row per nesting depth, bars positioned by start offset
+        hover = breakdown.apply(
+            lambda row: (f"{row['Span']}<br>{row['Seconds'] * 1000:.1f} ms (self {row['SelfSeconds'] * 1000:.1f} ms)"
+                         f"<br>rows in/out: {row['RowsIn']} / {row['RowsOut']}"
+                         + (f"<br>peak memory: {row['PeakMemoryMB']} MB" if pd.notna(row['PeakMemoryMB']) else "")),
+            axis=1
+        )
+        fig = go.Figure(go.Bar(
+            y=breakdown['Depth'],
+            x=breakdown['Seconds'] * 1000,
+            base=breakdown['Start'] * 1000,
+            orientation='h',
+            text=breakdown['Span'],
+            textposition='inside',
+            insidetextanchor='start',
+            hovertext=hover,
+            hoverinfo='text',
+            marker=dict(color=breakdown['Depth'], colorscale='YlOrRd', line=dict(color='white', width=1))
+        ))
+        fig.update_layout(
+            height=120 + 40 * (breakdown['Depth'].max() + 1),
+            margin=dict(l=10, r=10, t=10, b=30),
+            xaxis_title="ms",
+            yaxis=dict(autorange='reversed', title="depth", dtick=1),
+            showlegend=False
+        )
+        st.plotly_chart(fig, width='stretch')
+
+        display_df = breakdown.copy()
+        display_df['Span'] = display_df['Depth'].map(lambda depth: '  ' * depth) + display_df['Span']
+        st.dataframe(display_df.drop(columns=['Depth']), hide_index=True, width='stretch')
+
+        st.download_button(
+            "📥 Download Chrome Trace (JSON)",
+            data=export_chrome_trace(build_trace),
+            file_name=f"calendar_build_trace_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+            mime="application/json",
+            help="Open in chrome://tracing or https://ui.perfetto.dev"
+        )
+
+
+def display_performance_history():
+    """DB Admin view: p50/p95 calendar build time per stage over time with regression flags"""
+    import plotly.graph_objects as go
+    from config import PERFORMANCE_REGRESSION_THRESHOLD
+    from performance_history import load_history, stage_percentiles, detect_regressions, get_history_path
+
+    st.subheader("📈 Performance History")
+    history_path = get_history_path()
+    if history_path is None:
+        st.info("Performance history is disabled (PERFORMANCE_HISTORY_PATH is None in config.py).")
+        return
+    st.caption(f"Span timings of every calendar build, stored in `{history_path}`")
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        window_options = {"Last 7 days": 7, "Last 30 days": 30, "Last 90 days": 90, "All": None}
+        window = st.selectbox("Window", list(window_options.keys()), index=1, key="perf_history_window")
+    with col2:
+        threshold = st.number_input(
+            "Regression threshold (%)", min_value=5, max_value=500, step=5,
+            value=int(PERFORMANCE_REGRESSION_THRESHOLD * 100), key="perf_history_threshold"
+        ) / 100
+    with col3:
+        recent_builds = st.number_input("Recent builds compared", min_value=1, max_value=50, value=5,
+                                        key="perf_history_recent")
+
+    # Depth 0 is the whole build, depth 3 the pipeline stages (deeper spans are helpers)
+    history = load_history(days=window_options[window], max_depth=3)
+    if history.empty:
+        st.info("No calendar builds recorded yet.")
+        return
+
+    regressions = detect_regressions(history, threshold=threshold, recent_builds=int(recent_builds))
+    regressed = regressions[regressions['Regressed']] if not regressions.empty else regressions
+    if not regressed.empty:
+        for _, row in regressed.iterrows():
+            dataset_note = (f" (dataset {row['BaselineDataset']} → {row['RecentDataset']})"
+                            if row['BaselineDataset'] != row['RecentDataset'] else "")
+            st.warning(f"🐌 {row['Stage']}: median {row['BaselineP50']:.2f}s → {row['RecentP50']:.2f}s "
+                       f"(+{row['Change']:.0%}){dataset_note}")
+    elif not regressions.empty:
+        st.success(f"✅ No stage slower than {threshold:.0%} over the last {int(recent_builds)} builds")
+
+    percentiles = stage_percentiles(history)
+    stages = history.drop_duplicates('Stage').sort_values('Depth')['Stage'].tolist()
+    default_stages = [stage for stage in stages if stage in history.loc[history['Depth'].isin([0, 3]), 'Stage'].values]
+    selected_stages = st.multiselect("Stages", stages, default=default_stages, key="perf_history_stages")
+
+    fig = go.Figure()
+    for stage in selected_stages:
+        stage_percentiles_df = percentiles[percentiles['Stage'] == stage]
+        fig.add_trace(go.Scatter(x=stage_percentiles_df['Period'], y=stage_percentiles_df['P50'],
+                                 mode='lines+markers', name=f"{stage} p50"))
+        fig.add_trace(go.Scatter(x=stage_percentiles_df['Period'], y=stage_percentiles_df['P95'],
+                                 mode='lines', line=dict(dash='dot'), name=f"{stage} p95"))
+    fig.update_layout(height=420, margin=dict(l=10, r=10, t=10, b=30), yaxis_title="seconds",
+                      legend=dict(orientation='h', y=-0.2))
+    st.plotly_chart(fig, width='stretch')
+
+    builds = history[history['Depth'] == 0].groupby(['AppVersion', 'Dataset'])['Seconds'].agg(
+        Builds='count', P50=lambda s: s.quantile(0.5), P95=lambda s: s.quantile(0.95)
+    ).reset_index()
+    st.caption("Whole-build times by app version and dataset (patients/actual visits/trial rows)")
+    st.dataframe(builds.round(3), hide_index=True, width='stretch')
+    if not regressions.empty:
+        st.dataframe(regressions, hide_index=True, width='stretch')
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Financial period cube
+
+One aggregated table behind the profit sharing, ratio breakdown and income realization views.
+Each row is a cell of
+
+    (PeriodType, Period, Site, ContractSite, Study, Kind, When)
+
+with Visits (row count), Income (Payment sum), Recruits (recruited patients) and FirstSeen
+(position of the cell's first visit, so slices can list sites in order of appearance).
+
+- PeriodType is 'MonthYear', 'QuarterYear' or 'FinancialYear' - labelled like the
+  prepare_financial_data columns of the same name - or 'All' (one period, 'All')
+- Site is SiteofVisit for visits and the origin site for recruits; ContractSite is the income
+  attribution site (ContractSite, else SiteofVisit)
+- Kind is 'actual' (IsActual and not IsProposed), 'proposed', 'predicted' (IsActual == False),
+  'other' (no IsActual flag), 'tolerance' (tolerance marker rows) or 'recruited' (patients)
+- When places the date against today: 'past', 'today', 'future' or 'undated'
+
+Visits are aggregated per calendar month first and the month cells are rolled up into
+quarters, financial years and 'All', so the cube is built with two small groupbys. Every
+report is then a filter plus a groupby over a few hundred cells instead of a re-filter of
+the visits per period.
+"""
+import numpy as np
+import pandas as pd
+
+from helpers import get_financial_year_for_series, get_patient_origin_site_for_series
+from runtime_context import CACHE_TABLES, cache_data, current_date, register_cache_dependency
+from visit_status import TOLERANCE_STATUSES, visit_status_column
+
+PERIOD_TYPES = ('MonthYear', 'QuarterYear', 'FinancialYear', 'All')
+CUBE_KEYS = ['PeriodType', 'Period', 'Site', 'ContractSite', 'Study', 'Kind', 'When']
+CUBE_VALUES = ['Visits', 'Income', 'Recruits', 'FirstSeen']
+CUBE_COLUMNS = CUBE_KEYS + CUBE_VALUES
+
+# Visit kinds (everything but tolerance markers and recruits is a scheduled visit)
+VISIT_KINDS = ('actual', 'proposed', 'predicted', 'other')
+RECRUITED_STATUSES = ['randomized', 'withdrawn', 'deceased', 'completed', 'lost_to_followup']
+# When values up to and including today / from today on
+UP_TO_TODAY = ('past', 'today')
+FROM_TODAY = ('today', 'future')
+
+
+def period_labels(dates):
+    """Period label per date for every period type (MonthYear/QuarterYear/FinancialYear as in prepare_financial_data)"""
+    return {
+        'MonthYear': dates.dt.to_period('M').astype(str).where(dates.notna()),
+        # Missing dates become '0-Q0', like the QuarterYear column
+        'QuarterYear': (dates.dt.year.fillna(0).astype(int).astype(str) + '-Q' +
+                        dates.dt.quarter.fillna(0).astype(int).astype(str)),
+        'FinancialYear': get_financial_year_for_series(dates),
+        'All': pd.Series('All', index=dates.index, dtype=object),
+    }
+
+
+def _when(dates, today):
+    """'past'/'today'/'future'/'undated' per date"""
+    return pd.Series(np.select([dates < today, dates == today, dates > today], ['past', 'today', 'future'],
+                               default='undated'), index=dates.index, dtype=object)
+
+
+def _visit_kinds(visits_df):
+    """Kind per visit row (see module docstring)"""
+    is_actual = visits_df['IsActual'] == True if 'IsActual' in visits_df.columns else pd.Series(False, index=visits_df.index)
+    not_actual = visits_df['IsActual'] == False if 'IsActual' in visits_df.columns else pd.Series(False, index=visits_df.index)
+    is_proposed = visits_df['IsProposed'] == True if 'IsProposed' in visits_df.columns else pd.Series(False, index=visits_df.index)
+    is_marker = visit_status_column(visits_df).isin(TOLERANCE_STATUSES)
+    return pd.Series(np.select(
+        [is_marker, is_actual & ~is_proposed, not_actual, is_proposed],
+        ['tolerance', 'actual', 'predicted', 'proposed'], default='other',
+    ), index=visits_df.index, dtype=object)
+
+
+def _recruit_cells(patients_df, today):
+    """Recruited patients as (Site, ContractSite, Study, Kind, When, month, Recruits) rows
+
+    Mirrors calculate_recruitment_ratios: with a Status column only recruited statuses count and
+    the date is RandomizationDate, else ScreeningDate, else StartDate; without one every patient
+    counts and the date is StartDate, else ScreeningDate.
+    """
+    if patients_df is None or patients_df.empty:
+        return None
+    if 'Status' in patients_df.columns:
+        recruited = patients_df[patients_df['Status'].isin(RECRUITED_STATUSES)]
+        candidates = ['RandomizationDate', 'ScreeningDate', 'StartDate']
+    else:
+        recruited = patients_df
+        candidates = ['StartDate', 'ScreeningDate']
+    date_column = next((col for col in candidates if col in recruited.columns), None)
+    if date_column is None or recruited.empty:
+        return None
+
+    dates = pd.to_datetime(recruited[date_column], errors='coerce')
+    origin_sites = get_patient_origin_site_for_series(recruited, default="Unknown Site")
+    return pd.DataFrame({
+        'Site': origin_sites,
+        'ContractSite': origin_sites,
+        'Study': recruited['Study'] if 'Study' in recruited.columns else None,
+        'Kind': 'recruited',
+        'When': _when(dates, today),
+        'Month': dates,
+        'Visits': 0,
+        'Income': 0.0,
+        'Recruits': recruited['PatientID'].notna().astype(int) if 'PatientID' in recruited.columns else 0,
+        'FirstSeen': np.nan,
+    })
+
+
+def build_financial_cube(visits_df, patients_df=None, today=None):
+    """Aggregate visits (and recruited patients) into the financial period cube
+
+    Args:
+        visits_df: Visits (or prepare_financial_data output) with Date, Payment, SiteofVisit, Study, IsActual
+        patients_df: Optional patients for the recruitment counts
+        today: Date the When column is relative to (default: current_date())
+
+    Returns:
+        DataFrame with CUBE_COLUMNS, one row per non-empty cell
+    """
+    today = pd.Timestamp(today if today is not None else current_date()).normalize()
+    parts = []
+    if visits_df is not None and not visits_df.empty:
+        dates = pd.to_datetime(visits_df['Date'], errors='coerce')
+        payments = (pd.to_numeric(visits_df['Payment'], errors='coerce').fillna(0.0)
+                    if 'Payment' in visits_df.columns else pd.Series(0.0, index=visits_df.index))
+        sites = visits_df['SiteofVisit'] if 'SiteofVisit' in visits_df.columns else pd.Series(np.nan, index=visits_df.index)
+        parts.append(pd.DataFrame({
+            'Site': sites,
+            'ContractSite': visits_df['ContractSite'] if 'ContractSite' in visits_df.columns else sites,
+            'Study': visits_df['Study'],
+            'Kind': _visit_kinds(visits_df),
+            'When': _when(dates, today),
+            'Month': dates,
+            'Visits': 1,
+            'Income': payments,
+            'Recruits': 0,
+            'FirstSeen': np.arange(len(visits_df), dtype=float),
+        }))
+    recruits = _recruit_cells(patients_df, today)
+    if recruits is not None:
+        parts.append(recruits)
+    if not parts:
+        return pd.DataFrame(columns=CUBE_COLUMNS)
+
+    rows = pd.concat(parts, ignore_index=True)
+    # Month cells first; quarter, financial year and 'All' labels are functions of the month
+    rows['Month'] = rows['Month'].dt.to_period('M').dt.to_timestamp()
+    month_keys = ['Month', 'Site', 'ContractSite', 'Study', 'Kind', 'When']
+    months = rows.groupby(month_keys, dropna=False, sort=False).agg(
+        Visits=('Visits', 'sum'), Income=('Income', 'sum'), Recruits=('Recruits', 'sum'),
+        FirstSeen=('FirstSeen', 'min'),
+    ).reset_index()
+
+    labels = period_labels(months['Month'])
+    cells = pd.concat([months.assign(PeriodType=period_type, Period=labels[period_type])
+                       for period_type in PERIOD_TYPES], ignore_index=True)
+    cube = cells.groupby(CUBE_KEYS, dropna=False, sort=False).agg(
+        Visits=('Visits', 'sum'), Income=('Income', 'sum'), Recruits=('Recruits', 'sum'),
+        FirstSeen=('FirstSeen', 'min'),
+    ).reset_index()
+    return cube[CUBE_COLUMNS]
+
+
+@cache_data(show_spinner=False)
+def _financial_cube_cached(_visits_df, _patients_df, fingerprints, today):
+    """Cached cube, keyed on the visits/patients fingerprints and the day (underscore args aren't hashed)"""
+    return build_financial_cube(_visits_df, _patients_df, today)
+
+register_cache_dependency('financial_cube', _financial_cube_cached.clear, CACHE_TABLES)
+
+
+def get_financial_cube(visits_df, patients_df=None):
+    """Financial period cube for these visits/patients as of today (cached)
+
+    The calendar build's visits (and row-filtered copies) carry a derived fingerprint, so the
+    lookup doesn't hash them.
+    """
+    from processing_calendar import get_table_fingerprint
+    fingerprints = tuple(get_table_fingerprint(df) for df in (visits_df, patients_df))
+    return _financial_cube_cached(visits_df, patients_df, fingerprints, current_date())
+
+
+def cube_slice(cube, period_type, period=None, kinds=None, when=None):
+    """Cells of one period type, optionally of one period, some kinds and some When values"""
+    mask = cube['PeriodType'] == period_type
+    if period is not None:
+        mask &= cube['Period'] == period
+    if kinds is not None:
+        mask &= cube['Kind'].isin(kinds)
+    if when is not None:
+        mask &= cube['When'].isin(when)
+    return cube[mask]
+
+
+def cube_periods(cube, period_type):
+    """Sorted periods of a period type that have visits (like the periods of prepare_financial_data)"""
+    visit_cells = cube[(cube['PeriodType'] == period_type) & (cube['Kind'] != 'recruited')]
+    return sorted(period for period in visit_cells['Period'].unique() if pd.notna(period))
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
+import numpy as np
 import pandas as pd
 from datetime import date
+from visit_status import (MASK_COUNT, STATUS_ACTUAL, STATUS_DIED, STATUS_PLANNED, STATUS_PREDICTED,
+                          STATUS_PROPOSED, STATUS_SCREEN_FAIL, STATUS_WITHDRAWN, cell_status_masks, status_bit,
+                          visit_status_mask)
 
 def format_currency(value):
     """Format a numeric value as currency"""
@@ -168,38 +172,102 @@ def create_data_row_styles(row, today_date):
     
     return styles
 
+# Calendar style codes: a row code from the Date column, a cell code per distinct cell label
+DATE_STYLE_NONE, DATE_STYLE_TODAY, DATE_STYLE_FY_END, DATE_STYLE_MONTH_END, DATE_STYLE_WEEKEND = range(5)
+DATE_STYLES = (
+    "",
+    'background-color: #dc2626; color: white; font-weight: bold;',   # today
+    'background-color: #1e40af; color: white; font-weight: bold;',   # 31 March (financial year end)
+    'background-color: #60a5fa; color: white; font-weight: normal;', # month end
+    'background-color: #e5e7eb;',                                    # weekend
+)
+
+(VISIT_STYLE_NONE, VISIT_STYLE_COMPLETED, VISIT_STYLE_PROPOSED, VISIT_STYLE_SCREEN_FAIL,
+ VISIT_STYLE_WITHDRAWN, VISIT_STYLE_DIED, VISIT_STYLE_PREDICTED) = range(7)
+VISIT_STYLES = (
+    "",
+    'background-color: #d4edda; color: #155724; font-weight: bold;',
+    'background-color: #fff3cd; color: #856404; font-weight: bold; border: 2px solid #ffc107; font-style: italic;',
+    'background-color: #f8d7da; color: #721c24; font-weight: bold; border: 2px solid #dc3545;',
+    'background-color: #fff3cd; color: #856404; font-weight: bold; border: 2px solid #ffc107;',
+    'background-color: #e2e3e5; color: #721c24; font-weight: bold; border: 2px solid #6c757d;',
+    'background-color: #e2e3e5; color: #383d41; font-weight: normal;',
+)
+
 def get_date_based_style(date_obj, today_date):
     """Get styling based on date characteristics"""
     if date_obj.date() == today_date.date():
-        return 'background-color: #dc2626; color: white; font-weight: bold;'
+        return DATE_STYLES[DATE_STYLE_TODAY]
     elif date_obj.month == 3 and date_obj.day == 31:
-        return 'background-color: #1e40af; color: white; font-weight: bold;'
+        return DATE_STYLES[DATE_STYLE_FY_END]
     elif date_obj == date_obj + pd.offsets.MonthEnd(0):
-        return 'background-color: #60a5fa; color: white; font-weight: normal;'
+        return DATE_STYLES[DATE_STYLE_MONTH_END]
     elif date_obj.weekday() in (5, 6):
-        return 'background-color: #e5e7eb;'
+        return DATE_STYLES[DATE_STYLE_WEEKEND]
     return ""
 
+def date_style_codes(dates, today_date=None):
+    """DATE_STYLE_* code per date, column-wise (same priority as get_date_based_style)
+
+    today_date=None leaves today unmarked (e.g. for exports). Missing dates get DATE_STYLE_NONE.
+    """
+    dates = pd.to_datetime(pd.Series(dates)).dt.normalize()
+    today = pd.Timestamp(today_date).normalize() if today_date is not None else None
+    conditions = [
+        (dates == today).to_numpy() if today is not None else np.zeros(len(dates), dtype=bool),
+        ((dates.dt.month == 3) & (dates.dt.day == 31)).to_numpy(),
+        dates.dt.is_month_end.to_numpy(dtype=bool, na_value=False),
+        dates.dt.dayofweek.isin([5, 6]).to_numpy(),
+    ]
+    choices = [DATE_STYLE_TODAY, DATE_STYLE_FY_END, DATE_STYLE_MONTH_END, DATE_STYLE_WEEKEND]
+    return np.select(conditions, choices, default=DATE_STYLE_NONE).astype(np.int8)
+
+# Visit style per status, highest priority first (a cell's mask can have several statuses)
+_VISIT_STYLE_PRIORITY = (
+    (STATUS_ACTUAL, VISIT_STYLE_COMPLETED),
+    (STATUS_PROPOSED, VISIT_STYLE_PROPOSED),
+    (STATUS_SCREEN_FAIL, VISIT_STYLE_SCREEN_FAIL),
+    (STATUS_WITHDRAWN, VISIT_STYLE_WITHDRAWN),
+    (STATUS_DIED, VISIT_STYLE_DIED),
+    (STATUS_PREDICTED, VISIT_STYLE_PREDICTED),
+    (STATUS_PLANNED, VISIT_STYLE_PREDICTED),
+)
+
+def visit_style_code_for_mask(mask):
+    """VISIT_STYLE_* code of a calendar cell's status mask"""
+    for status, style_code in _VISIT_STYLE_PRIORITY:
+        if mask & status_bit(status):
+            return style_code
+    return VISIT_STYLE_NONE
+
+# VISIT_STYLE_* code for every possible status mask
+VISIT_STYLE_BY_MASK = np.array([visit_style_code_for_mask(mask) for mask in range(MASK_COUNT)], dtype=np.int8)
+
+def visit_style_code(cell_str):
+    """VISIT_STYLE_* code of a calendar cell label"""
+    return int(VISIT_STYLE_BY_MASK[visit_status_mask(cell_str)])
+
 def get_visit_based_style(cell_str):
     """Get styling based on visit type - simplified without tolerance windows"""
-    if '✅' in cell_str or ('Visit' in cell_str and any(symbol in cell_str for symbol in ["✅"])):
-        return 'background-color: #d4edda; color: #155724; font-weight: bold;'
-    elif '❓' in cell_str and '(Proposed)' in cell_str:
-        # Proposed visits (future-dated tentative bookings)
-        return 'background-color: #fff3cd; color: #856404; font-weight: bold; border: 2px solid #ffc107; font-style: italic;'
-    elif '⚠️ Screen Fail' in cell_str or 'Screen Fail' in cell_str:
-        return 'background-color: #f8d7da; color: #721c24; font-weight: bold; border: 2px solid #dc3545;'
-    elif '⚠️ Withdrawn' in cell_str or 'Withdrawn' in cell_str:
-        return 'background-color: #fff3cd; color: #856404; font-weight: bold; border: 2px solid #ffc107;'
-    elif '⚠️ Died' in cell_str or ('Died' in cell_str and '⚠️' in cell_str):
-        # Died visits - gray background with dark text to distinguish from withdrawn
-        return 'background-color: #e2e3e5; color: #721c24; font-weight: bold; border: 2px solid #6c757d;'
-    elif '📋' in cell_str and '(Predicted)' in cell_str:
-        # Predicted visits (no actual visit yet)
-        return 'background-color: #e2e3e5; color: #383d41; font-weight: normal;'
-    elif "Visit " in cell_str and not any(symbol in cell_str for symbol in ["✅", "⚠️", "📋", "❓"]):
-        return 'background-color: #e2e3e5; color: #383d41; font-weight: normal;'
-    return ""
+    return VISIT_STYLES[visit_style_code(cell_str)]
+
+def calendar_style_codes(calendar_df, value_columns, today_date=None, cell_status=None, masks=None):
+    """Style matrix of a calendar: DATE_STYLE_* per row and VISIT_STYLE_* per cell of value_columns
+
+    Cell codes come from each cell's status mask and VISIT_STYLE_BY_MASK. Masks are looked up in
+    cell_status (the build's status frame, by Date and column - see cell_status_masks), else
+    classified from the text; pass masks to reuse ones already computed. A cell's style is
+    DATE_STYLES[row code] when the row has one, else VISIT_STYLES[cell code] (as
+    create_data_row_styles does per cell).
+
+    Returns:
+        tuple: (row_codes: int8 array of len(calendar_df), cell_codes: int8 array rows x value_columns)
+    """
+    row_codes = date_style_codes(calendar_df['Date'], today_date)
+    if masks is None:
+        masks = cell_status_masks(calendar_df[list(value_columns)].to_numpy(dtype=object), calendar_df['Date'],
+                                  value_columns, cell_status)
+    return row_codes, VISIT_STYLE_BY_MASK[masks]
 
 def create_fy_highlighting_function():
     """Create function for highlighting financial year rows"""
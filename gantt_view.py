@@ -57,173 +57,154 @@ def detect_study_phase(lpfv_date: Optional[date], lplv_date: Optional[date], tod
             return 'in_followup'
     return 'active'
 
-def get_patient_recruitment_data(study: str, site: str, patients_df: pd.DataFrame) -> List[Tuple[date, int]]:
-    """
-    Get sorted list of patient recruitment dates with sequential numbers.
-
-    REFACTOR: Now uses Status-based recruitment - only counts patients with recruited statuses.
-    Uses RandomizationDate for recruited patients, not ScreeningDate.
-
-    Args:
-        study: Study name
-        site: Contract site name (for grouping only)
-        patients_df: Patients dataframe
-
-    Returns:
-        List of tuples: [(recruitment_date, patient_number), ...] sorted by date
-    """
-    # ContractSite is the grouping key; count all patients in the study
-    study_patients = patients_df[
-        (patients_df['Study'] == study)
-    ]
-
-    if study_patients.empty:
-        return []
-
-    # REFACTOR: Filter for recruited patients only (not screening/screen_failed)
-    if 'Status' in study_patients.columns:
-        recruited_statuses = ['randomized', 'withdrawn', 'deceased', 'completed', 'lost_to_followup']
-        study_patients = study_patients[study_patients['Status'].isin(recruited_statuses)]
-
-    if study_patients.empty:
-        return []
-
-    # REFACTOR: Use RandomizationDate for recruited patients (when randomized), with fallbacks
-    # Check each date column for actual non-null data before committing to it
-    date_column = None
-    for candidate_col in ['RandomizationDate', 'ScreeningDate', 'StartDate']:
-        if candidate_col in study_patients.columns:
-            if pd.to_datetime(study_patients[candidate_col], errors='coerce').notna().any():
-                date_column = candidate_col
-                break
-
-    if date_column is None:
-        return []
-
-    # Get and sort by date - OPTIMIZED: use itertuples for 2-3x speedup
-    patient_dates = []
-    for patient in study_patients.itertuples(index=False):
-        patient_date = pd.to_datetime(getattr(patient, date_column), errors='coerce')
-        if pd.notna(patient_date):
-            patient_dates.append(patient_date.date())
-    
-    # Sort by date and number sequentially
-    patient_dates.sort()
-    return [(date, idx + 1) for idx, date in enumerate(patient_dates)]
+GANTT_COLUMNS = ['Site', 'Study', 'StartDate', 'EndDate', 'LastEnrollment', 'Status', 'Duration', 'LPFVDate', 'SIVDate']
+RECRUITED_STATUSES = ['randomized', 'withdrawn', 'deceased', 'completed', 'lost_to_followup']
+OVERRIDE_COLUMNS = ['FPFV', 'LPFV', 'LPLV']
+
+def _as_dates(values: pd.Series) -> pd.Series:
+    """datetime64 Series -> object Series of date (None where missing)"""
+    return pd.Series([value.date() if pd.notna(value) else None for value in values],
+                     index=values.index, dtype=object)
+
+def _study_site_pairs(trials_df: Optional[pd.DataFrame], study_details_df: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """Every (Site, Study) pair of the trial schedules and study_site_details, sorted by site then study"""
+    pairs = []
+    if trials_df is not None and not trials_df.empty and 'SiteforVisit' in trials_df.columns:
+        pairs.append(trials_df[['SiteforVisit', 'Study']].set_axis(['Site', 'Study'], axis=1))
+    if study_details_df is not None and not study_details_df.empty:
+        # DEBUG: Log what columns we actually have
+        log_activity(f"DEBUG gantt_view: study_details_df columns: {list(study_details_df.columns)}", level='info')
 
-def calculate_study_dates(study: str, site: str, patients_df: pd.DataFrame, 
-                         visits_df: pd.DataFrame, trials_df: pd.DataFrame) -> Dict[str, Optional[date]]:
+        # Handle ContractSite as canonical, with backward-compatible fallbacks
+        if 'ContractSite' in study_details_df.columns:
+            site_col = 'ContractSite'
+        elif 'ContractedSite' in study_details_df.columns:
+            site_col = 'ContractedSite'
+        else:
+            site_col = 'SiteforVisit'
+        pairs.append(study_details_df[[site_col, 'Study']].set_axis(['Site', 'Study'], axis=1))
+    if not pairs:
+        return pd.DataFrame(columns=['Site', 'Study'])
+    pairs = pd.concat(pairs, ignore_index=True).drop_duplicates()
+    return pd.DataFrame(sorted(zip(pairs['Site'], pairs['Study'])), columns=['Site', 'Study'])
+
+def _study_site_overrides(pairs: pd.DataFrame, trials_df: Optional[pd.DataFrame],
+                          study_details_df: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """Status and FPFV/LPFV/LPLV overrides per pair (aligned to pairs)
+
+    From the pair's study_site_details row (first one, matched on ContractSite) where there is one,
+    else from the first non-null values of the pair's trial schedule rows, else 'active' and no dates.
     """
-    Calculate study dates (start, end, last enrollment) for a study at a specific contract site.
-    Prefers calculated dates, but uses FPFV/LPFV/LPLV overrides if available.
-    Auto-detects "in_followup" status if past LPFV but before LPLV.
-    
-    Args:
-        study: Study name
-        site: Contract site name
-        patients_df: Patients dataframe
-        visits_df: Visits dataframe (with Date column)
-        trials_df: Trial schedules dataframe (for backward compatibility, but prefers study_site_details)
-    
-    Returns:
-        dict with keys: 'start_date', 'end_date', 'last_enrollment', 'status', 'lpfv_date'
+    overrides = pd.DataFrame({'Status': 'active'}, index=pairs.index)
+    for col in OVERRIDE_COLUMNS:
+        overrides[col] = pd.NaT
+    has_details = pd.Series(False, index=pairs.index)
+
+    if (study_details_df is not None and not study_details_df.empty
+            and 'ContractSite' in study_details_df.columns):
+        details = study_details_df.drop_duplicates(subset=['Study', 'ContractSite'], keep='first')
+        details = details.reindex(columns=['Study', 'ContractSite', 'StudyStatus'] + OVERRIDE_COLUMNS)
+        matched = pairs.merge(details.rename(columns={'ContractSite': 'Site'}), on=['Site', 'Study'],
+                              how='left', indicator=True).set_index(pairs.index)
+        has_details = matched['_merge'] == 'both'
+        if 'StudyStatus' in study_details_df.columns:
+            overrides.loc[has_details, 'Status'] = matched.loc[has_details, 'StudyStatus'].fillna('active')
+        for col in OVERRIDE_COLUMNS:
+            overrides.loc[has_details, col] = pd.to_datetime(matched.loc[has_details, col], errors='coerce')
+
+    if trials_df is not None and not trials_df.empty and 'SiteforVisit' in trials_df.columns and not has_details.all():
+        trial_columns = [col for col in ['StudyStatus'] + OVERRIDE_COLUMNS if col in trials_df.columns]
+        if trial_columns:
+            # first() skips nulls, like taking .dropna().iloc[0] per pair
+            firsts = trials_df.groupby(['Study', 'SiteforVisit'], sort=False)[trial_columns].first()
+            firsts = firsts.rename_axis(['Study', 'Site']).reset_index()
+            matched = pairs.merge(firsts, on=['Site', 'Study'], how='left').set_index(pairs.index)
+            fallback = ~has_details
+            if 'StudyStatus' in trial_columns:
+                statuses = matched['StudyStatus']
+                use_status = fallback & statuses.notna()
+                overrides.loc[use_status, 'Status'] = statuses[use_status].astype(str).str.lower()
+            for col in OVERRIDE_COLUMNS:
+                if col in trial_columns:
+                    overrides.loc[fallback, col] = pd.to_datetime(matched.loc[fallback, col])
+    for col in OVERRIDE_COLUMNS:
+        overrides[col] = pd.to_datetime(overrides[col])
+    return overrides
+
+def _study_patient_starts(patients_df: pd.DataFrame) -> pd.Series:
+    """Earliest ScreeningDate (StartDate fallback) per study"""
+    date_col = 'ScreeningDate' if 'ScreeningDate' in patients_df.columns else 'StartDate'
+    if patients_df.empty or date_col not in patients_df.columns:
+        return pd.Series(dtype='datetime64[ns]')
+    return pd.to_datetime(patients_df[date_col], errors='coerce').groupby(patients_df['Study']).min()
+
+def _study_visit_ends(visits_df: pd.DataFrame) -> pd.Series:
+    """Latest visit Date per study"""
+    if visits_df.empty or 'Date' not in visits_df.columns:
+        return pd.Series(dtype='datetime64[ns]')
+    return pd.to_datetime(visits_df['Date'], errors='coerce').groupby(visits_df['Study']).max()
+
+def build_recruitment_curves(patients_df: pd.DataFrame) -> Dict[str, List[Tuple[date, int]]]:
+    """Recruitment curve per study: study -> [(recruitment_date, patient_number), ...]
+
+    Counts patients with a recruited Status (RECRUITED_STATUSES), numbered in date order. Each study
+    uses the first of RandomizationDate/ScreeningDate/StartDate that has any date for its recruited
+    patients; each candidate column is parsed once for all patients.
     """
-    today = date.today()
-    
-    # Try to get status and date overrides from study_site_details first
-    import database as db
-    study_details = db.fetch_study_site_details(study, site)
-    
-    # Get status (default to 'active' if not found)
-    status = 'active'
-    fpfv_override = None
-    lpfv_override = None
-    lplv_override = None
-    
-    if study_details:
-        # Use study_site_details (preferred)
-        status = study_details.get('StudyStatus', 'active')
-        if study_details.get('FPFV'):
-            fpfv_override = pd.to_datetime(study_details['FPFV'], errors='coerce').date() if pd.notna(pd.to_datetime(study_details['FPFV'], errors='coerce')) else None
-        if study_details.get('LPFV'):
-            lpfv_override = pd.to_datetime(study_details['LPFV'], errors='coerce').date() if pd.notna(pd.to_datetime(study_details['LPFV'], errors='coerce')) else None
-        if study_details.get('LPLV'):
-            lplv_override = pd.to_datetime(study_details['LPLV'], errors='coerce').date() if pd.notna(pd.to_datetime(study_details['LPLV'], errors='coerce')) else None
-    else:
-        # Fallback to trial_schedules for backward compatibility
-        study_trials = trials_df[(trials_df['Study'] == study) & (trials_df['SiteforVisit'] == site)] if trials_df is not None and not trials_df.empty else pd.DataFrame()
-        
-        if not study_trials.empty and 'StudyStatus' in study_trials.columns:
-            status_values = study_trials['StudyStatus'].dropna().unique()
-            if len(status_values) > 0:
-                status = str(status_values[0]).lower()
-        
-        if not study_trials.empty:
-            if 'FPFV' in study_trials.columns:
-                fpfv_values = study_trials['FPFV'].dropna()
-                if not fpfv_values.empty:
-                    fpfv_override = pd.to_datetime(fpfv_values.iloc[0]).date() if pd.notna(fpfv_values.iloc[0]) else None
-            
-            if 'LPFV' in study_trials.columns:
-                lpfv_values = study_trials['LPFV'].dropna()
-                if not lpfv_values.empty:
-                    lpfv_override = pd.to_datetime(lpfv_values.iloc[0]).date() if pd.notna(lpfv_values.iloc[0]) else None
-            
-            if 'LPLV' in study_trials.columns:
-                lplv_values = study_trials['LPLV'].dropna()
-                if not lplv_values.empty:
-                    lplv_override = pd.to_datetime(lplv_values.iloc[0]).date() if pd.notna(lplv_values.iloc[0]) else None
-    
-    # Calculate dates from patient/visit data if overrides not available
-    # BUT: LPFV should ONLY come from override, never calculated from patient dates
-    start_date = fpfv_override
-    end_date = lplv_override
-    
-    # Calculate start date (FPFV) from patients if override not set
-    if start_date is None:
-        study_patients = patients_df[
-            (patients_df['Study'] == study)
-        ]
-        # REFACTOR: Use ScreeningDate (with StartDate fallback for backward compatibility)
-        if not study_patients.empty:
-            if 'ScreeningDate' in study_patients.columns:
-                start_dates = pd.to_datetime(study_patients['ScreeningDate'], errors='coerce').dropna()
-            elif 'StartDate' in study_patients.columns:
-                start_dates = pd.to_datetime(study_patients['StartDate'], errors='coerce').dropna()
-            else:
-                start_dates = pd.Series(dtype='datetime64[ns]')
-
-            if not start_dates.empty:
-                start_date = start_dates.min().date()
-    
-    # Calculate end date (LPLV) from visits if override not set
-    if end_date is None:
-        study_visits = visits_df[
-            (visits_df['Study'] == study)
-        ]
-        if not study_visits.empty and 'Date' in study_visits.columns:
-            visit_dates = pd.to_datetime(study_visits['Date'], errors='coerce').dropna()
-            if not visit_dates.empty:
-                end_date = visit_dates.max().date()
-    
-    # LPFV should ONLY come from override in trials_df, never calculated from patient dates
-    # Recruitment phase is FPFV to LPFV (if LPFV is set), otherwise show all as recruitment
-    lpfv_date = lpfv_override  # Only use override, never calculate from patients
-    
+    recruited = patients_df
+    if 'Status' in recruited.columns:
+        recruited = recruited[recruited['Status'].isin(RECRUITED_STATUSES)]
+    if recruited.empty:
+        return {}
+
+    studies = recruited['Study']
+    recruitment_dates = pd.Series(pd.NaT, index=recruited.index, dtype='datetime64[ns]')
+    decided = pd.Series(False, index=studies.unique())
+    for candidate_col in ['RandomizationDate', 'ScreeningDate', 'StartDate']:
+        if candidate_col not in recruited.columns:
+            continue
+        parsed = pd.to_datetime(recruited[candidate_col], errors='coerce')
+        use_column = parsed.notna().groupby(studies).any().reindex(decided.index, fill_value=False) & ~decided
+        rows = studies.map(use_column).fillna(False).astype(bool)
+        recruitment_dates[rows] = parsed[rows]
+        decided |= use_column
+
+    dated = pd.DataFrame({'Study': studies, 'Date': recruitment_dates}).dropna(subset=['Date'])
+    dated = dated.sort_values(['Study', 'Date'], kind='mergesort')
     return {
-        'start_date': start_date,
-        'end_date': end_date,
-        'last_enrollment': lpfv_date,  # For backward compatibility, but should use lpfv_date
-        'status': status,
-        'lpfv_date': lpfv_date
+        study: [(recruitment_date.date(), idx + 1) for idx, recruitment_date in enumerate(group['Date'])]
+        for study, group in dated.groupby('Study', sort=False)
     }
 
+def _pair_siv_dates(pairs: pd.DataFrame, actual_visits_df: Optional[pd.DataFrame]) -> pd.Series:
+    """SIV date per pair: earliest SIV at the pair's site, else at any site of the study"""
+    siv_dates = pd.Series(pd.NaT, index=pairs.index, dtype='datetime64[ns]')
+    if (actual_visits_df is None or actual_visits_df.empty or 'VisitType' not in actual_visits_df.columns
+            or 'ActualDate' not in actual_visits_df.columns):
+        return siv_dates
+    sivs = actual_visits_df[actual_visits_df['VisitType'].astype(str).str.lower() == 'siv']
+    if sivs.empty:
+        return siv_dates
+    dates = pd.to_datetime(sivs['ActualDate'], errors='coerce')
+    siv_dates = pairs['Study'].map(dates.groupby(sivs['Study']).min()).astype('datetime64[ns]')
+    if 'SiteforVisit' in sivs.columns:
+        by_site = dates.groupby([sivs['Study'], sivs['SiteforVisit']])
+        pair_keys = pd.MultiIndex.from_frame(pairs[['Study', 'Site']])
+        has_site_sivs = pair_keys.isin(by_site.size().index)
+        site_dates = by_site.min().reindex(pair_keys).to_numpy()
+        siv_dates = siv_dates.where(~has_site_sivs, site_dates)
+    return siv_dates
+
 def build_gantt_data(patients_df: pd.DataFrame, trials_df: pd.DataFrame, 
                     visits_df: pd.DataFrame, actual_visits_df: Optional[pd.DataFrame] = None) -> Tuple[pd.DataFrame, Dict[Tuple[str, str], List[Tuple[date, int]]]]:
     """
     Build Gantt data structure grouped by site, with studies and their timelines.
     Also builds patient recruitment data for markers.
     
+    OPTIMIZED: All (study, site) pairs at once - study_site_details is fetched once (cached) and
+    joined to the pairs by merge, calculated FPFV/LPLV, recruitment curves and SIV dates come
+    from one groupby each.
+    
     Args:
         patients_df: Patients dataframe
         trials_df: Trial schedules dataframe
@@ -235,80 +216,41 @@ def build_gantt_data(patients_df: pd.DataFrame, trials_df: pd.DataFrame,
         - DataFrame with columns: Site, Study, StartDate, EndDate, LastEnrollment, Status, Duration, LPFVDate, SIVDate
         - Dict mapping (Study, Site) -> List of (recruitment_date, patient_number) tuples
     """
-    gantt_rows = []
-    patient_recruitment_data = {}
-    
-    # Get study+site combinations from both trial_schedules and study_site_details
     import database as db
     study_details_df = db.fetch_all_study_site_details()
 
-    # Build set of all study+site combinations
-    study_site_combinations = set()
-
-    # Add from trial_schedules - OPTIMIZED: use itertuples for 2-3x speedup
-    if trials_df is not None and not trials_df.empty and 'SiteforVisit' in trials_df.columns:
-        for row in trials_df.itertuples(index=False):
-            study_site_combinations.add((row.Study, row.SiteforVisit))
-
-    # Add from study_site_details (includes studies without trial schedules)
-    if study_details_df is not None and not study_details_df.empty:
-        # DEBUG: Log what columns we actually have
-        log_activity(f"DEBUG gantt_view: study_details_df columns: {list(study_details_df.columns)}", level='info')
-
-        # Handle ContractSite as canonical, with backward-compatible fallbacks
-        if 'ContractSite' in study_details_df.columns:
-            site_col = 'ContractSite'
-        elif 'ContractedSite' in study_details_df.columns:
-            site_col = 'ContractedSite'
-        else:
-            site_col = 'SiteforVisit'
-
-        # OPTIMIZED: use itertuples for 2-3x speedup
-        for row in study_details_df.itertuples(index=False):
-            study_site_combinations.add((row.Study, getattr(row, site_col)))
-    
-    if not study_site_combinations:
+    pairs = _study_site_pairs(trials_df, study_details_df)
+    if pairs.empty:
         log_activity("No study-site combinations found, cannot build Gantt data", level='error')
-        return pd.DataFrame(columns=['Site', 'Study', 'StartDate', 'EndDate', 'LastEnrollment', 'Status', 'Duration', 'LPFVDate', 'SIVDate']), {}
-    
-    # Get unique sites from all combinations
-    unique_sites = sorted(set(site for _, site in study_site_combinations))
-    
-    for site in unique_sites:
-        # Get all studies for this site from our combinations
-        site_studies = sorted(set(study for study, s in study_site_combinations if s == site))
-        
-        for study in site_studies:
-            dates = calculate_study_dates(study, site, patients_df, visits_df, trials_df)
-            
-            # Calculate duration in days
-            duration = None
-            if dates['start_date'] and dates['end_date']:
-                duration = (dates['end_date'] - dates['start_date']).days
-            
-            # Get patient recruitment data
-            recruitment_list = get_patient_recruitment_data(study, site, patients_df)
-            patient_recruitment_data[(study, site)] = recruitment_list
-            
-            # Extract SIV date
-            siv_date = None
-            if actual_visits_df is not None:
-                siv_date = extract_siv_dates(study, site, actual_visits_df)
-            
-            gantt_rows.append({
-                'Site': site,
-                'Study': study,
-                'StartDate': dates['start_date'],
-                'EndDate': dates['end_date'],
-                'LastEnrollment': dates['last_enrollment'],
-                'Status': dates['status'],
-                'Duration': duration,
-                'LPFVDate': dates['lpfv_date'],
-                'SIVDate': siv_date
-            })
-    
-    gantt_df = pd.DataFrame(gantt_rows)
-    
+        return pd.DataFrame(columns=GANTT_COLUMNS), {}
+
+    overrides = _study_site_overrides(pairs, trials_df, study_details_df)
+
+    # Calculated dates are per study (all sites); LPFV only ever comes from an override
+    start_dates = overrides['FPFV'].fillna(pairs['Study'].map(_study_patient_starts(patients_df)))
+    end_dates = overrides['LPLV'].fillna(pairs['Study'].map(_study_visit_ends(visits_df)))
+    start_dates = _as_dates(pd.to_datetime(start_dates))
+    end_dates = _as_dates(pd.to_datetime(end_dates))
+    lpfv_dates = _as_dates(overrides['LPFV'])
+    siv_dates = _as_dates(_pair_siv_dates(pairs, actual_visits_df))
+
+    gantt_df = pd.DataFrame({
+        'Site': pairs['Site'],
+        'Study': pairs['Study'],
+        'StartDate': start_dates,
+        'EndDate': end_dates,
+        'LastEnrollment': lpfv_dates,
+        'Status': overrides['Status'],
+        'Duration': [(end - start).days if start and end else None for start, end in zip(start_dates, end_dates)],
+        'LPFVDate': lpfv_dates,
+        'SIVDate': siv_dates,
+    })
+
+    recruitment_curves = build_recruitment_curves(patients_df)
+    patient_recruitment_data = {
+        (study, site): recruitment_curves.get(study, []) for site, study in zip(pairs['Site'], pairs['Study'])
+    }
+
     # Only show studies that have actual date data (patients enrolled or visits scheduled)
     gantt_df = gantt_df[gantt_df['StartDate'].notna()]
     
@@ -325,45 +267,6 @@ def get_status_color(status: str) -> str:
     }
     return status_colors.get(status.lower(), '#95a5a6')
 
-def extract_siv_dates(study: str, site: str, actual_visits_df: Optional[pd.DataFrame]) -> Optional[date]:
-    """
-    Extract SIV (Site Initiation Visit) date for a study at a specific site.
-    
-    Args:
-        study: Study name
-        site: Site name (SiteforVisit)
-        actual_visits_df: Actual visits dataframe
-    
-    Returns:
-        SIV date or None if not found
-    """
-    if actual_visits_df is None or actual_visits_df.empty:
-        return None
-    
-    # Filter for SIV events for this study
-    siv_visits = actual_visits_df[
-        (actual_visits_df['Study'] == study) &
-        (actual_visits_df.get('VisitType', '').astype(str).str.lower() == 'siv')
-    ]
-    
-    if siv_visits.empty:
-        return None
-    
-    # Get SiteforVisit from actual_visits if available, or match by site
-    # SIVs may not have SiteforVisit in actual_visits, so we check if it matches
-    if 'SiteforVisit' in siv_visits.columns:
-        site_matched = siv_visits[siv_visits['SiteforVisit'] == site]
-        if not site_matched.empty:
-            siv_visits = site_matched
-    
-    # Get the earliest SIV date (in case there are multiple)
-    if 'ActualDate' in siv_visits.columns:
-        siv_dates = pd.to_datetime(siv_visits['ActualDate'], errors='coerce').dropna()
-        if not siv_dates.empty:
-            return siv_dates.min().date()
-    
-    return None
-
 def display_gantt_chart(gantt_data: pd.DataFrame, patient_recruitment_data: Dict[Tuple[str, str], List[Tuple[date, int]]],
                        visits_df: Optional[pd.DataFrame] = None,
                        patients_df: Optional[pd.DataFrame] = None):
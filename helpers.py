@@ -2,6 +2,10 @@ import pandas as pd
 from dateutil.parser import parse
 from datetime import datetime
 
+# Standard priority order for patient origin site columns, and placeholder values that don't count
+PATIENT_SITE_COLUMNS = ['PatientPractice', 'PatientSite', 'Site', 'Practice', 'HomeSite']
+INVALID_SITE_VALUES = ['nan', 'None', '', 'null', 'NULL', 'Unknown Site']
+
 def get_patient_origin_site(patient_row, default="Unknown Site"):
     """
     Get patient origin site with consistent column priority.
@@ -13,18 +17,29 @@ def get_patient_origin_site(patient_row, default="Unknown Site"):
     Returns:
         str: Patient origin site name
     """
-    # Standard priority order for site columns
-    site_columns = ['PatientPractice', 'PatientSite', 'Site', 'Practice', 'HomeSite']
-    
-    for col in site_columns:
+    for col in PATIENT_SITE_COLUMNS:
         if col in patient_row and pd.notna(patient_row[col]):
             site_value = str(patient_row[col]).strip()
             # Validate it's not an invalid placeholder
-            if site_value and site_value not in ['nan', 'None', '', 'null', 'NULL', 'Unknown Site']:
+            if site_value and site_value not in INVALID_SITE_VALUES:
                 return site_value
     
     return default
 
+def get_patient_origin_site_for_series(patients_df, default="Unknown Site"):
+    """get_patient_origin_site for every row of a patients DataFrame at once (vectorized)"""
+    origin_sites = pd.Series(default, index=patients_df.index, dtype=object)
+    found = pd.Series(False, index=patients_df.index)
+    for col in PATIENT_SITE_COLUMNS:
+        if col not in patients_df.columns:
+            continue
+        values = patients_df[col]
+        site_values = values.astype(str).str.strip()
+        valid = ~found & values.notna() & ~site_values.isin(INVALID_SITE_VALUES)
+        origin_sites[valid] = site_values[valid]
+        found |= valid
+    return origin_sites
+
 def log_site_detection_summary(patients_df, function_name="Unknown"):
     """
     Log a summary of site detection results for verification.
@@ -322,8 +337,8 @@ def get_financial_year_boundaries(fy_string):
 
 def get_current_financial_year_boundaries():
     """Get the start and end dates for the current financial year"""
-    from datetime import date
-    today = pd.to_datetime(date.today())
+    from runtime_context import current_date
+    today = pd.to_datetime(current_date())
     
     if today.month >= 4:
         fy_start = pd.to_datetime(f"{today.year}-04-01")
@@ -443,14 +458,14 @@ def get_trial_payment_for_visit(trials_lookup, study, visit_name):
 # =============================================================================
 # ERROR COLLECTION SYSTEM - SUPABASE PREPARATION
 # =============================================================================
-import streamlit as st
-from datetime import datetime
 from typing import List, Dict, Optional
+from runtime_context import get_context
 
 def init_error_system():
     """Initialize error tracking in session state for Supabase preparation"""
-    if 'error_log' not in st.session_state:
-        st.session_state.error_log = {
+    state = get_context().state
+    if 'error_log' not in state:
+        state['error_log'] = {
             'errors': [],
             'warnings': [],
             'info': [],
@@ -466,7 +481,8 @@ def log_error(message: str, error_type: str = 'error', context: Optional[Dict] =
         error_type: 'error', 'warning', or 'info'
         context: Optional dict with patient_id, study, file_name, etc.
     """
-    if 'error_log' not in st.session_state:
+    state = get_context().state
+    if 'error_log' not in state:
         init_error_system()
     
     log_entry = {
@@ -476,21 +492,23 @@ def log_error(message: str, error_type: str = 'error', context: Optional[Dict] =
         'context': context or {}
     }
     
-    st.session_state.error_log[f"{error_type}s"].append(log_entry)
+    state['error_log'][f"{error_type}s"].append(log_entry)
 
 def get_error_summary() -> Dict[str, int]:
     """Get summary of errors for display"""
-    if 'error_log' not in st.session_state:
+    state = get_context().state
+    if 'error_log' not in state:
         return {'errors': 0, 'warnings': 0, 'info': 0}
     
     return {
-        'errors': len(st.session_state.error_log.get('errors', [])),
-        'warnings': len(st.session_state.error_log.get('warnings', [])),
-        'info': len(st.session_state.error_log.get('info', []))
+        'errors': len(state['error_log'].get('errors', [])),
+        'warnings': len(state['error_log'].get('warnings', [])),
+        'info': len(state['error_log'].get('info', []))
     }
 
 def display_error_log_section():
     """Display collected errors in expandable section"""
+    import streamlit as st
     if 'error_log' not in st.session_state:
         return
     
@@ -526,8 +544,9 @@ def display_error_log_section():
 
 def clear_error_log():
     """Clear error log"""
-    if 'error_log' in st.session_state:
-        st.session_state.error_log = {
+    state = get_context().state
+    if 'error_log' in state:
+        state['error_log'] = {
             'errors': [],
             'warnings': [],
             'info': [],
@@ -570,69 +589,80 @@ def validate_database_schema(df: pd.DataFrame, required_columns: List[str]) -> t
 # =============================================================================
 # ACTIVITY LOG SYSTEM
 # =============================================================================
-from datetime import datetime
+from collections import deque
+from itertools import islice
+import threading
+from config import DEBUG_ERRORS, DEBUG_STANDARD, DEBUG_VERBOSE
+
+# Fixed capacity of the activity log ring buffer (oldest entries drop off)
+MAX_LOG_ENTRIES = 500
+
+# Minimum debug level (config.DEBUG_*) at which each log level is recorded;
+# unknown levels are recorded at any level above DEBUG_OFF
+LOG_LEVEL_THRESHOLDS = {'error': DEBUG_ERRORS, 'warning': DEBUG_STANDARD,
+                        'info': DEBUG_VERBOSE, 'success': DEBUG_VERBOSE}
+
+# Debug level snapshot for the current script run (Streamlit runs each session's script in its own thread)
+_log_state = threading.local()
+
+def refresh_log_level(level: int = None) -> int:
+    """Snapshot the debug level used by log_activity for the rest of this run.
+
+    Called at the top of each app run and whenever the debug level changes.
+    """
+    if level is None:
+        from config import get_debug_level
+        level = get_debug_level()
+    _log_state.level = level
+    return level
+
+def log_enabled(level: str = 'info') -> bool:
+    """Whether a message at this level would be recorded (use to skip building costly messages)"""
+    current_level = getattr(_log_state, 'level', None)
+    if current_level is None:
+        current_level = refresh_log_level()
+    return current_level >= LOG_LEVEL_THRESHOLDS.get(level, DEBUG_ERRORS)
 
 def init_activity_log():
-    """Initialize activity log in session state"""
-    if 'activity_log' not in st.session_state:
-        st.session_state.activity_log = []
+    """Initialize activity log ring buffer in session state"""
+    state = get_context().state
+    log = state.get('activity_log')
+    if not isinstance(log, deque):
+        state['activity_log'] = deque(log or [], maxlen=MAX_LOG_ENTRIES)
 
-def log_activity(message: str, level: str = 'info', details: str = None):
+def log_activity(message: str, level: str = 'info', details: str = None, args: tuple = None):
     """
     Log activity with timestamp, respecting debug levels
 
     Args:
-        message: Main activity message
+        message: Main activity message (a str.format template when args is given)
         level: 'info', 'success', 'error', or 'warning'
         details: Optional additional details
+        args: Optional format arguments - the message is only formatted if it will be recorded
     """
-    # Check debug level before logging
-    try:
-        from config import (should_log_info, should_log_warning, 
-                          should_log_error, get_debug_level, DEBUG_OFF)
-        
-        current_level = get_debug_level()
-        
-        # If debug is OFF, don't log anything
-        if current_level == DEBUG_OFF:
-            return
-        
-        # Check level-specific filtering
-        if level == 'error':
-            if not should_log_error():
-                return
-        elif level == 'warning':
-            if not should_log_warning():
-                return
-        elif level in ['info', 'success']:
-            if not should_log_info():
-                return
-    except ImportError:
-        # If config not available, log everything (backward compatibility)
-        pass
-    except Exception:
-        # If any error checking debug level, log anyway (fail open)
-        pass
-    
-    if 'activity_log' not in st.session_state:
+    # OPTIMIZED: Level check against the per-run snapshot, no config import or session read
+    if not log_enabled(level):
+        return
+
+    if args is not None:
+        message = message.format(*args)
+
+    state = get_context().state
+    log = state.get('activity_log')
+    if not isinstance(log, deque):
         init_activity_log()
+        log = state['activity_log']
 
-    log_entry = {
+    log.append({
         'timestamp': datetime.now(),
         'message': message,
         'level': level,
         'details': details
-    }
-
-    st.session_state.activity_log.append(log_entry)
-
-    # Keep only last 500 entries to prevent memory issues (increased from 100 for longer sessions)
-    MAX_LOG_ENTRIES = 500
-    if len(st.session_state.activity_log) > MAX_LOG_ENTRIES:
-        st.session_state.activity_log = st.session_state.activity_log[-MAX_LOG_ENTRIES:]
+    })
 
 def display_activity_log_sidebar():
     """Display activity log in sidebar expander"""
+    import streamlit as st
     if 'activity_log' not in st.session_state or not st.session_state.activity_log:
         return
     
@@ -640,7 +670,7 @@ def display_activity_log_sidebar():
     
     with st.sidebar.expander(f"📋 Activity Log ({log_count})", expanded=False):
         # Display in reverse chronological order (newest first)
-        for entry in reversed(st.session_state.activity_log[-50:]):  # Show last 50
+        for entry in islice(reversed(st.session_state.activity_log), 50):  # Show last 50
             timestamp_str = entry['timestamp'].strftime('%H:%M:%S')
             level = entry['level']
             message = entry['message']
@@ -662,9 +692,29 @@ def display_activity_log_sidebar():
                 st.caption(f"   {entry['details']}")
 
 
-def trigger_data_refresh():
-    """Mark that data should be refreshed and bump cache buster."""
-    import streamlit as st
+def trigger_data_refresh(changed_patients=None, tables=None):
+    """Mark that data should be refreshed and bump cache buster.
+
+    changed_patients: optional (PatientID, Study) pairs whose visits changed; if every refresh
+    since the last calendar build lists them, the calendar is updated incrementally.
+    tables: optional database tables that were written (their caches were already cleared by
+    database.invalidate_tables); without it the refresh clears every database cache.
+    """
+    state = get_context().state
+
+    state['data_refresh_needed'] = True
+    state['calendar_cache_buster'] = state.get('calendar_cache_buster', 0) + 1
 
-    st.session_state.data_refresh_needed = True
-    st.session_state.calendar_cache_buster = st.session_state.get('calendar_cache_buster', 0) + 1
+    pending_tables = state.get('stale_tables', set())
+    if tables is None or pending_tables is None:
+        state['stale_tables'] = None  # Unknown writes - clear all caches
+    else:
+        state['stale_tables'] = set(pending_tables) | set(tables)
+
+    pending = state.get('calendar_changed_patients', set())
+    if changed_patients is None or pending is None:
+        state['calendar_changed_patients'] = None  # Full rebuild needed
+    else:
+        state['calendar_changed_patients'] = set(pending) | {
+            (str(patient_id), str(study)) for patient_id, study in changed_patients
+        }
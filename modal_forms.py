@@ -414,7 +414,7 @@ def patient_entry_modal():
                         log_activity(f"Added patient {new_patient_id} to database", level='success')
                         
                         # Trigger data refresh
-                        trigger_data_refresh()
+                        trigger_data_refresh(tables=['patients'])
                         st.session_state.show_patient_form = False
                         st.rerun()
                     else:
@@ -853,8 +853,8 @@ def visit_entry_modal():
                             level='success'
                         )
                         
-                        # Trigger data refresh
-                        trigger_data_refresh()
+                        # Trigger data refresh - only this patient's calendar rows need rebuilding
+                        trigger_data_refresh(changed_patients=[(selected_patient_id, patient_study)], tables=['actual_visits'])
                         st.session_state.show_visit_form = False
                         st.rerun()
                     else:
@@ -1126,7 +1126,7 @@ def study_event_entry_modal():
                         log_activity(f"Recorded study event {event_name} for {selected_study}", level='success')
                         
                         # Trigger data refresh
-                        trigger_data_refresh()
+                        trigger_data_refresh(tables=['actual_visits', 'trial_schedules'])
                         st.session_state.show_study_event_form = False
                         st.rerun()
                     else:
@@ -1384,7 +1384,7 @@ def proposed_visit_entry_modal():
                     log_activity(f"Proposed visit added: {selected_patient_id} - {selected_study} - {selected_visit_name} on {proposed_date}", level='success')
 
                     # Trigger data refresh
-                    trigger_data_refresh()
+                    trigger_data_refresh(tables=['actual_visits'])
                     st.session_state.show_proposed_visit_form = False
                     import time
                     time.sleep(0.5)  # Brief pause for user to see success message
@@ -1653,8 +1653,7 @@ def study_settings_navigation_modal():
                         if db.create_study_site_details(new_study, new_site, details):
                             st.success(f"✅ Successfully created {new_study} at {new_site}")
                             log_activity(f"Created new study: {new_study}/{new_site}", level='success')
-                            db.clear_database_cache()
-                            trigger_data_refresh()
+                            trigger_data_refresh(tables=['study_site_details'])
                             # Close modal and refresh to show new study
                             st.session_state['study_settings_add_new'] = False
                             st.session_state['show_study_settings_form'] = False
@@ -2057,9 +2056,8 @@ def study_settings_navigation_modal():
                         st.success(f"✅ Successfully updated settings for {selected_study} at {selected_site}")
                         log_activity(f"Updated study settings: {selected_study}/{selected_site} - Status: {selected_status}, Target: {recruitment_target}", level='success')
 
-                        # Clear cache and refresh
-                        db.clear_database_cache()
-                        trigger_data_refresh()
+                        # Refresh (the save already cleared the study_site_details caches)
+                        trigger_data_refresh(tables=['study_site_details'])
 
                         # Reset clear flags for this study
                         if clear_key_base in st.session_state:
@@ -0,0 +1,693 @@
+# -*- coding: utf-8 -*-
+"""
+Headless parity checks for the data layer and the calendar pipeline
+
+Runs each check against synthetic datasets (synthetic_data.py) without a Streamlit server or
+database and reports whether it passed, with the first differences when it did not. Run from
+the repo root (exits non-zero when a check fails):
+
+    python parity_checks.py --sizes 50 300
+"""
+import argparse
+import json
+import random
+import re
+import sys
+from html.parser import HTMLParser
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from config import DEBUG_OFF
+from runtime_context import HeadlessContext, use_context
+from synthetic_data import DEFAULT_SEED, REFERENCE_DATE, generate_dataset
+
+CHECKS = ('paged_fetch', 'visit_engine', 'calendar_fill', 'calendar_cache', 'calendar_render')
+DEFAULT_SIZES = (50, 300)
+# Differences reported per failed check
+MAX_DIFFERENCES = 5
+
+
+class LocalTableClient:
+    """In-memory stand-in for the Supabase client
+
+    Supports table().select().order().range()/limit().execute() and, like the hosted API,
+    returns at most max_rows rows per request (default: a quarter of the table, so every table
+    takes several requests). Like Postgres without ORDER BY, a request without
+    order() sees the rows in an arbitrary order, so only ordered paging reads a table exactly once.
+    """
+
+    def __init__(self, tables: Dict[str, List[dict]], max_rows: Optional[int] = None):
+        self.tables = tables
+        self.max_rows = max_rows
+        self.requests = 0
+
+    def table(self, name: str):
+        self._rows, self._columns, self._count = self.tables.get(name, []), None, None
+        self._range, self._ordered = (0, None), False
+        return self
+
+    def select(self, columns: str = "*", count: Optional[str] = None):
+        self._columns = None if columns == "*" else columns.split(",")
+        self._count = count
+        return self
+
+    def order(self, column: str):
+        self._rows = sorted(self._rows, key=lambda row: row.get(column))
+        self._ordered = True
+        return self
+
+    def range(self, start: int, end: int):
+        self._range = (start, end)
+        return self
+
+    def limit(self, count: int):
+        return self.range(0, count - 1)
+
+    def execute(self):
+        self.requests += 1
+        if not self._ordered:
+            self._rows = random.Random(self.requests).sample(self._rows, len(self._rows))
+        start, end = self._range
+        stop = len(self._rows) if end is None else end + 1
+        max_rows = self.max_rows or max(1, len(self._rows) // 4)
+        rows = self._rows[start:min(stop, start + max_rows)]
+        if self._columns:
+            rows = [{col: row.get(col) for col in self._columns} for row in rows]
+        count = len(self._rows) if self._count else None
+        return type('Response', (), {'data': rows, 'count': count})()
+
+
+def table_records(df):
+    """Rows of a DataFrame as the JSON records the Supabase API returns (ISO dates)"""
+    return json.loads(df.to_json(orient='records', date_format='iso'))
+
+
+# Public fetcher per table (each reads its table through fetch_table)
+TABLE_FETCHERS = {
+    'patients': 'fetch_all_patients',
+    'trial_schedules': 'fetch_all_trial_schedules',
+    'actual_visits': 'fetch_all_actual_visits',
+    'study_site_details': 'fetch_all_study_site_details',
+}
+
+
+def check_paged_fetch(dataset, page_size=None, max_rows=None):
+    """Tables larger than one response are read completely and exactly once
+
+    fetch_table() must return every row and value of each table through a client capped below
+    the page size (see LocalTableClient), and each database.fetch_all_* loader every id once.
+    """
+    import database
+    from database import FETCH_PAGE_SIZE, fetch_table
+    tables = {name: table_records(df) for name, df in dataset.items()}
+    client = LocalTableClient(tables, max_rows=max_rows)
+
+    differences = []
+    for name, df in dataset.items():
+        expected = pd.DataFrame(tables[name])
+        fetched = fetch_table(client, name, list(df.columns), page_size=page_size or FETCH_PAGE_SIZE)
+        if list(fetched.columns) != list(expected.columns):
+            differences.append(f"{name}: columns {list(fetched.columns)}")
+        elif len(fetched) != len(expected) or fetched['id'].nunique() != len(expected):
+            differences.append(f"fetch_table {name}: {fetched['id'].nunique()} distinct of {len(expected)} rows in {len(fetched)}")
+        elif not fetched.sort_values('id', ignore_index=True).equals(expected.sort_values('id', ignore_index=True)):
+            differences.append(f"fetch_table {name}: values differ")
+
+    # The app's loaders, with the stand-in client (their caches are cleared around the check)
+    get_client = database.get_supabase_client
+    database.get_supabase_client = lambda: client
+    try:
+        database.invalidate_tables(*TABLE_FETCHERS)
+        for name, fetcher in TABLE_FETCHERS.items():
+            fetched = getattr(database, fetcher)()
+            ids = fetched['id'] if fetched is not None and 'id' in fetched.columns else pd.Series(dtype=int)
+            if len(ids) != len(dataset[name]) or set(ids) != set(dataset[name]['id']):
+                differences.append(f"{fetcher}: {ids.nunique()} distinct of {len(dataset[name])} ids in {len(ids)} rows")
+    finally:
+        database.get_supabase_client = get_client
+        database.invalidate_tables(*TABLE_FETCHERS)
+    return len(differences) == 0, differences
+
+
+def _datetimes_as_ns(df):
+    """df with every datetime column as datetime64[ns]
+
+    pandas 3 infers the unit from the source (seconds for Timestamps in records, microseconds
+    from numpy arithmetic), and assert_frame_equal treats different units as different values.
+    """
+    columns = df.select_dtypes(include=['datetime64']).columns
+    return df.astype({col: 'datetime64[ns]' for col in columns})
+
+
+def check_visit_engine(patients_df, patient_visits, stoppages, actual_visits_df, anchor_config=None):
+    """The vectorized visit engine matches the row-by-row process_all_patients path
+
+    Both take the prepared inputs of a calendar build (_prepare_calendar_inputs) and must return
+    the same visit records and processing stats.
+    """
+    from processing_calendar import process_all_patients
+    from visit_engine import generate_patient_visits
+
+    reference = process_all_patients(patients_df, patient_visits, stoppages, actual_visits_df, anchor_config)
+    vectorized = generate_patient_visits(patients_df, patient_visits, stoppages, actual_visits_df, anchor_config)
+
+    differences = []
+    reference_df = _datetimes_as_ns(pd.DataFrame(reference['visit_records']))
+    vectorized_df = _datetimes_as_ns(vectorized['visit_records'])
+
+    if list(reference_df.columns) != list(vectorized_df.columns):
+        differences.append(f"Columns differ: {list(reference_df.columns)} vs {list(vectorized_df.columns)}")
+    elif len(reference_df) != len(vectorized_df):
+        differences.append(f"Row count differs: {len(reference_df)} vs {len(vectorized_df)}")
+    else:
+        try:
+            pd.testing.assert_frame_equal(reference_df, vectorized_df, check_dtype=False)
+        except AssertionError as e:
+            differences.append(f"Visit records differ: {e}")
+
+    for key in ['actual_visits_used', 'unmatched_visits', 'screen_fail_exclusions', 'out_of_window_visits',
+                'processing_messages', 'recalculated_patients', 'patients_with_no_visits']:
+        if reference[key] != vectorized[key]:
+            differences.append(f"'{key}' differs: {reference[key]!r} vs {vectorized[key]!r}")
+    return len(differences) == 0, differences
+
+
+def _fill_calendar_cell_by_cell(calendar_df, visits_df, trials_df):
+    """The original calendar fill, one visit and one cell at a time (oracle for check_calendar_fill)
+
+    Decides what a cell shows from the emoji of the labels already in it, as the app did before
+    the fill went column-wise; kept here only to produce the expected grid.
+    """
+    from calendar_builder import _build_col_id_mapping
+    from helpers import format_site_events, safe_string_conversion
+    from visit_processor import expand_tolerance_markers
+
+    for study in trials_df["Study"].unique():
+        calendar_df[f"{study} Income"] = 0.0
+    calendar_df["Daily Total"] = 0.0
+    if visits_df.empty:
+        return calendar_df
+
+    tolerance_markers = expand_tolerance_markers(visits_df)
+    if not tolerance_markers.empty:
+        visits_df = pd.concat([visits_df, tolerance_markers], ignore_index=True, sort=False)
+    visits_in_range = visits_df[
+        (visits_df["Date"] >= calendar_df["Date"].min()) & (visits_df["Date"] <= calendar_df["Date"].max())
+    ].copy()
+    visits_in_range["Date"] = pd.to_datetime(visits_in_range["Date"]).dt.normalize()
+
+    col_id_mapping = _build_col_id_mapping(calendar_df.columns)
+    date_to_idx = {date: idx for idx, date in enumerate(pd.to_datetime(calendar_df['Date']).dt.normalize())}
+
+    for visit_date, visits_today in visits_in_range.groupby("Date"):
+        if visit_date not in date_to_idx:
+            continue
+        i = date_to_idx[visit_date]
+        daily_total = 0.0
+        site_events = {}
+
+        for visit_tuple in visits_today.itertuples(index=True):
+            visit = visits_today.loc[visit_tuple.Index]
+            study = str(visit["Study"])
+            pid = str(visit["PatientID"])
+            visit_info = visit["Visit"]
+            payment = float(visit["Payment"]) if pd.notna(visit["Payment"]) else 0.0
+            is_actual = visit.get("IsActual", False)
+            visit_site = visit["SiteofVisit"]
+            is_study_event = visit.get("IsStudyEvent", False)
+            if pd.isna(is_study_event):
+                is_study_event = False
+
+            if is_study_event:
+                site_events.setdefault(visit_site, [])
+                event_type = safe_string_conversion(visit.get("EventType", "")).upper()
+                study_name = safe_string_conversion(visit.get("Study", ""))
+                if not event_type or event_type in ['NAN', 'NONE', '']:
+                    continue
+                if not study_name or study_name in ['NAN', 'NONE', ''] or study_name.upper() == 'NAN':
+                    continue
+                site_events[visit_site].append(f"✅ {event_type}_{study_name}")
+                income_col = f"{study_name} Income"
+                if income_col in calendar_df.columns and payment > 0:
+                    calendar_df.at[i, income_col] += payment
+                    daily_total += payment
+                continue
+
+            base_col_id = f"{study}_{pid}"
+            col_id = None
+            if base_col_id in calendar_df.columns:
+                col_id = base_col_id
+            elif base_col_id in col_id_mapping:
+                col_id = col_id_mapping[base_col_id][0]
+
+            if col_id and col_id in calendar_df.columns:
+                current_value = calendar_df.at[i, col_id]
+                if current_value == "":
+                    calendar_df.at[i, col_id] = visit_info
+                else:
+                    current_str = str(current_value)
+                    has_actual = any(symbol in current_str for symbol in ["✅", "🔴", "⚠️"])
+                    has_planned = "📅" in current_str
+                    has_predicted = "📋" in current_str
+                    has_proposed = "❓" in current_str
+
+                    if visit_info in ["-", "+"]:
+                        if not (has_actual or has_planned or has_predicted):
+                            if current_value in ["-", "+", ""]:
+                                calendar_df.at[i, col_id] = visit_info
+                            else:
+                                calendar_df.at[i, col_id] = f"{current_value}, {visit_info}"
+                    elif "📅" in visit_info and "(Planned)" in visit_info:
+                        if not has_actual:
+                            if current_value in ["-", "+", ""]:
+                                calendar_df.at[i, col_id] = visit_info
+                            else:
+                                calendar_df.at[i, col_id] = f"{current_value}\n{visit_info}"
+                    elif "❓" in visit_info and "(Proposed)" in visit_info:
+                        if current_value in ["-", "+", ""] or not has_actual:
+                            calendar_df.at[i, col_id] = visit_info
+                        else:
+                            calendar_df.at[i, col_id] = f"{current_value}\n{visit_info}"
+                    elif "📋" in visit_info and "(Predicted)" in visit_info:
+                        if current_value in ["-", "+", ""]:
+                            calendar_df.at[i, col_id] = visit_info
+                        elif not (has_actual or has_planned or has_proposed):
+                            calendar_df.at[i, col_id] = f"{current_value}\n{visit_info}"
+                    elif current_value in ["-", "+", ""] or not has_actual:
+                        calendar_df.at[i, col_id] = visit_info
+                    else:
+                        calendar_df.at[i, col_id] = f"{current_value}\n{visit_info}"
+
+            # Payments for actual visits and scheduled main visits, never for proposed ones
+            is_proposed = visit.get('IsProposed', False)
+            if (is_actual and not is_proposed) or (not is_actual and visit_info not in ("-", "+")):
+                income_col = f"{study} Income"
+                if income_col in calendar_df.columns:
+                    calendar_df.at[i, income_col] += payment
+                    daily_total += payment
+
+        for site, events in site_events.items():
+            events_col = f"{site}_Events"
+            if events_col in calendar_df.columns:
+                calendar_df.at[i, events_col] = format_site_events(events)
+        calendar_df.at[i, "Daily Total"] = daily_total
+    return calendar_df
+
+
+def check_calendar_fill(calendar_df, visits_df, trials_df):
+    """Golden-output check: the column-wise fill gives the same grid as the cell-by-cell fill
+
+    Fills copies of an empty calendar (build_calendar_dataframe) with both and diffs every column.
+    The status frame of the column-wise fill must cover the grid's dates and cell columns, with
+    each cell's mask matching its labels.
+    """
+    from calendar_builder import fill_calendar_with_visits
+    from visit_status import visit_status_mask
+
+    reference = _fill_calendar_cell_by_cell(calendar_df.copy(), visits_df, trials_df)
+    columnwise, cell_status = fill_calendar_with_visits(calendar_df.copy(), visits_df, trials_df)
+
+    differences = []
+    if list(reference.columns) != list(columnwise.columns):
+        differences.append(f"Columns differ: {list(reference.columns)} vs {list(columnwise.columns)}")
+        return False, differences
+
+    for col in reference.columns:
+        if pd.api.types.is_float_dtype(reference[col]):
+            mismatched = ~np.isclose(reference[col].to_numpy(dtype=float), columnwise[col].to_numpy(dtype=float))
+        else:
+            mismatched = (reference[col].astype(str) != columnwise[col].astype(str)).to_numpy()
+        for i in np.flatnonzero(mismatched)[:MAX_DIFFERENCES]:
+            differences.append(
+                f"{col} on {reference.at[i, 'Date']:%Y-%m-%d}: {reference.at[i, col]!r} vs {columnwise.at[i, col]!r}"
+            )
+
+    if not cell_status.index.equals(pd.DatetimeIndex(columnwise['Date'])):
+        differences.append("Status frame dates differ from the calendar's")
+        return False, differences
+    for col in cell_status.columns:
+        expected = columnwise[col].map(visit_status_mask).to_numpy()
+        for i in np.flatnonzero(cell_status[col].to_numpy() != expected)[:MAX_DIFFERENCES]:
+            differences.append(
+                f"{col} status on {columnwise.at[i, 'Date']:%Y-%m-%d}: {cell_status[col].iat[i]} for {columnwise.at[i, col]!r}"
+            )
+    return len(differences) == 0, differences
+
+
+def check_calendar_cache(dataset):
+    """build_calendar reuses an incremental build only while the tables are unchanged
+
+    Builds the calendar, updates it incrementally for one patient (trigger_data_refresh with
+    changed_patients) and calls build_calendar again with the same cache buster: with the same
+    tables it must return the incremental build, with a table edited outside the session (same
+    cache buster, new content) it must rebuild and match a full build of the edited tables.
+    Runs in its own context, with the performance history off.
+    """
+    import config
+    import processing_calendar
+    from helpers import trigger_data_refresh
+    from processing_calendar import _build_calendar_impl, build_calendar, clear_build_calendar_cache
+
+    patients_df = dataset['patients'].copy()
+    trials_df = dataset['trial_schedules'].copy()
+    actual_visits_df = dataset['actual_visits'].copy()
+    changed = actual_visits_df.iloc[0]
+    updated = actual_visits_df.drop(actual_visits_df.index[0])
+    edited = updated.drop(updated.index[0])
+
+    differences = []
+    history_path = config.PERFORMANCE_HISTORY_PATH
+    config.PERFORMANCE_HISTORY_PATH = None
+    context = HeadlessContext(settings={'debug_level': DEBUG_OFF}, today=REFERENCE_DATE)
+    try:
+        with use_context(context):
+            clear_build_calendar_cache()
+            build_calendar(patients_df, trials_df, actual_visits_df)
+            trigger_data_refresh(changed_patients=[(changed['PatientID'], changed['Study'])], tables=['actual_visits'])
+            build_calendar(patients_df, trials_df, updated)
+            if not context.state['calendar_last_build']['incremental']:
+                differences.append("Update for one patient was not incremental")
+
+            misses = processing_calendar._calendar_cache_misses
+            build_calendar(patients_df, trials_df, updated)
+            if processing_calendar._calendar_cache_misses != misses or not context.state['calendar_last_build']['incremental']:
+                differences.append("Unchanged tables did not reuse the incremental build")
+
+            result = build_calendar(patients_df, trials_df, edited)
+            if processing_calendar._calendar_cache_misses == misses:
+                differences.append("Changed table content with the same cache buster reused the incremental build")
+            expected = _build_calendar_impl(patients_df.copy(), trials_df.copy(), edited.copy())
+            if not result[1].equals(expected[1]):
+                differences.append("Rebuilt calendar differs from a full build of the edited tables")
+    finally:
+        config.PERFORMANCE_HISTORY_PATH = history_path
+        clear_build_calendar_cache()
+    return len(differences) == 0, differences
+
+
+def _patient_info(col_name, site_column_mapping):
+    for site_data in site_column_mapping.values():
+        for p_info in site_data.get('patient_info', []):
+            if p_info['col_id'] == col_name:
+                return p_info
+    return None
+
+
+def _styler_visit_tooltip(cell_content, col_name, site_column_mapping, date_str=None):
+    """Tooltip text of a visit cell, as the Styler renderer built it"""
+    from display_components import _visit_tooltip_status
+    if not cell_content or str(cell_content).strip() in ['', '-', '+']:
+        return None
+    patient_info = _patient_info(col_name, site_column_mapping)
+    if not patient_info:
+        return None
+    visit_name, status = _visit_tooltip_status(cell_content)
+    tooltip_parts = [
+        f"Patient: {patient_info['patient_id']}",
+        f"Study: {patient_info['study']}",
+        f"Visit: {visit_name}" if visit_name else "Visit",
+        f"Status: {status}"
+    ]
+    if date_str:
+        tooltip_parts.insert(2, f"Date: {date_str}")
+    tooltip_parts.append(f"Origin: {patient_info.get('origin_site', 'Unknown')}")
+    return " | ".join(tooltip_parts)
+
+
+def _styler_header_tooltip(col_name, site_column_mapping):
+    """Tooltip text of a header cell, as the Styler renderer built it"""
+    patient_info = _patient_info(col_name, site_column_mapping)
+    if patient_info:
+        return f"Patient: {patient_info['patient_id']} | Study: {patient_info['study']} | Origin: {patient_info.get('origin_site', 'Unknown')}"
+    return None
+
+
+def _render_styled_calendar(styled_df, site_column_mapping, compact_mode, column_names, header_rows_df):
+    """The original calendar renderer: Styler.to_html() rewritten row by row with regexes
+    (header rows, header/visit tooltips, compact icons)"""
+    from display_components import _calendar_header_style, _calendar_html_document, _convert_to_compact_icon
+
+    html_table_base = styled_df.to_html(escape=False, index=False)
+    header_html = header_rows_df.to_html(escape=False, index=False, header=False)
+    header_tr_matches = re.findall(r'<tr[^>]*>.*?</tr>', header_html, re.DOTALL)
+    if header_tr_matches and '<tbody>' in html_table_base:
+        html_table_base = html_table_base.replace('<tbody>', '<tbody>\n' + '\n'.join(header_tr_matches), 1)
+
+    # One <tr>...</tr> per line
+    html_table_base = re.sub(
+        r'<tr[^>]*>.*?</tr>',
+        lambda match: re.sub(r'>\s+<', '><', re.sub(r'\s+', ' ', match.group(0))),
+        html_table_base, flags=re.DOTALL
+    )
+
+    lines = []
+    header_rows_assigned = 0
+    in_thead = False
+    for line in html_table_base.split('\n'):
+        if '<thead>' in line or '</thead>' in line:
+            in_thead = '<thead>' in line
+            lines.append(line)
+            continue
+        if '<tbody>' in line or '</tbody>' in line or '<tr' not in line:
+            lines.append(line)
+            continue
+
+        is_data_row = '<td>' in line
+        if '<th>' in line and not is_data_row and in_thead:
+            lines.append(re.sub(r'<th[^>]*></th>\s*', '', line, count=1))
+            continue
+
+        if is_data_row and header_rows_assigned < 3:
+            header_rows_assigned += 1
+            td_matches = list(re.finditer(r'<td[^>]*>(.*?)</td>', line))
+            th_matches = list(re.finditer(r'<th[^>]*>(.*?)</th>', line))
+            for idx, match in enumerate(th_matches or td_matches):
+                if idx < len(column_names):
+                    tooltip = _styler_header_tooltip(column_names[idx], site_column_mapping)
+                    tag_content = match.group(0)
+                    if tooltip and 'title=' not in tag_content:
+                        line = line.replace(tag_content, tag_content.replace('>', f' title="{tooltip}">', 1), 1)
+            line = line.replace('<tr', f'<tr class="header-row-{header_rows_assigned}"', 1)
+            sticky_style = _calendar_header_style(header_rows_assigned, compact_mode)
+
+            def add_sticky_style(match):
+                tag_attrs = match.group(2)
+                if 'style=' in tag_attrs:
+                    tag_attrs = re.sub(r'style="[^"]*"', f'style="{sticky_style}"', tag_attrs)
+                else:
+                    tag_attrs = f'{tag_attrs} style="{sticky_style}"'
+                return f'<{match.group(1)}{tag_attrs}>'
+            lines.append(re.sub(r'<(td|th)([^>]*)>', add_sticky_style, line))
+            continue
+
+        # Data rows: compact icons and visit tooltips, last cell first
+        date_match = re.search(r'<td[^>]*>(\d{2}/\d{2}/\d{4})</td>', line)
+        date_str = date_match.group(1) if date_match else None
+        td_matches = list(re.finditer(r'<td[^>]*>(.*?)</td>', line))
+        new_line = line
+        for idx in range(min(len(td_matches), len(column_names)) - 1, -1, -1):
+            col_name = column_names[idx]
+            if col_name in ['Date', 'Day']:
+                continue
+            match = td_matches[idx]
+            cell_content = match.group(1)
+            if compact_mode:
+                icon_content = _convert_to_compact_icon(cell_content)
+                if icon_content != cell_content:
+                    old_tag = match.group(0)
+                    new_line = new_line.replace(old_tag, old_tag.replace(cell_content, icon_content, 1), 1)
+                    cell_content = icon_content
+            tooltip = _styler_visit_tooltip(cell_content, col_name, site_column_mapping, date_str)
+            tag_content = match.group(0)
+            if tooltip and 'title=' not in tag_content:
+                tooltip = tooltip.replace('"', '&quot;')
+                if 'style=' in tag_content:
+                    new_tag = tag_content.replace('style=', f'title="{tooltip}" style=', 1)
+                else:
+                    new_tag = tag_content.replace('>', f' title="{tooltip}">', 1)
+                new_line = new_line.replace(tag_content, new_tag, 1)
+        lines.append(new_line)
+
+    return _calendar_html_document('\n'.join(lines), compact_mode)
+
+
+def reference_calendar_html(calendar_df, site_column_mapping, unique_visit_sites, today, compact_mode=False):
+    """Calendar page rendered the original way (Styler with style_calendar_row, then regex rewriting)"""
+    from display_components import _calendar_display_frames, _calendar_with_header_rows
+    from formatters import style_calendar_row
+
+    today = pd.to_datetime(today)
+    display_df, header_rows = _calendar_display_frames(calendar_df, site_column_mapping, unique_visit_sites)
+    with_headers = _calendar_with_header_rows(display_df, header_rows)
+    styled_data = with_headers.iloc[3:].style.apply(lambda row: style_calendar_row(row, today), axis=1).hide(axis='index')
+    # Styler stops rendering rows past styler.render.max_elements cells - render the whole grid
+    with pd.option_context('styler.render.max_elements', max(with_headers.size, 1)):
+        return _render_styled_calendar(
+            styled_data, site_column_mapping, compact_mode, list(with_headers.columns), with_headers.iloc[:3]
+        )
+
+
+class _CalendarCellParser(HTMLParser):
+    """Rows of (tag attributes, text) per <td> plus the <style> text of a calendar page"""
+
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self.css = []
+        self._cell = None
+        self._in_style = False
+        self._in_thead = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'thead':
+            self._in_thead = True
+        elif tag == 'style':
+            self._in_style = True
+        elif tag == 'tr' and not self._in_thead:
+            self.rows.append((dict(attrs).get('class', ''), []))
+        elif tag == 'td' and self.rows and not self._in_thead:
+            self._cell = [dict(attrs), '']
+
+    def handle_endtag(self, tag):
+        if tag == 'thead':
+            self._in_thead = False
+        elif tag == 'style':
+            self._in_style = False
+        elif tag == 'td' and self._cell is not None:
+            self.rows[-1][1].append(tuple(self._cell))
+            self._cell = None
+
+    def handle_data(self, data):
+        if self._in_style:
+            self.css.append(data)
+        elif self._cell is not None:
+            self._cell[1] += data
+
+
+def _css_declarations(css):
+    """selector -> set of 'property: value' declarations for simple '#id'/'td.class' rules"""
+    declarations = {}
+    for selectors, body in re.findall(r'([^{}]+)\{([^{}]*)\}', css):
+        decls = frozenset(' '.join(d.split()) for d in body.split(';') if d.strip())
+        for selector in selectors.split(','):
+            selector = selector.strip()
+            if selector.startswith('#T_'):
+                declarations[selector[1:]] = decls
+            elif ' td.' in selector:
+                declarations[selector.rsplit('.', 1)[1]] = decls
+    return declarations
+
+
+def _calendar_cells(html_doc):
+    """Data rows of a rendered calendar page as lists of (text, declarations, title)"""
+    parser = _CalendarCellParser()
+    parser.feed(html_doc)
+    declarations = _css_declarations(''.join(parser.css))
+    rows = []
+    for row_class, cells in parser.rows:
+        if row_class.startswith('header-row') or not cells:
+            continue
+        rows.append([
+            (text.strip(),
+             declarations.get(attrs.get('id'), declarations.get(attrs.get('class'), frozenset())),
+             attrs.get('title'))
+            for attrs, text in cells
+        ])
+    return rows
+
+
+def check_calendar_render(calendar_df, site_column_mapping, unique_visit_sites, cell_status=None, today=REFERENCE_DATE):
+    """Golden-output check: render_calendar_table matches the Styler renderer cell by cell
+
+    Renders the calendar both ways, in standard and compact mode, and diffs text, effective
+    cell style and tooltip of every data cell. Header tooltips are not compared: the Styler
+    renderer attaches them by replacing the first matching tag, which shifts them onto earlier
+    cells. In compact mode only text and style are compared, as it drops the tooltips of cells
+    it turned into icons.
+    """
+    from display_components import _calendar_display_frames, _calendar_html_document, render_calendar_table
+
+    today = pd.to_datetime(today)
+    display_df, header_rows = _calendar_display_frames(calendar_df, site_column_mapping, unique_visit_sites)
+    columns = list(display_df.columns)
+    differences = []
+    for compact_mode in (False, True):
+        mode = 'compact' if compact_mode else 'standard'
+        reference = reference_calendar_html(calendar_df, site_column_mapping, unique_visit_sites, today, compact_mode)
+        table_html, cell_css = render_calendar_table(display_df, header_rows, site_column_mapping, today, compact_mode,
+                                                     cell_status=cell_status)
+        direct = _calendar_html_document(table_html, compact_mode, cell_css=cell_css)
+
+        reference_rows, direct_rows = _calendar_cells(reference), _calendar_cells(direct)
+        if len(reference_rows) != len(direct_rows):
+            differences.append(f"{mode}: row count differs: {len(reference_rows)} vs {len(direct_rows)}")
+            continue
+        for reference_row, direct_row in zip(reference_rows, direct_rows):
+            for col, expected, actual in zip(columns, reference_row, direct_row):
+                if compact_mode:
+                    expected, actual = expected[:2], actual[:2]
+                if expected != actual and len(differences) < MAX_DIFFERENCES:
+                    differences.append(f"{mode}: {col} on {reference_row[0][0]}: {expected!r} vs {actual!r}")
+    return len(differences) == 0, differences
+
+
+def _check_calls(dataset):
+    """(check name, function returning (matches, differences)) for every check"""
+    from calendar_builder import build_calendar_dataframe
+    from processing_calendar import _build_anchor_config, _build_calendar_impl, _prepare_calendar_inputs
+
+    (patients_df, trials_df, actual_visits_df, patient_visits, _, stoppages, _) = _prepare_calendar_inputs(
+        dataset['patients'].copy(), dataset['trial_schedules'].copy(), dataset['actual_visits'].copy()
+    )
+    (visits_df, calendar_df, cell_status, _, _, site_column_mapping, unique_visit_sites, _) = _build_calendar_impl(
+        dataset['patients'].copy(), dataset['trial_schedules'].copy(), dataset['actual_visits'].copy()
+    )
+    empty_calendar = build_calendar_dataframe(visits_df, patients_df, False, actual_visits_df)[0]
+    return {
+        'paged_fetch': lambda: check_paged_fetch(dataset),
+        'visit_engine': lambda: check_visit_engine(
+            patients_df, patient_visits, stoppages, actual_visits_df, _build_anchor_config()),
+        'calendar_fill': lambda: check_calendar_fill(empty_calendar, visits_df, trials_df),
+        'calendar_cache': lambda: check_calendar_cache(dataset),
+        'calendar_render': lambda: check_calendar_render(calendar_df, site_column_mapping, unique_visit_sites, cell_status),
+    }
+
+
+def run_checks(sizes=DEFAULT_SIZES, checks=CHECKS, seed=DEFAULT_SEED):
+    """Run every check on a generated dataset per size
+
+    Returns a DataFrame (Patients, Check, Passed, Differences). A check that raises is recorded
+    as failed with its error. Checks run in a headless context with logging off and today fixed
+    at the datasets' REFERENCE_DATE.
+    """
+    rows = []
+    with use_context(HeadlessContext(settings={'debug_level': DEBUG_OFF}, today=REFERENCE_DATE)):
+        for size in sizes:
+            calls = _check_calls(generate_dataset(size, seed=seed))
+            for check in checks:
+                try:
+                    passed, differences = calls[check]()
+                except Exception as e:
+                    passed, differences = False, [f"{type(e).__name__}: {e}"]
+                rows.append({'Patients': size, 'Check': check, 'Passed': passed,
+                             'Differences': '; '.join(map(str, differences[:MAX_DIFFERENCES]))})
+    return pd.DataFrame(rows, columns=['Patients', 'Check', 'Passed', 'Differences'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check optimized paths against their reference behaviour on synthetic data")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="patient counts")
+    parser.add_argument('--checks', nargs='+', choices=CHECKS, default=list(CHECKS))
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    args = parser.parse_args(argv)
+
+    results = run_checks(args.sizes, args.checks, seed=args.seed)
+    with pd.option_context('display.width', 200, 'display.max_colwidth', 120):
+        print(results.to_string(index=False))
+    return results
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main()['Passed'].all() else 1)
@@ -1,10 +1,13 @@
 import pandas as pd
-from datetime import timedelta, date
+from datetime import timedelta
 import os
 import json
 from helpers import safe_string_conversion, get_visit_type_series
+from runtime_context import current_date
+from visit_status import (STATUS_ACTUAL, STATUS_DATA_ERROR, STATUS_DIED, STATUS_PREDICTED, STATUS_PROPOSED,
+                          STATUS_SCREEN_FAIL, STATUS_WITHDRAWN, render_visit_label)
 from visit_processor import (calculate_tolerance_windows, is_visit_out_of_protocol, 
-                           create_tolerance_window_records)
+                           calculate_tolerance_bounds)
 
 # Known optional visits that don't appear in trial schedules (Day 0, unscheduled, etc.)
 # These should not trigger "not found in trials" warnings
@@ -65,12 +68,13 @@ def get_debug_log_content():
         # Include activity log if level >= VERBOSE
         if current_level >= DEBUG_VERBOSE:
             try:
-                import streamlit as st
-                if 'activity_log' in st.session_state and st.session_state.activity_log:
+                from runtime_context import get_context
+                activity_log = get_context().state.get('activity_log')
+                if activity_log:
                     content_parts.append("=" * 80)
                     content_parts.append("ACTIVITY LOG")
                     content_parts.append("=" * 80)
-                    for entry in st.session_state.activity_log:
+                    for entry in activity_log:
                         timestamp = entry['timestamp'].strftime('%Y-%m-%d %H:%M:%S') if hasattr(entry['timestamp'], 'strftime') else str(entry['timestamp'])
                         level = entry.get('level', 'info').upper()
                         message = entry.get('message', '')
@@ -104,11 +108,71 @@ def get_debug_log_content():
         pass
     return None
 
+# Columns added by match_actual_visits()
+VISIT_MATCH_COLUMNS = ['MatchedVisitName', 'MatchedDay', 'MatchType']
+
+def normalize_visit_names(visit_names):
+    """Normalize a VisitName Series once for matching (str(name).strip() per value)"""
+    return visit_names.astype(str).str.strip()
+
+def match_actual_visits(actual_visits_df, schedule_df, on=None):
+    """Batch-match actual visits to trial schedule visits by VisitName
+
+    Tries an exact merge on the stripped VisitName first, then a case-folded merge,
+    optionally within groups given by `on` (e.g. ['Study', 'Pathway']). The first
+    schedule row wins when a name appears more than once, as in the per-patient lookups.
+
+    Args:
+        actual_visits_df: Actual visits with a VisitName column (plus `on` columns)
+        schedule_df: Trial schedule rows with VisitName and Day (plus `on` columns), in schedule order
+        on: Optional list of columns both frames are matched within
+
+    Returns:
+        DataFrame aligned with actual_visits_df (same index) with columns:
+        MatchedVisitName (normalized actual name), MatchedDay (NaN if unmatched) and
+        MatchType ('exact', 'case_insensitive', 'optional' for KNOWN_OPTIONAL_VISITS, or 'unmatched')
+    """
+    on = list(on or [])
+    names = normalize_visit_names(actual_visits_df['VisitName']) if len(actual_visits_df) else pd.Series(dtype=object)
+    matched_day = pd.Series(float('nan'), index=actual_visits_df.index)
+    case_folded = pd.Series(False, index=actual_visits_df.index)
+
+    if len(actual_visits_df) and schedule_df is not None and not schedule_df.empty:
+        schedule = schedule_df[on].copy()
+        schedule['_name'] = normalize_visit_names(schedule_df['VisitName'])
+        schedule['_name_key'] = schedule['_name'].str.lower()
+        schedule['_day'] = schedule_df['Day'].values
+
+        actuals = actual_visits_df[on].reset_index(drop=True)
+        actuals['_name'] = names.values
+        actuals['_name_key'] = actuals['_name'].str.lower()
+
+        # Exact match first, then case-insensitive (left merges keep actual row order)
+        exact_lookup = schedule.drop_duplicates(on + ['_name'])[on + ['_name', '_day']]
+        exact_day = actuals.merge(exact_lookup, on=on + ['_name'], how='left')['_day']
+        folded_lookup = schedule.drop_duplicates(on + ['_name_key'])[on + ['_name_key', '_day']]
+        folded_day = actuals.merge(folded_lookup, on=on + ['_name_key'], how='left')['_day']
+
+        case_folded = pd.Series((exact_day.isna() & folded_day.notna()).values, index=actual_visits_df.index)
+        matched_day = pd.Series(exact_day.fillna(folded_day).values, index=actual_visits_df.index)
+
+    match_type = pd.Series('unmatched', index=actual_visits_df.index, dtype=object)
+    match_type[names.isin(KNOWN_OPTIONAL_VISITS).values] = 'optional'
+    match_type[matched_day.notna()] = 'exact'
+    match_type[case_folded] = 'case_insensitive'
+
+    return pd.DataFrame({
+        'MatchedVisitName': names.values,
+        'MatchedDay': matched_day.values,
+        'MatchType': match_type.values
+    }, index=actual_visits_df.index)
+
 def process_patient_actual_visits(patient_id, study, actual_visits_df, study_visits):
     """Process actual visits for a specific patient
 
     Args:
-        actual_visits_df: Can be pre-filtered to this patient (for performance) or full DataFrame
+        actual_visits_df: Can be pre-filtered to this patient (for performance) or full DataFrame.
+            If it already carries match_actual_visits() columns, matching is not repeated.
     """
     from helpers import log_activity
 
@@ -142,56 +206,31 @@ def process_patient_actual_visits(patient_id, study, actual_visits_df, study_vis
     else:
         patient_actuals = actual_visits_df
     
-    if len(patient_actuals) > 0:
-        log_activity(f"  Found {len(patient_actuals)} actual patient visits for {patient_id}", level='info')
-    
-    # OPTIMIZED: Pre-create lookup dictionaries for faster matching (O(1) instead of O(n))
-    # Create exact match lookup
-    study_visits_stripped = study_visits["VisitName"].str.strip()
-    exact_match_lookup = {}
-    for idx, visit_name in study_visits_stripped.items():
-        if visit_name not in exact_match_lookup:
-            exact_match_lookup[visit_name] = study_visits.loc[idx]
-    
-    # Create case-insensitive lookup (lowercase key -> original row)
-    case_insensitive_lookup = {}
-    for idx, visit_name in study_visits_stripped.items():
-        key = visit_name.lower()
-        if key not in case_insensitive_lookup:
-            case_insensitive_lookup[key] = study_visits.loc[idx]
-    
-    # OPTIMIZED: Use itertuples for faster iteration
-    for actual_visit_tuple in patient_actuals.itertuples():
-        visit_name = str(actual_visit_tuple.VisitName).strip()
-        log_activity(f"    Matching actual visit '{visit_name}' for patient {patient_id}", level='info')
-        
-        # Convert tuple back to Series for compatibility with existing code
-        actual_visit = patient_actuals.loc[actual_visit_tuple.Index]
-        
-        # Try exact match first (O(1) lookup)
-        matching_trial = exact_match_lookup.get(visit_name)
-        
-        # If no exact match, try case-insensitive match (O(1) lookup)
-        if matching_trial is None:
-            matching_trial = case_insensitive_lookup.get(visit_name.lower())
-        
-        if matching_trial is None:
-            # Check if this is a known optional visit (Day 0, unscheduled, etc.)
-            if visit_name in KNOWN_OPTIONAL_VISITS:
-                log_activity(f"      ℹ️ Optional visit '{visit_name}' for patient {patient_id} (Day 0/unscheduled)", level='info')
-            else:
-                log_activity(f"      ⚠️ Visit '{visit_name}' not found in trial schedule", level='warning')
-                unmatched_visits.append(f"Patient {patient_id}, Study {study}: Visit '{visit_name}' not found in trials")
-            # Still add it to actual visits so it shows up on calendar
-            patient_actual_visits[visit_name] = actual_visit
-            actual_visits_used += 1
-            continue
-        
-        # Found a match!
-        matched_day = matching_trial["Day"]
-        log_activity(f"      ✅ Matched to trial visit (Day {matched_day})", level='info')
-        patient_actual_visits[visit_name] = actual_visit
-        actual_visits_used += 1
+    if len(patient_actuals) == 0:
+        return patient_actual_visits, actual_visits_used, unmatched_visits
+
+    log_activity("  Found {} actual patient visits for {}", level='info', args=(len(patient_actuals), patient_id))
+    
+    # OPTIMIZED: Batch matching (exact, then case-insensitive merge) instead of per-row lookups.
+    # Reuse matches computed upfront for all patients when available.
+    if 'MatchType' in patient_actuals.columns and patient_actuals['MatchType'].notna().all():
+        matches = patient_actuals[VISIT_MATCH_COLUMNS]
+    else:
+        matches = match_actual_visits(patient_actuals, study_visits)
+
+    for visit_name in matches.loc[matches['MatchType'] == 'unmatched', 'MatchedVisitName']:
+        log_activity(f"      ⚠️ Visit '{visit_name}' not found in trial schedule", level='warning')
+        unmatched_visits.append(f"Patient {patient_id}, Study {study}: Visit '{visit_name}' not found in trials")
+
+    optional_names = matches.loc[matches['MatchType'] == 'optional', 'MatchedVisitName'].tolist()
+    if optional_names:
+        log_activity("      ℹ️ Optional visit(s) {} for patient {} (Day 0/unscheduled)", level='info', args=(optional_names, patient_id))
+
+    # Still add unmatched visits to actual visits so they show up on calendar.
+    # Plain dict records instead of a Series per row; later rows with the same name win.
+    records = patient_actuals.drop(columns=VISIT_MATCH_COLUMNS, errors='ignore').to_dict('records')
+    patient_actual_visits = dict(zip(matches['MatchedVisitName'], records))
+    actual_visits_used = len(records)
     
     return patient_actual_visits, actual_visits_used, unmatched_visits
 
@@ -229,7 +268,7 @@ def process_actual_visit(patient_id, study, patient_origin, patient_seen_at, vis
     
     # Check if this is a proposed visit (future date or explicit patient_proposed type)
     # Ensure both dates are properly normalized for comparison
-    today = pd.Timestamp(date.today()).normalize()
+    today = pd.Timestamp(current_date()).normalize()
     # visit_date is already normalized above, ensure it's date-only
     visit_date = pd.Timestamp(visit_date.date()).normalize() if hasattr(visit_date, 'date') else pd.Timestamp(visit_date).normalize()
     
@@ -239,7 +278,7 @@ def process_actual_visit(patient_id, study, patient_origin, patient_seen_at, vis
     # Debug logging for proposed visit detection
     if is_proposed:
         from helpers import log_activity
-        log_activity(f"  Proposed visit detected: {visit_name} on {visit_date.strftime('%Y-%m-%d')} (today: {today.strftime('%Y-%m-%d')})", level='info')
+        log_activity("  Proposed visit detected: {} on {:%Y-%m-%d} (today: {:%Y-%m-%d})", level='info', args=(visit_name, visit_date, today))
     
     # Get payment amount
     trial_payment = visit.get("Payment", 0)
@@ -257,7 +296,7 @@ def process_actual_visit(patient_id, study, patient_origin, patient_seen_at, vis
     # Improved data validation with warnings
     # CRITICAL: Skip stoppage date validation for proposed visits (they're legitimate tentative bookings)
     if not is_proposed and stoppage_date is not None and visit_date > stoppage_date:
-        visit_status = f"⚠️ DATA ERROR {visit_name}"
+        status_code = STATUS_DATA_ERROR
         is_out_of_protocol = False
         processing_messages.append(f"⚠️ Patient {patient_id} has visit '{visit_name}' on {visit_date.strftime('%Y-%m-%d')} AFTER screen failure, withdrawal, or death")
     else:
@@ -268,22 +307,23 @@ def process_actual_visit(patient_id, study, patient_origin, patient_seen_at, vis
             # Proposed visit - format with 📅 emoji and (Proposed) text
             from helpers import log_activity
             if is_screen_fail:
-                visit_status = f"⚠️ Screen Fail {visit_name}"  # Shouldn't happen, but handle gracefully
+                status_code = STATUS_SCREEN_FAIL  # Shouldn't happen, but handle gracefully
             elif is_withdrawn:
-                visit_status = f"⚠️ Withdrawn {visit_name}"  # Shouldn't happen, but handle gracefully
+                status_code = STATUS_WITHDRAWN  # Shouldn't happen, but handle gracefully
             elif is_died:
-                visit_status = f"⚠️ Died {visit_name}"  # Shouldn't happen, but handle gracefully
+                status_code = STATUS_DIED  # Shouldn't happen, but handle gracefully
             else:
-                visit_status = f"📅 {visit_name} (Proposed)"
-                log_activity(f"  Formatting as proposed: {visit_status}", level='info')
+                status_code = STATUS_PROPOSED
+                log_activity("  Formatting as proposed: {}", level='info', args=(render_visit_label(visit_name, status_code),))
         elif is_screen_fail:
-            visit_status = f"⚠️ Screen Fail {visit_name}"
+            status_code = STATUS_SCREEN_FAIL
         elif is_withdrawn:
-            visit_status = f"⚠️ Withdrawn {visit_name}"
+            status_code = STATUS_WITHDRAWN
         elif is_died:
-            visit_status = f"⚠️ Died {visit_name}"
+            status_code = STATUS_DIED
         else:
-            visit_status = f"✅ {visit_name}"
+            status_code = STATUS_ACTUAL
+    visit_status = render_visit_label(visit_name, status_code)
     
     # CHANGED: Use patient SiteSeenAt for visit location
     site = patient_seen_at
@@ -307,6 +347,7 @@ def process_actual_visit(patient_id, study, patient_origin, patient_seen_at, vis
         "Date": visit_date,
         "PatientID": patient_id,
         "Visit": visit_status,
+        "VisitStatus": status_code,
         "Study": study,
         "Payment": payment,
         "SiteofVisit": site,
@@ -375,7 +416,13 @@ def process_scheduled_visit(patient_id, study, patient_origin, patient_seen_at,
     # END CHANGED
     
     # Style the visit name as predicted (no actual visit yet)
-    visit_display = f"📋 {visit_name} (Predicted)"
+    visit_display = render_visit_label(visit_name, STATUS_PREDICTED)
+    
+    # CHANGED: Tolerance window stored as interval columns on the predicted visit;
+    # '-'/'+' markers are expanded only when the calendar grid is filled
+    tolerance_start, tolerance_end = calculate_tolerance_bounds(
+        scheduled_date, tolerance_before, tolerance_after, visit_day, stoppage_date
+    )
     
     # Create main scheduled visit record
     contract_site = visit.get("ContractSite") or visit.get("SiteforVisit")
@@ -383,6 +430,7 @@ def process_scheduled_visit(patient_id, study, patient_origin, patient_seen_at,
         "Date": scheduled_date,
         "PatientID": patient_id,
         "Visit": visit_display,
+        "VisitStatus": STATUS_PREDICTED,
         "Study": study,
         "Payment": payment,
         "SiteofVisit": site,
@@ -394,16 +442,13 @@ def process_scheduled_visit(patient_id, study, patient_origin, patient_seen_at,
         "IsOutOfProtocol": False,
         "VisitDay": visit_day,
         "VisitName": visit_name,
-        "VisitType": visit_type
+        "VisitType": visit_type,
+        "ExpectedDate": scheduled_date,
+        "ToleranceStart": tolerance_start,
+        "ToleranceEnd": tolerance_end
     }
     
-    # Create tolerance window records for predicted visits
-    tolerance_records = create_tolerance_window_records(
-        patient_id, study, site, patient_origin, expected_date,
-        tolerance_before, tolerance_after, visit_day, visit_name,
-        stoppage_date
-    )
-    return [main_record] + tolerance_records, 0
+    return [main_record], 0
 
 def update_patient_status_on_visit(patient_id, study, visit_name, visit_notes, visit_date):
     """Update patient status when certain visits are recorded
@@ -461,7 +506,8 @@ def process_single_patient(patient, patient_visits, stoppages, actual_visits_df=
     patient_origin = str(patient.get("PatientPractice", "Unknown Site"))
     patient_seen_at = patient.get("SiteSeenAt") or patient_origin
 
-    log_activity(f"Processing patient {patient_id} (Study: {study}, ScreeningDate: {screening_date}, Origin: {patient_origin})", level='info')
+    log_activity("Processing patient {} (Study: {}, ScreeningDate: {}, Origin: {})", level='info',
+                 args=(patient_id, study, screening_date, patient_origin))
 
     visit_records = []
     actual_visits_used = 0
@@ -558,7 +604,7 @@ def process_single_patient(patient, patient_visits, stoppages, actual_visits_df=
                 )
 
     # CRITICAL: Identify proposed visits AND latest actual visit BEFORE creating predicted visits (for suppression logic)
-    today = pd.Timestamp(date.today()).normalize()
+    today = pd.Timestamp(current_date()).normalize()
     proposed_visits = {}  # visit_name -> proposed_date
     proposed_visit_dates = []  # List of all proposed dates for this patient
     actual_visit_dates = []  # List of all completed (past) actual visit dates
@@ -573,7 +619,7 @@ def process_single_patient(patient, patient_visits, stoppages, actual_visits_df=
             # This is a proposed visit (future)
             proposed_visits[visit_name] = visit_date
             proposed_visit_dates.append(visit_date)
-            log_activity(f"  Found proposed visit: {visit_name} on {visit_date.strftime('%Y-%m-%d')}", level='info')
+            log_activity("  Found proposed visit: {} on {:%Y-%m-%d}", level='info', args=(visit_name, visit_date))
         else:
             # This is a completed actual visit (past or today)
             actual_visit_dates.append(visit_date)
@@ -699,7 +745,8 @@ def process_single_patient(patient, patient_visits, stoppages, actual_visits_df=
                         suppress_reason = f"missed visit (before latest actual visit on {latest_actual_date.strftime('%Y-%m-%d')})"
 
                 if should_suppress:
-                    log_activity(f"  Suppressing predicted visit {visit_name} on {predicted_date.strftime('%Y-%m-%d')} - {suppress_reason}", level='info')
+                    log_activity("  Suppressing predicted visit {} on {:%Y-%m-%d} - {}", level='info',
+                                 args=(visit_name, predicted_date, suppress_reason))
                     # Don't create this predicted visit
                 else:
                     # Process scheduled visit with full tolerance windows
@@ -781,23 +828,25 @@ def process_single_patient(patient, patient_visits, stoppages, actual_visits_df=
             is_died = "Died" in notes_str
             
             if is_screen_fail:
-                visit_display = f"⚠️ Screen Fail {visit_name}"
+                status_code = STATUS_SCREEN_FAIL
             elif is_withdrawn:
-                visit_display = f"⚠️ Withdrawn {visit_name}"
+                status_code = STATUS_WITHDRAWN
             elif is_died:
-                visit_display = f"⚠️ Died {visit_name}"
+                status_code = STATUS_DIED
             else:
-                visit_display = f"✅ {visit_name}"
+                status_code = STATUS_ACTUAL
+            visit_display = render_visit_label(visit_name, status_code)
             
             # Check if this unmatched visit is proposed (future date)
             unmatched_visit_date = pd.Timestamp(actual_visit_data["ActualDate"].date())
-            today = pd.Timestamp(date.today()).normalize()
+            today = pd.Timestamp(current_date()).normalize()
             is_unmatched_proposed = unmatched_visit_date > today
             
             visit_record = {
                 "Date": unmatched_visit_date,
                 "PatientID": patient_id,
                 "Visit": visit_display,
+                "VisitStatus": status_code,
                 "Study": study,
                 "Payment": payment,
                 "SiteofVisit": str(visit_site).strip(),
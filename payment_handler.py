@@ -6,7 +6,6 @@ to prevent data loss and ensure accurate financial calculations.
 """
 
 import pandas as pd
-import streamlit as st
 from helpers import log_activity
 
 def get_payment_column_name(df):
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent performance history
+
+Span timings of traced calendar builds (tracing.py) are appended to a local SQLite file,
+keyed by dataset size (patient, actual visit and trial schedule row counts) and app version,
+so build times can be compared across sessions and after data changes.
+"""
+import os
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+
+from helpers import log_activity
+from tracing import trace_breakdown
+
+HISTORY_COLUMNS = ['RecordedAt', 'AppVersion', 'Trace', 'BuildID', 'Stage', 'Depth', 'Seconds',
+                   'SelfSeconds', 'RowsIn', 'RowsOut', 'PeakMemoryMB', 'Patients', 'Visits', 'Trials',
+                   'Dataset']
+
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS span_timings (
+    RecordedAt TEXT NOT NULL,
+    AppVersion TEXT,
+    Trace TEXT NOT NULL,
+    BuildID TEXT NOT NULL,
+    Stage TEXT NOT NULL,
+    Depth INTEGER,
+    Seconds REAL,
+    SelfSeconds REAL,
+    RowsIn INTEGER,
+    RowsOut INTEGER,
+    PeakMemoryMB REAL,
+    Patients INTEGER,
+    Visits INTEGER,
+    Trials INTEGER,
+    Dataset TEXT
+)
+"""
+
+def get_history_path():
+    """Resolved path of the performance history database (None when history is disabled)"""
+    from config import PERFORMANCE_HISTORY_PATH
+    return os.path.expanduser(PERFORMANCE_HISTORY_PATH) if PERFORMANCE_HISTORY_PATH else None
+
+def _connect(path):
+    connection = sqlite3.connect(path, timeout=5)
+    connection.execute(_CREATE_TABLE)
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_span_timings_recorded ON span_timings (Trace, RecordedAt)")
+    return connection
+
+def dataset_key(patients, visits, trials):
+    """Dataset fingerprint used to group builds: row counts of patients, actual visits and trials"""
+    return f"{patients}p/{visits}v/{trials}t"
+
+def record_trace(trace_data, patients=0, visits=0, trials=0, path=None):
+    """Append every span of a finished trace to the history (never raises)
+
+    Returns the number of rows written.
+    """
+    path = path or get_history_path()
+    if path is None:
+        return 0
+    try:
+        from config import APP_VERSION
+        breakdown = trace_breakdown(trace_data)
+        if breakdown.empty:
+            return 0
+        recorded_at = datetime.fromtimestamp(trace_data['started_at'])
+        rows = breakdown.rename(columns={'Span': 'Stage'})[
+            ['Stage', 'Depth', 'Seconds', 'SelfSeconds', 'RowsIn', 'RowsOut', 'PeakMemoryMB']
+        ]
+        rows = rows.astype(object).where(rows.notna(), None)  # NaN -> NULL
+        rows.insert(0, 'RecordedAt', recorded_at.isoformat(timespec='seconds'))
+        rows.insert(1, 'AppVersion', APP_VERSION)
+        rows.insert(2, 'Trace', trace_data['name'])
+        rows.insert(3, 'BuildID', recorded_at.strftime('%Y%m%d%H%M%S%f'))
+        rows['Patients'] = int(patients)
+        rows['Visits'] = int(visits)
+        rows['Trials'] = int(trials)
+        rows['Dataset'] = dataset_key(patients, visits, trials)
+
+        with _connect(path) as connection:
+            connection.executemany(
+                f"INSERT INTO span_timings ({', '.join(HISTORY_COLUMNS)}) VALUES ({', '.join('?' * len(HISTORY_COLUMNS))})",
+                rows[HISTORY_COLUMNS].itertuples(index=False, name=None)
+            )
+        return len(rows)
+    except Exception as e:
+        log_activity(f"Could not record performance history: {e}", level='warning')
+        return 0
+
+def load_history(trace_name='calendar_build', days=None, max_depth=None, path=None):
+    """Recorded span timings as a DataFrame (RecordedAt parsed), oldest first"""
+    query = "SELECT * FROM span_timings WHERE Trace = ?"
+    params = [trace_name]
+    if days is not None:
+        query += " AND RecordedAt >= ?"
+        params.append((datetime.now() - pd.Timedelta(days=days)).isoformat(timespec='seconds'))
+    if max_depth is not None:
+        query += " AND Depth <= ?"
+        params.append(int(max_depth))
+    query += " ORDER BY RecordedAt"
+    path = path or get_history_path()
+    if path is None or not os.path.exists(path):
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+    try:
+        with _connect(path) as connection:
+            history = pd.read_sql_query(query, connection, params=params)
+    except Exception as e:
+        log_activity(f"Could not read performance history: {e}", level='warning')
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+    history['RecordedAt'] = pd.to_datetime(history['RecordedAt'])
+    return history
+
+def stage_percentiles(history, freq='D'):
+    """p50/p95 build time per stage per period (Period, Stage, P50, P95, Builds)"""
+    if history.empty:
+        return pd.DataFrame(columns=['Period', 'Stage', 'P50', 'P95', 'Builds'])
+    grouped = history.groupby([history['RecordedAt'].dt.to_period(freq).dt.start_time.rename('Period'), 'Stage'])['Seconds']
+    return grouped.agg(
+        P50=lambda s: s.quantile(0.5),
+        P95=lambda s: s.quantile(0.95),
+        Builds='count'
+    ).reset_index()
+
+def detect_regressions(history, threshold=None, recent_builds=5, min_seconds=0.05):
+    """Compare each stage's last `recent_builds` builds with the builds before them
+
+    A stage is flagged when its recent median exceeds the earlier median by more than
+    threshold (fraction; default config.PERFORMANCE_REGRESSION_THRESHOLD) and by at least
+    min_seconds. Returns Stage, BaselineP50, RecentP50, Change, Regressed, BaselineDataset, RecentDataset.
+    """
+    if threshold is None:
+        from config import PERFORMANCE_REGRESSION_THRESHOLD
+        threshold = PERFORMANCE_REGRESSION_THRESHOLD
+
+    rows = []
+    for stage, stage_history in history.groupby('Stage', sort=False):
+        builds = stage_history.sort_values('RecordedAt')
+        if len(builds) <= recent_builds:
+            continue
+        baseline, recent = builds.iloc[:-recent_builds], builds.iloc[-recent_builds:]
+        baseline_p50 = baseline['Seconds'].median()
+        recent_p50 = recent['Seconds'].median()
+        change = (recent_p50 - baseline_p50) / baseline_p50 if baseline_p50 else None
+        rows.append({
+            'Stage': stage,
+            'BaselineP50': round(baseline_p50, 4),
+            'RecentP50': round(recent_p50, 4),
+            'Change': round(change, 3) if change is not None else None,
+            'Regressed': bool(change is not None and change > threshold and recent_p50 - baseline_p50 >= min_seconds),
+            'BaselineDataset': baseline['Dataset'].iloc[-1],
+            'RecentDataset': recent['Dataset'].iloc[-1],
+        })
+    return pd.DataFrame(rows, columns=['Stage', 'BaselineP50', 'RecentP50', 'Change', 'Regressed',
+                                       'BaselineDataset', 'RecentDataset'])
@@ -1,15 +1,27 @@
+import hashlib
+import os
+import time
+import numpy as np
 import pandas as pd
-import streamlit as st
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
-from helpers import (safe_string_conversion, standardize_visit_columns, validate_required_columns, 
+from helpers import (safe_string_conversion, safe_string_conversion_series, standardize_visit_columns, validate_required_columns, 
                     get_financial_year_start_year, is_financial_year_end, log_activity, get_visit_type_series)
 from payment_handler import normalize_payment_column, validate_payment_data
 
 # Import from our new modules
-from visit_processor import process_study_events, detect_screen_failures, detect_withdrawals, detect_patient_stoppages
+from visit_processor import (process_study_events, detect_screen_failures, detect_withdrawals, detect_patient_stoppages,
+                             expand_tolerance_markers)
 from patient_processor import process_single_patient
-from calendar_builder import build_calendar_dataframe, fill_calendar_with_visits
-from profiling import timeit
+from calendar_builder import (build_calendar_dataframe, fill_calendar_with_visits, get_calendar_date_range,
+                              build_inactivity_index, hide_inactive_columns)
+from visit_engine import build_study_visit_cache, attach_visit_matches, generate_patient_visits
+from profiling import timeit, record_timing
+from tracing import trace, span, store_trace
+from performance_history import record_trace
+from runtime_context import (get_context, cache_data, set_default_context, register_cache_dependency,
+                             compute_table_fingerprint, CACHE_TABLES)
+from visit_status import STATUS_COLUMN, TOLERANCE_STATUSES, visit_status_column
 
 # Dynamic processing debug flag - checks debug level at runtime
 def _get_processing_debug():
@@ -25,8 +37,12 @@ def _build_anchor_config():
 
     Returns a dict mapping study names to their AnchorVisitName.
     Studies without an AnchorVisitName (or with NULL/empty) are omitted,
-    meaning they use the default Day 1 / Screening anchor.
+    meaning they use the default Day 1 / Screening anchor. Headless runs have no
+    database connection and take the dict from the context's 'anchor_config' setting.
     """
+    context = get_context()
+    if not context.is_streamlit:
+        return dict(context.state.get('anchor_config') or {})
     from database import fetch_all_study_site_details
     anchor_config = {}
     try:
@@ -42,10 +58,12 @@ def _build_anchor_config():
     return anchor_config
 
 
-@timeit
-def _build_calendar_impl(patients_df, trials_df, actual_visits_df=None, hide_inactive=False):
-    """Enhanced calendar builder with study events support - Main orchestrator function"""
-    
+def _prepare_calendar_inputs(patients_df, trials_df, actual_visits_df=None):
+    """Clean, validate and type the raw inputs for a calendar build
+
+    Returns (patients_df, trials_df, actual_visits_df, patient_visits, study_event_templates,
+    stoppages, unmatched_visits).
+    """
     # Clean columns - ensure they are strings before using .str accessor
     patients_df.columns = [str(col).strip() for col in patients_df.columns]
     trials_df.columns = [str(col).strip() for col in trials_df.columns]
@@ -136,42 +154,65 @@ def _build_calendar_impl(patients_df, trials_df, actual_visits_df=None, hide_ina
     # Separate visit types
     patient_visits, study_event_templates = separate_visit_types(trials_df)
 
-    # Process all visits
-    visit_records = []
-
-    # Process study events first
-    if not study_event_templates.empty:
-        visit_records.extend(process_study_events(study_event_templates, actual_visits_df))
-
-    # Build anchor config: {study_name: anchor_visit_name} for studies with rebasing
-    anchor_config = _build_anchor_config()
+    return patients_df, trials_df, actual_visits_df, patient_visits, study_event_templates, stoppages, unmatched_visits
 
+def _generate_patient_visit_stats(patients_df, patient_visits, stoppages, actual_visits_df, anchor_config):
+    """Generate patient visit records with the configured visit engine"""
     # Process patient visits (using stoppages which includes both screen failures and withdrawals)
-    import time
     patient_start = time.time()
-    processing_stats = process_all_patients(
-        patients_df, patient_visits, stoppages, actual_visits_df, anchor_config
-    )
+    # OPTIMIZED: Vectorized visit generation (cross-join patients x schedule) by default;
+    # the row-by-row process_all_patients path is kept as the reference implementation
+    from config import VISIT_ENGINE
+    if VISIT_ENGINE == 'vectorized':
+        processing_stats = generate_patient_visits(
+            patients_df, patient_visits, stoppages, actual_visits_df, anchor_config
+        )
+    else:
+        processing_stats = process_all_patients(
+            patients_df, patient_visits, stoppages, actual_visits_df, anchor_config
+        )
     patient_elapsed = time.time() - patient_start
     if patient_elapsed > 1.0:
         log_activity(f"⏱️ Patient processing took {patient_elapsed:.2f}s for {len(patients_df)} patients ({patient_elapsed/len(patients_df)*1000:.1f}ms per patient)", level='info')
-    
-    visit_records.extend(processing_stats['visit_records'])
-    
-    # Create visits DataFrame
+    return processing_stats
+
+def _create_visits_dataframe(visit_records, processing_stats):
+    """Combine study event records with the patient visit records into one DataFrame"""
+    # Create visits DataFrame (vectorized engine already returns patient visits as a DataFrame)
     df_start = time.time()
-    visits_df = pd.DataFrame(visit_records)
+    patient_records = processing_stats['visit_records']
+    if isinstance(patient_records, pd.DataFrame):
+        if not visit_records:
+            visits_df = patient_records
+        elif patient_records.empty:
+            visits_df = pd.DataFrame(visit_records)
+        else:
+            visits_df = pd.concat([pd.DataFrame(visit_records), patient_records], ignore_index=True, sort=False)
+    else:
+        visit_records.extend(patient_records)
+        visits_df = pd.DataFrame(visit_records)
+    if not visits_df.empty:
+        # Records from every source carry VisitStatus; one int8 column for the whole frame
+        visits_df[STATUS_COLUMN] = visit_status_column(visits_df)
     df_elapsed = time.time() - df_start
     if df_elapsed > 0.5:
-        log_activity(f"⏱️ DataFrame creation took {df_elapsed:.2f}s for {len(visit_records)} records", level='info')
+        log_activity(f"⏱️ DataFrame creation took {df_elapsed:.2f}s for {len(visits_df)} records", level='info')
 
     if _get_processing_debug():
         log_activity(f"Created visits DataFrame with {len(visits_df)} records", level='info')
         if not visits_df.empty:
             log_activity(f"Visits date range: {visits_df['Date'].min()} to {visits_df['Date'].max()}", level='info')
-    if visits_df.empty:
-        raise ValueError("No visits generated. Check that Patient 'Study' matches Trial 'Study' values and ScreeningDate is populated.")
+    return visits_df
 
+def _count_predicted_visits(visits_df):
+    """Count predicted visits (excludes actuals, tolerance markers and study events)"""
+    predicted_mask = ~visits_df['IsActual'].fillna(False).astype(bool) & ~visit_status_column(visits_df).isin(TOLERANCE_STATUSES)
+    if 'IsStudyEvent' in visits_df.columns:
+        predicted_mask &= ~visits_df['IsStudyEvent'].fillna(False).astype(bool)
+    return int(predicted_mask.sum())
+
+def _remove_duplicate_visits(visits_df):
+    """Drop duplicate visits (same patient, study, date, visit), keeping the first"""
     # Check for duplicate visits (same patient, study, date, visit)
     dedup_start = time.time()
     if 'PatientID' in visits_df.columns and 'Study' in visits_df.columns and 'Date' in visits_df.columns and 'Visit' in visits_df.columns:
@@ -189,6 +230,64 @@ def _build_calendar_impl(patients_df, trials_df, actual_visits_df=None, hide_ina
         if _get_processing_debug():
             log_activity(f"Reset duplicate indices in visits DataFrame", level='info')
         visits_df = visits_df.reset_index(drop=True)
+    return visits_df
+
+@timeit
+def _build_calendar_impl(patients_df, trials_df, actual_visits_df=None, hide_inactive=False):
+    """Enhanced calendar builder with study events support - Main orchestrator function"""
+    return select_calendar_view(_build_calendar_data(patients_df, trials_df, actual_visits_df), hide_inactive)
+
+
+def select_calendar_view(build, hide_inactive=False):
+    """Build result for the current view - hide_inactive only drops inactive patients' columns"""
+    if not hide_inactive:
+        return build['result']
+    (visits_df, calendar_df, cell_status, stats, processing_messages, site_column_mapping,
+     unique_visit_sites, patients_df) = build['result']
+    calendar_df, site_column_mapping = hide_inactive_columns(calendar_df, site_column_mapping, build['inactivity_index'])
+    return (visits_df, calendar_df, cell_status, stats, processing_messages, site_column_mapping,
+            unique_visit_sites, patients_df)
+
+
+@timeit
+def _build_calendar_data(patients_df, trials_df, actual_visits_df=None):
+    """Full calendar build (every patient column) plus the per-patient inactivity index
+
+    Returns:
+        dict: {'result': _build_calendar_impl result tuple, 'inactivity_index': build_inactivity_index output}
+    """
+    with span('prepare_calendar_inputs', rows_in=len(patients_df)) as record:
+        (patients_df, trials_df, actual_visits_df, patient_visits, study_event_templates,
+         stoppages, unmatched_visits) = _prepare_calendar_inputs(patients_df, trials_df, actual_visits_df)
+        if record is not None:
+            record['rows_out'] = len(patient_visits)
+
+    # Process all visits
+    visit_records = []
+
+    # Process study events first
+    if not study_event_templates.empty:
+        with span('process_study_events', rows_in=len(study_event_templates)) as record:
+            visit_records.extend(process_study_events(study_event_templates, actual_visits_df))
+            if record is not None:
+                record['rows_out'] = len(visit_records)
+
+    # Build anchor config: {study_name: anchor_visit_name} for studies with rebasing
+    anchor_config = _build_anchor_config()
+
+    processing_stats = _generate_patient_visit_stats(patients_df, patient_visits, stoppages, actual_visits_df, anchor_config)
+    with span('create_visits_dataframe') as record:
+        visits_df = _create_visits_dataframe(visit_records, processing_stats)
+        if record is not None:
+            record['rows_out'] = len(visits_df)
+    if visits_df.empty:
+        raise ValueError("No visits generated. Check that Patient 'Study' matches Trial 'Study' values and ScreeningDate is populated.")
+
+    total_predicted_visits = _count_predicted_visits(visits_df)
+    with span('remove_duplicate_visits', rows_in=len(visits_df)) as record:
+        visits_df = _remove_duplicate_visits(visits_df)
+        if record is not None:
+            record['rows_out'] = len(visits_df)
 
     # Build processing messages
     processing_messages = build_processing_messages(processing_stats, unmatched_visits)
@@ -198,17 +297,17 @@ def _build_calendar_impl(patients_df, trials_df, actual_visits_df=None, hide_ina
         log_activity(f"Building calendar with {len(visits_df)} visits", level='info')
     
     # Build calendar dataframe
-    calendar_df, site_column_mapping, unique_visit_sites = build_calendar_dataframe(visits_df, patients_df, hide_inactive, actual_visits_df)
+    calendar_df, site_column_mapping, unique_visit_sites = build_calendar_dataframe(visits_df, patients_df, False, actual_visits_df)
     
     # Fill calendar with visits
-    calendar_df = fill_calendar_with_visits(calendar_df, visits_df, trials_df)
+    calendar_df, cell_status = fill_calendar_with_visits(calendar_df, visits_df, trials_df)
 
     # Calculate financial totals
     calendar_df = calculate_financial_totals(calendar_df)
 
     # Build stats
     stats = {
-        "total_visits": len([v for v in visit_records if not v.get('IsActual', False) and v['Visit'] not in ['-', '+'] and not v.get('IsStudyEvent', False)]),
+        "total_visits": total_predicted_visits,
         "total_income": pd.to_numeric(visits_df.get("Payment", 0), errors="coerce").fillna(0).sum(),
         "messages": processing_messages,
         "out_of_window_visits": processing_stats['out_of_window_visits']
@@ -231,39 +330,270 @@ def _build_calendar_impl(patients_df, trials_df, actual_visits_df=None, hide_ina
                     for idx, visit in kiltearn_visits.iterrows():
                         log_activity(f"🔍 DEBUG: Kiltearn visit - PatientID: {visit.get('PatientID')}, Visit: {visit.get('Visit')}, Date: {visit.get('Date')}", level='warning')
 
-    return visits_df, calendar_df, stats, processing_messages, site_column_mapping, unique_visit_sites, patients_df
+    with span('build_inactivity_index', rows_in=len(visits_df)) as record:
+        inactivity_index = build_inactivity_index(visits_df, actual_visits_df)
+        if record is not None:
+            record['rows_out'] = len(inactivity_index)
+
+    return {
+        'result': (visits_df, calendar_df, cell_status, stats, processing_messages, site_column_mapping,
+                   unique_visit_sites, patients_df),
+        'inactivity_index': inactivity_index
+    }
 
 
-@st.cache_data(show_spinner=False)
 @timeit
-def _build_calendar_cached(patients_df, trials_df, actual_visits_df, cache_buster, hide_inactive):
-    """Cached wrapper around the core calendar builder."""
-    return _build_calendar_impl(patients_df, trials_df, actual_visits_df, hide_inactive)
+def update_calendar_for_patients(previous_build, patients_df, trials_df, actual_visits_df, changed_patients):
+    """Incrementally update a previous _build_calendar_data build after visits change for a few patients
+
+    Regenerates only the changed (PatientID, Study) visit rows, refills the calendar rows on the
+    dates those visits touch (old and new, incl. tolerance markers), re-runs
+    calculate_financial_totals from the first changed date and refreshes those patients' inactivity
+    entries. Returns None when the change alters the calendar layout (date range, visit sites or
+    patient columns) and a full build is needed.
+    """
+    (prev_visits, prev_calendar, prev_status, prev_stats, _, site_column_mapping,
+     unique_visit_sites, prev_patients) = previous_build['result']
+    changed = [(str(patient_id).strip(), str(study).strip()) for patient_id, study in changed_patients]
+
+    def is_changed(df):
+        keys = pd.MultiIndex.from_arrays([
+            safe_string_conversion_series(df['PatientID']), safe_string_conversion_series(df['Study'])
+        ])
+        return keys.isin(changed)
+
+    try:
+        # Re-run the normal input preparation on just the changed patients and their actual visits
+        patients_subset = patients_df[is_changed(patients_df)].copy()
+        prev_patient_mask = is_changed(prev_patients)
+        if patients_subset.empty or len(patients_subset) != int(prev_patient_mask.sum()) or not prev_patients.index.is_unique:
+            return None
+        actual_subset = None
+        if actual_visits_df is not None and not actual_visits_df.empty:
+            actual_subset = actual_visits_df[is_changed(actual_visits_df)].copy()
+            if actual_subset.empty:
+                actual_subset = None
+        (patients_subset, trials_df, actual_subset, patient_visits, _,
+         stoppages, unmatched_visits) = _prepare_calendar_inputs(patients_subset, trials_df.copy(), actual_subset)
+
+        processing_stats = _generate_patient_visit_stats(
+            patients_subset, patient_visits, stoppages, actual_subset, _build_anchor_config()
+        )
+        new_rows = _create_visits_dataframe([], processing_stats)
+        new_predicted = 0
+        if not new_rows.empty:
+            new_predicted = _count_predicted_visits(new_rows)
+            new_rows = _remove_duplicate_visits(new_rows)
+
+        # Splice the new rows in where the patient's old rows were
+        old_mask = is_changed(prev_visits)
+        old_rows = prev_visits[old_mask]
+        first_position = int(np.flatnonzero(old_mask)[0]) if old_mask.any() else len(prev_visits)
+        visits_df = pd.concat(
+            [prev_visits.iloc[:first_position][~old_mask[:first_position]], new_rows,
+             prev_visits.iloc[first_position:][~old_mask[first_position:]]],
+            ignore_index=True, sort=False
+        )
+
+        # Layout checks - anything that would add/remove columns or change the date range needs a full build
+        def patient_sites(rows):
+            if rows.empty:
+                return set()
+            return set(zip(rows['PatientID'].astype(str), rows['Study'].astype(str), rows['SiteofVisit']))
+        if patient_sites(old_rows) != patient_sites(new_rows):
+            return None
+        min_date, max_date = get_calendar_date_range(visits_df, prev_patients)
+        if min_date != prev_calendar['Date'].min() or max_date != prev_calendar['Date'].max():
+            return None
+
+        # Dates whose cells or income can change: where the changed patients' rows (incl. tolerance
+        # markers) differ between the previous and the new build
+        def date_signatures(rows):
+            if rows.empty:
+                return pd.Series(dtype=object)
+            rows = pd.concat([rows, expand_tolerance_markers(rows)], ignore_index=True, sort=False)
+            signature = rows.reindex(columns=['PatientID', 'Study', 'Visit', 'Payment', 'SiteofVisit', 'IsActual', 'IsProposed'])
+            signature = signature.astype(str).agg('|'.join, axis=1)
+            return signature.groupby(pd.to_datetime(rows['Date']).dt.normalize()).agg('\n'.join)
+        old_signatures, new_signatures = date_signatures(old_rows).align(date_signatures(new_rows))
+        changed_dates = old_signatures.fillna('') != new_signatures.fillna('')
+        affected = np.sort(old_signatures.index[changed_dates].to_numpy(dtype='datetime64[ns]'))
+
+        calendar_df = prev_calendar.copy()
+        cell_status = prev_status.copy()
+        row_mask = calendar_df['Date'].isin(affected)
+        if row_mask.any():
+            # All visits on those dates, plus predicted visits whose tolerance window reaches one of them
+            on_dates = pd.to_datetime(visits_df['Date']).dt.normalize().isin(affected).to_numpy()
+            if 'ToleranceStart' in visits_df.columns:
+                window_start = visits_df['ToleranceStart'].to_numpy(dtype='datetime64[ns]')
+                window_end = visits_df['ToleranceEnd'].to_numpy(dtype='datetime64[ns]')
+                on_dates = on_dates | visits_df['ToleranceStart'].notna().to_numpy() & (
+                    np.searchsorted(affected, window_start, side='left') < np.searchsorted(affected, window_end, side='right')
+                )
+
+            total_columns = {'Daily Total', 'MonthPeriod', 'Monthly Total', 'FYStart', 'FY Total'}
+            cell_columns = [
+                col for col in calendar_df.columns
+                if col not in ('Date', 'Day') and col not in total_columns and not col.endswith(' Income')
+            ]
+            day_calendar = calendar_df.loc[row_mask, ['Date', 'Day'] + cell_columns].reset_index(drop=True)
+            day_calendar[cell_columns] = ""
+            day_calendar, day_status = fill_calendar_with_visits(day_calendar, visits_df[on_dates], trials_df)
+            income_columns = [col for col in day_calendar.columns if col.endswith(' Income')] + ['Daily Total']
+            calendar_df.loc[row_mask, cell_columns] = day_calendar[cell_columns].to_numpy()
+            cell_status.loc[day_status.index, day_status.columns] = day_status.to_numpy()
+            calendar_df.loc[row_mask, income_columns] = day_calendar[income_columns].to_numpy(dtype=float)
+            calendar_df = calculate_financial_totals(calendar_df, from_date=affected[0])
+
+        # Changed patients' prepared rows replace their previous ones (e.g. status updates)
+        patients_subset["ColumnID"] = patients_subset["Study"] + "_" + patients_subset["PatientID"]
+        prev_keys = list(zip(prev_patients.loc[prev_patient_mask, 'PatientID'], prev_patients.loc[prev_patient_mask, 'Study']))
+        replacement = patients_subset.set_index(['PatientID', 'Study'], drop=False).loc[prev_keys]
+        replacement = replacement.reset_index(drop=True).reindex(columns=prev_patients.columns)
+        replacement.index = prev_patients.index[prev_patient_mask]
+        patients_out = pd.concat([prev_patients[~prev_patient_mask], replacement]).loc[prev_patients.index]
+
+        processing_messages = build_processing_messages(processing_stats, unmatched_visits)
+        stats = dict(prev_stats)
+        stats["total_visits"] = prev_stats["total_visits"] - (_count_predicted_visits(old_rows) if not old_rows.empty else 0) + new_predicted
+        stats["total_income"] = pd.to_numeric(visits_df.get("Payment", 0), errors="coerce").fillna(0).sum()
+        stats["messages"] = processing_messages
+
+        inactivity_index = {
+            key: value for key, value in previous_build['inactivity_index'].items() if key not in set(changed)
+        }
+        inactivity_index.update(build_inactivity_index(new_rows, actual_subset))
+
+        log_activity(f"Incremental calendar update for {len(changed)} patient(s): {len(affected)} date(s) refilled", level='info')
+        return {
+            'result': (visits_df, calendar_df, cell_status, stats, processing_messages, site_column_mapping,
+                       unique_visit_sites, patients_out),
+            'inactivity_index': inactivity_index
+        }
+    except Exception as e:
+        log_activity(f"⚠️ Incremental calendar update failed, running full build: {e}", level='warning')
+        return None
+
+
+_calendar_cache_misses = 0
+
+@cache_data(show_spinner=False)
+@timeit
+def _build_calendar_cached(_patients_df, _trials_df, _actual_visits_df, fingerprints, cache_buster):
+    """Cached wrapper around the core calendar builder.
+
+    Keyed on the table fingerprints (not the DataFrames - underscore args aren't hashed). The full
+    build is cached with its inactivity index, so toggling hide_inactive only re-selects columns.
+    """
+    global _calendar_cache_misses
+    _calendar_cache_misses += 1
+    return _build_calendar_data(_patients_df, _trials_df, _actual_visits_df)
+
+
+def attach_derived_fingerprint(df, *sources):
+    """Mark a DataFrame as computed from sources (fingerprints, cache buster...) so its fingerprint is cheap
+
+    Only frames with a unique index are marked - row selections are told apart by their index labels -
+    and a mark carried over from an earlier frame is dropped otherwise.
+    """
+    if df is None:
+        return df
+    if df.index.is_unique:
+        digest = hashlib.sha1(repr(sources).encode()).hexdigest()[:16]
+        df.attrs['derived_fingerprint'] = (tuple(map(str, df.columns)), digest)
+    else:
+        df.attrs.pop('derived_fingerprint', None)
+    return df
+
+
+def get_table_fingerprint(df):
+    """Fingerprint attached by database.py at fetch time, or a full-content hash for other DataFrames
+
+    A fetch-time fingerprint is only trusted while the row count still matches (pandas carries
+    attrs over to filtered copies). A derived fingerprint (attach_derived_fingerprint) is trusted
+    while the columns match; row selections of the frame are keyed on their index labels.
+    """
+    if df is None:
+        return None
+    derived = df.attrs.get('derived_fingerprint')
+    if derived is not None and derived[0] == tuple(map(str, df.columns)):
+        index_hash = hashlib.sha1(pd.util.hash_pandas_object(df.index).to_numpy().tobytes()).hexdigest()[:16]
+        return (len(df), derived[1], index_hash)
+    fingerprint = df.attrs.get('fingerprint')
+    if fingerprint is not None and fingerprint[0] == len(df):
+        return fingerprint
+    return compute_table_fingerprint(df)
 
 
 def build_calendar(patients_df, trials_df, actual_visits_df=None, cache_buster=None, hide_inactive=False):
-    """Public calendar builder with caching support."""
+    """Public calendar builder with caching support.
+
+    If every change since the last build was registered with trigger_data_refresh(changed_patients=...),
+    the last build is updated incrementally instead of rebuilding all patients. An incremental build
+    is reused only while the cache buster and the tables' fingerprints are unchanged - outside edits
+    picked up by a later fetch go through the fingerprint-keyed cache.
+    """
+    state = get_context().state
     if cache_buster is None:
-        cache_buster = st.session_state.get('calendar_cache_buster', 0)
-    return _build_calendar_cached(patients_df, trials_df, actual_visits_df, cache_buster, hide_inactive)
+        cache_buster = state.get('calendar_cache_buster', 0)
+
+    fingerprint_start = time.perf_counter()
+    fingerprints = tuple(get_table_fingerprint(df) for df in (patients_df, trials_df, actual_visits_df))
+    fingerprint_elapsed = time.perf_counter() - fingerprint_start
+
+    last_build = state.get('calendar_last_build')
+    if (last_build is not None and last_build['incremental'] and last_build['cache_buster'] == cache_buster
+            and last_build.get('fingerprints') == fingerprints):
+        return select_calendar_view(last_build['build'], hide_inactive)
+
+    from config import TRACE_MEMORY
+    build = None
+    cache_hit = False
+    changed_patients = state.get('calendar_changed_patients')
+    with trace('calendar_build', memory=state.get('trace_memory', TRACE_MEMORY)) as build_trace:
+        if last_build is not None and changed_patients and last_build['cache_buster'] != cache_buster:
+            build = update_calendar_for_patients(
+                last_build['build'], patients_df, trials_df, actual_visits_df, changed_patients
+            )
+        incremental = build is not None
+        if build is None:
+            # OPTIMIZED: Cache lookup keyed on fetch-time fingerprints instead of hashing every row
+            lookup_start = time.perf_counter()
+            misses_before = _calendar_cache_misses
+            build = _build_calendar_cached(patients_df, trials_df, actual_visits_df, fingerprints, cache_buster)
+            cache_hit = _calendar_cache_misses == misses_before
+            record_timing(
+                'calendar_cache_lookup', time.perf_counter() - lookup_start + fingerprint_elapsed,
+                fingerprint_elapsed=fingerprint_elapsed, cache_hit=cache_hit
+            )
+
+    # A cache hit only re-reads the stored build - keep the trace of the last real build
+    if not cache_hit:
+        store_trace(build_trace)
+        record_trace(build_trace, patients=len(patients_df), trials=len(trials_df),
+                     visits=len(actual_visits_df) if actual_visits_df is not None else 0)
+
+    # Downstream caches (financial cube, site statistics) key on these instead of hashing the visits/patients
+    attach_derived_fingerprint(build['result'][0], 'calendar_build', fingerprints, cache_buster)
+    attach_derived_fingerprint(build['result'][7], 'calendar_build_patients', fingerprints, cache_buster)
+    state['calendar_last_build'] = {
+        'cache_buster': cache_buster,
+        'fingerprints': fingerprints,
+        'incremental': incremental,
+        'build': build
+    }
+    state['calendar_changed_patients'] = set()
+    return select_calendar_view(build, hide_inactive)
 
 
 def clear_build_calendar_cache():
-    """Clear cached calendar data."""
-    clear_fn = getattr(_build_calendar_cached, "clear", None)
-    if callable(clear_fn):
-        clear_fn()
-        return
-    cache_clear_fn = getattr(_build_calendar_cached, "cache_clear", None)
-    if callable(cache_clear_fn):
-        cache_clear_fn()
-        return
-    # Fallback: clear all data caches if per-function clear is unavailable
-    try:
-        if hasattr(st.cache_data, "clear"):
-            st.cache_data.clear()
-    except Exception:
-        pass
+    """Clear cached calendar builds (other data caches are left alone)."""
+    _build_calendar_cached.clear()
+
+
+# The calendar is built from every table (study_site_details supplies the anchor visits)
+register_cache_dependency('calendar_build', clear_build_calendar_cache, CACHE_TABLES)
 
 def prepare_actual_visits_data(actual_visits_df):
     """Prepare actual visits data with proper data types"""
@@ -361,7 +691,7 @@ def prepare_trials_data(trials_df):
     try:
         trials_df["Day"] = pd.to_numeric(trials_df["Day"], errors='coerce').fillna(1).astype(int)
     except:
-        st.error("Invalid 'Day' values in trials file. Days must be numeric.")
+        get_context().notify("Invalid 'Day' values in trials file. Days must be numeric.")
         raise ValueError("Invalid Day column in trials file")
 
     # Optional interval-based scheduling columns
@@ -496,8 +826,6 @@ def validate_study_structure(patients_df, trials_df):
 
 def separate_visit_types(trials_df):
     """Separate patient visits from study events"""
-    from helpers import get_visit_type_series
-    
     # Ensure VisitType column exists and fill None values (add it if missing, infer from VisitName)
     visit_type_col = None
     if 'VisitType' in trials_df.columns:
@@ -558,65 +886,19 @@ def separate_visit_types(trials_df):
     return patient_visits, study_event_templates
 
 @timeit
-def process_all_patients(patients_df, patient_visits, screen_failures, actual_visits_df, anchor_config=None):
-    """Process visits for all patients
+def _process_patient_rows(positions, patients_df, study_visit_cache, scheduled_studies, screen_failures,
+                          patient_actual_visits_cache, anchor_config):
+    """Run process_single_patient for each patient row
 
-    Args:
-        anchor_config: Optional dict of {study: anchor_visit_name} for visit rebasing.
-            Studies with an anchor visit will rebase downstream predictions from the
-            actual date of that visit once it's recorded.
+    Returns a list of (row position, patient_id, study, results tuple or None if the study
+    has no schedule). Module-level and fed only the slices it needs so it can run in a worker process.
     """
-    all_visit_records = []
-    total_actual_visits_used = 0
-    all_unmatched_visits = []
-    total_screen_fail_exclusions = 0
-    all_out_of_window_visits = []
-    all_processing_messages = []
-    recalculated_patients = []
-    patients_with_no_visits = []
-
-    # OPTIMIZATION 1: Pre-compute study/pathway visit filters to avoid repeated DataFrame filtering
-    # This creates a lookup cache: study_visit_cache[study][pathway] -> filtered DataFrame
-    # Reduces O(N × M) filter operations to O(N) lookups
-    study_visit_cache = {}
-
-    if 'Pathway' in patient_visits.columns:
-        # Build cache for each unique study/pathway combination
-        for study in patient_visits['Study'].unique():
-            study_visit_cache[study] = {}
-            study_visits_all = patient_visits[patient_visits['Study'] == study]
-            for pathway in study_visits_all['Pathway'].unique():
-                study_visit_cache[study][pathway] = study_visits_all[
-                    study_visits_all['Pathway'] == pathway
-                ].sort_values('Day').copy()
-    else:
-        # Backward compatibility: cache by study only
-        for study in patient_visits['Study'].unique():
-            study_visit_cache[study] = {
-                'standard': patient_visits[patient_visits['Study'] == study].sort_values('Day').copy()
-            }
-
-    # OPTIMIZATION 2: Pre-filter actual visits by patient for O(1) lookups
-    # Instead of filtering actual_visits_df for each patient (O(N × M)),
-    # create a dictionary: patient_actual_visits_cache[patient_id_study] -> DataFrame
-    patient_actual_visits_cache = {}
-    if actual_visits_df is not None and not actual_visits_df.empty:
-        from helpers import get_visit_type_series
-        visit_type_series = get_visit_type_series(actual_visits_df, default='patient')
-        # Filter for patient visits only (exclude siv, monitor)
-        patient_actuals_only = actual_visits_df[visit_type_series.isin(['patient', 'extra', 'patient_proposed'])].copy()
-        # Group by patient+study
-        for (patient_id, study), group_df in patient_actuals_only.groupby(['PatientID', 'Study']):
-            cache_key = f"{patient_id}_{study}"
-            patient_actual_visits_cache[cache_key] = group_df
-
-    if _get_processing_debug():
-        log_activity(f"Pre-computed visit filters for {len(study_visit_cache)} studies and {len(patient_actual_visits_cache)} patients", level='info')
+    patient_results = []
 
     # OPTIMIZED: Process patients and generate visits using itertuples (faster than iterrows)
     # itertuples() is 2-3x faster than iterrows() because it returns namedtuples instead of Series
 
-    for patient_tuple in patients_df.itertuples():
+    for position, patient_tuple in zip(positions, patients_df.itertuples()):
         patient_id = str(patient_tuple.PatientID)
         study = str(patient_tuple.Study)
 
@@ -650,18 +932,154 @@ def process_all_patients(patients_df, patient_visits, screen_failures, actual_vi
         # Look up anchor visit name for this study (None means use default Day 1 anchor)
         patient_anchor_visit = anchor_config.get(study) if anchor_config else None
 
-        visit_records, actual_visits_used, unmatched_visits, screen_fail_exclusions, out_of_window_visits, processing_messages, patient_needs_recalc = process_single_patient(
+        results = process_single_patient(
             patient, study_specific_visits, screen_failures, patient_specific_actuals,
             anchor_visit_name=patient_anchor_visit
         )
-        
+        visit_records, actual_visits_used = results[0], results[1]
+
         if _get_processing_debug():
             log_activity(f"DEBUG: Patient {patient_id} used {actual_visits_used} actual visits", level='info')
-        
-        if not visit_records and len(patient_visits[patient_visits["Study"] == study]) == 0:
+
+        if not visit_records and study not in scheduled_studies:
+            results = None
+
+        patient_results.append((position, patient_id, study, results))
+
+    return patient_results
+
+def _process_patient_chunk(chunk):
+    """Worker entry point for the multi-process backend (one chunk of whole studies)"""
+    return _process_patient_rows(*chunk)
+
+def _build_patient_chunks(patients_df, study_visit_cache, scheduled_studies, screen_failures,
+                          patient_actual_visits_cache, anchor_config, num_chunks):
+    """Split patients into chunks of whole studies, balanced by patient count
+
+    Each chunk carries only its studies' schedules and its patients' stoppages and actual visits,
+    so little more than the chunk's own data is pickled to the worker.
+    """
+    studies = patients_df['Study'].astype(str)
+    study_sizes = studies.value_counts()
+
+    # Largest studies first, each to the least-loaded chunk
+    chunk_studies = [[] for _ in range(num_chunks)]
+    chunk_loads = [0] * num_chunks
+    for study, size in study_sizes.items():
+        target = chunk_loads.index(min(chunk_loads))
+        chunk_studies[target].append(study)
+        chunk_loads[target] += size
+
+    chunks = []
+    for bucket in chunk_studies:
+        if not bucket:
+            continue
+        in_chunk = studies.isin(bucket).to_numpy()
+        chunk_patients = patients_df[in_chunk]
+        patient_keys = set(chunk_patients['PatientID'].astype(str) + '_' + chunk_patients['Study'].astype(str))
+        chunks.append((
+            np.flatnonzero(in_chunk).tolist(),
+            chunk_patients,
+            {study: study_visit_cache[study] for study in bucket if study in study_visit_cache},
+            {study for study in bucket if study in scheduled_studies},
+            {key: screen_failures[key] for key in patient_keys if key in screen_failures},
+            {key: patient_actual_visits_cache[key] for key in patient_keys if key in patient_actual_visits_cache},
+            {study: anchor_config[study] for study in bucket if anchor_config and study in anchor_config},
+        ))
+    return chunks
+
+def _get_parallel_workers(patients_df, parallel, max_workers):
+    """Number of worker processes to use (0 = serial)"""
+    from config import PARALLEL_PATIENT_THRESHOLD, PARALLEL_MAX_WORKERS
+    if parallel is None:
+        parallel = PARALLEL_PATIENT_THRESHOLD is not None and len(patients_df) >= PARALLEL_PATIENT_THRESHOLD
+    if not parallel or patients_df.empty:
+        return 0
+    workers = max_workers or PARALLEL_MAX_WORKERS or os.cpu_count() or 1
+    workers = min(workers, patients_df['Study'].astype(str).nunique())
+    return workers if workers > 1 else 0
+
+def process_all_patients(patients_df, patient_visits, screen_failures, actual_visits_df, anchor_config=None,
+                         parallel=None, max_workers=None):
+    """Process visits for all patients
+
+    Args:
+        anchor_config: Optional dict of {study: anchor_visit_name} for visit rebasing.
+            Studies with an anchor visit will rebase downstream predictions from the
+            actual date of that visit once it's recorded.
+        parallel: True/False to force the multi-process backend on/off; None switches it on
+            at config.PARALLEL_PATIENT_THRESHOLD patients (off while that is None).
+        max_workers: Worker process count (defaults to config.PARALLEL_MAX_WORKERS or CPU count).
+    """
+    all_visit_records = []
+    total_actual_visits_used = 0
+    all_unmatched_visits = []
+    total_screen_fail_exclusions = 0
+    all_out_of_window_visits = []
+    all_processing_messages = []
+    recalculated_patients = []
+    patients_with_no_visits = []
+
+    # OPTIMIZATION 1: Pre-compute study/pathway visit filters to avoid repeated DataFrame filtering
+    # This creates a lookup cache: study_visit_cache[study][pathway] -> filtered DataFrame
+    # Reduces O(N × M) filter operations to O(N) lookups
+    study_visit_cache = build_study_visit_cache(patient_visits)
+    scheduled_studies = set(patient_visits['Study'])
+
+    # OPTIMIZATION 2: Pre-filter actual visits by patient for O(1) lookups
+    # Instead of filtering actual_visits_df for each patient (O(N × M)),
+    # create a dictionary: patient_actual_visits_cache[patient_id_study] -> DataFrame
+    patient_actual_visits_cache = {}
+    if actual_visits_df is not None and not actual_visits_df.empty:
+        visit_type_series = get_visit_type_series(actual_visits_df, default='patient')
+        # Filter for patient visits only (exclude siv, monitor)
+        patient_actuals_only = actual_visits_df[visit_type_series.isin(['patient', 'extra', 'patient_proposed'])].copy()
+        # OPTIMIZATION 3: Match all VisitNames against each patient's schedule in one batch
+        # (exact merge, then case-folded merge) instead of per-patient lookup dicts
+        patient_actuals_only = attach_visit_matches(patient_actuals_only, patients_df, study_visit_cache)
+        # Group by patient+study
+        for (patient_id, study), group_df in patient_actuals_only.groupby(['PatientID', 'Study']):
+            cache_key = f"{patient_id}_{study}"
+            patient_actual_visits_cache[cache_key] = group_df
+
+    if _get_processing_debug():
+        log_activity(f"Pre-computed visit filters for {len(study_visit_cache)} studies and {len(patient_actual_visits_cache)} patients", level='info')
+
+    # OPTIMIZATION 4: Multi-process backend for large patient lists - whole studies per worker,
+    # results put back in patient order so output matches the serial path exactly
+    patient_results = None
+    workers = _get_parallel_workers(patients_df, parallel, max_workers)
+    if workers:
+        chunks = _build_patient_chunks(
+            patients_df, study_visit_cache, scheduled_studies, screen_failures,
+            patient_actual_visits_cache, anchor_config, workers
+        )
+        try:
+            # Workers get a headless context with this run's debug level and clock
+            with ProcessPoolExecutor(max_workers=len(chunks), initializer=set_default_context,
+                                     initargs=(get_context().worker_context(),)) as executor:
+                patient_results = [result for chunk_results in executor.map(_process_patient_chunk, chunks)
+                                   for result in chunk_results]
+            patient_results.sort(key=lambda result: result[0])
+            if _get_processing_debug():
+                log_activity(f"Processed {len(patients_df)} patients in {len(chunks)} worker processes", level='info')
+        except Exception as e:
+            log_activity(f"⚠️ Parallel patient processing failed, falling back to serial: {e}", level='warning')
+            patient_results = None
+
+    if patient_results is None:
+        patient_results = _process_patient_rows(
+            range(len(patients_df)), patients_df, study_visit_cache, scheduled_studies, screen_failures,
+            patient_actual_visits_cache, anchor_config
+        )
+
+    for _, patient_id, study, results in patient_results:
+        if results is None:
             patients_with_no_visits.append(f"{patient_id} (Study: {study})")
             continue
-        
+
+        visit_records, actual_visits_used, unmatched_visits, screen_fail_exclusions, out_of_window_visits, processing_messages, patient_needs_recalc = results
+
         all_visit_records.extend(visit_records)
         total_actual_visits_used += actual_visits_used
         all_unmatched_visits.extend(unmatched_visits)
@@ -688,6 +1106,38 @@ def process_all_patients(patients_df, patient_visits, screen_failures, actual_vi
         'patients_with_no_visits': patients_with_no_visits
     }
 
+def benchmark_patient_backends(patients_df, patient_visits, screen_failures, actual_visits_df,
+                               patient_counts=(250, 500, 1000, 2000, 4000), max_workers=None, anchor_config=None):
+    """Time process_all_patients serial vs multi-process on the first N patients
+
+    Returns a DataFrame (Patients, SerialSeconds, ParallelSeconds, Speedup, Identical) - use it
+    to pick config.PARALLEL_PATIENT_THRESHOLD for the host's CPU count.
+    """
+    import time
+    rows = []
+    for count in patient_counts:
+        subset = patients_df.head(count)
+        start = time.perf_counter()
+        serial = process_all_patients(subset, patient_visits, screen_failures, actual_visits_df,
+                                      anchor_config, parallel=False)
+        serial_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        parallel = process_all_patients(subset, patient_visits, screen_failures, actual_visits_df,
+                                        anchor_config, parallel=True, max_workers=max_workers)
+        parallel_seconds = time.perf_counter() - start
+        rows.append({
+            'Patients': len(subset),
+            'SerialSeconds': round(serial_seconds, 3),
+            'ParallelSeconds': round(parallel_seconds, 3),
+            'Speedup': round(serial_seconds / parallel_seconds, 2) if parallel_seconds else None,
+            'Identical': pd.DataFrame(serial['visit_records']).equals(pd.DataFrame(parallel['visit_records'])) and all(
+                serial[key] == parallel[key] for key in serial if key != 'visit_records'
+            ),
+        })
+        if len(subset) < count:
+            break
+    return pd.DataFrame(rows)
+
 def build_processing_messages(processing_stats, unmatched_visits):
     """Build the final processing messages"""
     processing_messages = []
@@ -722,13 +1172,25 @@ def build_processing_messages(processing_stats, unmatched_visits):
     return processing_messages
 
 @timeit
-def calculate_financial_totals(calendar_df):
+def calculate_financial_totals(calendar_df, from_date=None):
     """
     Calculate monthly and financial year totals using vectorized operations.
     
     OPTIMIZATION: Uses groupby().cumsum() instead of loops (2-3x faster)
     CRITICAL: Must sort by Date before cumsum to ensure correct cumulative totals
+    
+    from_date: recompute only from the start of the financial year containing this date
+    (for a calendar that already has totals, e.g. after an incremental update)
     """
+    if from_date is not None and {"MonthPeriod", "FYStart", "Monthly Total", "FY Total"}.issubset(calendar_df.columns):
+        from helpers import get_financial_year_start_year_for_series
+        from_fy = get_financial_year_start_year_for_series(pd.Series([pd.Timestamp(from_date)])).iloc[0]
+        rows = calendar_df["FYStart"] >= from_fy
+        recalc = calendar_df.loc[rows]
+        calendar_df.loc[rows, "Monthly Total"] = recalc.groupby("MonthPeriod", observed=True)["Daily Total"].cumsum().fillna(0.0)
+        calendar_df.loc[rows, "FY Total"] = recalc.groupby("FYStart", observed=True)["Daily Total"].cumsum().fillna(0.0)
+        return calendar_df
+    
     # Add period columns
     calendar_df["MonthPeriod"] = calendar_df["Date"].dt.to_period("M")
     
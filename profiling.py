@@ -3,16 +3,30 @@
 Profiling utilities for performance monitoring
 
 Provides timing decorators that work both in Streamlit and standalone contexts.
+Inside a tracing.trace() block, timed functions also record nested spans.
 """
 import time
 import functools
+from tracing import span, count_rows
+from runtime_context import get_context
+
+def record_timing(name, elapsed, **details):
+    """Store a timing in the runtime context's performance_timings (session state in the app)
+
+    Extra keyword details (e.g. cache_hit=True) are stored alongside 'elapsed'.
+    """
+    state = get_context().state
+    if 'performance_timings' not in state:
+        state['performance_timings'] = {}
+    state['performance_timings'][name] = {'elapsed': elapsed, **details}
 
 def timeit(func):
     """
     Decorator to measure function execution time.
     
-    Works in both Streamlit (uses st.session_state) and standalone (uses print) contexts.
-    Logs timing with appropriate level based on duration.
+    Works in Streamlit and headless runs (timings go to the runtime context state).
+    Logs timing with appropriate level based on duration. When a trace is active the call
+    is recorded as a span (rows in from the first DataFrame argument, rows out from the result).
     
     Usage:
         @timeit
@@ -21,9 +35,13 @@ def timeit(func):
     """
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        elapsed = time.time() - start_time
+        rows_in = next((count_rows(arg) for arg in args if hasattr(arg, 'columns')), None)
+        with span(func.__name__, rows_in=rows_in) as record:
+            start_time = time.time()
+            result = func(*args, **kwargs)
+            elapsed = time.time() - start_time
+            if record is not None:
+                record['rows_out'] = count_rows(result)
         
         # Format timing message
         if elapsed > 5.0:
@@ -39,30 +57,14 @@ def timeit(func):
         message = f"{emoji} PERFORMANCE: {func.__name__} took {elapsed:.2f}s"
         
         # Always store timing in session state (for potential UI display)
-        try:
-            import streamlit as st
-            if 'performance_timings' not in st.session_state:
-                st.session_state.performance_timings = {}
-            st.session_state.performance_timings[func.__name__] = {
-                'elapsed': elapsed,
-                'emoji': emoji,
-                'level': level
-            }
-        except (ImportError, AttributeError):
-            pass
+        record_timing(func.__name__, elapsed, emoji=emoji, level=level)
         
         # Check debug level before logging to activity log
         should_log_performance = False
         try:
-            from config import should_log_info, get_debug_level, DEBUG_STANDARD
-            # Log slow functions (>5s) at STANDARD level, all others at VERBOSE
-            current_level = get_debug_level()
-            if elapsed > 5.0:
-                # Always log very slow functions as warnings (if warnings enabled)
-                should_log_performance = current_level >= DEBUG_STANDARD
-            else:
-                # Log normal/fast functions only at VERBOSE level
-                should_log_performance = should_log_info()
+            from helpers import log_enabled
+            # Log slow functions (>5s) as warnings (STANDARD level), all others at VERBOSE
+            should_log_performance = log_enabled(level)
         except (ImportError, AttributeError):
             # If config not available, log everything (backward compatibility)
             should_log_performance = True
@@ -81,7 +83,7 @@ def timeit(func):
 
 def profile_dataframe_operation(df, operation_name):
     """
-    Context manager for profiling DataFrame operations.
+    Context manager for profiling DataFrame operations (recorded as a span inside a trace).
     
     Usage:
         with profile_dataframe_operation(df, "groupby operation"):
@@ -92,13 +94,16 @@ def profile_dataframe_operation(df, operation_name):
             self.df = df
             self.name = name
             self.start_time = None
+            self.span = span(name, rows_in=len(df))
         
         def __enter__(self):
+            self.span.__enter__()
             self.start_time = time.time()
             return self
         
         def __exit__(self, exc_type, exc_val, exc_tb):
             elapsed = time.time() - self.start_time
+            self.span.__exit__(exc_type, exc_val, exc_tb)
             message = f"⏱️ {self.name} on {len(self.df)} rows took {elapsed:.2f}s"
             
             # Check debug level before logging
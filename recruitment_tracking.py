@@ -6,131 +6,126 @@ import pandas as pd
 import streamlit as st
 from typing import Optional, Dict
 from helpers import log_activity
+from runtime_context import cache_data, register_cache_dependency
 import plotly.graph_objects as go
 import plotly.express as px
 
-def build_recruitment_data(patients_df: pd.DataFrame, trials_df: pd.DataFrame) -> pd.DataFrame:
-    """
-    Build recruitment tracking data grouped by Study + SiteforVisit.
-    
-    Args:
-        patients_df: Patients dataframe (with PatientPractice column)
-        trials_df: Trial schedules dataframe (for getting Study+Site combinations, but prefers study_site_details for targets)
-    
-    Returns:
-        DataFrame with columns: Study, Site, Target, Actual, Progress, Status
-    """
-    import database as db
-    recruitment_rows = []
-    
+RECRUITMENT_COLUMNS = ['Study', 'Site', 'Target', 'Actual', 'Progress', 'Status', 'StudyStatus']
+
+def _first_by_pair(df: pd.DataFrame, site_col: str, columns: list) -> pd.DataFrame:
+    """First row (or first non-null value with skipna) of `columns` per (Study, Site) pair"""
+    keyed = df.dropna(subset=['Study', site_col]).rename(columns={site_col: 'Site'})
+    return keyed.drop_duplicates(subset=['Study', 'Site'], keep='first')[['Study', 'Site'] + columns]
+
+def _recruitment_table(patients_df: pd.DataFrame, trials_df: pd.DataFrame,
+                       study_details_df: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """Target/Actual/Progress/Status per study-site pair from the three tables (see build_recruitment_data)"""
     # Get unique study-site combinations - try study_site_details first, fallback to trials_df
-    study_details_df = db.fetch_all_study_site_details()
-    
     if study_details_df is not None and not study_details_df.empty:
         # Use study_site_details as primary source (ContractSite is canonical)
         if 'ContractSite' in study_details_df.columns:
-            study_site_combos = study_details_df[['Study', 'ContractSite']].drop_duplicates()
-            study_site_combos = study_site_combos.rename(columns={'ContractSite': 'Site'})
+            site_col = 'ContractSite'
         elif 'ContractedSite' in study_details_df.columns:
-            study_site_combos = study_details_df[['Study', 'ContractedSite']].drop_duplicates()
-            study_site_combos = study_site_combos.rename(columns={'ContractedSite': 'Site'})
+            site_col = 'ContractedSite'
         else:
-            study_site_combos = study_details_df[['Study', 'SiteforVisit']].drop_duplicates()
-            study_site_combos = study_site_combos.rename(columns={'SiteforVisit': 'Site'})
+            site_col = 'SiteforVisit'
+        study_site_combos = study_details_df[['Study', site_col]].drop_duplicates()
+        study_site_combos = study_site_combos.rename(columns={site_col: 'Site'}).reset_index(drop=True)
     elif 'SiteforVisit' in trials_df.columns:
         # Fallback to trials_df
         study_site_combos = trials_df.groupby(['Study', 'SiteforVisit']).first().reset_index()[['Study', 'SiteforVisit']]
         study_site_combos = study_site_combos.rename(columns={'SiteforVisit': 'Site'})
     else:
         log_activity("No SiteforVisit column in trials_df and no study_site_details, cannot build recruitment data", level='error')
-        return pd.DataFrame(columns=['Study', 'Site', 'Target', 'Actual', 'Progress', 'Status'])
-    
-    for _, row in study_site_combos.iterrows():
-        study = row['Study']
-        site = row['Site']
-        
-        # Get target and status from study_site_details (preferred) or fallback to trials_df
-        target = None
-        study_status = 'active'
-        
-        if study_details_df is not None and not study_details_df.empty:
-            # Try to get from study_site_details
-            if 'ContractSite' in study_details_df.columns:
-                study_detail = study_details_df[
-                    (study_details_df['Study'] == study) & 
-                    (study_details_df['ContractSite'] == site)
-                ]
-            elif 'ContractedSite' in study_details_df.columns:
-                study_detail = study_details_df[
-                    (study_details_df['Study'] == study) & 
-                    (study_details_df['ContractedSite'] == site)
-                ]
-            else:
-                study_detail = study_details_df[
-                    (study_details_df['Study'] == study) & 
-                    (study_details_df['SiteforVisit'] == site)
-                ]
-            if not study_detail.empty:
-                target = study_detail.iloc[0].get('RecruitmentTarget')
-                if pd.notna(target):
-                    target = int(target)  # Preserves 0 as valid "open target"
-                else:
-                    target = None
-                study_status = study_detail.iloc[0].get('StudyStatus', 'active')
-        
-        # Fallback to trials_df if not found in study_site_details
-        if target is None and 'RecruitmentTarget' in trials_df.columns:
-            target_rows = trials_df[(trials_df['Study'] == study) & (trials_df['SiteforVisit'] == site)]
-            if not target_rows.empty:
-                target_values = target_rows['RecruitmentTarget'].dropna().unique()
-                if len(target_values) > 0:
-                    target = int(target_values[0]) if pd.notna(target_values[0]) else None
-        
-        if study_status == 'active' and 'StudyStatus' in trials_df.columns:
-            status_rows = trials_df[(trials_df['Study'] == study) & (trials_df['SiteforVisit'] == site)]
-            if not status_rows.empty:
-                status_values = status_rows['StudyStatus'].dropna().unique()
-                if len(status_values) > 0:
-                    study_status = str(status_values[0]).lower()
-        
-        # Calculate actual recruitment count
-        actual = 0
-        # ContractSite counts all patients in the study, regardless of where they were seen
-        if 'Study' in patients_df.columns:
-            study_patients = patients_df[
-                (patients_df['Study'] == study)
-            ]
-            actual = len(study_patients)
-        
-        # Calculate progress percentage
-        progress = None
-        if target is not None and target > 0:
-            progress = (actual / target) * 100
+        return pd.DataFrame(columns=RECRUITMENT_COLUMNS)
 
-        # Determine status
+    combos = study_site_combos[['Study', 'Site']]
+    targets = pd.Series(None, index=combos.index, dtype=object)
+    study_statuses = pd.Series('active', index=combos.index, dtype=object)
+
+    # Target and status from the pair's first study_site_details row (preferred)
+    if study_details_df is not None and not study_details_df.empty:
+        detail_columns = [col for col in ['RecruitmentTarget', 'StudyStatus'] if col in study_details_df.columns]
+        details = _first_by_pair(study_details_df, site_col, detail_columns)
+        matched = combos.merge(details, on=['Study', 'Site'], how='left', indicator=True).set_index(combos.index)
+        has_detail = matched['_merge'] == 'both'
+        if 'RecruitmentTarget' in detail_columns:
+            targets = matched['RecruitmentTarget'].where(has_detail)
+        if 'StudyStatus' in detail_columns:
+            study_statuses = study_statuses.where(~has_detail, matched['StudyStatus'])
+
+    # Fallback to the first non-null trial schedule values of the pair
+    trial_columns = [col for col in ['RecruitmentTarget', 'StudyStatus'] if col in trials_df.columns]
+    if trial_columns and 'SiteforVisit' in trials_df.columns:
+        firsts = trials_df.groupby(['Study', 'SiteforVisit'])[trial_columns].first()
+        firsts = firsts.rename_axis(['Study', 'Site']).reset_index()
+        matched = combos.merge(firsts, on=['Study', 'Site'], how='left').set_index(combos.index)
+        if 'RecruitmentTarget' in trial_columns:
+            targets = targets.where(targets.notna(), matched['RecruitmentTarget'])
+        if 'StudyStatus' in trial_columns:
+            use_trial_status = (study_statuses == 'active') & matched['StudyStatus'].notna()
+            study_statuses[use_trial_status] = matched.loc[use_trial_status, 'StudyStatus'].astype(str).str.lower()
+
+    # ContractSite counts all patients in the study, regardless of where they were seen
+    if 'Study' in patients_df.columns:
+        actuals = combos['Study'].map(patients_df['Study'].value_counts()).fillna(0).astype(int)
+    else:
+        actuals = pd.Series(0, index=combos.index)
+
+    targets = [int(target) if pd.notna(target) else None for target in targets]  # Preserves 0 as valid "open target"
+    progress = [(actual / target) * 100 if target is not None and target > 0 else None
+                for actual, target in zip(actuals, targets)]
+    statuses = []
+    for actual, target, pct in zip(actuals, targets, progress):
         if target is None:
-            status = 'no_target'
+            statuses.append('no_target')
         elif target == 0:
-            status = 'open_target'
+            statuses.append('open_target')
         elif actual >= target:
-            status = 'at_or_over'
-        elif progress and progress >= 75:
-            status = 'near_target'
+            statuses.append('at_or_over')
+        elif pct and pct >= 75:
+            statuses.append('near_target')
         else:
-            status = 'under_target'
-        
-        recruitment_rows.append({
-            'Study': study,
-            'Site': site,
-            'Target': target,
-            'Actual': actual,
-            'Progress': progress,
-            'Status': status,
-            'StudyStatus': study_status
-        })
+            statuses.append('under_target')
+
+    return pd.DataFrame({
+        'Study': combos['Study'].to_numpy(),
+        'Site': combos['Site'].to_numpy(),
+        'Target': targets,
+        'Actual': actuals.to_numpy(),
+        'Progress': progress,
+        'Status': statuses,
+        'StudyStatus': study_statuses.to_numpy(),
+    }, columns=RECRUITMENT_COLUMNS)
+
+@cache_data(show_spinner=False)
+def _build_recruitment_data_cached(_patients_df, _trials_df, _study_details_df, fingerprints):
+    """Cached recruitment table, keyed on the table fingerprints (underscore args aren't hashed)"""
+    return _recruitment_table(_patients_df, _trials_df, _study_details_df)
+
+register_cache_dependency('recruitment_data', _build_recruitment_data_cached.clear,
+                          ['patients', 'trial_schedules', 'study_site_details'])
+
+def build_recruitment_data(patients_df: pd.DataFrame, trials_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Build recruitment tracking data grouped by Study + SiteforVisit.
+    
+    OPTIMIZED: Actuals come from one value_counts of patients per study, targets and study
+    statuses from one merge against study_site_details with a merge against trials_df as the
+    fallback, and the table is cached on the fingerprints of the three tables.
     
-    recruitment_df = pd.DataFrame(recruitment_rows)
-    return recruitment_df
+    Args:
+        patients_df: Patients dataframe (with PatientPractice column)
+        trials_df: Trial schedules dataframe (for getting Study+Site combinations, but prefers study_site_details for targets)
+    
+    Returns:
+        DataFrame with columns: Study, Site, Target, Actual, Progress, Status, StudyStatus
+    """
+    import database as db
+    from processing_calendar import get_table_fingerprint
+    study_details_df = db.fetch_all_study_site_details()
+    fingerprints = tuple(get_table_fingerprint(df) for df in (patients_df, trials_df, study_details_df))
+    return _build_recruitment_data_cached(patients_df, trials_df, study_details_df, fingerprints)
 
 def get_progress_color(status: str) -> str:
     """Get color for recruitment progress status"""
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Runtime context for the computation layer
+
+Core modules (processing_calendar, calculations, helpers, config, profiling, tracing and the
+visit/calendar builders) reach session values and settings, user-facing messages, caches and
+today's date through get_context() instead of importing streamlit:
+
+- StreamlitContext inside a Streamlit script run (st.session_state, st.cache_data, st.error)
+- HeadlessContext everywhere else - worker processes, benchmark_suite.py, scripts - backed by
+  a plain dict, an in-process memo cache and an optional fixed date
+
+use_context() installs a specific context for a block, e.g. a fixed clock for reproducible runs:
+
+    with use_context(HeadlessContext(settings={'debug_level': DEBUG_OFF}, today=REFERENCE_DATE)):
+        _build_calendar_impl(patients_df, trials_df, actual_visits_df)
+
+Table fingerprints and the cache-dependency registry (which cached artifacts are built from which
+tables) live here too, so core modules can key and declare their caches without importing database.py.
+"""
+import copy
+import functools
+import hashlib
+import inspect
+import pickle
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+import pandas as pd
+
+_local = threading.local()
+
+
+class HeadlessContext:
+    """Context for runs outside Streamlit: dict-backed state, memo cache, optional fixed date"""
+    is_streamlit = False
+
+    def __init__(self, settings=None, today=None):
+        self._state = dict(settings or {})
+        self.fixed_today = pd.Timestamp(today).date() if today is not None else None
+
+    @property
+    def state(self):
+        """Session values and settings (debug_level, calendar_cache_buster, traces, ...)"""
+        return self._state
+
+    def today(self) -> date:
+        return self.fixed_today or date.today()
+
+    def now(self) -> datetime:
+        return datetime.combine(self.fixed_today, datetime.now().time()) if self.fixed_today else datetime.now()
+
+    def notify(self, message, level='error'):
+        """User-facing message; headless runs only record it in the activity log"""
+        from helpers import log_activity
+        log_activity(message, level=level)
+
+    def make_cache(self, func, options):
+        return _MemoCache(func, ttl=options.get('ttl'), max_entries=options.get('max_entries'))
+
+    def worker_context(self):
+        """Picklable context for worker processes (same debug level and clock, empty state)"""
+        settings = {key: self.state.get(key) for key in ('debug_level',) if self.state.get(key) is not None}
+        return HeadlessContext(settings=settings, today=self.fixed_today)
+
+
+class StreamlitContext(HeadlessContext):
+    """Context for a Streamlit script run"""
+    is_streamlit = True
+
+    def __init__(self):
+        super().__init__()
+
+    @property
+    def state(self):
+        import streamlit as st
+        return st.session_state
+
+    def notify(self, message, level='error'):
+        import streamlit as st
+        getattr(st, level, st.error)(message)
+
+    def make_cache(self, func, options):
+        import streamlit as st
+        return st.cache_data(**options)(func)
+
+
+_default_context = HeadlessContext()
+_streamlit_context = StreamlitContext()
+
+
+def _in_streamlit_run() -> bool:
+    """True inside a Streamlit script run (streamlit is never imported just to find out)"""
+    if 'streamlit' not in sys.modules:
+        return False
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        try:
+            return get_script_run_ctx(suppress_warning=True) is not None
+        except TypeError:
+            return get_script_run_ctx() is not None
+    except Exception:
+        return False
+
+
+def get_context():
+    """Context for the current thread: use_context() override, else Streamlit run, else headless default"""
+    context = getattr(_local, 'context', None)
+    if context is not None:
+        return context
+    return _streamlit_context if _in_streamlit_run() else _default_context
+
+
+@contextmanager
+def use_context(context):
+    """Run a block with `context` as this thread's context"""
+    previous = getattr(_local, 'context', None)
+    _local.context = context
+    try:
+        yield context
+    finally:
+        _local.context = previous
+
+
+def set_default_context(context):
+    """Replace the process-wide headless context (ProcessPoolExecutor initializer for workers)"""
+    global _default_context
+    _default_context = context
+
+
+def current_date() -> date:
+    """Today's date from the active context (fixed in reproducible headless runs)"""
+    return get_context().today()
+
+
+# =============================================================================
+# CACHING
+# =============================================================================
+
+def _hash_value(value):
+    """Hashable cache key part for an argument (raises if it can't be pickled either)"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest = hashlib.sha1(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+        columns = tuple(map(str, value.columns)) if isinstance(value, pd.DataFrame) else (str(value.name),)
+        return ('frame', columns, digest.hexdigest())
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return ('pickle', hashlib.sha1(pickle.dumps(value)).hexdigest())
+
+
+class _MemoCache:
+    """In-process equivalent of st.cache_data: arguments whose name starts with '_' are not
+    hashed, results are copied on the way out, optional ttl (seconds) and max_entries"""
+
+    def __init__(self, func, ttl=None, max_entries=None):
+        self.func = func
+        self.signature = inspect.signature(func)
+        self.ttl = ttl.total_seconds() if isinstance(ttl, timedelta) else ttl
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def _key(self, args, kwargs):
+        bound = self.signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return tuple((name, _hash_value(value)) for name, value in bound.arguments.items()
+                     if not name.startswith('_'))
+
+    def __call__(self, *args, **kwargs):
+        try:
+            key = self._key(args, kwargs)
+        except (TypeError, AttributeError, pickle.PicklingError):
+            return self.func(*args, **kwargs)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and (self.ttl is None or time.monotonic() - entry[0] < self.ttl):
+            return copy.deepcopy(entry[1])
+        value = self.func(*args, **kwargs)
+        with self.lock:
+            if self.max_entries is not None and len(self.entries) >= self.max_entries:
+                self.entries.pop(next(iter(self.entries)))
+            self.entries[key] = (time.monotonic(), value)
+        return copy.deepcopy(value)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def cache_data(func=None, **options):
+    """Cache decorator resolved per context (st.cache_data in the app, memo cache headless)
+
+    Takes st.cache_data's options (ttl, max_entries, show_spinner, ...); like st.cache_data,
+    arguments named with a leading underscore are not part of the key. The wrapper's clear()
+    clears the cache in every context it was used in.
+    """
+    def decorate(func):
+        caches = {}
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            context = get_context()
+            cache = caches.get(type(context))
+            if cache is None:
+                cache = caches.setdefault(type(context), context.make_cache(func, options))
+            return cache(*args, **kwargs)
+
+        def clear():
+            for cache in caches.values():
+                cache.clear()
+
+        wrapper.clear = clear
+        return wrapper
+
+    return decorate(func) if func is not None else decorate
+
+
+def compute_table_fingerprint(df: Optional[pd.DataFrame], columns: Optional[list] = None) -> Optional[tuple]:
+    """Content fingerprint for a table: (row count, latest updated_at, hash of the column values)
+
+    Computed once at fetch time and stored in df.attrs['fingerprint'] so cache lookups
+    (e.g. the calendar build) can key on it instead of hashing whole DataFrames on every rerun.
+    Every column is hashed by default - fetches only load the columns the app reads - so a
+    value-only edit made outside this session (a new ScreeningDate, a changed Payment or Notes)
+    changes the fingerprint; nothing relies on updated_at being maintained.
+    """
+    if df is None:
+        return None
+    if columns is None:
+        columns = list(df.columns)
+    columns = [col for col in columns if col in df.columns]
+
+    latest_update = None
+    if 'updated_at' in df.columns:
+        updated = df['updated_at'].dropna()
+        latest_update = str(updated.max()) if not updated.empty else None
+
+    content_hash = ''
+    if columns and not df.empty:
+        digest = hashlib.sha1(repr(tuple(map(str, columns))).encode())
+        for col in columns:
+            try:
+                values = pd.util.hash_pandas_object(df[col], index=False)
+            except TypeError:
+                # Unhashable cell values (lists/dicts from JSON columns): hash their text
+                values = pd.util.hash_pandas_object(df[col].astype(str), index=False)
+            digest.update(values.to_numpy().tobytes())
+        content_hash = digest.hexdigest()[:16]
+    return (len(df), latest_update, content_hash)
+
+
+# =============================================================================
+# CACHE DEPENDENCIES
+# =============================================================================
+
+# Cached artifacts and the tables they are built from: name -> (clear function, tables).
+# Each table fetch registers itself; derived caches (e.g. the calendar build) register
+# alongside their definition so a write only clears what was built from the written table.
+CACHE_TABLES = ('patients', 'trial_schedules', 'actual_visits', 'study_site_details')
+_cache_dependencies = {}
+
+def register_cache_dependency(name: str, clear_fn, tables) -> None:
+    """Declare that cached artifact `name` is built from `tables` (cleared by invalidate_tables)"""
+    unknown = set(tables) - set(CACHE_TABLES)
+    if unknown:
+        raise ValueError(f"Unknown tables for cache '{name}': {sorted(unknown)}")
+    _cache_dependencies[name] = (clear_fn, frozenset(tables))
+
+def invalidate_tables(*tables) -> List[str]:
+    """Clear the fetch caches of `tables` and every cached artifact depending on them
+
+    Returns the names of the cleared caches.
+    """
+    from helpers import log_activity
+    written = set(tables)
+    cleared = []
+    for name, (clear_fn, depends_on) in _cache_dependencies.items():
+        if depends_on & written:
+            clear_fn()
+            cleared.append(name)
+    log_activity(f"Invalidated caches for {', '.join(sorted(written))}: {', '.join(cleared) or 'none'}", level='info')
+    return cleared
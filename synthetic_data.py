@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic clinical-trial datasets for scale testing
+
+generate_dataset() builds the four database tables (patients, trial_schedules,
+actual_visits, study_site_details) for 10 to 100k patients from a fixed seed and
+reference date, so the same arguments always give the same data. Frames come back
+as the app loads them from the database (parsed dates); write_backup_zip() writes
+them in the backup ZIP layout that database.restore_database_from_zip() reads.
+"""
+import io
+import zipfile
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_SEED = 42
+# Generated data is relative to this date (not today) so datasets are reproducible
+REFERENCE_DATE = date(2025, 6, 30)
+DATASET_SIZES = (10, 100, 1000, 10000, 100000)
+
+SITES = ['Ashfields', 'Kiltearn']
+REFERRAL_PRACTICES = ['Riverside Practice', 'Hillview Surgery', 'Castle Street Practice']
+
+# Patient outcomes (probabilities); everyone else stays on study until completion
+OUTCOME_RATES = {
+    'screen_failed': 0.15,
+    'dna_screening': 0.02,
+    'withdrawn': 0.07,
+    'deceased': 0.015,
+    'lost_to_followup': 0.01,
+}
+PROPOSED_VISIT_RATE = 0.3     # ongoing patients with their next visit booked (patient_proposed)
+UNSCHEDULED_VISIT_RATE = 0.03  # patients with an extra 'Unscheduled' visit
+
+STOPPAGE_NOTES = {'screen_failed': 'ScreenFail', 'withdrawn': 'Withdrawn', 'deceased': 'Died'}
+
+PATIENT_COLUMNS = ['id', 'PatientID', 'Study', 'ScreeningDate', 'RandomizationDate', 'Status',
+                   'PatientPractice', 'SiteSeenAt', 'Pathway']
+TRIAL_COLUMNS = ['id', 'Study', 'Pathway', 'Day', 'VisitName', 'SiteforVisit', 'Payment',
+                 'ToleranceBefore', 'ToleranceAfter', 'IntervalUnit', 'IntervalValue', 'VisitType']
+VISIT_COLUMNS = ['id', 'PatientID', 'Study', 'VisitName', 'ActualDate', 'Notes', 'VisitType']
+STUDY_DETAIL_COLUMNS = ['id', 'Study', 'ContractSite', 'StudyStatus', 'RecruitmentTarget',
+                        'FPFV', 'LPFV', 'LPLV']
+
+# Backup file prefix and date columns per table (as database.create_backup_zip writes them)
+BACKUP_FILES = {
+    'patients': ('patients_backup_', ['ScreeningDate', 'RandomizationDate']),
+    'trial_schedules': ('trials_backup_', []),
+    'actual_visits': ('actual_visits_backup_', ['ActualDate']),
+    'study_site_details': ('study_site_details_backup_', ['FPFV', 'LPFV', 'LPLV']),
+}
+
+
+def _add_months(dates, months):
+    """dates + months, clamped to month end like pd.DateOffset(months=n)"""
+    dates = pd.DatetimeIndex(dates)
+    total = dates.year * 12 + (dates.month - 1) + np.asarray(months, dtype=int)
+    year, month = total // 12, total % 12 + 1
+    month_start = pd.to_datetime(pd.DataFrame({'year': year, 'month': month, 'day': 1}))
+    day = np.minimum(dates.day, month_start.dt.days_in_month)
+    return pd.to_datetime(pd.DataFrame({'year': year, 'month': month, 'day': day})).values
+
+
+def _study_schedule(rng, study, contract_site, with_run_in):
+    """Schedule rows for one study: day-based visits, month-based follow-ups, SIV and Monitor events"""
+    v1_day = int(rng.choice([7, 14]))
+    gap = int(rng.choice([7, 14, 28]))
+    visit_days = [v1_day + gap * k for k in range(int(rng.integers(3, 9)))]
+    month_step = int(rng.choice([3, 6]))
+    first_month = -(-visit_days[-1] // 30) + month_step
+    follow_up_months = [first_month + month_step * k for k in range(int(rng.integers(0, 5)))]
+    tolerance = int(rng.choice([2, 3, 7]))
+    visit_payment = float(rng.integers(8, 25) * 10)
+
+    rows = []
+
+    def add(pathway, day, name, payment, before=0, after=0, unit=None, value=None, visit_type='patient'):
+        rows.append({'Study': study, 'Pathway': pathway, 'Day': day, 'VisitName': name,
+                     'SiteforVisit': contract_site, 'Payment': payment,
+                     'ToleranceBefore': before, 'ToleranceAfter': after,
+                     'IntervalUnit': unit, 'IntervalValue': value, 'VisitType': visit_type})
+
+    pathways = {'standard': 0}
+    if with_run_in:
+        pathways['with_run_in'] = 21
+    for pathway, shift in pathways.items():
+        add(pathway, 1, 'Screening', float(rng.integers(10, 40) * 10))
+        if shift:
+            add(pathway, 10, 'Run-in', visit_payment)
+        for number, day in enumerate(visit_days, start=1):
+            add(pathway, day + shift, f"V{number}", visit_payment * (2 if number == 1 else 1),
+                before=3 if number == 1 else tolerance, after=3 if number == 1 else tolerance)
+        for number, months in enumerate(follow_up_months, start=1):
+            add(pathway, months * 30 + 1 + shift, f"FU{number}", visit_payment,
+                before=14, after=14, unit='month', value=months + (1 if shift else 0))
+
+    add('standard', 0, 'SIV', float(rng.integers(15, 40) * 100), visit_type='siv')
+    add('standard', 0, 'Monitor', float(rng.choice([0, 150])), visit_type='monitor')
+    last_day = max(follow_up_months[-1] * 30 if follow_up_months else 0, visit_days[-1]) + max(pathways.values())
+    return rows, last_day
+
+
+def _generate_studies(rng, n_studies, as_of):
+    """trial_schedules and study_site_details; the first ~80% of studies are recruiting"""
+    as_of = pd.Timestamp(as_of)
+    n_active = max(1, int(round(n_studies * 0.8)))
+    schedule_rows = []
+    details = []
+    for index in range(n_studies):
+        study = f"SYN{index + 1:03d}"
+        contract_site = SITES[int(rng.integers(len(SITES)))]
+        rows, last_day = _study_schedule(rng, study, contract_site, with_run_in=rng.random() < 0.35)
+        schedule_rows.extend(rows)
+        if index < n_active:
+            fpfv = as_of - pd.Timedelta(days=int(rng.integers(120, 1500)))
+            lpfv = fpfv + pd.Timedelta(days=int(rng.integers(365, 1100)))
+            status = 'active'
+        else:
+            fpfv = as_of + pd.Timedelta(days=int(rng.integers(30, 365)))
+            lpfv = fpfv + pd.Timedelta(days=int(rng.integers(365, 730)))
+            status = str(rng.choice(['contracted', 'in_setup', 'expression_of_interest']))
+        details.append({'Study': study, 'ContractSite': contract_site, 'StudyStatus': status,
+                        'RecruitmentTarget': int(rng.integers(2, 12) * 5),
+                        'FPFV': fpfv, 'LPFV': lpfv, 'LPLV': lpfv + pd.Timedelta(days=last_day)})
+
+    trials_df = pd.DataFrame(schedule_rows)
+    trials_df.insert(0, 'id', np.arange(1, len(trials_df) + 1))
+    details_df = pd.DataFrame(details)
+    details_df.insert(0, 'id', np.arange(1, len(details_df) + 1))
+    return trials_df[TRIAL_COLUMNS], details_df[STUDY_DETAIL_COLUMNS]
+
+
+def _generate_patients(rng, n_patients, trials_df, details_df, as_of):
+    """Patients spread over the recruiting studies' FPFV..LPFV windows (status filled in later)"""
+    as_of = pd.Timestamp(as_of)
+    active = details_df[details_df['StudyStatus'] == 'active'].reset_index(drop=True)
+    weights = rng.dirichlet(np.full(len(active), 2.0))
+    study_index = rng.choice(len(active), size=n_patients, p=weights)
+    studies = active['Study'].values[study_index]
+
+    fpfv = active['FPFV'].values[study_index]
+    window_end = np.minimum(active['LPFV'].values[study_index], (as_of + pd.Timedelta(days=30)).to_datetime64())
+    window_days = ((window_end - fpfv) / np.timedelta64(1, 'D')).astype(int)
+    screening = fpfv + (rng.random(n_patients) * window_days).astype('timedelta64[D]')
+
+    run_in_studies = set(trials_df.loc[trials_df['Pathway'] == 'with_run_in', 'Study'])
+    pathway = np.where(np.isin(studies, list(run_in_studies)) & (rng.random(n_patients) < 0.4),
+                       'with_run_in', 'standard')
+    seen_at = np.array(SITES)[rng.integers(len(SITES), size=n_patients)]
+    referred = rng.random(n_patients) < 0.15
+    practice = np.where(referred, np.array(REFERRAL_PRACTICES)[rng.integers(len(REFERRAL_PRACTICES), size=n_patients)],
+                        seen_at)
+
+    outcomes = np.array(list(OUTCOME_RATES) + ['ongoing'])
+    probabilities = list(OUTCOME_RATES.values()) + [1 - sum(OUTCOME_RATES.values())]
+    return pd.DataFrame({
+        'id': np.arange(1, n_patients + 1),
+        'PatientID': [f"{study}-{number:06d}" for study, number in zip(studies, range(1, n_patients + 1))],
+        'Study': studies,
+        'ScreeningDate': pd.to_datetime(screening).normalize(),
+        'PatientPractice': practice,
+        'SiteSeenAt': seen_at,
+        'Pathway': pathway,
+        '_outcome': rng.choice(outcomes, size=n_patients, p=probabilities),
+    })
+
+
+def _generate_patient_visits(rng, patients_df, trials_df, as_of):
+    """Actual and proposed visits per patient, with stoppage notes; fills Status/RandomizationDate"""
+    as_of = pd.Timestamp(as_of)
+    schedule = trials_df[trials_df['VisitType'] == 'patient'][
+        ['Study', 'Pathway', 'Day', 'VisitName', 'ToleranceBefore', 'ToleranceAfter', 'IntervalUnit', 'IntervalValue']
+    ]
+    schedule = schedule.assign(_pos=schedule.groupby(['Study', 'Pathway']).cumcount())
+    schedule['_visits'] = schedule.groupby(['Study', 'Pathway'])['_pos'].transform('size')
+
+    grid = patients_df[['PatientID', 'Study', 'Pathway', 'ScreeningDate', '_outcome']].reset_index().rename(
+        columns={'index': '_patient'}
+    ).merge(schedule, on=['Study', 'Pathway'], how='inner', sort=False)
+
+    expected = (grid['ScreeningDate'] + pd.to_timedelta(grid['Day'] - 1, unit='D')).to_numpy(copy=True)
+    month_rows = (grid['IntervalUnit'] == 'month').values
+    if month_rows.any():
+        expected[month_rows] = _add_months(grid.loc[month_rows, 'ScreeningDate'],
+                                           grid.loc[month_rows, 'IntervalValue'].astype(int))
+    jitter = rng.integers(-grid['ToleranceBefore'].values, grid['ToleranceAfter'].values + 1)
+    grid['ExpectedDate'] = pd.to_datetime(expected)
+    grid['ActualDate'] = grid['ExpectedDate'] + pd.to_timedelta(np.where(grid['_pos'] == 0, 0, jitter), unit='D')
+
+    # Last schedule position each patient reaches; withdrawals/deaths stop at a random later visit
+    outcome = grid['_outcome'].values
+    stop_at_visit = rng.integers(1, np.maximum(grid['_visits'].values, 2))
+    stop_pos = np.select(
+        [np.isin(outcome, ['screen_failed', 'dna_screening']), np.isin(outcome, ['withdrawn', 'deceased', 'lost_to_followup'])],
+        [0, np.minimum(stop_at_visit, grid['_visits'].values - 1)],
+        default=grid['_visits'].values - 1
+    )
+    stop_pos = pd.Series(stop_pos).groupby(grid['_patient'].values).transform('first').values
+    grid = grid[(grid['_pos'] <= stop_pos[grid.index]) & (outcome != 'dna_screening')].copy()
+
+    done = grid['ActualDate'] <= as_of
+    is_stop_visit = grid['_pos'] == stop_pos[grid.index]
+    stopped = (done & is_stop_visit).groupby(grid['_patient']).transform('any')
+    grid['Notes'] = np.where(done & is_stop_visit, grid['_outcome'].map(STOPPAGE_NOTES).fillna(''), '')
+    grid['VisitType'] = 'patient'
+
+    # The next upcoming visit of some ongoing patients is already booked
+    upcoming = grid[~done & ~stopped]
+    next_visit = upcoming.groupby('_patient', sort=False).head(1)
+    booked = next_visit[rng.random(len(next_visit)) < PROPOSED_VISIT_RATE].index
+    grid.loc[booked, 'VisitType'] = 'patient_proposed'
+    grid.loc[booked, 'ActualDate'] = grid.loc[booked, 'ExpectedDate']
+    visits = grid[done | grid.index.isin(booked)]
+
+    # Patient status follows the visits that actually happened
+    attended = grid[done]
+    last_pos = attended.groupby('_patient')['_pos'].max()
+    randomized_on = attended[attended['VisitName'] == 'V1'].groupby('_patient')['ActualDate'].first()
+    patients = patients_df.copy()
+    schedule_length = grid.groupby('_patient')['_visits'].first()
+    stopped_patients = stopped.groupby(grid['_patient']).any()
+    status = pd.Series('screening', index=patients.index)
+    status[patients.index.isin(randomized_on.index)] = 'randomized'
+    status[last_pos.index[last_pos == schedule_length.reindex(last_pos.index) - 1]] = 'completed'
+    stopped_early = (patients['_outcome'].isin(['screen_failed', 'withdrawn', 'deceased', 'lost_to_followup']) &
+                     patients.index.isin(stopped_patients[stopped_patients].index))
+    status[stopped_early] = patients.loc[stopped_early, '_outcome']
+    status[(patients['_outcome'] == 'dna_screening') & (patients['ScreeningDate'] <= as_of)] = 'dna_screening'
+    patients['Status'] = status
+    patients['RandomizationDate'] = randomized_on.reindex(patients.index).where(
+        ~patients['Status'].isin(['screen_failed', 'dna_screening', 'screening'])
+    )
+
+    # A few patients have an extra visit that is not in their schedule
+    extra = attended.groupby('_patient').tail(1)
+    extra = extra[(rng.random(len(extra)) < UNSCHEDULED_VISIT_RATE) & (extra['_pos'] > 0) & (extra['Notes'] == '')]
+    extra = extra.assign(VisitName='Unscheduled', Notes='',
+                         ActualDate=extra['ActualDate'] - pd.Timedelta(days=1))
+
+    visits = pd.concat([visits, extra]).sort_values(['_patient', 'ActualDate'], kind='stable')
+    return patients[PATIENT_COLUMNS], visits[['PatientID', 'Study', 'VisitName', 'ActualDate', 'Notes', 'VisitType']]
+
+
+def _generate_study_events(rng, details_df, as_of):
+    """SIV before FPFV, quarterly monitoring visits up to as_of and the next one proposed"""
+    as_of = pd.Timestamp(as_of)
+    events = []
+    for study, fpfv in details_df.loc[details_df['StudyStatus'] == 'active', ['Study', 'FPFV']].itertuples(index=False):
+        events.append((f"SIV_{study}", study, 'SIV', fpfv - pd.Timedelta(days=int(rng.integers(14, 60))), '', 'siv'))
+        monitor_dates = pd.date_range(fpfv + pd.Timedelta(days=60), as_of + pd.Timedelta(days=90), freq='91D')
+        for monitor_date in monitor_dates:
+            visit_type = 'monitor' if monitor_date <= as_of else 'event_proposed'
+            events.append((f"MONITOR_{study}", study, 'Monitor', monitor_date, '', visit_type))
+    return pd.DataFrame(events, columns=['PatientID', 'Study', 'VisitName', 'ActualDate', 'Notes', 'VisitType'])
+
+
+def generate_dataset(n_patients=1000, seed=DEFAULT_SEED, n_studies=None, as_of=REFERENCE_DATE):
+    """Generate a reproducible synthetic dataset
+
+    n_studies defaults to roughly sqrt(n_patients) / 2 (2 to 60); about 20% of studies are
+    in set-up and have no patients. Returns {'patients', 'trial_schedules', 'actual_visits',
+    'study_site_details'} DataFrames with parsed dates, as the app loads them from the database.
+    """
+    if n_patients < 1:
+        raise ValueError("n_patients must be at least 1")
+    rng = np.random.default_rng(seed)
+    if n_studies is None:
+        n_studies = int(np.clip(round(np.sqrt(n_patients) / 2), 2, 60))
+
+    trials_df, details_df = _generate_studies(rng, n_studies, as_of)
+    patients_df = _generate_patients(rng, n_patients, trials_df, details_df, as_of)
+    patients_df, patient_visits = _generate_patient_visits(rng, patients_df, trials_df, as_of)
+    visits_df = pd.concat([patient_visits, _generate_study_events(rng, details_df, as_of)], ignore_index=True)
+    visits_df.insert(0, 'id', np.arange(1, len(visits_df) + 1))
+
+    return {
+        'patients': patients_df.reset_index(drop=True),
+        'trial_schedules': trials_df,
+        'actual_visits': visits_df[VISIT_COLUMNS],
+        'study_site_details': details_df,
+    }
+
+
+def backup_frames(dataset):
+    """Dataset tables in the upload/backup CSV format (no id column, dates as DD/MM/YYYY)"""
+    frames = {}
+    for table, (_, date_columns) in BACKUP_FILES.items():
+        df = dataset[table].drop(columns=['id'], errors='ignore').copy()
+        for column in date_columns:
+            df[column] = pd.to_datetime(df[column], errors='coerce').dt.strftime('%d/%m/%Y').fillna('')
+        frames[table] = df
+    return frames
+
+
+def write_backup_zip(dataset, path=None):
+    """Write the dataset as a database backup ZIP (restore_database_from_zip layout)
+
+    Returns the ZIP as a BytesIO; when path is given it is also saved there.
+    """
+    today = datetime.now().strftime('%Y-%m-%d')
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for table, df in backup_frames(dataset).items():
+            zip_file.writestr(f"{BACKUP_FILES[table][0]}{today}.csv", df.to_csv(index=False))
+    zip_buffer.seek(0)
+    if path is not None:
+        with open(path, 'wb') as f:
+            f.write(zip_buffer.getvalue())
+    return zip_buffer
+
+
+def dataset_summary(dataset):
+    """Row counts per table plus patients per status, for logging and benchmark reports"""
+    summary = {table: len(df) for table, df in dataset.items()}
+    summary['status'] = dataset['patients']['Status'].value_counts().to_dict()
+    return summary
@@ -1,16 +1,19 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import io
 from datetime import datetime, date
 from formatters import (
     apply_currency_formatting, apply_currency_or_empty_formatting,
     create_fy_highlighting_function, format_dataframe_index_as_string,
-    format_currency, clean_numeric_for_display, apply_conditional_formatting
+    format_currency, clean_numeric_for_display, apply_conditional_formatting,
+    date_style_codes, DATE_STYLE_FY_END, DATE_STYLE_MONTH_END, DATE_STYLE_WEEKEND
 )
 from calculations import (
     calculate_income_realization_metrics, calculate_monthly_realization_breakdown,
     calculate_study_pipeline_breakdown, calculate_site_realization_breakdown
 )
+from financial_cube import get_financial_cube
 
 def create_enhanced_excel_export(calendar_df, patients_df, visits_df, site_column_mapping, unique_sites, include_financial=True):
     """
@@ -191,36 +194,27 @@ def create_enhanced_excel_export(calendar_df, patients_df, visits_df, site_colum
         cell.fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
         cell.alignment = Alignment(horizontal="center")
     
+    # Row fills from date style codes computed column-wise
+    # NOTE: We do NOT highlight today's date in Excel (only on screen)
+    row_date_codes = np.zeros(len(enhanced_df), dtype=np.int8)
+    if 'Date' in enhanced_df.columns:
+        export_dates = enhanced_df['Date']
+        if not pd.api.types.is_datetime64_any_dtype(export_dates):
+            export_dates = pd.to_datetime(export_dates, format='%d/%m/%Y', errors='coerce')
+        row_date_codes = date_style_codes(export_dates)
+    date_fills = {
+        # Financial year end - dark blue background
+        DATE_STYLE_FY_END: PatternFill(start_color="1E40AF", end_color="1E40AF", fill_type="solid"),
+        # Month end - light blue background
+        DATE_STYLE_MONTH_END: PatternFill(start_color="60A5FA", end_color="60A5FA", fill_type="solid"),
+        # Weekend - gray background
+        DATE_STYLE_WEEKEND: PatternFill(start_color="E5E7EB", end_color="E5E7EB", fill_type="solid"),
+    }
+
     # OPTIMIZED: Use itertuples for faster iteration (2-3x faster than iterrows)
     # Data rows - handle values carefully with UK accounting format + date-based styling
     for row_idx, row_tuple in enumerate(enhanced_df.itertuples(index=True)):
-        # Get the date for this row (for styling)
-        row_date = None
-        if 'Date' in enhanced_df.columns:
-            try:
-                date_val = enhanced_df.iloc[row_idx]['Date']
-                if pd.notna(date_val):
-                    if isinstance(date_val, str):
-                        row_date = pd.to_datetime(date_val, format='%d/%m/%Y', errors='coerce')
-                    else:
-                        row_date = pd.to_datetime(date_val)
-            except:
-                row_date = None
-        
-        # Determine row styling based on date
-        # NOTE: We do NOT highlight today's date in Excel (only on screen)
-        row_fill = None
-        if row_date is not None and pd.notna(row_date):
-            # Check for special dates (in priority order)
-            if row_date.month == 3 and row_date.day == 31:
-                # Financial year end - dark blue background
-                row_fill = PatternFill(start_color="1E40AF", end_color="1E40AF", fill_type="solid")
-            elif row_date == row_date + pd.offsets.MonthEnd(0):
-                # Month end - light blue background
-                row_fill = PatternFill(start_color="60A5FA", end_color="60A5FA", fill_type="solid")
-            elif row_date.weekday() in (5, 6):
-                # Weekend - gray background
-                row_fill = PatternFill(start_color="E5E7EB", end_color="E5E7EB", fill_type="solid")
+        row_fill = date_fills.get(int(row_date_codes[row_idx]))
         
         # Process each cell in the row
         # OPTIMIZED: itertuples returns (Index, col1, col2, ...), so we skip Index (position 0) and start at 1
@@ -413,10 +407,12 @@ def create_enhanced_excel_export(calendar_df, patients_df, visits_df, site_colum
             else:
                 # Create empty trials_df (not used by these functions but required by signature)
                 trials_df = pd.DataFrame()
+                # One financial cube for the four sheets
+                cube = get_financial_cube(source_visits_df)
                 
                 # === Sheet 1: By Study Income (FY) ===
                 try:
-                    by_study_df = calculate_study_realization_by_study(source_visits_df, period='current_fy')
+                    by_study_df = calculate_study_realization_by_study(source_visits_df, period='current_fy', cube=cube)
                     if by_study_df is not None and not by_study_df.empty:
                         ws_by = wb.create_sheet("By Study Income (FY)")
                         
@@ -481,7 +477,7 @@ def create_enhanced_excel_export(calendar_df, patients_df, visits_df, site_colum
                 
                 # === Sheet 2: Monthly Realization Breakdown ===
                 try:
-                    monthly_data = calculate_monthly_realization_breakdown(source_visits_df, trials_df)
+                    monthly_data = calculate_monthly_realization_breakdown(source_visits_df, trials_df, cube=cube)
                     if monthly_data and len(monthly_data) > 0:
                         monthly_df = pd.DataFrame(monthly_data)
                         ws_monthly = wb.create_sheet("Monthly Realization")
@@ -543,7 +539,7 @@ def create_enhanced_excel_export(calendar_df, patients_df, visits_df, site_colum
                 
                 # === Sheet 3: Study Pipeline Breakdown ===
                 try:
-                    study_pipeline_df = calculate_study_pipeline_breakdown(source_visits_df, trials_df)
+                    study_pipeline_df = calculate_study_pipeline_breakdown(source_visits_df, trials_df, cube=cube)
                     if study_pipeline_df is not None and not study_pipeline_df.empty:
                         ws_pipeline = wb.create_sheet("Study Pipeline")
                         
@@ -595,7 +591,7 @@ def create_enhanced_excel_export(calendar_df, patients_df, visits_df, site_colum
                 
                 # === Sheet 4: Site Realization Breakdown ===
                 try:
-                    site_data = calculate_site_realization_breakdown(source_visits_df, trials_df)
+                    site_data = calculate_site_realization_breakdown(source_visits_df, trials_df, cube=cube)
                     if site_data and len(site_data) > 0:
                         site_df = pd.DataFrame(site_data)
                         ws_site = wb.create_sheet("Site Realization")
@@ -790,8 +786,11 @@ def display_complete_realization_analysis(visits_df, trials_df, patients_df):
     try:
         st.subheader("Income Realization Analysis")
         
+        # One financial cube for every breakdown below
+        cube = get_financial_cube(visits_df)
+
         # Calculate metrics
-        metrics = calculate_income_realization_metrics(visits_df, trials_df, patients_df)
+        metrics = calculate_income_realization_metrics(visits_df, trials_df, patients_df, cube=cube)
         
         # Display summary metrics
         col1, col2, col3, col4 = st.columns(4)
@@ -805,7 +804,7 @@ def display_complete_realization_analysis(visits_df, trials_df, patients_df):
             st.metric("Realization Rate", f"{metrics['realization_rate']:.1f}%")
         
         # Monthly breakdown
-        monthly_data = calculate_monthly_realization_breakdown(visits_df, trials_df)
+        monthly_data = calculate_monthly_realization_breakdown(visits_df, trials_df, cube=cube)
         if monthly_data:
             st.write("**Monthly Realization Breakdown**")
             monthly_df = pd.DataFrame(monthly_data)
@@ -815,7 +814,7 @@ def display_complete_realization_analysis(visits_df, trials_df, patients_df):
             st.dataframe(monthly_df, width='stretch', hide_index=True)
         
         # Study pipeline breakdown
-        study_pipeline = calculate_study_pipeline_breakdown(visits_df, trials_df)
+        study_pipeline = calculate_study_pipeline_breakdown(visits_df, trials_df, cube=cube)
         if not study_pipeline.empty:
             st.write("**Pipeline by Study**")
             study_display = study_pipeline.copy()
@@ -823,7 +822,7 @@ def display_complete_realization_analysis(visits_df, trials_df, patients_df):
             st.dataframe(study_display, width='stretch', hide_index=True)
         
         # Site realization breakdown
-        site_data = calculate_site_realization_breakdown(visits_df, trials_df)
+        site_data = calculate_site_realization_breakdown(visits_df, trials_df, cube=cube)
         if site_data:
             st.write("**Site Realization Summary**")
             site_df = pd.DataFrame(site_data)
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Structured tracing for hot paths (calendar builds)
+
+A trace collects nested spans opened in the current thread: each span records its parent,
+start offset, duration, row counts in/out and - when memory tracking is on - the peak memory
+allocated (tracemalloc) while it was open. @timeit functions open a span automatically
+whenever a trace is active. Finished traces export to Chrome trace-event JSON
+(chrome://tracing or https://ui.perfetto.dev) and to a flat breakdown table.
+"""
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+from runtime_context import get_context
+
+# Active trace and open-span stack for this thread (Streamlit runs each session's script in its own thread)
+_state = threading.local()
+
+def active_trace():
+    """Trace being collected in this thread, or None"""
+    return getattr(_state, 'trace', None)
+
+def count_rows(value):
+    """Row count of a DataFrame/Series/list (first DataFrame of a tuple), else None"""
+    if isinstance(value, (pd.DataFrame, pd.Series, list)):
+        return len(value)
+    if isinstance(value, tuple):
+        for item in value:
+            if isinstance(item, pd.DataFrame):
+                return len(item)
+    if isinstance(value, dict):
+        # Calendar build dicts ({'result': tuple}) and processing stats ({'visit_records': list})
+        for key in ('result', 'visit_records'):
+            if key in value:
+                return count_rows(value[key])
+    return None
+
+@contextmanager
+def trace(name, memory=False, **details):
+    """Collect every span opened in this thread until the block exits.
+
+    Yields the trace dict {'name', 'started_at', 'memory', 'spans'} (spans[0] is the root span).
+    memory=True tracks peak allocations per span with tracemalloc (noticeably slower).
+    A trace opened inside another trace becomes a span of the outer one.
+    """
+    if active_trace() is not None:
+        with span(name, **details):
+            yield active_trace()
+        return
+
+    start_memory = memory and not tracemalloc.is_tracing()
+    if start_memory:
+        tracemalloc.start()
+    trace_data = {
+        'name': name,
+        'started_at': time.time(),
+        'origin': time.perf_counter(),
+        'memory': bool(memory) and tracemalloc.is_tracing(),
+        'spans': []
+    }
+    _state.trace = trace_data
+    _state.stack = []
+    try:
+        with span(name, **details):
+            yield trace_data
+    finally:
+        _state.trace = None
+        _state.stack = []
+        if start_memory:
+            tracemalloc.stop()
+
+@contextmanager
+def span(name, rows_in=None, **details):
+    """Time a block as a child of the innermost open span (no-op outside a trace).
+
+    Yields the span dict (None outside a trace); set span['rows_out'] to record output size.
+    """
+    trace_data = active_trace()
+    if trace_data is None:
+        yield None
+        return
+
+    stack = _state.stack
+    parent = stack[-1] if stack else None
+    record = {
+        'id': len(trace_data['spans']),
+        'parent': parent['id'] if parent else None,
+        'name': name,
+        'depth': len(stack),
+        'thread': threading.get_ident(),
+        'start': time.perf_counter() - trace_data['origin'],
+        'duration': None,
+        'rows_in': rows_in,
+        'rows_out': None,
+        'peak_memory': None,
+        **details
+    }
+    trace_data['spans'].append(record)
+
+    if trace_data['memory']:
+        # Fold the peak reached so far into the parent, then measure this span from a fresh peak
+        current, peak = tracemalloc.get_traced_memory()
+        if parent is not None:
+            parent['_peak'] = max(parent['_peak'], peak)
+        tracemalloc.reset_peak()
+        record['_base'] = current
+        record['_peak'] = current
+
+    stack.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record['duration'] = time.perf_counter() - start
+        stack.pop()
+        if trace_data['memory']:
+            _, peak = tracemalloc.get_traced_memory()
+            peak = max(record.pop('_peak'), peak)
+            record['peak_memory'] = peak - record.pop('_base')
+            if parent is not None:
+                parent['_peak'] = max(parent['_peak'], peak)
+            tracemalloc.reset_peak()
+
+def store_trace(trace_data):
+    """Keep a finished trace in the runtime context's traces[name] (session state in the app)"""
+    state = get_context().state
+    if 'traces' not in state:
+        state['traces'] = {}
+    state['traces'][trace_data['name']] = trace_data
+
+def get_trace(name):
+    """Last stored trace with this name, or None"""
+    return get_context().state.get('traces', {}).get(name)
+
+def trace_breakdown(trace_data):
+    """Flat per-span table in call order with self time (duration minus direct children)
+
+    Columns: Span, Depth, Start, Seconds, SelfSeconds, Share, RowsIn, RowsOut, PeakMemoryMB
+    """
+    spans = trace_data['spans'] if trace_data else []
+    if not spans:
+        return pd.DataFrame(columns=['Span', 'Depth', 'Start', 'Seconds', 'SelfSeconds', 'Share',
+                                     'RowsIn', 'RowsOut', 'PeakMemoryMB'])
+
+    child_time = {}
+    for record in spans:
+        if record['parent'] is not None:
+            child_time[record['parent']] = child_time.get(record['parent'], 0.0) + (record['duration'] or 0.0)
+
+    total = spans[0]['duration'] or 0.0
+    rows = []
+    for record in spans:
+        duration = record['duration'] or 0.0
+        rows.append({
+            'Span': record['name'],
+            'Depth': record['depth'],
+            'Start': round(record['start'], 4),
+            'Seconds': round(duration, 4),
+            'SelfSeconds': round(max(duration - child_time.get(record['id'], 0.0), 0.0), 4),
+            'Share': round(duration / total, 3) if total else None,
+            'RowsIn': record['rows_in'],
+            'RowsOut': record['rows_out'],
+            'PeakMemoryMB': round(record['peak_memory'] / 1e6, 2) if record['peak_memory'] is not None else None,
+        })
+    return pd.DataFrame(rows)
+
+def to_chrome_trace(trace_data):
+    """Chrome trace-event dict (complete 'X' events, microsecond timestamps) for a trace"""
+    pid = os.getpid()
+    events = []
+    for record in trace_data['spans']:
+        args = {key: record[key] for key in ('rows_in', 'rows_out', 'peak_memory', 'error')
+                if record.get(key) is not None}
+        events.append({
+            'name': record['name'],
+            'cat': trace_data['name'],
+            'ph': 'X',
+            'ts': round(record['start'] * 1e6, 1),
+            'dur': round((record['duration'] or 0.0) * 1e6, 1),
+            'pid': pid,
+            'tid': record['thread'],
+            'args': args,
+        })
+    return {
+        'traceEvents': events,
+        'displayTimeUnit': 'ms',
+        'otherData': {'trace': trace_data['name'], 'started_at': trace_data['started_at'],
+                      'memory': trace_data['memory']},
+    }
+
+def export_chrome_trace(trace_data):
+    """Chrome trace-event JSON string for a trace (load in chrome://tracing or Perfetto)"""
+    return json.dumps(to_chrome_trace(trace_data), default=str)
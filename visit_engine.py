@@ -0,0 +1,601 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized visit generation engine
+
+Builds the same patient visit records as process_all_patients/process_single_patient,
+but column-wise: patients are cross-joined with their Study+Pathway schedule and
+expected dates, tolerance windows (ToleranceStart/ToleranceEnd) and stoppage cut-offs
+are computed as columns.
+
+The row-by-row path in patient_processor remains the reference implementation.
+`python parity_checks.py --checks visit_engine` checks that both produce the same visits DataFrame.
+"""
+import numpy as np
+import pandas as pd
+from helpers import get_visit_type_series, log_activity
+from patient_processor import (KNOWN_OPTIONAL_VISITS, VISIT_MATCH_COLUMNS, match_actual_visits,
+                               normalize_visit_names, process_single_patient)
+from profiling import timeit
+from runtime_context import current_date
+from visit_status import (STATUS_ACTUAL, STATUS_DATA_ERROR, STATUS_DIED, STATUS_DTYPE, STATUS_PREDICTED,
+                          STATUS_PROPOSED, STATUS_SCREEN_FAIL, STATUS_WITHDRAWN, render_visit_labels)
+
+INVALID_VISIT_SITES = ['', 'nan', 'None', 'null', 'NULL', 'Unknown Site', 'Default Site']
+
+# Record layouts produced by the reference path (key order matters for DataFrame column order)
+ACTUAL_RECORD_COLUMNS = [
+    'Date', 'PatientID', 'Visit', 'VisitStatus', 'Study', 'Payment', 'SiteofVisit', 'ContractSite',
+    'PatientOrigin', 'IsActual', 'IsProposed', 'IsScreenFail', 'IsWithdrawn', 'IsDied',
+    'IsOutOfProtocol', 'VisitDay', 'VisitName', 'VisitType'
+]
+PREDICTED_RECORD_COLUMNS = [
+    'Date', 'PatientID', 'Visit', 'VisitStatus', 'Study', 'Payment', 'SiteofVisit', 'ContractSite',
+    'PatientOrigin', 'IsActual', 'IsProposed', 'IsScreenFail', 'IsOutOfProtocol',
+    'VisitDay', 'VisitName', 'VisitType', 'ExpectedDate', 'ToleranceStart', 'ToleranceEnd'
+]
+
+# Sort keys used to reproduce the reference record order:
+# patient order -> section (0 = schedule loop, 1 = unmatched actuals) -> schedule position -> record order
+_ORDER_COLUMNS = ['_patient', '_section', '_pos', '_sub']
+
+
+def build_study_visit_cache(patient_visits):
+    """Pre-compute study/pathway visit filters: study_visit_cache[study][pathway] -> DataFrame sorted by Day"""
+    study_visit_cache = {}
+
+    if 'Pathway' in patient_visits.columns:
+        # Build cache for each unique study/pathway combination
+        for study in patient_visits['Study'].unique():
+            study_visit_cache[study] = {}
+            study_visits_all = patient_visits[patient_visits['Study'] == study]
+            for pathway in study_visits_all['Pathway'].unique():
+                study_visit_cache[study][pathway] = study_visits_all[
+                    study_visits_all['Pathway'] == pathway
+                ].sort_values('Day').copy()
+    else:
+        # Backward compatibility: cache by study only
+        for study in patient_visits['Study'].unique():
+            study_visit_cache[study] = {
+                'standard': patient_visits[patient_visits['Study'] == study].sort_values('Day').copy()
+            }
+
+    return study_visit_cache
+
+
+def resolve_study_visits_key(study_visit_cache, study, pathway):
+    """Return the (study, pathway) cache key used for a patient, falling back to 'standard'"""
+    if study in study_visit_cache and pathway in study_visit_cache[study]:
+        return (study, pathway)
+    if study in study_visit_cache and 'standard' in study_visit_cache[study]:
+        return (study, 'standard')
+    return None
+
+
+def assign_schedule_ids(study_visit_cache, studies, pathways):
+    """Resolve each (study, pathway) pair to a schedule id
+
+    Returns:
+        tuple: (numpy array of schedule ids, -1 where no schedule exists; {(study, pathway): id})
+    """
+    combos = pd.DataFrame({'Study': np.asarray(studies), 'Pathway': np.asarray(pathways)})
+    unique_combos = combos.drop_duplicates()
+    schedule_keys = {}
+    schedule_ids = []
+    for study, pathway in unique_combos.itertuples(index=False):
+        cache_key = resolve_study_visits_key(study_visit_cache, study, pathway)
+        schedule_ids.append(-1 if cache_key is None else schedule_keys.setdefault(cache_key, len(schedule_keys)))
+    unique_combos = unique_combos.assign(_schedule=schedule_ids)
+    resolved = combos.merge(unique_combos, on=['Study', 'Pathway'], how='left', sort=False)
+    return resolved['_schedule'].values, schedule_keys
+
+
+def build_schedule_frame(study_visit_cache, schedule_keys):
+    """Concatenate the resolved schedules into one frame (one row per schedule visit, in Day order)"""
+    schedule_frames = []
+    for (study, schedule_pathway), schedule_id in schedule_keys.items():
+        study_visits = study_visit_cache[study][schedule_pathway]
+        frame = pd.DataFrame({
+            '_schedule': schedule_id,
+            '_pos': np.arange(len(study_visits)),
+            'Day': study_visits['Day'].astype(int).values,
+            'VisitName': study_visits['VisitName'].astype(str).values,
+            'NameKey': study_visits['VisitName'].str.strip().str.lower().values,
+            'TrialPayment': study_visits['Payment'].values if 'Payment' in study_visits.columns else 0,
+            'SiteforVisit': study_visits['SiteforVisit'].values if 'SiteforVisit' in study_visits.columns else '',
+            'ToleranceBefore': _tolerance_days(study_visits['ToleranceBefore']).values if 'ToleranceBefore' in study_visits.columns else 0,
+            'ToleranceAfter': _tolerance_days(study_visits['ToleranceAfter']).values if 'ToleranceAfter' in study_visits.columns else 0,
+            'IntervalUnit': study_visits['IntervalUnit'].astype(str).str.strip().str.lower().values if 'IntervalUnit' in study_visits.columns else '',
+            'IntervalValue': pd.to_numeric(study_visits['IntervalValue'], errors='coerce').values if 'IntervalValue' in study_visits.columns else np.nan,
+            'ScheduleVisitType': get_visit_type_series(study_visits, default='patient').values,
+            'RawVisitType': study_visits['VisitType'].values if 'VisitType' in study_visits.columns else 'patient',
+        })
+        frame['IsTail'] = frame['_pos'] >= len(frame) - 5
+        schedule_frames.append(frame)
+
+    if not schedule_frames:
+        return pd.DataFrame()
+    return pd.concat(schedule_frames, ignore_index=True)
+
+
+def attach_visit_matches(actual_visits_df, patients_df, study_visit_cache):
+    """Batch-match actual visits against each patient's Study+Pathway schedule in one pass
+
+    Adds VISIT_MATCH_COLUMNS to a copy of actual_visits_df so process_patient_actual_visits
+    can skip per-patient matching. Rows without a single resolvable schedule are left
+    unmatched (NaN) and get matched per patient as before.
+    """
+    matched = actual_visits_df.copy()
+    for column in VISIT_MATCH_COLUMNS:
+        matched[column] = np.nan
+    if matched.empty or patients_df is None or patients_df.empty:
+        return matched
+
+    pathways = patients_df['Pathway'] if 'Pathway' in patients_df.columns else pd.Series('standard', index=patients_df.index)
+    schedule_ids, schedule_keys = assign_schedule_ids(study_visit_cache, patients_df['Study'].map(str), pathways)
+    patient_schedules = pd.DataFrame({
+        '_key': (patients_df['PatientID'].map(str) + '_' + patients_df['Study'].map(str)).values,
+        '_schedule': schedule_ids,
+    })
+    # Patients listed more than once with different schedules are matched per patient later
+    conflicting = patient_schedules.groupby('_key')['_schedule'].transform('nunique') > 1
+    patient_schedules = patient_schedules[~conflicting & (patient_schedules['_schedule'] >= 0)].drop_duplicates('_key')
+
+    actual_keys = matched['PatientID'].map(str) + '_' + matched['Study'].map(str)
+    actual_schedules = actual_keys.map(patient_schedules.set_index('_key')['_schedule'])
+    has_schedule = actual_schedules.notna()
+    if not has_schedule.any():
+        return matched
+
+    to_match = matched.loc[has_schedule, ['VisitName']].assign(_schedule=actual_schedules[has_schedule].astype(int))
+    matches = match_actual_visits(to_match, build_schedule_frame(study_visit_cache, schedule_keys), on=['_schedule'])
+    for column in VISIT_MATCH_COLUMNS:
+        matched[column] = matched[column].astype(object)
+        matched.loc[has_schedule, column] = matches[column].values
+    return matched
+
+
+def calculate_expected_dates(baseline, visit_day, interval_unit, interval_value):
+    """Vectorized equivalent of calculate_tolerance_windows' expected date
+
+    Month-based rows use calendar-aware month addition (clamped to month end like
+    pd.DateOffset); all other rows use baseline + (day - 1) days.
+    """
+    expected = baseline + pd.to_timedelta(visit_day - 1, unit='D')
+
+    month_mask = (interval_unit == 'month') & interval_value.notna() & np.isfinite(interval_value)
+    if month_mask.any():
+        base = baseline[month_mask]
+        months = np.trunc(interval_value[month_mask]).astype(int)
+        total = base.dt.year * 12 + (base.dt.month - 1) + months
+        year = total // 12
+        month = total % 12 + 1
+        month_start = pd.to_datetime(pd.DataFrame({'year': year, 'month': month, 'day': 1}))
+        day = np.minimum(base.dt.day, month_start.dt.days_in_month)
+        shifted = pd.to_datetime(pd.DataFrame({'year': year, 'month': month, 'day': day}))
+        expected = expected.where(~month_mask, shifted + (base - base.dt.normalize()))
+
+    return expected
+
+
+def _tolerance_days(series):
+    """int(float(x)) per value, with missing/invalid values treated as 0"""
+    values = pd.to_numeric(series, errors='coerce').fillna(0)
+    return np.trunc(values).astype(int)
+
+
+def _status_flags(notes):
+    """ScreenFail/Withdrawn/Died flags from Notes (case-sensitive, as the reference path)"""
+    notes = notes.astype(str)
+    return (
+        notes.str.contains('ScreenFail', regex=False),
+        notes.str.contains('Withdrawn', regex=False),
+        notes.str.contains('Died', regex=False),
+    )
+
+
+def _stoppage_status(is_screen_fail, is_withdrawn, is_died, default_statuses):
+    """VisitStatus with stoppage statuses taking precedence over the default status"""
+    statuses = default_statuses.copy()
+    statuses = statuses.mask(is_died, STATUS_DIED)
+    statuses = statuses.mask(is_withdrawn, STATUS_WITHDRAWN)
+    statuses = statuses.mask(is_screen_fail, STATUS_SCREEN_FAIL)
+    return statuses.astype(STATUS_DTYPE)
+
+
+def _empty_result():
+    return {
+        'visit_records': pd.DataFrame(),
+        'actual_visits_used': 0,
+        'unmatched_visits': [],
+        'screen_fail_exclusions': 0,
+        'out_of_window_visits': [],
+        'processing_messages': [],
+        'recalculated_patients': [],
+        'patients_with_no_visits': []
+    }
+
+
+def _order_records(pieces):
+    """Concatenate (columns, frame) pieces in reference order and reproduce its column order"""
+    pieces = [(columns, frame) for columns, frame in pieces if not frame.empty]
+    if not pieces:
+        return pd.DataFrame()
+
+    frames = []
+    for kind, (columns, frame) in enumerate(pieces):
+        frame = frame[columns + _ORDER_COLUMNS].copy()
+        frame['_kind'] = kind
+        frames.append(frame)
+
+    combined = pd.concat(frames, ignore_index=True, sort=False)
+    combined = combined.sort_values(_ORDER_COLUMNS, kind='mergesort').reset_index(drop=True)
+
+    # pd.DataFrame(list_of_dicts) orders columns by first appearance across records
+    column_order = []
+    for kind in combined['_kind'].drop_duplicates():
+        for column in pieces[kind][0]:
+            if column not in column_order:
+                column_order.append(column)
+
+    return combined[column_order]
+
+
+@timeit
+def generate_patient_visits(patients_df, patient_visits, stoppages, actual_visits_df, anchor_config=None):
+    """Vectorized replacement for process_all_patients
+
+    Returns the same statistics dict as process_all_patients, except that
+    'visit_records' is a DataFrame equal to pd.DataFrame(reference visit_records).
+    Patients that hit rare data-error branches (invalid visit site, unparseable
+    actual dates) are routed through process_single_patient so output stays identical.
+    """
+    if patients_df is None or patients_df.empty:
+        return _empty_result()
+
+    today = pd.Timestamp(current_date()).normalize()
+    study_visit_cache = build_study_visit_cache(patient_visits)
+
+    # ---- Patients -------------------------------------------------------------
+    practice = patients_df['PatientPractice'] if 'PatientPractice' in patients_df.columns else pd.Series('', index=patients_df.index)
+    seen_at = patients_df['SiteSeenAt'] if 'SiteSeenAt' in patients_df.columns else pd.Series(None, index=patients_df.index, dtype=object)
+    pathway = patients_df['Pathway'] if 'Pathway' in patients_df.columns else pd.Series('standard', index=patients_df.index)
+
+    patients = pd.DataFrame({
+        '_patient': np.arange(len(patients_df)),
+        'RawPatientID': patients_df['PatientID'].values,
+        'RawStudy': patients_df['Study'].values,
+        'PatientID': patients_df['PatientID'].map(str).values,
+        'Study': patients_df['Study'].map(str).values,
+        'ScreeningDate': pd.to_datetime(patients_df['ScreeningDate']).values,
+        'PatientOrigin': practice.map(str).values,
+        'Pathway': pathway.values,
+    })
+    # patient.get("SiteSeenAt") or patient_origin
+    patients['SeenAt'] = [site or origin for site, origin in zip(seen_at.values, patients['PatientOrigin'].values)]
+    patients['StoppageDate'] = pd.to_datetime(
+        (patients['PatientID'] + '_' + patients['Study']).map(stoppages) if stoppages else pd.NaT
+    )
+
+    # Resolve schedule id per patient (unique study/pathway combinations only)
+    patients['_schedule'], schedule_keys = assign_schedule_ids(study_visit_cache, patients['Study'], patients['Pathway'])
+
+    known_studies = set(patient_visits['Study'].astype(str)) if 'Study' in patient_visits.columns else set()
+    no_visit_mask = ~patients['Study'].isin(known_studies)
+    patients_with_no_visits = [
+        f"{pid} (Study: {study})"
+        for pid, study in patients.loc[no_visit_mask, ['PatientID', 'Study']].itertuples(index=False)
+    ]
+
+    # Only patients with a baseline and a schedule generate visits
+    patients = patients[patients['ScreeningDate'].notna() & (patients['_schedule'] >= 0)].reset_index(drop=True)
+
+    # ---- Schedule (one frame for every study/pathway in use) --------------------
+    schedule = build_schedule_frame(study_visit_cache, schedule_keys)
+
+    if schedule.empty or patients.empty:
+        result = _empty_result()
+        result['patients_with_no_visits'] = patients_with_no_visits
+        if patients_with_no_visits:
+            log_activity(f"⚠️ {len(patients_with_no_visits)} patients have no visits scheduled", level='warning')
+        return result
+
+    # Baseline visit name: Day 1 visit, else first visit
+    first_rows = schedule[schedule['_pos'] == 0].set_index('_schedule')['VisitName']
+    day_1_rows = schedule[schedule['Day'] == 1].drop_duplicates('_schedule').set_index('_schedule')['VisitName']
+    baseline_names = first_rows.copy()
+    baseline_names.update(day_1_rows)
+
+    # Anchor visit (rebasing) per schedule: name and Day of its first schedule row
+    anchor_names = {}
+    rebase_days = {}
+    for (study, _), schedule_id in schedule_keys.items():
+        anchor_name = anchor_config.get(str(study)) if anchor_config else None
+        if anchor_name and anchor_name != baseline_names[schedule_id]:
+            anchor_rows = schedule[(schedule['_schedule'] == schedule_id) & (schedule['VisitName'] == anchor_name)]
+            if len(anchor_rows) > 0:
+                anchor_names[schedule_id] = anchor_name
+                rebase_days[schedule_id] = int(anchor_rows['Day'].iloc[0])
+    patients['BaselineName'] = patients['_schedule'].map(baseline_names)
+    patients['AnchorName'] = patients['_schedule'].map(anchor_names)
+    patients['RebaseDay'] = patients['_schedule'].map(rebase_days)
+
+    # ---- Actual visits --------------------------------------------------------
+    actual_columns = ['_patient', '_order', 'ActName', 'ActualDate', 'Notes', 'ActualVisitType', 'EntryVisitType']
+    actuals = pd.DataFrame(columns=actual_columns)
+    if actual_visits_df is not None and not actual_visits_df.empty:
+        visit_type_series = get_visit_type_series(actual_visits_df, default='patient')
+        patient_actuals = actual_visits_df[
+            visit_type_series.isin(['patient', 'extra', 'patient_proposed']) &
+            actual_visits_df['PatientID'].notna() & actual_visits_df['Study'].notna()
+        ]
+        if not patient_actuals.empty:
+            raw_visit_type = patient_actuals['VisitType'] if 'VisitType' in patient_actuals.columns else pd.Series(np.nan, index=patient_actuals.index)
+            actual_rows = pd.DataFrame({
+                '_key': (patient_actuals['PatientID'].map(str) + '_' + patient_actuals['Study'].map(str)).values,
+                '_order': np.arange(len(patient_actuals)),
+                'ActName': normalize_visit_names(patient_actuals['VisitName']).values,
+                'ActualDate': pd.to_datetime(patient_actuals['ActualDate']).dt.normalize().values,
+                'Notes': patient_actuals['Notes'].map(str).values if 'Notes' in patient_actuals.columns else '',
+                'ActualVisitType': raw_visit_type.map(str).str.lower().values,
+                'EntryVisitType': get_visit_type_series(patient_actuals, default='patient').values,
+                'RawVisitType': raw_visit_type.values,
+            })
+            patient_keys = pd.DataFrame({
+                '_key': (patients['PatientID'] + '_' + patients['Study']).values,
+                '_patient': patients['_patient'].values,
+            })
+            actuals = patient_keys.merge(actual_rows, on='_key', how='inner', sort=False)
+            actuals = actuals.sort_values(['_patient', '_order'], kind='mergesort').reset_index(drop=True)
+
+    # Rare data-error branches go through the reference path (per-visit logging and skips)
+    delegated_mask = patients['SeenAt'].map(lambda site: pd.isna(site) or site in INVALID_VISIT_SITES)
+    if not actuals.empty:
+        bad_dates = actuals.loc[actuals['ActualDate'].isna(), '_patient'].unique()
+        delegated_mask |= patients['_patient'].isin(bad_dates)
+    delegated = patients[delegated_mask]
+    patients = patients[~delegated_mask].reset_index(drop=True)
+    if not actuals.empty:
+        actuals = actuals[actuals['_patient'].isin(patients['_patient'])].reset_index(drop=True)
+
+    patient_info = patients.set_index('_patient')
+    unmatched_messages = []
+    processing_messages = []
+
+    # Visit name matching: batch exact merge, then case-folded merge against each schedule
+    actual_visits_used = actuals.groupby('_patient').size() if not actuals.empty else pd.Series(dtype=int)
+    if not actuals.empty:
+        actuals['_schedule'] = actuals['_patient'].map(patient_info['_schedule'])
+        actuals['NameKey'] = actuals['ActName'].str.lower()
+        matches = match_actual_visits(actuals[['_schedule']].assign(VisitName=actuals['ActName']), schedule, on=['_schedule'])
+        not_found = actuals[(matches['MatchType'] == 'unmatched').values]
+        for patient_ordinal, visit_name in not_found[['_patient', 'ActName']].itertuples(index=False):
+            log_activity(f"      ⚠️ Visit '{visit_name}' not found in trial schedule", level='warning')
+            info = patient_info.loc[patient_ordinal]
+            unmatched_messages.append((patient_ordinal, f"Patient {info['PatientID']}, Study {info['Study']}: Visit '{visit_name}' not found in trials"))
+
+    # One entry per visit name (last row wins, first occurrence keeps its position)
+    if not actuals.empty:
+        entries = actuals.drop_duplicates(['_patient', 'ActName'], keep='last').copy()
+        first_order = actuals.drop_duplicates(['_patient', 'ActName'], keep='first').set_index(['_patient', 'ActName'])['_order']
+        entries['_first'] = first_order.reindex(pd.MultiIndex.from_frame(entries[['_patient', 'ActName']])).values
+        entries = entries.sort_values(['_patient', '_first'], kind='mergesort').reset_index(drop=True)
+    else:
+        entries = actuals.assign(_first=pd.Series(dtype=int), _schedule=pd.Series(dtype=int))
+
+    # Per-patient suppression inputs
+    is_future = entries['ActualDate'] > today
+    latest_proposed = entries[is_future].groupby('_patient')['ActualDate'].max()
+    latest_actual = entries[~is_future].groupby('_patient')['ActualDate'].max()
+    tail_names = schedule.loc[schedule['IsTail'], ['_schedule', 'VisitName']].drop_duplicates()
+    terminal = entries[is_future].merge(
+        tail_names, left_on=['_schedule', 'ActName'], right_on=['_schedule', 'VisitName'], how='inner'
+    )['_patient'].unique()
+    # reindex rather than map: pandas 3 can't map through an empty datetime Series
+    patients['LatestProposed'] = pd.to_datetime(latest_proposed.reindex(patients['_patient']).to_numpy())
+    patients['LatestActual'] = pd.to_datetime(latest_actual.reindex(patients['_patient']).to_numpy())
+    patients['IsTerminal'] = patients['_patient'].isin(terminal)
+
+    # Baseline from actual Day 1 visit, rebase date from actual anchor visit
+    entry_dates = entries.set_index(['_patient', 'ActName'])['ActualDate']
+    baseline_actual = pd.to_datetime(pd.Series(entry_dates.reindex(pd.MultiIndex.from_arrays([patients['_patient'], patients['BaselineName']])).values))
+    anchor_actual = pd.to_datetime(pd.Series(entry_dates.reindex(pd.MultiIndex.from_arrays([patients['_patient'], patients['AnchorName']])).values))
+    baseline_changed = baseline_actual.notna() & (baseline_actual != patients['ScreeningDate'])
+    patients['Baseline'] = patients['ScreeningDate'].where(~baseline_changed, baseline_actual).dt.normalize()
+    patients['RebaseDate'] = pd.to_datetime(anchor_actual.where(patients['RebaseDay'].notna())).dt.normalize()
+    recalc_mask = baseline_changed | patients['RebaseDate'].notna()
+    recalculated = [
+        (ordinal, f"{pid} ({study})")
+        for ordinal, pid, study in patients.loc[recalc_mask, ['_patient', 'PatientID', 'Study']].itertuples(index=False)
+    ]
+
+    # ---- Cross join patients x schedule -------------------------------------------
+    grid = patients[[
+        '_patient', '_schedule', 'PatientID', 'Study', 'PatientOrigin', 'SeenAt', 'StoppageDate',
+        'Baseline', 'RebaseDate', 'RebaseDay', 'LatestProposed', 'LatestActual', 'IsTerminal'
+    ]].merge(schedule, on='_schedule', how='inner', sort=False)
+    grid = grid.merge(
+        entries[['_patient', 'ActName', 'ActualDate', 'Notes', 'ActualVisitType']],
+        left_on=['_patient', 'VisitName'], right_on=['_patient', 'ActName'], how='left', sort=False
+    )
+    has_actual = grid['ActName'].notna()
+
+    rebased = grid['RebaseDate'].notna() & (grid['Day'] >= grid['RebaseDay'])
+    grid['EffectiveBaseline'] = grid['Baseline'].where(~rebased, grid['RebaseDate'])
+    grid['EffectiveDay'] = grid['Day'].where(~rebased, grid['Day'] - grid['RebaseDay'].fillna(0) + 1).astype(int)
+    grid['ExpectedDate'] = calculate_expected_dates(
+        grid['EffectiveBaseline'], grid['EffectiveDay'], grid['IntervalUnit'], grid['IntervalValue']
+    ).dt.normalize()
+    stopped = grid['StoppageDate'].notna()
+
+    # ---- Actual visit records -----------------------------------------------------
+    act = grid[has_actual].copy()
+    is_proposed_type = act['ActualVisitType'] == 'patient_proposed'
+    act['IsProposed'] = is_proposed_type | (act['ActualDate'] > today)
+    screen_fail, withdrawn, died = _status_flags(act['Notes'])
+    data_error = ~act['IsProposed'] & stopped[has_actual] & (act['ActualDate'] > act['StoppageDate'])
+    default_statuses = pd.Series(STATUS_ACTUAL, index=act.index).mask(act['IsProposed'], STATUS_PROPOSED)
+    statuses = _stoppage_status(screen_fail, withdrawn, died, default_statuses)
+    act['VisitStatus'] = statuses.mask(data_error, STATUS_DATA_ERROR).astype(STATUS_DTYPE)
+    act['Visit'] = render_visit_labels(act['VisitName'], act['VisitStatus'])
+    act['Date'] = act['ActualDate']
+    act['Payment'] = pd.to_numeric(act['TrialPayment'], errors='coerce').fillna(0.0).astype(float)
+    act['SiteofVisit'] = act['SeenAt'].map(str)
+    act['ContractSite'] = act['SiteforVisit']
+    act['IsActual'] = True
+    act['IsScreenFail'] = screen_fail.values
+    act['IsWithdrawn'] = withdrawn.values
+    act['IsDied'] = died.values
+    act['IsOutOfProtocol'] = False
+    act['VisitDay'] = act['Day'].astype(int)
+    act['VisitType'] = act['ScheduleVisitType'].where(~is_proposed_type, act['ActualVisitType'])
+    act['_section'] = 0
+    act['_sub'] = 0
+    for patient_ordinal, pid, visit_name, visit_date in act.loc[data_error, ['_patient', 'PatientID', 'VisitName', 'Date']].itertuples(index=False):
+        processing_messages.append((patient_ordinal, f"⚠️ Patient {pid} has visit '{visit_name}' on {visit_date.strftime('%Y-%m-%d')} AFTER screen failure, withdrawal, or death"))
+
+    # ---- Predicted visit records (suppression rules 2-4, stoppage cut-off) ------------
+    pred = grid[~has_actual & (grid['Day'] != 0)].copy()
+    predicted_date = pred['ExpectedDate']
+    has_proposed = pred['LatestProposed'].notna()
+    upcoming = (predicted_date >= today) & has_proposed
+    suppress = upcoming & (
+        (predicted_date < pred['LatestProposed']) |
+        (pred['IsTerminal'] & (predicted_date > pred['LatestProposed']))
+    )
+    suppress |= ~upcoming & (predicted_date < today) & pred['LatestActual'].notna() & (predicted_date < pred['LatestActual'])
+    pred = pred[~suppress]
+    after_stoppage = pred['StoppageDate'].notna() & (pred['ExpectedDate'] > pred['StoppageDate'])
+    screen_fail_exclusions = int(after_stoppage.sum())
+    pred = pred[~after_stoppage].copy()
+
+    pred['Date'] = pred['ExpectedDate']
+    pred['VisitStatus'] = np.full(len(pred), STATUS_PREDICTED, dtype=STATUS_DTYPE)
+    pred['Visit'] = render_visit_labels(pred['VisitName'], pred['VisitStatus'])
+    pred['Payment'] = pd.to_numeric(pred['TrialPayment'], errors='coerce').astype(float)
+    pred['SiteofVisit'] = pred['SeenAt'].map(str)
+    pred['ContractSite'] = pred['SiteforVisit']
+    pred['IsActual'] = False
+    pred['IsProposed'] = False
+    pred['IsScreenFail'] = False
+    pred['IsOutOfProtocol'] = False
+    pred['VisitDay'] = pred['EffectiveDay']
+    predicted_type = pred['RawVisitType'].map(str).str.strip().str.lower()
+    pred['VisitType'] = predicted_type.mask(predicted_type.isin(['', 'nan', 'none', 'null']), 'patient')
+    pred['_section'] = 0
+    pred['_sub'] = 0
+
+    # Tolerance window as interval columns ('-' days only after Day 1, '+' days capped at stoppage)
+    before_days = pd.to_timedelta(pred['ToleranceBefore'].where(pred['EffectiveDay'] > 1, 0).clip(lower=0), unit='D')
+    after_days = pd.to_timedelta(pred['ToleranceAfter'].clip(lower=0), unit='D')
+    pred['ToleranceStart'] = pred['ExpectedDate'] - before_days
+    pred['ToleranceEnd'] = (pred['ExpectedDate'] + after_days).where(
+        pred['StoppageDate'].isna(), np.minimum(pred['ExpectedDate'] + after_days, pred['StoppageDate'])
+    )
+
+    # ---- Unmatched actual visits (names not in schedule, e.g. Day 0 optional visits) ----
+    unmatched = entries.copy()
+    if not unmatched.empty:
+        exact_names = schedule[['_schedule', 'VisitName']].drop_duplicates()
+        exact = unmatched.merge(exact_names, left_on=['_schedule', 'ActName'], right_on=['_schedule', 'VisitName'], how='left', indicator=True)['_merge'] == 'both'
+        unmatched = unmatched[~exact.values & ~unmatched['ActualVisitType'].isin(['siv', 'monitor'])]
+        first_match = schedule.drop_duplicates(['_schedule', 'NameKey'])[['_schedule', 'NameKey', 'Day', 'TrialPayment', 'SiteforVisit']]
+        unmatched = unmatched.merge(first_match, on=['_schedule', 'NameKey'], how='left', sort=False)
+        in_trials = unmatched['Day'].notna()
+        optional = ~in_trials & unmatched['ActName'].isin(KNOWN_OPTIONAL_VISITS)
+        for patient_ordinal, visit_name in unmatched.loc[~in_trials & ~optional, ['_patient', 'ActName']].itertuples(index=False):
+            log_activity(
+                f"⚠️ Skipping unmatched visit '{visit_name}' for patient {patient_info.loc[patient_ordinal, 'PatientID']} - "
+                f"not in trial schedule and cannot safely determine ContractSite",
+                level='error'
+            )
+        unmatched = unmatched[in_trials | optional].copy()
+        optional = optional[in_trials | optional]
+        for column in ['PatientID', 'Study', 'PatientOrigin', 'SeenAt']:
+            unmatched[column] = unmatched['_patient'].map(patient_info[column])
+        screen_fail, withdrawn, died = _status_flags(unmatched['Notes'])
+        unmatched['VisitStatus'] = _stoppage_status(
+            screen_fail, withdrawn, died, pd.Series(STATUS_ACTUAL, index=unmatched.index))
+        unmatched['Visit'] = render_visit_labels(unmatched['ActName'], unmatched['VisitStatus'])
+        unmatched['Date'] = unmatched['ActualDate']
+        unmatched['Payment'] = unmatched['TrialPayment'].where(~optional, 0.0)
+        unmatched['SiteofVisit'] = unmatched['SeenAt'].map(str).str.strip()
+        unmatched['ContractSite'] = unmatched['SiteforVisit'].where(~optional, unmatched['SeenAt'])
+        unmatched['IsActual'] = True
+        unmatched['IsProposed'] = unmatched['ActualDate'] > today
+        unmatched['IsScreenFail'] = screen_fail.values
+        unmatched['IsWithdrawn'] = withdrawn.values
+        unmatched['IsDied'] = died.values
+        unmatched['IsOutOfProtocol'] = False
+        unmatched['VisitDay'] = unmatched['Day'].where(~optional, 0).astype(int)
+        unmatched['VisitName'] = unmatched['ActName']
+        unmatched['VisitType'] = unmatched['EntryVisitType']
+        unmatched['_section'] = 1
+        unmatched['_pos'] = unmatched['_first']
+        unmatched['_sub'] = 0
+    else:
+        unmatched = pd.DataFrame(columns=ACTUAL_RECORD_COLUMNS + _ORDER_COLUMNS)
+
+    pieces = [
+        (ACTUAL_RECORD_COLUMNS, act),
+        (PREDICTED_RECORD_COLUMNS, pred),
+        (ACTUAL_RECORD_COLUMNS, unmatched),
+    ]
+
+    # ---- Delegated patients (reference path) -------------------------------------
+    delegated_used = 0
+    if not delegated.empty:
+        patient_actual_visits_cache = {}
+        if actual_visits_df is not None and not actual_visits_df.empty:
+            visit_type_series = get_visit_type_series(actual_visits_df, default='patient')
+            patient_actuals_only = actual_visits_df[visit_type_series.isin(['patient', 'extra', 'patient_proposed'])]
+            for (patient_id, study), group_df in patient_actuals_only.groupby(['PatientID', 'Study']):
+                patient_actual_visits_cache[f"{patient_id}_{study}"] = group_df
+
+        delegated_records = {}
+        for patient_ordinal, row in zip(delegated['_patient'], delegated.itertuples(index=False)):
+            patient = {
+                "PatientID": row.RawPatientID,
+                "Study": row.RawStudy,
+                "ScreeningDate": row.ScreeningDate,
+                "PatientPractice": patients_df['PatientPractice'].iloc[patient_ordinal] if 'PatientPractice' in patients_df.columns else '',
+                "SiteSeenAt": seen_at.iloc[patient_ordinal],
+                "Pathway": row.Pathway
+            }
+            study, schedule_pathway = resolve_study_visits_key(study_visit_cache, row.Study, row.Pathway)
+            (records, used, patient_unmatched, exclusions, _, messages, needs_recalc) = process_single_patient(
+                patient, study_visit_cache[study][schedule_pathway], stoppages,
+                patient_actual_visits_cache.get(f"{row.PatientID}_{row.Study}"),
+                anchor_visit_name=anchor_config.get(row.Study) if anchor_config else None
+            )
+            delegated_used += used
+            screen_fail_exclusions += exclusions
+            unmatched_messages.extend((patient_ordinal, message) for message in patient_unmatched)
+            processing_messages.extend((patient_ordinal, message) for message in messages)
+            if needs_recalc:
+                recalculated.append((patient_ordinal, f"{row.PatientID} ({row.Study})"))
+            for seq, record in enumerate(records):
+                record = dict(record, _patient=patient_ordinal, _section=0, _pos=seq, _sub=0)
+                delegated_records.setdefault(tuple(record), []).append(record)
+
+        for keys, records in delegated_records.items():
+            pieces.append(([key for key in keys if key not in _ORDER_COLUMNS], pd.DataFrame(records)))
+
+    visit_records = _order_records(pieces)
+
+    if patients_with_no_visits:
+        log_activity(f"⚠️ {len(patients_with_no_visits)} patients have no visits scheduled", level='warning')
+
+    def _in_patient_order(items):
+        return [message for _, message in sorted(items, key=lambda item: item[0])]
+
+    return {
+        'visit_records': visit_records,
+        'actual_visits_used': int(actual_visits_used.sum()) + delegated_used,
+        'unmatched_visits': _in_patient_order(unmatched_messages),
+        'screen_fail_exclusions': screen_fail_exclusions,
+        'out_of_window_visits': [],
+        'processing_messages': _in_patient_order(processing_messages),
+        'recalculated_patients': _in_patient_order(recalculated),
+        'patients_with_no_visits': patients_with_no_visits
+    }
+
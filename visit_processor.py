@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
+import numpy as np
 import pandas as pd
 from datetime import timedelta
 from helpers import safe_string_conversion
+from runtime_context import current_date
+from visit_status import STATUS_ACTUAL, STATUS_DTYPE, STATUS_PROPOSED, STATUS_TOL_AFTER, STATUS_TOL_BEFORE, render_visit_label
 
 def process_study_events(event_templates, actual_visits_df):
     """Process all study-level events (SIV, monitor, etc.)"""
@@ -49,8 +52,7 @@ def process_study_events(event_templates, actual_visits_df):
             continue
         
         # Check if date is in future (for proposed detection)
-        from datetime import date
-        today = date.today()
+        today = current_date()
         if isinstance(actual_date, str):
             actual_date_obj = pd.to_datetime(actual_date, dayfirst=True)
         else:
@@ -108,10 +110,8 @@ def process_study_events(event_templates, actual_visits_df):
             continue
         
         # Format visit status - proposed events get 📅 emoji and (Proposed) text
-        if is_proposed:
-            visit_status = f"📅 {visit_type.upper()}_{study} (Proposed)"
-        else:
-            visit_status = f"✅ {visit_type.upper()}_{study}"
+        status_code = STATUS_PROPOSED if is_proposed else STATUS_ACTUAL
+        visit_status = render_visit_label(f"{visit_type.upper()}_{study}", status_code)
         is_actual = True
         # payment already set from template (line 48)
         
@@ -119,6 +119,7 @@ def process_study_events(event_templates, actual_visits_df):
             "Date": actual_date,
             "PatientID": f"{visit_type.upper()}_{study}",
             "Visit": visit_status,
+            "VisitStatus": status_code,
             "Study": study,
             "Payment": payment,
             "SiteofVisit": site,
@@ -320,63 +321,70 @@ def is_visit_out_of_protocol(visit_date, visit_day, visit_name, earliest_accepta
     else:
         return visit_date < earliest_acceptable or visit_date > latest_acceptable
 
-def create_tolerance_window_records(patient_id, study, site, patient_origin, expected_date, 
-                                  tolerance_before, tolerance_after, visit_day, visit_name, 
-                                  stoppage_date, actual_visit_date=None):
-    """Create tolerance window records for a visit
-    
-    Args:
-        stoppage_date: Date of screen failure, withdrawal, or death (stops future visits)
+def calculate_tolerance_bounds(expected_date, tolerance_before, tolerance_after, visit_day, stoppage_date):
+    """Compact tolerance window for a predicted visit: (start, end) dates of its '-'/'+' marker days
+
+    Before-window days only apply after Day 1; after-window days stop at the stoppage date
+    (screen failure, withdrawal, or death). Use expand_tolerance_markers() to get per-day markers.
     """
-    records = []
-    
-    # Add tolerance windows before the visit
-    if visit_day > 1:
-        for i in range(1, tolerance_before + 1):
-            tolerance_date = expected_date - timedelta(days=i)
-            if stoppage_date is not None and tolerance_date > stoppage_date:
-                continue
-            if actual_visit_date is not None and tolerance_date == actual_visit_date:
-                continue  # Don't duplicate actual visit date
-            
-            records.append({
-                "Date": tolerance_date,
-                "PatientID": patient_id,
-                "Visit": "-",
-                "Study": study,
-                "Payment": 0,
-                "SiteofVisit": site,
-                "PatientOrigin": patient_origin,
-                "IsActual": False,
-                "IsProposed": False,  # Tolerance markers are never proposed
-                "IsScreenFail": False,
-                "IsOutOfProtocol": False,
-                "VisitDay": visit_day,
-                "VisitName": visit_name
-            })
+    start = expected_date - timedelta(days=max(tolerance_before, 0)) if visit_day > 1 else expected_date
+    end = expected_date + timedelta(days=max(tolerance_after, 0))
+    if stoppage_date is not None and end > stoppage_date:
+        end = max(stoppage_date, expected_date)
+    return start, end
 
-    # Add tolerance windows after the visit
-    for i in range(1, tolerance_after + 1):
-        tolerance_date = expected_date + timedelta(days=i)
-        if stoppage_date is not None and tolerance_date > stoppage_date:
-            continue
-        if actual_visit_date is not None and tolerance_date == actual_visit_date:
-            continue  # Don't duplicate actual visit date
-        
-        records.append({
-            "Date": tolerance_date,
-            "PatientID": patient_id,
-            "Visit": "+",
-            "Study": study,
+def _repeat_offsets(counts):
+    """For counts [2, 0, 3] return (row positions [0, 0, 2, 2, 2], offsets [1, 2, 1, 2, 3])"""
+    counts = np.clip(np.asarray(counts, dtype=int), 0, None)
+    positions = np.repeat(np.arange(len(counts)), counts)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    offsets = np.arange(counts.sum()) - starts + 1
+    return positions, offsets
+
+def expand_tolerance_markers(visits_df):
+    """Expand tolerance intervals on predicted visits into '-'/'+' marker rows (one per day)
+
+    Markers are emitted in visit order ('-' days counting back from the expected date, then
+    '+' days counting forward) and de-duplicated per patient/study/date/marker, matching the
+    per-day records the calendar grid has always used.
+    """
+    marker_columns = [
+        "Date", "PatientID", "Visit", "VisitStatus", "Study", "Payment", "SiteofVisit", "PatientOrigin",
+        "IsActual", "IsProposed", "IsScreenFail", "IsOutOfProtocol", "VisitDay", "VisitName"
+    ]
+    if visits_df is None or visits_df.empty or 'ExpectedDate' not in visits_df.columns:
+        return pd.DataFrame(columns=marker_columns)
+
+    windows = visits_df[visits_df['ExpectedDate'].notna()]
+    expected = pd.to_datetime(windows['ExpectedDate'])
+    before_counts = (expected - pd.to_datetime(windows['ToleranceStart'])).dt.days.fillna(0).astype(int).values
+    after_counts = (pd.to_datetime(windows['ToleranceEnd']) - expected).dt.days.fillna(0).astype(int).values
+
+    marker_frames = []
+    for status, counts, sign, order_offset in ((STATUS_TOL_BEFORE, before_counts, -1, 0),
+                                               (STATUS_TOL_AFTER, after_counts, 1, before_counts)):
+        positions, offsets = _repeat_offsets(counts)
+        rows = windows.iloc[positions]
+        marker_frames.append(pd.DataFrame({
+            "Date": expected.values[positions] + pd.to_timedelta(sign * offsets, unit='D'),
+            "PatientID": rows['PatientID'].values,
+            "Visit": render_visit_label(None, status),
+            "VisitStatus": np.full(len(positions), status, dtype=STATUS_DTYPE),
+            "Study": rows['Study'].values,
             "Payment": 0,
-            "SiteofVisit": site,
-            "PatientOrigin": patient_origin,
+            "SiteofVisit": rows['SiteofVisit'].values,
+            "PatientOrigin": rows['PatientOrigin'].values,
             "IsActual": False,
             "IsProposed": False,  # Tolerance markers are never proposed
             "IsScreenFail": False,
             "IsOutOfProtocol": False,
-            "VisitDay": visit_day,
-            "VisitName": visit_name
-        })
-    
-    return records
+            "VisitDay": rows['VisitDay'].values,
+            "VisitName": rows['VisitName'].values,
+            "_row": positions,
+            "_order": offsets + (np.asarray(order_offset)[positions] if np.ndim(order_offset) else order_offset),
+        }))
+
+    markers = pd.concat(marker_frames, ignore_index=True)
+    markers = markers.sort_values(['_row', '_order'], kind='mergesort')
+    markers = markers.drop_duplicates(subset=['PatientID', 'Study', 'Date', 'Visit'], keep='first')
+    return markers[marker_columns].reset_index(drop=True)
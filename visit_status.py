@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Typed visit status codes
+
+Every visit record carries a VisitStatus code (int8) next to its Visit label. The code is set
+where the record is created and the label is rendered from it (render_visit_label(s)), so
+downstream consumers - the calendar fill, cell styles, compact icons and tooltips - compare
+integers instead of searching labels for emojis.
+
+A calendar cell can hold several labels, so cells carry a status mask (one bit per code, see
+status_bit). fill_calendar_with_visits builds the masks from the records that landed in each
+cell and returns them next to the grid as a status frame: int16 masks indexed by Date with one
+column per patient/events column. The frame is part of the calendar build result and is looked
+up by (Date, column) (cell_status_masks), so it stays aligned with any row/column selection of
+the grid.
+
+visit_status_codes() and visit_status_mask() classify label text. They are only the fallback
+for frames that carry no codes or masks (builds cached before the codes existed, hand-made frames).
+"""
+import numpy as np
+import pandas as pd
+
+(STATUS_NONE, STATUS_ACTUAL, STATUS_PROPOSED, STATUS_PREDICTED, STATUS_PLANNED, STATUS_TOL_BEFORE,
+ STATUS_TOL_AFTER, STATUS_SCREEN_FAIL, STATUS_WITHDRAWN, STATUS_DIED, STATUS_DATA_ERROR) = range(11)
+STATUS_NAMES = (
+    'NONE', 'ACTUAL', 'PROPOSED', 'PREDICTED', 'PLANNED', 'TOL_BEFORE',
+    'TOL_AFTER', 'SCREEN_FAIL', 'WITHDRAWN', 'DIED', 'DATA_ERROR',
+)
+STATUS_DTYPE = np.int8
+STATUS_COLUMN = 'VisitStatus'
+
+# Display label per code: (prefix, suffix) around the visit name, or None for the fixed markers
+_LABEL_PARTS = (
+    ("", ""),
+    ("✅ ", ""),
+    ("📅 ", " (Proposed)"),
+    ("📋 ", " (Predicted)"),
+    ("📅 ", " (Planned)"),
+    None,
+    None,
+    ("⚠️ Screen Fail ", ""),
+    ("⚠️ Withdrawn ", ""),
+    ("⚠️ Died ", ""),
+    ("⚠️ DATA ERROR ", ""),
+)
+TOLERANCE_LABELS = {STATUS_TOL_BEFORE: '-', STATUS_TOL_AFTER: '+'}
+
+# Recorded visits (the ✅/⚠️ labels), stoppage notes and tolerance window days
+ACTUAL_STATUSES = (STATUS_ACTUAL, STATUS_SCREEN_FAIL, STATUS_WITHDRAWN, STATUS_DIED, STATUS_DATA_ERROR)
+STOPPAGE_STATUSES = (STATUS_SCREEN_FAIL, STATUS_WITHDRAWN, STATUS_DIED)
+TOLERANCE_STATUSES = (STATUS_TOL_BEFORE, STATUS_TOL_AFTER)
+
+# Mask bit per code - index with an array of codes for column-wise masks
+STATUS_BITS = np.array([0] + [1 << status for status in range(1, len(STATUS_NAMES))], dtype=np.int16)
+
+
+def status_bit(status):
+    """Mask bit of a status code (STATUS_NONE has none)"""
+    return int(STATUS_BITS[status])
+
+
+def status_bits(statuses):
+    """Mask with the bits of all `statuses` set"""
+    mask = 0
+    for status in statuses:
+        mask |= status_bit(status)
+    return mask
+
+
+ACTUAL_MASK = status_bits(ACTUAL_STATUSES)
+TOLERANCE_MASK = status_bits(TOLERANCE_STATUSES)
+MASK_COUNT = 1 << len(STATUS_NAMES)
+
+
+def render_visit_label(visit_name, status):
+    """Display label of one visit record"""
+    parts = _LABEL_PARTS[status]
+    if parts is None:
+        return TOLERANCE_LABELS[status]
+    return f"{parts[0]}{visit_name}{parts[1]}"
+
+
+def render_visit_labels(visit_names, statuses):
+    """Display labels for aligned Series of visit names and status codes"""
+    visit_names = visit_names.astype(str)
+    labels = pd.Series("", index=visit_names.index, dtype=object)
+    statuses = pd.Series(np.asarray(statuses), index=visit_names.index)
+    for status in statuses.unique():
+        rows = statuses == status
+        parts = _LABEL_PARTS[status]
+        if parts is None:
+            labels[rows] = TOLERANCE_LABELS[status]
+        else:
+            labels[rows] = parts[0] + visit_names[rows] + parts[1]
+    return labels
+
+
+def _label_status(label):
+    """Status code of one label (text fallback, see visit_status_codes)"""
+    if not isinstance(label, str):
+        return STATUS_NONE
+    if label == '-':
+        return STATUS_TOL_BEFORE
+    if label == '+':
+        return STATUS_TOL_AFTER
+    for status in (STATUS_DATA_ERROR, STATUS_SCREEN_FAIL, STATUS_WITHDRAWN, STATUS_DIED):
+        if label.startswith(_LABEL_PARTS[status][0]):
+            return status
+    if label.startswith(("✅", "🔴")):
+        return STATUS_ACTUAL
+    if label.startswith("📋") and label.endswith("(Predicted)"):
+        return STATUS_PREDICTED
+    if label.startswith(("📅", "❓")) and label.endswith("(Proposed)"):
+        return STATUS_PROPOSED
+    if label.startswith("📅") and label.endswith("(Planned)"):
+        return STATUS_PLANNED
+    return STATUS_NONE
+
+
+def visit_status_codes(labels):
+    """Status code per Visit label, classifying each distinct label once (text fallback)"""
+    labels = pd.Series(labels)
+    factor_codes, uniques = pd.factorize(labels, use_na_sentinel=True)
+    label_codes = np.array([_label_status(label) for label in uniques] + [STATUS_NONE], dtype=STATUS_DTYPE)
+    return pd.Series(label_codes[factor_codes], index=labels.index, dtype=STATUS_DTYPE)
+
+
+def visit_status_column(visits_df):
+    """VisitStatus codes of a visits DataFrame, classifying the labels of rows that have none"""
+    if visits_df.empty:
+        return pd.Series(dtype=STATUS_DTYPE, index=visits_df.index)
+    if STATUS_COLUMN not in visits_df.columns:
+        return visit_status_codes(visits_df['Visit'])
+    codes = visits_df[STATUS_COLUMN]
+    missing = codes.isna()
+    if missing.any():
+        codes = codes.where(~missing, visit_status_codes(visits_df.loc[missing, 'Visit']))
+    return codes.astype(STATUS_DTYPE)
+
+
+def visit_status_mask(cell_text):
+    """Status mask of a calendar cell's text (text fallback for cells without a looked-up mask)"""
+    if not isinstance(cell_text, str) or cell_text == "":
+        return 0
+    mask = 0
+    for line in cell_text.split("\n"):
+        status = _label_status(line)
+        if status == STATUS_NONE and ", " in line:
+            # Merged tolerance markers ("-, +") and site event lists ("✅ SIV_A, ✅ MONITOR_B")
+            for part in line.split(", "):
+                mask |= status_bit(_label_status(part))
+        else:
+            mask |= status_bit(status)
+    return mask
+
+
+def cell_status_masks(values, dates, columns, cell_status=None):
+    """Status mask per cell of a (rows x columns) array of calendar values
+
+    Masks are looked up in cell_status - the status frame of fill_calendar_with_visits - by each
+    row's date and the column name, so `values` can be any row/column selection of the grid.
+    Cells the frame does not cover (every cell without a frame) are classified from their text.
+    """
+    values = np.asarray(values, dtype=object)
+    masks = np.full(values.shape, -1, dtype=np.int16)
+    if cell_status is not None and values.size:
+        if not cell_status.index.is_unique:
+            cell_status = cell_status[~cell_status.index.duplicated(keep='last')]
+        rows = pd.DatetimeIndex(pd.to_datetime(pd.Series(dates).to_numpy())).normalize()
+        looked_up = cell_status.reindex(index=rows, columns=list(columns)).to_numpy(dtype=float)
+        covered = ~np.isnan(looked_up)
+        masks[covered] = looked_up[covered]
+    missing = masks < 0
+    if missing.any():
+        factor_codes, uniques = pd.factorize(values[missing], use_na_sentinel=True)
+        text_masks = np.array([visit_status_mask(value) for value in uniques] + [0], dtype=np.int16)
+        masks[missing] = text_masks[factor_codes]
+    return masks